@@ -1,5 +1,4 @@
 import os
-import pathlib
 import sys
 import time
 from contextlib import asynccontextmanager
@@ -7,29 +6,39 @@ from contextlib import asynccontextmanager
 import uvicorn
 import vcenter_lookup_bridge.vmware.instances as g
 from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
 from fastapi.routing import APIRoute
 from fastapi_cache import FastAPICache
-from fastapi_cache.backends.redis import RedisBackend
 from redis import asyncio as aioredis
 from vcenter_lookup_bridge.api.main import api_router
-from vcenter_lookup_bridge.utils.config_util import ConfigUtil
+from vcenter_lookup_bridge.broker.client import BrokerClient
+from vcenter_lookup_bridge.cache.cache_policy import CachePolicy
+from vcenter_lookup_bridge.cache.cache_warmer import CacheWarmer
+from vcenter_lookup_bridge.cache.tiered_backend import TieredBackend
+from vcenter_lookup_bridge.utils.admission_controller import AdmissionController
+from vcenter_lookup_bridge.utils.cancellation import OperationCancelledError
 from vcenter_lookup_bridge.utils.constants import Constants as cs
 from vcenter_lookup_bridge.utils.logging import Logging
 from vcenter_lookup_bridge.vmware.connector import Connector
+from vcenter_lookup_bridge.vmware.vcenter_config_manager import VCenterConfigManager
+from vcenter_lookup_bridge.vmware.work_scheduler import WorkScheduler
 
 # const
 LOG_DIR_DEFAULT = "./log"
 LOG_FILE_DEFAULT = "vcenter_lookup_bridge.log"
 CONFIG_DIR_DEFAULT = "./config"
 CONFIG_VCENTER_DIR_DEFAULT = "./config/vcenters"
+CACHE_WARMUP_CONFIG_FILE_DEFAULT = "./config/cache_warmup.yml"
+CACHE_POLICY_CONFIG_FILE_DEFAULT = "./config/cache_policy.yml"
 VLB_ADDRESS_DEFAULT = "0.0.0.0"
 VLB_PORT_DEFAULT = 8000
 VLB_CACHE_HOSTNAME_DEFAULT = "cache"
 VLB_CACHE_PORT_DEFAULT = 6379
 VLB_ROOT_PATH_DEFAULT = "/vcenter-lookup-bridge"
+HTTP_STATUS_CLIENT_CLOSED_REQUEST = 499
 
 
-g.vcenter_configurations = {}
+VCenterConfigManager.set_vcenter_configurations({})
 
 
 @asynccontextmanager
@@ -40,35 +49,59 @@ async def lifespan(app: FastAPI):
 
     # Load Configs
     try:
-        for vcenter_config in pathlib.Path(f"{CONFIG_VCENTER_DIR_DEFAULT}").iterdir():
-            if vcenter_config.suffix == ".yml":
-                config = ConfigUtil.parse_config(f"{vcenter_config}")
-                Logging.info(f'vCenter Configuration Loaded: {config["name"]}')
-                g.vcenter_configurations[config["name"]] = config
+        VCenterConfigManager.load_vcenter_configurations(CONFIG_VCENTER_DIR_DEFAULT)
     except Exception as e:
         Logging.error(f"vCenterの設定ファイルを読み込めませんでした(STATUS/{cs.EXIT_ERR_LOAD_CONFIG})")
         Logging.error(e)
         sys.exit(cs.EXIT_ERR_LOAD_CONFIG)
+    try:
+        # リソースの種別ごとのキャッシュのポリシー(有効期限など)
+        CachePolicy.load(CACHE_POLICY_CONFIG_FILE_DEFAULT)
+    except Exception as e:
+        Logging.error(f"キャッシュのポリシーの設定ファイルを読み込めませんでした。既定のポリシーを利用します: {e}")
 
+    # Redisの初期化に失敗した場合は、キャッシュを利用する機能を無効化する
+    redis = cache_backend = None
     try:
         # Initialize Cache
-        redis = init_redis_cache(cache_host, cache_port)
+        redis, cache_backend = init_redis_cache(cache_host, cache_port)
     except Exception as e:
         Logging.error(f"Redisの初期化に失敗しました。キャッシュ機能を無効化します。")
         Logging.error(e)
 
-    Connector.get_service_instances()
+    Connector.connect_on_startup()
+    Connector.start_connection_monitor()
+    VCenterConfigManager.start_watcher()
+    AdmissionController.start_event_loop_monitor()
+    BrokerClient.start_stats_monitor()
+    if redis is not None:
+        # よく利用されるリクエストのレスポンスを、事前にキャッシュする
+        CacheWarmer.start(app=app, redis=redis, config_file=CACHE_WARMUP_CONFIG_FILE_DEFAULT)
+    g.startup_completed = True
     Logging.info("Startup completed.")
     yield
-    await redis.close()
+    g.startup_completed = False
+    await CacheWarmer.stop(redis=redis)
+    AdmissionController.stop_event_loop_monitor()
+    BrokerClient.stop_stats_monitor()
+    VCenterConfigManager.stop_watcher()
+    Connector.stop_connection_monitor()
+    WorkScheduler.shutdown()
+    if cache_backend is not None:
+        await cache_backend.stop_invalidation_listener()
+    if redis is not None:
+        await redis.close()
     Logging.info("Shutdown completed.")
 
 
 def init_redis_cache(cache_host, cache_port):
     redis = aioredis.from_url(f"redis://{cache_host}:{cache_port}")
-    FastAPICache.init(RedisBackend(redis), prefix="fastapi-cache")
+    # ワーカープロセス内のLRUキャッシュをRedisの前段に配置し、よく参照されるレスポンスはRedisに問い合わせずに返す
+    cache_backend = TieredBackend(redis)
+    FastAPICache.init(cache_backend, prefix="fastapi-cache")
+    cache_backend.start_invalidation_listener()
     Logging.info(redis)
-    return redis
+    return redis, cache_backend
 
 
 def use_route_names_as_operation_ids(app: FastAPI) -> None:
@@ -112,6 +145,19 @@ async def add_process_time_header(request: Request, call_next):
     return response
 
 
+@app.middleware("http")
+async def admission_control(request: Request, call_next):
+    # 負荷が高い場合、vCenterへのリクエストを伴う処理を早期に拒否する
+    return await AdmissionController.dispatch(request, call_next)
+
+
+@app.exception_handler(OperationCancelledError)
+async def handle_operation_cancelled(request: Request, exc: OperationCancelledError):
+    # クライアントは切断済みのため、レスポンスはアクセスログの記録用
+    Logging.info(f"vCenterへのリクエスト処理をキャンセルしました({request.url.path}): {exc}")
+    return JSONResponse(status_code=HTTP_STATUS_CLIENT_CLOSED_REQUEST, content={"detail": str(exc)})
+
+
 if __name__ == "__main__":
     # gunicorn、uvicornコマンドで実行する場合、以下設定は無視されます。
     listen_address = os.getenv("VLB_LISTEN_ADDRESS", VLB_ADDRESS_DEFAULT)
@@ -56,7 +56,7 @@ def mock_connector(monkeypatch):
     mock_content.rootFolder.childEntity = [mock_datacenter]
     mock_service_instance.RetrieveContent.return_value = mock_content
 
-    def mock_get_service_instances(configs):
+    def mock_get_service_instances(configs=None):
         return {"test-vcenter": mock_service_instance}
 
     def mock_get_vmware_content(vcenter_name):
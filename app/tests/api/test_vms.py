@@ -131,8 +131,8 @@ def mock_folder(mock_vm):
 
 @pytest.fixture
 def setup_inventory_path(mock_content, mock_folder):
-    """FindByInventoryPathのセットアップを行う"""
-    mock_content.searchIndex.FindByInventoryPath.return_value = mock_folder
+    """FindChildのセットアップを行う"""
+    mock_content.searchIndex.FindChild.return_value = mock_folder
     return mock_content
 
 @pytest.fixture
@@ -152,7 +152,7 @@ def mock_connector(monkeypatch):
     mock_content.rootFolder.childEntity = [mock_datacenter]
     mock_service_instance.RetrieveContent.return_value = mock_content
 
-    def mock_get_service_instances(configs):
+    def mock_get_service_instances(configs=None):
         return {"test-vcenter": mock_service_instance}
 
     def mock_get_vmware_content(vcenter_name):
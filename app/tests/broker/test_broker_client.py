@@ -0,0 +1,119 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+from vcenter_lookup_bridge.broker.client import BrokerClient
+from vcenter_lookup_bridge.broker.protocol import BrokerProtocol
+from vcenter_lookup_bridge.utils.cancellation import CancellationToken, OperationCancelledError
+
+
+def get_vms(vcenter_name: str, service_instances: dict, configs: dict, cancel_token=None):
+    return []
+
+
+async def run_with_fake_broker(socket_path, handle, coro_factory):
+    server = await asyncio.start_unix_server(handle, path=socket_path)
+    async with server:
+        return await coro_factory()
+
+
+def test_call_sends_request_and_returns_result(monkeypatch, tmp_path):
+    """service_instancesとconfigsを除いた引数をブローカーに送信し、結果を受け取ること"""
+    socket_path = str(tmp_path / "broker.sock")
+    monkeypatch.setenv("VLB_BROKER_SOCKET", socket_path)
+    received = {}
+
+    async def handle(reader, writer):
+        _, request = await BrokerProtocol.read_frame(reader)
+        received.update(request)
+        writer.write(BrokerProtocol.encode_frame(BrokerProtocol.FRAME_RESULT, ["vm01"]))
+        await writer.drain()
+        writer.close()
+
+    result = asyncio.run(
+        run_with_fake_broker(
+            socket_path,
+            handle,
+            lambda: BrokerClient.call(get_vms, vcenter_name="vcenter01", service_instances={}, configs={}),
+        )
+    )
+    assert result == ["vm01"]
+    assert received["method"] == "get_vms"
+    assert received["kwargs"] == {"vcenter_name": "vcenter01"}
+
+
+def test_call_raises_http_exception_from_broker(monkeypatch, tmp_path):
+    """ブローカーで発生したHTTPExceptionが、ワーカープロセスで再送出されること"""
+    socket_path = str(tmp_path / "broker.sock")
+    monkeypatch.setenv("VLB_BROKER_SOCKET", socket_path)
+
+    async def handle(reader, writer):
+        await BrokerProtocol.read_frame(reader)
+        writer.write(BrokerProtocol.encode_frame(BrokerProtocol.FRAME_ERROR, {"status_code": 404, "detail": "none"}))
+        await writer.drain()
+        writer.close()
+
+    with pytest.raises(HTTPException) as e:
+        asyncio.run(run_with_fake_broker(socket_path, handle, lambda: BrokerClient.call(get_vms)))
+    assert e.value.status_code == 404
+
+
+def test_call_disconnects_on_cancel(monkeypatch, tmp_path):
+    """キャンセル時はブローカーとの接続を切断し、ブローカーが切断を検知できること"""
+    socket_path = str(tmp_path / "broker.sock")
+    monkeypatch.setenv("VLB_BROKER_SOCKET", socket_path)
+    monkeypatch.setattr(BrokerClient, "CANCEL_POLL_INTERVAL_SEC", 0.01)
+    cancel_token = CancellationToken()
+    disconnected = asyncio.Event()
+
+    async def handle(reader, writer):
+        await BrokerProtocol.read_frame(reader)
+        cancel_token.cancel("test")
+        await reader.read()
+        disconnected.set()
+
+    async def call_and_wait():
+        try:
+            await BrokerClient.call(get_vms, cancel_token=cancel_token)
+        finally:
+            await asyncio.wait_for(disconnected.wait(), timeout=1)
+
+    with pytest.raises(OperationCancelledError):
+        asyncio.run(run_with_fake_broker(socket_path, handle, call_and_wait))
+
+
+def test_fetch_stats(monkeypatch, tmp_path):
+    """予約済みの処理名で、ブローカーの負荷情報と接続状態を取得すること"""
+    socket_path = str(tmp_path / "broker.sock")
+    monkeypatch.setenv("VLB_BROKER_SOCKET", socket_path)
+    stats = {"scheduler": {"queued": {"bulk": 3}, "running": {"bulk": 1}}, "vcenters": {}}
+    received = {}
+
+    async def handle(reader, writer):
+        _, request = await BrokerProtocol.read_frame(reader)
+        received.update(request)
+        writer.write(BrokerProtocol.encode_frame(BrokerProtocol.FRAME_RESULT, stats))
+        await writer.drain()
+        writer.close()
+
+    assert asyncio.run(run_with_fake_broker(socket_path, handle, BrokerClient.fetch_stats)) == stats
+    assert received["method"] == BrokerProtocol.METHOD_STATS
+
+
+def test_call_restores_response_schemas(monkeypatch, tmp_path):
+    """ブローカーから受け取った結果のスキーマとタプルを、JSONから復元すること"""
+    from vcenter_lookup_bridge.schemas.cluster_parameter import ClusterResponseSchema
+
+    socket_path = str(tmp_path / "broker.sock")
+    monkeypatch.setenv("VLB_BROKER_SOCKET", socket_path)
+    cluster = ClusterResponseSchema(name="cluster01", status="green", hosts=["esxi01"], vcenter="vcenter01")
+
+    async def handle(reader, writer):
+        await BrokerProtocol.read_frame(reader)
+        writer.write(BrokerProtocol.encode_frame(BrokerProtocol.FRAME_RESULT, ([cluster], {"vcenter01": "alive"})))
+        await writer.drain()
+        writer.close()
+
+    clusters, sessions = asyncio.run(run_with_fake_broker(socket_path, handle, lambda: BrokerClient.call(get_vms)))
+    assert clusters == [cluster]
+    assert sessions == {"vcenter01": "alive"}
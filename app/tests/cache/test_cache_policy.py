@@ -0,0 +1,45 @@
+import vcenter_lookup_bridge.vmware.instances as g
+from vcenter_lookup_bridge.cache.cache_policy import CachePolicy
+
+
+def test_policy_is_resolved_per_resource_and_vcenter(tmp_path, monkeypatch):
+    """デコレータの引数・設定ファイル・vCenterの設定ファイルの順に、ポリシーを上書きすること"""
+    config_file = tmp_path / "cache_policy.yml"
+    config_file.write_text(
+        "default:\n  max_bytes: 1024\n"
+        "resources:\n"
+        "  events:\n    expire_secs: 15\n    stale_secs: 0\n    unknown: 1\n"
+        "  clusters:\n    expire_secs: 3600\n    compression: 'False'\n"
+    )
+    monkeypatch.setattr(
+        g,
+        "vcenter_configurations",
+        {
+            "vcenter01": {
+                "name": "vcenter01",
+                "cache_policy": {"expire_secs": 120, "resources": {"events": {"bypass": True}}},
+            }
+        },
+        raising=False,
+    )
+    CachePolicy.load(str(config_file))
+
+    assert CachePolicy.get_policy("events", None, expire_secs=60, stale_secs=300) == {
+        "expire_secs": 15,
+        "stale_secs": 0,
+        "max_bytes": 1024,
+        "compression": None,
+        "bypass": False,
+    }
+    assert CachePolicy.get_policy("events", "vcenter01", expire_secs=60, stale_secs=300) == {
+        "expire_secs": 120,
+        "stale_secs": 0,
+        "max_bytes": 1024,
+        "compression": None,
+        "bypass": True,
+    }
+    clusters = CachePolicy.get_policy("clusters", "vcenter02", expire_secs=60, stale_secs=300)
+    assert (clusters["expire_secs"], clusters["stale_secs"], clusters["compression"]) == (3600, 300, False)
+
+    CachePolicy.load(str(tmp_path / "missing.yml"))
+    assert CachePolicy.get_policy("events", None, expire_secs=60, stale_secs=300)["expire_secs"] == 60
@@ -0,0 +1,85 @@
+import asyncio
+
+from fastapi import FastAPI, Request
+from vcenter_lookup_bridge.cache.cache_warmer import CacheWarmer
+
+
+class DictRedis(object):
+    """テスト用に、利用するコマンドのみを辞書で実装したRedis"""
+
+    def __init__(self):
+        self.data = {}
+
+    async def set(self, key, value, nx=False, ex=None):
+        if nx and key in self.data:
+            return False
+        self.data[key] = value.encode("utf-8")
+        return True
+
+    async def get(self, key):
+        return self.data.get(key)
+
+    async def expire(self, key, seconds):
+        pass
+
+    async def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+
+
+def test_load_queries(tmp_path):
+    """設定ファイルからリクエストを読み込み、pathのないものは除外すること"""
+    config_file = tmp_path / "cache_warmup.yml"
+    config_file.write_text(
+        'queries:\n  - path: "/vms/"\n    params:\n      vm_folders: ["folder01"]\n'
+        '  - params: {}\n  - path: "/hosts/"\n'
+    )
+
+    assert CacheWarmer.load_queries(str(config_file)) == [
+        {"path": "/vms/", "params": {"vm_folders": ["folder01"]}},
+        {"path": "/hosts/", "params": {}},
+    ]
+    assert CacheWarmer.load_queries(str(tmp_path / "missing.yml")) == []
+
+
+def test_warm_up_limits_concurrency(monkeypatch):
+    """同時に実行するリクエスト数を制限し、キャッシュを使わずに取得し直すこと"""
+    monkeypatch.setenv("VLB_CACHE_WARMUP_CONCURRENCY", "2")
+    app = FastAPI(root_path="/vcenter-lookup-bridge/api/v1")
+    running = []
+    max_running = []
+    received = []
+
+    @app.get("/vms/")
+    async def list_vms(request: Request):
+        running.append(1)
+        max_running.append(len(running))
+        received.append((request.query_params.getlist("vm_folders"), request.headers.get("Cache-Control")))
+        await asyncio.sleep(0.01)
+        running.pop()
+        return {}
+
+    queries = [{"path": "/vms/", "params": {"vm_folders": [f"folder{i}", "common"]}} for i in range(5)]
+    queries.append({"path": "/missing/", "params": {}})
+
+    assert asyncio.run(CacheWarmer.warm_up(app, queries)) == 5
+    assert max(max_running) == 2
+    assert received[0] == (["folder0", "common"], "no-cache")
+
+
+def test_only_one_leader():
+    """ロックを取得したワーカープロセスのみがリーダーとなり、解放後は他のワーカープロセスが引き継ぐこと"""
+    redis = DictRedis()
+
+    async def run():
+        assert await CacheWarmer.acquire_leadership(redis, expire=90)
+        assert await CacheWarmer.acquire_leadership(redis, expire=90)
+
+        # 他のワーカープロセスがロックを保持している場合
+        await CacheWarmer.release_leadership(redis)
+        redis.data[CacheWarmer.LEADER_LOCK_KEY] = b"other"
+        assert not await CacheWarmer.acquire_leadership(redis, expire=90)
+        await CacheWarmer.release_leadership(redis)
+        assert redis.data[CacheWarmer.LEADER_LOCK_KEY] == b"other"
+
+    asyncio.run(run())
@@ -0,0 +1,407 @@
+import asyncio
+import json
+
+import pytest
+from fastapi_cache import FastAPICache
+from fastapi_cache.backends.inmemory import InMemoryBackend
+from starlette.requests import Request
+from starlette.responses import Response
+from vcenter_lookup_bridge.cache.cache_entry import CacheEntry
+from vcenter_lookup_bridge.cache.cache_policy import CachePolicy
+from vcenter_lookup_bridge.cache.response_cache import ResponseCache
+
+
+class LockingBackend(InMemoryBackend):
+    """再作成のロック(SET NX)とタグ(SADD)を、Redisの代わりに保持するバックエンド"""
+
+    def __init__(self):
+        self._store = {}
+        self.redis = self
+        self.locks = {}
+        self.tags = {}
+
+    async def set(self, key, value, expire=None, nx=False, ex=None):
+        if nx:
+            if key in self.locks:
+                return False
+            self.locks[key] = value
+            return True
+        return await super().set(key, value, expire)
+
+    async def delete(self, *keys):
+        for key in keys:
+            self.locks.pop(key, None)
+            self.tags.pop(key, None)
+
+    def register_script(self, script):
+        async def compare_and_delete(keys, args):
+            if self.locks.get(keys[0]) != args[0]:
+                return 0
+            del self.locks[keys[0]]
+            return 1
+
+        return compare_and_delete
+
+    def pipeline(self, transaction=True):
+        return self
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+    def sadd(self, key, *values):
+        self.tags.setdefault(key, set()).update(values)
+
+    def expire(self, key, seconds, nx=False, gt=False):
+        pass
+
+    async def execute(self):
+        pass
+
+    async def sunion(self, keys):
+        return set().union(*[self.tags.get(key, set()) for key in keys])
+
+
+def create_request() -> Request:
+    return Request({"type": "http", "method": "GET", "path": "/vms/", "headers": [], "query_string": b""})
+
+
+def test_stale_response_triggers_single_refresh():
+    """鮮度の期限を過ぎたレスポンスは即座に返し、バックグラウンドでの再作成は1件のみ実行すること"""
+    calls = []
+
+    @ResponseCache.cached(resource="vms", expire=60, stale_expire=300)
+    async def list_items(request: Request, name: str):
+        calls.append(request)
+        await asyncio.sleep(0.01)
+        return {"count": len(calls)}
+
+    async def run():
+        backend = LockingBackend()
+        FastAPICache.reset()
+        FastAPICache.init(backend, prefix="fastapi-cache")
+
+        first = await list_items(request=create_request(), name="a")
+        assert json.loads(first.body) == {"count": 1}
+        assert first.headers["X-FastAPI-Cache"] == "MISS"
+
+        # 鮮度の期限切れを再現する
+        key = next(iter(backend._store.keys()))
+        entry = CacheEntry.decode(backend._store[key].data)
+        entry.fresh_until = 0
+        await backend.set(key, entry.encode(), 360)
+
+        responses = [await list_items(request=create_request(), name="a") for _ in range(2)]
+        assert [json.loads(response.body) for response in responses] == [{"count": 1}, {"count": 1}]
+        assert [response.headers["X-FastAPI-Cache"] for response in responses] == ["STALE", "STALE"]
+        await asyncio.gather(*ResponseCache._refresh_tasks.values())
+
+        refreshed = await list_items(request=create_request(), name="a")
+        assert json.loads(refreshed.body) == {"count": 2}
+        assert refreshed.headers["X-FastAPI-Cache"] == "HIT"
+        assert backend.locks == {}
+
+    asyncio.run(run())
+
+    # バックグラウンドでの再作成は、HTTPクライアントの切断を監視しないようrequestなしで呼び出す
+    assert len(calls) == 2
+    assert calls[1] is None
+
+
+def test_release_refresh_lock_keeps_lock_of_other_worker():
+    """ロックの有効期限を過ぎた後は、他のワーカープロセスが取得し直したロックを解放しないこと"""
+
+    async def run():
+        backend = LockingBackend()
+        FastAPICache.reset()
+        FastAPICache.init(backend, prefix="fastapi-cache")
+
+        token = await ResponseCache._acquire_refresh_lock("key01")
+        assert token is not None
+        assert await ResponseCache._acquire_refresh_lock("key01") is None
+
+        # ロックの有効期限切れ後に、他のワーカープロセスがロックを取得し直した状態を再現する
+        lock_key = f"{ResponseCache.REFRESH_LOCK_PREFIX}key01"
+        backend.locks[lock_key] = "other-worker"
+        await ResponseCache._release_refresh_lock("key01", token)
+        assert backend.locks == {lock_key: "other-worker"}
+
+        await ResponseCache._release_refresh_lock("key01", "other-worker")
+        assert backend.locks == {}
+
+    asyncio.run(run())
+
+
+def test_invalidate_by_resource_and_vcenter():
+    """リソース・vCenterを指定した場合、該当するレスポンスと、vCenterを指定しないリクエストのレスポンスのみ破棄すること"""
+
+    class SearchParams(object):
+        def __init__(self, vcenter):
+            self.vcenter = vcenter
+
+    @ResponseCache.cached(resource="vms", expire=60, stale_expire=0)
+    async def list_vms(request: Request, search_params: SearchParams):
+        return {"vcenter": search_params.vcenter}
+
+    @ResponseCache.cached(resource="events", expire=60, stale_expire=0)
+    async def list_events(request: Request, search_params: SearchParams):
+        return {"vcenter": search_params.vcenter}
+
+    async def run():
+        backend = LockingBackend()
+        FastAPICache.reset()
+        FastAPICache.init(backend, prefix="fastapi-cache")
+        for func in (list_vms, list_events):
+            for vcenter in ("vcenter01", "vcenter02", None):
+                await func(request=create_request(), search_params=SearchParams(vcenter))
+
+        assert await ResponseCache.invalidate(resource="vms", vcenter_name="vcenter01") == 2
+        remaining = sorted(key.split(":")[1] + ":" + key.split(":")[2] for key in backend._store.keys())
+        assert remaining == ["events:_all", "events:vcenter01", "events:vcenter02", "vms:vcenter02"]
+
+        assert await ResponseCache.invalidate(resource="events") == 3
+        assert [key.split(":")[1] for key in backend._store.keys()] == ["vms"]
+
+    asyncio.run(run())
+
+
+def test_hit_returns_stored_bytes_without_decoding(monkeypatch):
+    """キャッシュしたレスポンスは、デコードせずに保存したバイト列とヘッダのまま返すこと"""
+
+    @ResponseCache.cached(resource="hosts", expire=60, stale_expire=0)
+    async def list_hosts(request: Request):
+        return {"results": [{"name": "esxi01"}], "message": "1件のESXiホストを取得しました。"}
+
+    async def run():
+        backend = LockingBackend()
+        FastAPICache.reset()
+        FastAPICache.init(backend, prefix="fastapi-cache")
+        first = await list_hosts(request=create_request())
+
+        monkeypatch.setattr(FastAPICache.get_coder(), "decode", lambda value: pytest.fail("decodeしないこと"))
+        second = await list_hosts(request=create_request())
+        return first, second
+
+    first, second = asyncio.run(run())
+
+    assert isinstance(second, Response)
+    assert second.body == first.body
+    assert second.headers["content-type"] == "application/json"
+    assert second.headers["content-length"] == str(len(first.body))
+    assert second.headers["X-FastAPI-Cache"] == "HIT"
+    assert json.loads(second.body)["results"] == [{"name": "esxi01"}]
+
+
+def test_not_modified_when_etag_matches():
+    """If-None-MatchがETagと一致する場合、エンドポイントを呼び出さずに304を返し、作成時刻のみ異なるレスポンスは同じETagとすること"""
+    calls = []
+
+    @ResponseCache.cached(resource="vms", expire=60, stale_expire=0)
+    async def get_vm(request: Request, vm_instance_uuid: str):
+        calls.append(vm_instance_uuid)
+        return {"results": {"uuid": vm_instance_uuid}, "timestamp": f"2025-07-24T10:00:0{len(calls)}"}
+
+    def create_conditional_request(etag: str, cache_control: str = "") -> Request:
+        headers = [(b"if-none-match", f'W/{etag}, "other"'.encode())]
+        if cache_control:
+            headers.append((b"cache-control", cache_control.encode()))
+        return Request({"type": "http", "method": "GET", "path": "/vms/1", "headers": headers, "query_string": b""})
+
+    async def run():
+        FastAPICache.reset()
+        FastAPICache.init(LockingBackend(), prefix="fastapi-cache")
+        first = await get_vm(request=create_request(), vm_instance_uuid="1")
+        etag = first.headers["etag"]
+
+        not_modified = await get_vm(request=create_conditional_request(etag), vm_instance_uuid="1")
+        assert not_modified.status_code == 304
+        assert not_modified.body == b""
+        assert not_modified.headers["etag"] == etag
+        assert calls == ["1"]
+
+        # 作成し直しても内容が同じであれば304を返す
+        recreated = await get_vm(request=create_conditional_request(etag, "no-cache"), vm_instance_uuid="1")
+        assert recreated.status_code == 304
+        assert calls == ["1", "1"]
+
+        other = await get_vm(request=create_conditional_request(etag), vm_instance_uuid="2")
+        assert other.status_code == 200
+        assert other.headers["etag"] != etag
+
+    asyncio.run(run())
+
+
+def test_expire_is_jittered(monkeypatch):
+    """鮮度の期限は、VLB_CACHE_TTL_JITTER_RATIOの割合の範囲で短縮すること"""
+    monkeypatch.setenv("VLB_CACHE_TTL_JITTER_RATIO", "0.2")
+    expires = {ResponseCache._get_jittered_expire(100) for _ in range(200)}
+
+    assert min(expires) >= 80 and max(expires) <= 100
+    assert len(expires) > 1
+
+    monkeypatch.setenv("VLB_CACHE_TTL_JITTER_RATIO", "0")
+    assert ResponseCache._get_jittered_expire(100) == 100
+
+
+def test_degraded_response_is_cached_briefly(monkeypatch):
+    """最後に取得に成功した結果を含むレスポンスは、鮮度の期限をVLB_CACHE_DEGRADED_EXPIRE_SECSまでに短縮すること"""
+    monkeypatch.setenv("VLB_CACHE_DEGRADED_EXPIRE_SECS", "5")
+
+    degraded = ResponseCache._create_entry({"results": [], "staleVcenters": {"vcenter02": "2025-07-24T09:55:00"}}, 60)
+    fresh = ResponseCache._create_entry({"results": [], "staleVcenters": None}, 60)
+
+    assert degraded.get_expire_sec() == 5
+    assert fresh.get_expire_sec() == 60
+
+
+def test_recompute_early_probability():
+    """期限が近いほど、また作成に時間を要したエントリほど、期限前に作成し直すと判定すること"""
+    entry = CacheEntry(body=b"", created_at=0, fresh_until=60, compute_sec=2.0)
+
+    # rand=0.5の場合、期限の約1.4秒(2.0 * ln2)前から作成し直す
+    assert not entry.should_recompute_early(beta=1.0, now=58.0, rand=0.5)
+    assert entry.should_recompute_early(beta=1.0, now=58.7, rand=0.5)
+    assert not entry.should_recompute_early(beta=1.0, now=30.0, rand=0.5)
+    assert entry.should_recompute_early(beta=1.0, now=30.0, rand=1e-9)
+    assert not entry.should_recompute_early(beta=0, now=59.9, rand=1e-9)
+    assert not CacheEntry(body=b"", created_at=0, fresh_until=60).should_recompute_early(beta=1.0, now=59.9)
+
+
+def test_fresh_hit_recomputes_early(monkeypatch):
+    """期限前でも早期に作成し直すと判定した場合、キャッシュしたレスポンスを返し、バックグラウンドで作成し直すこと"""
+    calls = []
+
+    @ResponseCache.cached(resource="clusters", expire=60, stale_expire=0)
+    async def list_clusters(request: Request):
+        calls.append(request)
+        return {"count": len(calls)}
+
+    async def run():
+        FastAPICache.reset()
+        FastAPICache.init(LockingBackend(), prefix="fastapi-cache")
+        await list_clusters(request=create_request())
+
+        monkeypatch.setattr(CacheEntry, "should_recompute_early", lambda self, beta: True)
+        response = await list_clusters(request=create_request())
+        assert response.headers["X-FastAPI-Cache"] == "HIT"
+        assert json.loads(response.body) == {"count": 1}
+        await asyncio.gather(*ResponseCache._refresh_tasks.values())
+
+    asyncio.run(run())
+
+    assert len(calls) == 2
+    assert calls[1] is None
+
+
+def test_policy_bypass_and_max_bytes(monkeypatch):
+    """ポリシーでbypassを指定した場合はキャッシュを利用せず、max_bytesを超えるレスポンスはキャッシュしないこと"""
+    policies = {"bypass": False, "max_bytes": 0}
+    calls = []
+
+    @ResponseCache.cached(resource="events", expire=60, stale_expire=0)
+    async def list_events(request: Request, size: int):
+        calls.append(size)
+        return {"results": "x" * size}
+
+    def get_policy(resource, vcenter_name, expire_secs, stale_secs):
+        return {"expire_secs": expire_secs, "stale_secs": stale_secs, "compression": None, **policies}
+
+    monkeypatch.setattr(CachePolicy, "get_policy", get_policy)
+
+    async def run():
+        backend = LockingBackend()
+        FastAPICache.reset()
+        FastAPICache.init(backend, prefix="fastapi-cache")
+
+        policies["bypass"] = True
+        assert await list_events(request=create_request(), size=1) == {"results": "x"}
+        assert backend._store == {}
+
+        policies.update({"bypass": False, "max_bytes": 100})
+        for _ in range(2):
+            response = await list_events(request=create_request(), size=200)
+            assert response.headers["X-FastAPI-Cache"] == "MISS"
+        await list_events(request=create_request(), size=10)
+        await list_events(request=create_request(), size=10)
+        assert len(backend._store) == 1
+
+    asyncio.run(run())
+
+    assert calls == [1, 200, 200, 10]
+
+
+def test_uninitialized_cache_calls_endpoint():
+    """キャッシュのバックエンドが初期化されていない場合、キャッシュを利用せずにエンドポイントを呼び出すこと"""
+
+    @ResponseCache.cached(resource="vms", expire=60)
+    async def list_vms(request: Request):
+        return {"count": 1}
+
+    FastAPICache.reset()
+    assert asyncio.run(list_vms(request=create_request())) == {"count": 1}
+
+
+def test_cached_route_does_not_touch_vcenter_on_hit(monkeypatch):
+    """キャッシュから応答する場合(304を含む)は、依存関係のService Instanceの接続確認を行わないこと"""
+    from fastapi import Depends, FastAPI
+    from starlette.concurrency import run_in_threadpool
+    from vcenter_lookup_bridge.vmware.connector import Connector
+
+    vcenter_calls = []
+    monkeypatch.setattr(
+        Connector, "get_service_instances", classmethod(lambda cls: vcenter_calls.append(1) or {"vcenter01": "si"})
+    )
+    app = FastAPI()
+
+    @app.get("/vms/")
+    @ResponseCache.cached(resource="vms", expire=60)
+    async def list_vms(request: Request, service_instances: object = Depends(Connector.get_lazy_service_instances)):
+        # vCenterごとの処理と同様に、スレッドでService Instanceを参照する
+        return {"vcenters": await run_in_threadpool(lambda: sorted(service_instances.keys()))}
+
+    async def get(headers: list) -> dict:
+        messages = []
+
+        async def receive():
+            return {"type": "http.request", "body": b"", "more_body": False}
+
+        async def send(message):
+            messages.append(message)
+
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": "GET",
+            "scheme": "http",
+            "path": "/vms/",
+            "raw_path": b"/vms/",
+            "root_path": "",
+            "query_string": b"",
+            "headers": headers,
+            "client": ("127.0.0.1", 12345),
+            "server": ("testserver", 80),
+        }
+        await app(scope, receive, send)
+        return {
+            "status": messages[0]["status"],
+            "headers": {k.decode("latin-1"): v.decode("latin-1") for k, v in messages[0]["headers"]},
+        }
+
+    async def run():
+        FastAPICache.reset()
+        FastAPICache.init(LockingBackend(), prefix="fastapi-cache")
+
+        first = await get([])
+        assert first["status"] == 200 and first["headers"]["x-fastapi-cache"] == "MISS"
+        assert vcenter_calls == [1]
+
+        not_modified = await get([(b"if-none-match", first["headers"]["etag"].encode("latin-1"))])
+        assert not_modified["status"] == 304
+        assert (await get([]))["headers"]["x-fastapi-cache"] == "HIT"
+
+    asyncio.run(run())
+
+    assert vcenter_calls == [1]
@@ -0,0 +1,109 @@
+import asyncio
+import json
+
+from fastapi_cache.backends.inmemory import InMemoryBackend
+from vcenter_lookup_bridge.cache.lru_cache import LruCache
+from vcenter_lookup_bridge.cache.tiered_backend import TieredBackend
+
+
+class FakeRedis(object):
+    """送信した通知を記録するRedisの代替"""
+
+    def __init__(self):
+        self.published = []
+
+    async def publish(self, channel, message):
+        self.published.append((channel, message))
+
+
+class CountingBackend(InMemoryBackend):
+    """Redisへの問い合わせ回数を記録するバックエンド"""
+
+    def __init__(self):
+        self._store = {}
+        self.reads = 0
+
+    async def get_with_ttl(self, key):
+        self.reads += 1
+        return await super().get_with_ttl(key)
+
+
+def create_backend(monkeypatch) -> TieredBackend:
+    monkeypatch.setenv("VLB_CACHE_LOCAL_ENABLED", "True")
+    backend = TieredBackend(FakeRedis())
+    backend.redis_backend = CountingBackend()
+    return backend
+
+
+def test_lru_cache_evicts_least_recently_used():
+    """件数・バイト数の上限を超えた場合、最も長く参照されていないエントリから破棄すること"""
+    lru = LruCache(max_entries=2, max_bytes=1024)
+    lru.set("a", b"1", 60)
+    lru.set("b", b"2", 60)
+    lru.get_with_ttl("a")
+    lru.set("c", b"3", 60)
+
+    assert lru.get_with_ttl("b") == (0, None)
+    assert lru.get_with_ttl("a")[1] == b"1"
+    assert lru.get_with_ttl("c")[1] == b"3"
+
+    lru = LruCache(max_entries=10, max_bytes=10)
+    lru.set("a", b"12345", 60)
+    lru.set("b", b"12345", 60)
+    assert lru.get_with_ttl("a") == (0, None)
+    assert lru.get_stats()["bytes"] <= 10
+
+
+def test_hit_is_served_from_local_cache(monkeypatch):
+    """登録済みのレスポンスは、Redisに問い合わせずに返すこと"""
+    backend = create_backend(monkeypatch)
+
+    async def run():
+        await backend.set("fastapi-cache::key", b"value", 60)
+        return [await backend.get_with_ttl("fastapi-cache::key") for _ in range(3)]
+
+    results = asyncio.run(run())
+
+    assert [value for _, value in results] == [b"value"] * 3
+    assert backend.redis_backend.reads == 0
+    assert json.loads(backend.redis.published[0][1])["keys"] == ["fastapi-cache::key"]
+
+
+def test_invalidation_from_other_worker(monkeypatch):
+    """他のワーカープロセスからの通知で、1次キャッシュのエントリを破棄し、自身の通知は無視すること"""
+    backend = create_backend(monkeypatch)
+    backend.local.set("fastapi-cache::a", b"a", 60)
+    backend.local.set("fastapi-cache::b", b"b", 60)
+    backend.local.set("other::c", b"c", 60)
+
+    backend.apply_invalidation(json.dumps({"origin": backend.origin, "keys": ["fastapi-cache::a"]}))
+    assert backend.local.get_with_ttl("fastapi-cache::a")[1] == b"a"
+
+    backend.apply_invalidation(json.dumps({"origin": "other", "keys": ["fastapi-cache::a"]}))
+    assert backend.local.get_with_ttl("fastapi-cache::a")[1] is None
+
+    backend.apply_invalidation(json.dumps({"origin": "other", "keys": [], "prefix": "fastapi-cache"}))
+    assert backend.local.get_with_ttl("fastapi-cache::b")[1] is None
+    assert backend.local.get_with_ttl("other::c")[1] == b"c"
+
+
+def test_large_response_is_compressed_in_redis(monkeypatch):
+    """閾値以上のレスポンスはRedisに圧縮して保存し、圧縮前のレスポンスとして読み込むこと"""
+    monkeypatch.setenv("VLB_CACHE_COMPRESSION_MIN_BYTES", "1024")
+    backend = create_backend(monkeypatch)
+    large = json.dumps({"results": [{"name": f"vm{i}", "powerState": "poweredOn"} for i in range(100)]}).encode()
+
+    async def run():
+        await backend.set("fastapi-cache::large", large, 60)
+        await backend.set("fastapi-cache::small", b"small", 60)
+        await backend.set("fastapi-cache::uncompressed", large, 60, compress=False)
+        backend.local.clear()
+        return [(await backend.get_with_ttl(key))[1] for key in ("fastapi-cache::large", "fastapi-cache::small")]
+
+    assert asyncio.run(run()) == [large, b"small"]
+    assert len(backend.redis_backend._store["fastapi-cache::large"].data) < len(large)
+    assert backend.redis_backend._store["fastapi-cache::small"].data == b"small"
+    assert backend.redis_backend._store["fastapi-cache::uncompressed"].data == large
+    stats = backend.get_stats()["compression"]
+    assert stats["compressed"] == 1 and stats["uncompressed"] == 2
+    assert stats["ratio"] < 1
@@ -0,0 +1,74 @@
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+from vcenter_lookup_bridge.broker.client import BrokerClient
+from vcenter_lookup_bridge.utils.admission_controller import AdmissionController
+from vcenter_lookup_bridge.vmware.work_scheduler import WorkScheduler
+
+
+@pytest.fixture
+def client(monkeypatch):
+    """受け付け制御のミドルウェアのみを組み込んだテスト用のクライアントを作成"""
+    app = FastAPI()
+
+    @app.middleware("http")
+    async def admission_control(request: Request, call_next):
+        return await AdmissionController.dispatch(request, call_next)
+
+    @app.get("/vms/")
+    async def list_vms():
+        return {"results": []}
+
+    @app.get("/healthcheck/")
+    async def healthcheck():
+        return {"status": "ok"}
+
+    monkeypatch.setattr(AdmissionController, "_cached_urls", type(AdmissionController._cached_urls)())
+    monkeypatch.setenv("VLB_ADMISSION_MAX_OUTSTANDING_WORK", "10")
+    monkeypatch.setenv("VLB_ADMISSION_RETRY_AFTER_SECS", "7")
+    return TestClient(app)
+
+
+def set_outstanding_work(monkeypatch, count: int):
+    monkeypatch.setattr(
+        WorkScheduler,
+        "get_stats",
+        classmethod(lambda cls: {"queued": {"bulk": count}, "running": {"bulk": 0}}),
+    )
+
+
+def test_admits_request_under_threshold(client, monkeypatch):
+    """閾値以下の場合はリクエストを受け付けること"""
+    set_outstanding_work(monkeypatch, 0)
+    assert client.get("/vms/").status_code == 200
+
+
+def test_rejects_request_over_outstanding_work(client, monkeypatch):
+    """vCenterへのリクエスト処理が滞留している場合は、503とRetry-Afterを返すこと"""
+    set_outstanding_work(monkeypatch, 11)
+    response = client.get("/vms/")
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "7"
+
+
+def test_healthcheck_is_exempt(client, monkeypatch):
+    """ヘルスチェックは負荷に関わらず受け付けること"""
+    set_outstanding_work(monkeypatch, 11)
+    assert client.get("/healthcheck/").status_code == 200
+
+
+def test_cached_url_is_admitted(client, monkeypatch):
+    """直近でキャッシュに格納されたURLは、滞留があっても受け付けること"""
+    AdmissionController._cached_urls["/vms/?"] = float("inf")
+    set_outstanding_work(monkeypatch, 11)
+    assert client.get("/vms/").status_code == 200
+
+
+def test_rejects_request_over_broker_outstanding_work(client, monkeypatch):
+    """ブローカーを利用する場合は、ブローカーのスケジューラの滞留で判断すること"""
+    set_outstanding_work(monkeypatch, 0)
+    monkeypatch.setenv("VLB_BROKER_SOCKET", "/tmp/broker.sock")
+    monkeypatch.setattr(
+        BrokerClient, "_stats", {"scheduler": {"queued": {"bulk": 11}, "running": {"bulk": 0}}, "vcenters": {}}
+    )
+    assert client.get("/vms/").status_code == 503
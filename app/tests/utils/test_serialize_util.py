@@ -0,0 +1,21 @@
+import pytest
+from vcenter_lookup_bridge.schemas.cluster_parameter import ClusterResponseSchema
+from vcenter_lookup_bridge.utils.serialize_util import SerializeUtil
+
+
+def test_dumps_and_loads_restores_response_schemas():
+    """レスポンスのスキーマを含む取得結果を、スキーマのクラスごと復元すること"""
+    cluster = ClusterResponseSchema(name="cluster01", status="green", hosts=["esxi01"], vcenter="vcenter01")
+    value = {"fragment01": [cluster], "count": (1, 2)}
+
+    restored = SerializeUtil.loads(SerializeUtil.dumps(value))
+
+    assert restored["fragment01"] == [cluster]
+    assert restored["count"] == [1, 2]
+
+
+def test_loads_rejects_models_outside_schemas():
+    """スキーマ以外のクラスは復元しないこと"""
+    data = b'{"__vlb_model__": "os:system", "data": {}}'
+    with pytest.raises(ValueError):
+        SerializeUtil.loads(data)
@@ -0,0 +1,40 @@
+import asyncio
+import json
+import threading
+
+from starlette.requests import Request
+from vcenter_lookup_bridge.utils.cancellation import CancellationToken
+from vcenter_lookup_bridge.utils.stream_util import StreamUtil
+from vcenter_lookup_bridge.vmware.last_known_good import LastKnownGood
+
+
+def test_stale_vcenters_lookup_runs_outside_event_loop(monkeypatch):
+    """保存した結果を返したvCenterの問い合わせ(Redis)は、イベントループのスレッドで実行しないこと"""
+    threads = []
+
+    def get_stale_vcenters(request_id):
+        threads.append(threading.current_thread())
+        return {"vcenter01": "2025-07-24T09:55:00+00:00"}
+
+    monkeypatch.setattr(LastKnownGood, "get_stale_vcenters", get_stale_vcenters)
+
+    async def batches():
+        yield "vcenter01", [{"name": "vm01"}], None
+
+    async def receive():
+        await asyncio.sleep(10)
+
+    async def run():
+        request = Request({"type": "http", "method": "GET", "path": "/vms/stream", "headers": []}, receive)
+        lines = [
+            line
+            async for line in StreamUtil._generate_ndjson_lines(
+                request=request, batches=batches(), object_name="仮想マシン", cancel_token=CancellationToken()
+            )
+        ]
+        return lines, threading.current_thread()
+
+    lines, loop_thread = asyncio.run(run())
+
+    assert threads and threads[0] is not loop_thread
+    assert json.loads(lines[0])["retrievedAt"] == "2025-07-24T09:55:00+00:00"
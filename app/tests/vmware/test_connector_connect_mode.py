@@ -0,0 +1,223 @@
+import time
+from unittest.mock import Mock
+
+import pytest
+import vcenter_lookup_bridge.vmware.instances as g
+from vcenter_lookup_bridge.vmware.connector import Connector
+from vcenter_lookup_bridge.vmware.service_instance_pool import ServiceInstancePool
+
+
+def test_get_connect_mode_prefers_vcenter_config(monkeypatch):
+    """vCenterの設定ファイルのconnect_modeが環境変数より優先され、不正な値はeagerとして扱うこと"""
+    monkeypatch.setattr(
+        g,
+        "vcenter_configurations",
+        {"vcenter01": {"connect_mode": "lazy"}, "vcenter02": {}, "vcenter03": {"connect_mode": "unknown"}},
+        raising=False,
+    )
+    monkeypatch.setenv("VLB_VCENTER_CONNECT_MODE", "idle_timeout")
+
+    assert Connector.get_connect_mode("vcenter01") == Connector.CONNECT_MODE_LAZY
+    assert Connector.get_connect_mode("vcenter02") == Connector.CONNECT_MODE_IDLE_TIMEOUT
+    assert Connector.get_connect_mode("vcenter03") == Connector.CONNECT_MODE_EAGER
+
+
+def test_pooled_connects_on_first_use(monkeypatch):
+    """初回の利用時に接続するvCenterは、vCenterごとの処理の実行時に接続されること"""
+    monkeypatch.setattr(g, "vcenter_configurations", {"vcenter01": {"connect_mode": "lazy"}}, raising=False)
+    monkeypatch.setattr(g, "service_instances", {}, raising=False)
+    si = Mock()
+    monkeypatch.setattr(Connector, "get_on_demand_service_instance", classmethod(lambda cls, vcenter_name: si))
+
+    @ServiceInstancePool.pooled
+    def get_objects(vcenter_name: str, service_instances: dict):
+        return service_instances[vcenter_name]
+
+    assert get_objects("vcenter01", g.service_instances) is si
+
+
+def test_close_idle_connections(monkeypatch):
+    """idle_timeoutのvCenterのみ、一定時間利用されていない接続を切断すること"""
+    monkeypatch.setattr(
+        g,
+        "vcenter_configurations",
+        {
+            "vcenter01": {"connect_mode": "idle_timeout", "idle_timeout_sec": 60},
+            "vcenter02": {"connect_mode": "lazy"},
+        },
+        raising=False,
+    )
+    si01, si02 = Mock(), Mock()
+    monkeypatch.setattr(g, "service_instances", {"vcenter01": si01, "vcenter02": si02}, raising=False)
+    monkeypatch.setattr(Connector, "_owned_sessions", {"vcenter01"})
+    monkeypatch.setattr(
+        Connector, "_last_used", {"vcenter01": time.monotonic() - 120, "vcenter02": time.monotonic() - 120}
+    )
+    disconnected = []
+    monkeypatch.setattr(Connector, "_disconnect_vcenter", classmethod(lambda cls, si: disconnected.append(si)))
+
+    Connector.close_idle_connections()
+
+    assert g.service_instances == {"vcenter02": si02}
+    assert disconnected == [si01]
+
+
+def test_get_health_snapshot(monkeypatch):
+    """記録済みの接続状態を返し、確認していないvCenterはnot_connectedとして返すこと"""
+    monkeypatch.setattr(g, "vcenter_configurations", {"vcenter01": {}, "vcenter02": {}}, raising=False)
+    monkeypatch.setattr(Connector, "_vcenter_health", {})
+    si = Mock()
+
+    Connector._check_current_time("vcenter01", si)
+    snapshot = Connector.get_health_snapshot()
+
+    si.CurrentTime.assert_called_once()
+    assert snapshot["vcenter01"]["status"] == Connector.HEALTH_STATUS_ALIVE
+    assert snapshot["vcenter01"]["latencyMs"] is not None
+    assert snapshot["vcenter02"] == {
+        "status": Connector.HEALTH_STATUS_NOT_CONNECTED,
+        "latencyMs": None,
+        "checkedAt": None,
+    }
+
+
+def test_interrupted_probe_is_recorded_as_failure(monkeypatch):
+    """復旧の検査がExceptionの派生以外で中断された場合も、失敗を記録してロックを解放すること"""
+    from vcenter_lookup_bridge.vmware.vcenter_circuit_breaker import VCenterCircuitBreaker
+    from vcenter_lookup_bridge.vmware.vcenter_ws_session_managr import VCenterWSSessionManager
+
+    monkeypatch.setattr(g, "vcenter_configurations", {"vcenter01": {}}, raising=False)
+    monkeypatch.setattr(g, "service_instances", {}, raising=False)
+    monkeypatch.setattr(VCenterWSSessionManager, "initialize", classmethod(lambda cls: Mock()))
+    circuit = {"state": VCenterCircuitBreaker.STATE_OPEN, "failures": 2, "backoff": 10, "open_until": 0.0}
+    monkeypatch.setattr(VCenterCircuitBreaker, "get_state", classmethod(lambda cls, redis, vcenter_name: circuit))
+    monkeypatch.setattr(VCenterCircuitBreaker, "try_start_probe", classmethod(lambda cls, redis, vcenter_name: True))
+    calls = []
+    monkeypatch.setattr(
+        VCenterCircuitBreaker,
+        "record_failure",
+        classmethod(lambda cls, redis, vcenter_name: calls.append(("failure", vcenter_name))),
+    )
+    monkeypatch.setattr(
+        VCenterCircuitBreaker,
+        "finish_probe",
+        classmethod(lambda cls, redis, vcenter_name: calls.append(("finish", vcenter_name))),
+    )
+
+    def interrupt(cls, redis, config, vcenter_name):
+        raise KeyboardInterrupt()
+
+    monkeypatch.setattr(Connector, "_reconnect_vcenter", classmethod(interrupt))
+
+    with pytest.raises(KeyboardInterrupt):
+        Connector.probe_open_circuits()
+
+    assert calls == [("failure", "vcenter01"), ("finish", "vcenter01")]
+
+
+def test_login_failure_is_a_per_vcenter_error_after_startup(monkeypatch):
+    """起動後の再接続でログインに失敗した場合は、異常終了せずにvCenterごとの接続エラーとして記録すること"""
+    from vcenter_lookup_bridge.vmware.connector import VCenterLoginError
+    from vcenter_lookup_bridge.vmware.vcenter_circuit_breaker import VCenterCircuitBreaker
+
+    monkeypatch.setattr(g, "service_instances", {}, raising=False)
+    monkeypatch.setattr(Connector, "_login_failures", set())
+    monkeypatch.setattr(Connector, "_vcenter_health", {})
+
+    def login_fail(cls, config, vcenter_name):
+        raise VCenterLoginError("invalid login")
+
+    failures = []
+    monkeypatch.setattr(Connector, "_connect_vcenter", classmethod(login_fail))
+    monkeypatch.setattr(
+        VCenterCircuitBreaker,
+        "record_failure",
+        classmethod(lambda cls, redis, vcenter_name: failures.append(vcenter_name)),
+    )
+
+    config = {"hostname": "vcenter01.example.com", "port": 443}
+    assert Connector._reconnect_vcenter(redis=Mock(), config=config, vcenter_name="vcenter01") is False
+    assert failures == ["vcenter01"]
+    assert Connector._vcenter_health["vcenter01"]["status"] == Connector.HEALTH_STATUS_DEAD
+    assert Connector._login_failures == {"vcenter01"}
+
+
+def test_connect_on_startup_exits_on_login_failure(monkeypatch):
+    """起動時にログインに失敗したvCenterがある場合のみ、異常終了すること"""
+    from vcenter_lookup_bridge.utils.constants import Constants as cs
+
+    monkeypatch.setattr(Connector, "_login_failures", set())
+    monkeypatch.setattr(Connector, "get_service_instances", classmethod(lambda cls: {}))
+    assert Connector.connect_on_startup() == {}
+
+    def login_fail(cls):
+        cls._login_failures.add("vcenter01")
+        return {}
+
+    monkeypatch.setattr(Connector, "get_service_instances", classmethod(login_fail))
+    with pytest.raises(SystemExit) as e:
+        Connector.connect_on_startup()
+    assert e.value.code == cs.EXIT_ERR_VCENTER_CONNECT_LOGIN_FAIL
+
+
+def test_on_demand_login_failure_returns_none(monkeypatch):
+    """初回の利用時の接続でログインに失敗した場合は、異常終了せずにNoneを返し、失敗を記録すること"""
+    from vcenter_lookup_bridge.vmware.connector import VCenterLoginError
+    from vcenter_lookup_bridge.vmware.vcenter_circuit_breaker import VCenterCircuitBreaker
+    from vcenter_lookup_bridge.vmware.vcenter_ws_session_managr import VCenterWSSessionManager
+
+    monkeypatch.setattr(
+        g,
+        "vcenter_configurations",
+        {"vcenter01": {"connect_mode": "lazy", "hostname": "vcenter01.example.com", "port": 443}},
+        raising=False,
+    )
+    monkeypatch.setattr(g, "service_instances", {}, raising=False)
+    monkeypatch.setattr(Connector, "_login_failures", set())
+    monkeypatch.setattr(Connector, "_vcenter_health", {})
+    monkeypatch.setattr(VCenterWSSessionManager, "initialize", classmethod(lambda cls: Mock()))
+    monkeypatch.setattr(
+        VCenterCircuitBreaker, "get_state", classmethod(lambda cls, redis, vcenter_name: cls._decode_state({}))
+    )
+    failures = []
+    monkeypatch.setattr(
+        VCenterCircuitBreaker,
+        "record_failure",
+        classmethod(lambda cls, redis, vcenter_name: failures.append(vcenter_name)),
+    )
+
+    def login_fail(cls, config, vcenter_name):
+        raise VCenterLoginError("invalid login")
+
+    monkeypatch.setattr(Connector, "_connect_vcenter", classmethod(login_fail))
+
+    assert Connector.get_on_demand_service_instance("vcenter01") is None
+    assert failures == ["vcenter01"]
+    assert "vcenter01" not in g.service_instances
+
+
+def test_uuid_lookup_searches_vcenters_not_connected_yet(monkeypatch):
+    """vCenterを指定しないUUIDでの検索は、まだ接続していないvCenter(connect_mode: lazy)も検索すること"""
+    from pyVmomi import vim
+    from vcenter_lookup_bridge.vmware.vm import Vm
+
+    configs = {"vcenter01": {}, "vcenter02": {"connect_mode": "lazy"}}
+    monkeypatch.setattr(g, "vcenter_configurations", configs, raising=False)
+    si01, si02 = Mock(), Mock()
+    si01.RetrieveContent.return_value.searchIndex.FindByUuid.return_value = None
+    vm = Mock(spec=vim.VirtualMachine)
+    vm.parent = None
+    content02 = si02.RetrieveContent.return_value
+    content02.searchIndex.FindByUuid.return_value = vm
+    content02.rootFolder.childEntity = []
+    monkeypatch.setattr(Connector, "get_on_demand_service_instance", classmethod(lambda cls, vcenter_name: si02))
+    monkeypatch.setattr(Vm, "_generate_vm_info", classmethod(lambda cls, vcenter_name, **kwargs: vcenter_name))
+
+    result = Vm.get_vm_by_instance_uuid_from_all_vcenters(
+        vcenter_name=None,
+        service_instances={"vcenter01": si01},
+        configs=configs,
+        instance_uuid="12345678-1234-5678-1234-567812345678",
+    )
+
+    assert result == "vcenter02"
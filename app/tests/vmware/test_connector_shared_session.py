@@ -0,0 +1,54 @@
+from unittest.mock import Mock
+
+import pytest
+from vcenter_lookup_bridge.vmware.connector import Connector
+from vcenter_lookup_bridge.vmware.vcenter_shared_session import VCenterSharedSessionManager
+from vcenter_lookup_bridge.vmware.vcenter_ws_session_managr import VCenterWSSessionManager
+
+CONFIG = {"hostname": "vcenter.example.com", "port": 443}
+
+
+@pytest.fixture
+def shared_session(monkeypatch):
+    """Redisを利用せずに、共有セッションの状態を保持するテスト用の辞書を作成"""
+    state = {"session_id": None, "published": [], "logins": 0}
+    monkeypatch.setattr(VCenterWSSessionManager, "initialize", staticmethod(lambda: Mock()))
+    monkeypatch.setattr(
+        VCenterSharedSessionManager, "get_session_id", classmethod(lambda cls, redis, vcenter_name: state["session_id"])
+    )
+    monkeypatch.setattr(
+        VCenterSharedSessionManager,
+        "publish_session_id",
+        classmethod(lambda cls, redis, vcenter_name, session_id: state["published"].append(session_id)),
+    )
+    monkeypatch.setattr(
+        VCenterSharedSessionManager, "acquire_login_lock", classmethod(lambda cls, redis, vcenter_name: "token")
+    )
+    monkeypatch.setattr(
+        VCenterSharedSessionManager, "release_login_lock", classmethod(lambda cls, redis, vcenter_name, token: None)
+    )
+
+    def smart_connect(cls, config, vcenter_name, session_id=None):
+        si = Mock()
+        if session_id is None:
+            state["logins"] += 1
+            si._stub.GetSessionId.return_value = "new-session"
+        return si
+
+    monkeypatch.setattr(Connector, "_smart_connect", classmethod(smart_connect))
+    return state
+
+
+def test_attaches_to_shared_session(shared_session):
+    """共有されたセッションが有効な場合、ログインせずに接続すること"""
+    shared_session["session_id"] = "shared-session"
+    Connector._connect_vcenter_with_shared_session(config=CONFIG, vcenter_name="vcenter01")
+    assert shared_session["logins"] == 0
+    assert shared_session["published"] == []
+
+
+def test_logs_in_and_publishes_session(shared_session):
+    """共有されたセッションがない場合、ログインしてセッションを共有すること"""
+    Connector._connect_vcenter_with_shared_session(config=CONFIG, vcenter_name="vcenter01")
+    assert shared_session["logins"] == 1
+    assert shared_session["published"] == ["new-session"]
@@ -0,0 +1,90 @@
+import pytest
+from vcenter_lookup_bridge.vmware.fragment_cache import FragmentCache
+
+
+class DictRedis(object):
+    """テスト用に、利用するコマンドのみを辞書で実装したRedis"""
+
+    def __init__(self):
+        self.data = {}
+
+    def mget(self, keys):
+        return [self.data.get(key) for key in keys]
+
+    def set(self, key, value, ex=None):
+        self.data[key] = value
+
+    def sadd(self, key, *values):
+        self.data.setdefault(key, set()).update(values)
+
+    def expire(self, key, seconds):
+        pass
+
+    def pipeline(self, transaction=True):
+        return self
+
+    def execute(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    redis = DictRedis()
+    monkeypatch.setattr(FragmentCache, "_get_redis", classmethod(lambda cls: redis))
+    return redis
+
+
+def test_only_missing_fragments_are_computed(redis):
+    """キャッシュにない断片のみ取得し、重なりのあるリクエストではキャッシュ済みの断片を再利用すること"""
+    computed = []
+
+    def compute(fragments):
+        computed.append(fragments)
+        return {fragment: [f"{fragment}-vm01", f"{fragment}-vm02"] for fragment in fragments}
+
+    results = FragmentCache.get_fragments("vms", "vcenter01", ["A", "B"], compute)
+    assert results == {"A": ["A-vm01", "A-vm02"], "B": ["B-vm01", "B-vm02"]}
+
+    results = FragmentCache.get_fragments("vms", "vcenter01", ["B", "C", "B"], compute)
+    assert list(results.keys()) == ["B", "C"]
+    assert computed == [["A", "B"], ["C"]]
+
+    # 他のvCenterの断片は共有しない
+    FragmentCache.get_fragments("vms", "vcenter02", ["A"], compute)
+    assert computed[-1] == ["A"]
+
+
+def test_stale_fragments_are_not_cached(redis):
+    """最後に取得に成功した結果(LastKnownGood)を返した場合は、断片をキャッシュしないこと"""
+    from vcenter_lookup_bridge.vmware.last_known_good import LastKnownGood
+
+    def compute(fragments):
+        for detection in LastKnownGood._local.detections:
+            detection["stale"] = True
+        return {fragment: [f"{fragment}-vm01"] for fragment in fragments}
+
+    results = FragmentCache.get_fragments("vms", "vcenter01", ["A"], compute)
+    assert results == {"A": ["A-vm01"]}
+    assert FragmentCache._get_key("vms", "vcenter01", "A") not in redis.data
+
+
+def test_assemble_applies_offset_and_removes_duplicates():
+    """断片を結合してoffset/max_resultsを適用し、複数の断片に含まれる結果は1件のみ返すこと"""
+    results_by_fragment = {
+        "tag01": [{"name": "ds01"}, {"name": "ds02"}],
+        "tag02": [{"name": "ds02"}, {"name": "ds03"}],
+    }
+
+    results = FragmentCache.assemble(results_by_fragment, unique_key=lambda result: result["name"])
+    assert [result["name"] for result in results] == ["ds01", "ds02", "ds03"]
+
+    results = FragmentCache.assemble(
+        results_by_fragment, offset=1, max_results=1, unique_key=lambda result: result["name"]
+    )
+    assert [result["name"] for result in results] == ["ds02"]
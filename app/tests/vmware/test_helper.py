@@ -0,0 +1,86 @@
+from unittest.mock import Mock
+
+from pyVmomi import vim
+from vcenter_lookup_bridge.vmware.helper import Helper
+
+
+def create_datacenter(name: str) -> Mock:
+    datacenter = Mock(spec=vim.Datacenter)
+    datacenter.name = name
+    return datacenter
+
+
+def create_folder(child_entity: list) -> Mock:
+    folder = Mock(spec=vim.Folder)
+    folder.childEntity = child_entity
+    return folder
+
+
+def test_get_datacenters_includes_nested_folders():
+    """フォルダの配下に配置されたデータセンターも含め、全てのデータセンターを取得すること"""
+    datacenter01 = create_datacenter("datacenter01")
+    datacenter02 = create_datacenter("datacenter02")
+    datacenter03 = create_datacenter("datacenter03")
+    content = Mock()
+    content.rootFolder = create_folder(
+        [datacenter01, create_folder([datacenter02, create_folder([datacenter03])]), create_folder([])]
+    )
+
+    assert Helper.get_datacenters(content) == [datacenter01, datacenter02, datacenter03]
+
+
+def test_get_datacenter_of():
+    """親フォルダをたどって、所属するデータセンターを取得すること"""
+    datacenter = create_datacenter("datacenter01")
+    folder = create_folder([])
+    folder.parent = datacenter
+    vm = Mock(spec=vim.VirtualMachine)
+    vm.parent = folder
+    orphan = Mock(spec=vim.VirtualMachine)
+    orphan.parent = None
+
+    assert Helper.get_datacenter_of(vm) is datacenter
+    assert Helper.get_datacenter_of(orphan) is None
+
+
+def test_scan_datacenters_applies_offset_across_datacenters():
+    """全データセンターの結果を結合したうえでoffset/max_resultsを適用し、対象のオブジェクトのみ応答を生成すること"""
+    datacenters = [create_datacenter("datacenter01"), create_datacenter("datacenter02")]
+    objects = {"datacenter01": ["vm01", "vm02", "vm03"], "datacenter02": ["vm04", "vm05"]}
+    generated = []
+
+    def collect(datacenter, limit):
+        return objects[datacenter.name][:limit]
+
+    def generate(datacenter, obj):
+        generated.append(obj)
+        return f"{datacenter.name}/{obj}"
+
+    results = Helper.scan_datacenters(datacenters, collect, generate, offset=2, max_results=2)
+
+    assert results == ["datacenter01/vm03", "datacenter02/vm04"]
+    assert sorted(generated) == ["vm03", "vm04"]
+
+
+def test_get_vms_in_vm_folders_of_datacenter_in_folder():
+    """フォルダの配下に配置されたデータセンターでも、vmFolderを起点に仮想マシンフォルダの仮想マシンを取得すること"""
+    vm01 = Mock(spec=vim.VirtualMachine)
+    vm_folder = create_folder([vm01, create_folder([])])
+    vm_folder.name = "folder01"
+    base_folder = create_folder([vm_folder])
+    base_folder.name = "vlb"
+    datacenter = create_datacenter("datacenter02")
+    datacenter.vmFolder = create_folder([base_folder])
+    region_folder = create_folder([datacenter])
+    region_folder.name = "Region1"
+    datacenter.parent = region_folder
+
+    search_index = Mock()
+    search_index.FindChild.side_effect = lambda entity, name: next(
+        (child for child in entity.childEntity if child.name == name), None
+    )
+
+    assert Helper.get_vms_in_vm_folders(search_index, datacenter, "vlb", ["folder01", "folder02"]) == [
+        ("folder01", vm01)
+    ]
+    search_index.FindByInventoryPath.assert_not_called()
@@ -0,0 +1,113 @@
+import pytest
+from vcenter_lookup_bridge.vmware.last_known_good import LastKnownGood
+from vcenter_lookup_bridge.vmware.vcenter_circuit_breaker import VCenterCircuitBreaker
+
+
+class DictRedis(object):
+    """テスト用に、利用するコマンドのみを辞書で実装したRedis"""
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, ex=None):
+        self.data[key] = value
+
+    def hgetall(self, key):
+        return {k.encode("utf-8"): str(v).encode("utf-8") for k, v in self.data.get(key, {}).items()}
+
+    def hset(self, key, field=None, value=None, mapping=None):
+        self.data.setdefault(key, {}).update(mapping or {field: value})
+
+    def expire(self, key, seconds):
+        pass
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    redis = DictRedis()
+    monkeypatch.setattr(LastKnownGood, "_get_redis", classmethod(lambda cls: redis))
+    return redis
+
+
+def test_fallback_serves_last_known_good_on_failure(redis):
+    """取得に失敗した場合、最後に取得に成功した結果を返し、取得時刻を記録すること"""
+    responses = [["vm01"], ConnectionError("vCenter is down")]
+
+    @LastKnownGood.fallback
+    def get_vms(vcenter_name: str, vm_folders: list, request_id: str = None):
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    assert get_vms("vcenter01", ["folder01"], request_id="req01") == ["vm01"]
+    assert LastKnownGood.get_stale_vcenters("req01") is None
+
+    assert get_vms("vcenter01", ["folder01"], request_id="req02") == ["vm01"]
+    assert "vcenter01" in LastKnownGood.get_stale_vcenters("req02")
+
+
+def test_fallback_skips_vcenter_while_circuit_is_open(redis):
+    """接続が遮断されている場合、vCenterに接続せずに保存した結果を返すこと"""
+    calls = []
+
+    @LastKnownGood.fallback
+    def get_vms(vcenter_name: str, vm_folders: list, request_id: str = None):
+        calls.append(vcenter_name)
+        return ["vm01"]
+
+    get_vms("vcenter01", ["folder01"])
+    redis.hset(f"{VCenterCircuitBreaker.CIRCUIT_PREFIX}vcenter01", mapping={"state": "open"})
+
+    assert get_vms("vcenter01", ["folder01"], request_id="req01") == ["vm01"]
+    assert calls == ["vcenter01"]
+
+
+def test_fallback_raises_without_last_known_good(redis):
+    """保存した結果がない場合は、例外をそのまま送出すること"""
+
+    @LastKnownGood.fallback
+    def get_vms(vcenter_name: str, vm_folders: list, request_id: str = None):
+        raise ConnectionError("vCenter is down")
+
+    with pytest.raises(ConnectionError):
+        get_vms("vcenter01", ["folder02"])
+
+
+def test_fragment_results_are_saved_per_fragment(redis):
+    """断片ごとに保存し、取得する断片の組み合わせが異なるリクエストでも保存した結果を返すこと"""
+    responses = [{"A": ["vm01"], "B": ["vm02"]}, ConnectionError("vCenter is down")]
+
+    @LastKnownGood.fallback(fragments_arg="fragments")
+    def get_vms(vcenter_name: str, fragments: list, request_id: str = None):
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    assert get_vms("vcenter01", ["A", "B"], request_id="req01") == {"A": ["vm01"], "B": ["vm02"]}
+    assert get_vms("vcenter01", ["B"], request_id="req02") == {"B": ["vm02"]}
+    assert "vcenter01" in LastKnownGood.get_stale_vcenters("req02")
+
+
+def test_detect_stale(redis):
+    """保存した結果を返した場合のみ、検出すること"""
+    responses = [["vm01"], ConnectionError("vCenter is down")]
+
+    @LastKnownGood.fallback
+    def get_vms(vcenter_name: str, vm_folders: list, request_id: str = None):
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    with LastKnownGood.detect_stale() as detection:
+        get_vms("vcenter01", ["folder01"])
+    assert not detection["stale"]
+
+    with LastKnownGood.detect_stale() as detection:
+        get_vms("vcenter01", ["folder01"])
+    assert detection["stale"]
@@ -0,0 +1,79 @@
+from unittest.mock import Mock
+
+from pyVmomi import vim
+from pyVmomi.SoapAdapter import SoapStubAdapter
+from vcenter_lookup_bridge.vmware.service_instance_pool import ServiceInstancePool
+from vcenter_lookup_bridge.vmware.vcenter_deadline import VCenterDeadline
+
+
+def create_service_instance():
+    """接続を行わないService Instanceを作成"""
+    stub = SoapStubAdapter(host="vcenter.example.com", version="vim.version.version9")
+    stub.cookie = 'vmware_soap_session="dummy"'
+    return vim.ServiceInstance("ServiceInstance", stub)
+
+
+def test_checkout_shares_cookie_with_independent_stub():
+    """貸し出したService Instanceが、セッションCookieを共有する別のスタブを持つこと"""
+    base_si = create_service_instance()
+    ServiceInstancePool.invalidate("vcenter01")
+
+    with ServiceInstancePool.checkout("vcenter01", base_si) as si:
+        assert si is not base_si
+        assert si._stub is not base_si._stub
+        assert si._stub.pool is not base_si._stub.pool
+        assert si._stub.cookie == base_si._stub.cookie
+
+
+def test_checkout_creates_up_to_pool_size(monkeypatch):
+    """同時に貸し出すService Instanceが、プールの上限まで作成されること"""
+    monkeypatch.setenv("VLB_VCENTER_SOAP_STUB_POOL_SIZE", "2")
+    base_si = create_service_instance()
+    ServiceInstancePool.invalidate("vcenter01")
+
+    with ServiceInstancePool.checkout("vcenter01", base_si) as si1:
+        with ServiceInstancePool.checkout("vcenter01", base_si) as si2:
+            assert si1._stub is not si2._stub
+    assert ServiceInstancePool.get_stats()["vcenter01"] == {"created": 2, "idle": 2}
+
+
+def test_pooled_passes_mock_through():
+    """SOAPスタブを複製できないモックの場合は、そのまま渡されること"""
+    mock_si = Mock()
+
+    @ServiceInstancePool.pooled
+    def get_objects(vcenter_name: str, service_instances: dict):
+        return service_instances[vcenter_name]
+
+    assert get_objects("vcenter01", {"vcenter01": mock_si}) is mock_si
+
+
+def test_clone_does_not_share_per_stub_state():
+    """複製したスタブが、複製元のスレッドごとの状態(制限時間など)を共有しないこと"""
+    base_si = create_service_instance()
+    VCenterDeadline.apply_to_stub(base_si._stub, "vcenter01")
+    base_si._stub._deadline_local().call = {"timeout": 1}
+    ServiceInstancePool.invalidate("vcenter01")
+
+    with ServiceInstancePool.checkout("vcenter01", base_si) as si:
+        assert si._stub._deadline_local() is not base_si._stub._deadline_local()
+        assert getattr(si._stub._deadline_local(), "call", None) is None
+        assert si._stub.host == base_si._stub.host
+        assert si._stub.schemeArgs is not base_si._stub.schemeArgs
+        assert si._stub.lock is not base_si._stub.lock
+
+
+def test_failed_clone_is_not_counted(monkeypatch):
+    """Service Instanceを複製できなかった場合、共有のService Instanceを利用し、作成数に含めないこと"""
+    monkeypatch.setenv("VLB_VCENTER_SOAP_STUB_POOL_SIZE", "1")
+    base_si = create_service_instance()
+    ServiceInstancePool.invalidate("vcenter01")
+
+    def fail(vcenter_name, base_si):
+        raise OSError("clone failed")
+
+    monkeypatch.setattr(ServiceInstancePool, "_clone_service_instance", fail)
+    for _ in range(2):
+        with ServiceInstancePool.checkout("vcenter01", base_si) as si:
+            assert si is base_si
+    assert ServiceInstancePool.get_stats()["vcenter01"] == {"created": 0, "idle": 0}
@@ -0,0 +1,51 @@
+from vcenter_lookup_bridge.vmware.vcenter_circuit_breaker import VCenterCircuitBreaker
+
+
+def _circuit(state=VCenterCircuitBreaker.STATE_CLOSED, failures=0, backoff=0, open_until=0.0):
+    return {"state": state, "failures": failures, "backoff": backoff, "open_until": open_until}
+
+
+def test_circuit_opens_after_threshold_with_exponential_backoff(monkeypatch):
+    """連続した失敗が閾値に達した場合に遮断し、検査の失敗ごとに待機時間を倍にすること"""
+    monkeypatch.setenv("VLB_VCENTER_CONNECT_RETRY_MAX_COUNT", "2")
+    monkeypatch.setenv("VLB_VCENTER_CONNECT_RETRY_INTERVAL_SEC", "10")
+    monkeypatch.setenv("VLB_VCENTER_CIRCUIT_BACKOFF_MAX_SEC", "25")
+
+    circuit = VCenterCircuitBreaker.next_state_on_failure(_circuit(failures=1), now=100.0)
+    assert circuit["state"] == VCenterCircuitBreaker.STATE_CLOSED
+    assert VCenterCircuitBreaker.allows_request(circuit)
+
+    circuit = VCenterCircuitBreaker.next_state_on_failure(_circuit(failures=2), now=100.0)
+    assert circuit["state"] == VCenterCircuitBreaker.STATE_OPEN
+    assert circuit["backoff"] == 10 and circuit["open_until"] == 110.0
+    assert not VCenterCircuitBreaker.allows_request(circuit)
+    assert not VCenterCircuitBreaker.is_probe_due(circuit, now=109.0)
+    assert VCenterCircuitBreaker.is_probe_due(circuit, now=110.0)
+
+    # 検査(half_open)の失敗では、失敗回数に関わらず待機時間を倍にして再び遮断する(上限あり)
+    probing = {**circuit, "state": VCenterCircuitBreaker.STATE_HALF_OPEN, "failures": 3}
+    circuit = VCenterCircuitBreaker.next_state_on_failure(probing, now=200.0)
+    assert circuit["state"] == VCenterCircuitBreaker.STATE_OPEN and circuit["backoff"] == 20
+    circuit = VCenterCircuitBreaker.next_state_on_failure({**circuit, "state": "half_open"}, now=300.0)
+    assert circuit["backoff"] == 25 and circuit["open_until"] == 325.0
+
+
+def test_half_open_circuit_does_not_allow_requests():
+    """検査中(half_open)は、リクエスト時の接続も、検査の期限内の新たな検査も行わないこと"""
+    circuit = _circuit(state=VCenterCircuitBreaker.STATE_HALF_OPEN, failures=2, backoff=10, open_until=220.0)
+    assert not VCenterCircuitBreaker.allows_request(circuit)
+    assert not VCenterCircuitBreaker.is_probe_due(circuit, now=100.0)
+
+
+def test_expired_half_open_circuit_is_probed_again():
+    """検査の結果が記録されないまま期限が経過した場合は、再び検査の対象とすること"""
+    circuit = _circuit(state=VCenterCircuitBreaker.STATE_HALF_OPEN, failures=2, backoff=10, open_until=220.0)
+    assert VCenterCircuitBreaker.is_probe_due(circuit, now=220.0)
+
+
+def test_decode_state_defaults_to_closed():
+    """状態が登録されていないvCenterは、closedとして扱うこと"""
+    assert VCenterCircuitBreaker._decode_state({}) == _circuit()
+    assert (
+        VCenterCircuitBreaker._decode_state({b"state": b"open", b"failures": b"3", b"backoff": b"40"})["backoff"] == 40
+    )
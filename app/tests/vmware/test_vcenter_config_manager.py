@@ -0,0 +1,83 @@
+from unittest.mock import Mock
+
+import pytest
+import vcenter_lookup_bridge.vmware.instances as g
+from vcenter_lookup_bridge.vmware.connector import Connector
+from vcenter_lookup_bridge.vmware.vcenter_config_manager import VCenterConfigManager
+
+
+@pytest.fixture(autouse=True)
+def restore_configurations(monkeypatch):
+    monkeypatch.setattr(g, "vcenter_configurations", {}, raising=False)
+    monkeypatch.setattr(VCenterConfigManager, "_config_dir", VCenterConfigManager.CONFIG_VCENTER_DIR_DEFAULT)
+    monkeypatch.setattr(VCenterConfigManager, "_signature", None)
+
+
+def write_config(config_dir, name, hostname):
+    (config_dir / f"{name}.yml").write_text(f"name: {name}\nhostname: {hostname}\nport: 443\n")
+
+
+def test_diff_configurations():
+    """追加・削除・変更されたvCenterのみを返すこと"""
+    current = {"vcenter01": {"hostname": "a"}, "vcenter02": {"hostname": "b"}, "vcenter03": {"hostname": "c"}}
+    new = {"vcenter01": {"hostname": "a"}, "vcenter02": {"hostname": "changed"}, "vcenter04": {"hostname": "d"}}
+
+    assert VCenterConfigManager.diff_configurations(current, new) == (["vcenter04"], ["vcenter03"], ["vcenter02"])
+
+
+def test_reload_applies_only_changes(monkeypatch, tmp_path):
+    """設定ファイルが変更された場合のみ設定を差し替え、変更のあったvCenterを接続に反映すること"""
+    apply = Mock()
+    monkeypatch.setattr(Connector, "apply_configuration_changes", apply)
+    write_config(tmp_path, "vcenter01", "vcenter01.example.com")
+    write_config(tmp_path, "vcenter02", "vcenter02.example.com")
+    VCenterConfigManager.load_vcenter_configurations(str(tmp_path))
+    configs_before = g.vcenter_configurations
+
+    assert VCenterConfigManager.reload() is False
+    apply.assert_not_called()
+
+    write_config(tmp_path, "vcenter02", "vcenter02-new.example.com")
+    (tmp_path / "vcenter03.yml").write_text("name: vcenter03\nhostname: vcenter03.example.com\nport: 443\n")
+    (tmp_path / "vcenter01.yml").unlink()
+
+    assert VCenterConfigManager.reload() is True
+    apply.assert_called_once_with(added=["vcenter03"], removed=["vcenter01"], changed=["vcenter02"])
+    assert g.vcenter_configurations is not configs_before
+    assert set(g.vcenter_configurations.keys()) == {"vcenter02", "vcenter03"}
+
+
+def test_reload_keeps_configurations_on_error(monkeypatch, tmp_path):
+    """読み込めない設定ファイルがある場合は、現在の設定を維持すること"""
+    monkeypatch.setattr(Connector, "apply_configuration_changes", Mock())
+    write_config(tmp_path, "vcenter01", "vcenter01.example.com")
+    VCenterConfigManager.load_vcenter_configurations(str(tmp_path))
+
+    (tmp_path / "vcenter02.yml").write_text("hostname: [invalid\n")
+
+    assert VCenterConfigManager.reload() is False
+    assert set(g.vcenter_configurations.keys()) == {"vcenter01"}
+
+
+def test_apply_configuration_changes_keeps_unaffected_vcenters(monkeypatch):
+    """変更のないvCenterの接続は維持し、削除・変更されたvCenterのみ切断すること"""
+    monkeypatch.setattr(
+        g, "vcenter_configurations", {"vcenter01": {}, "vcenter02": {"connect_mode": "lazy"}}, raising=False
+    )
+    si_unaffected, si_changed, si_removed = Mock(), Mock(), Mock()
+    monkeypatch.setattr(
+        g,
+        "service_instances",
+        {"vcenter01": si_unaffected, "vcenter02": si_changed, "vcenter03": si_removed},
+        raising=False,
+    )
+    monkeypatch.setattr(Connector, "_owned_sessions", set())
+    reconnect = Mock()
+    monkeypatch.setattr(Connector, "_reconnect_vcenter", reconnect)
+    monkeypatch.setattr("vcenter_lookup_bridge.vmware.connector.VCenterWSSessionManager.initialize", Mock())
+
+    Connector.apply_configuration_changes(added=[], removed=["vcenter03"], changed=["vcenter02"])
+
+    assert g.service_instances == {"vcenter01": si_unaffected}
+    # 初回の利用時に接続するvCenterは、変更後も利用されるまで接続しない
+    reconnect.assert_not_called()
@@ -0,0 +1,64 @@
+import socket
+import threading
+import time
+
+import pytest
+import vcenter_lookup_bridge.vmware.instances as g
+from fastapi import HTTPException
+from pyVmomi import vim
+from pyVmomi.SoapAdapter import SoapStubAdapter
+from vcenter_lookup_bridge.vmware.vcenter_deadline import DeadlineSoapStubAdapter, DeadlineWatchdog, VCenterDeadline
+
+
+def test_get_timeout_sec_prefers_vcenter_config(monkeypatch):
+    """設定ファイルの処理の種類ごとの制限時間、設定ファイルの既定値、環境変数の順に優先されること"""
+    monkeypatch.setattr(
+        g,
+        "vcenter_configurations",
+        {"vcenter01": {"call_timeouts": {"default": 30, "events": 120}}, "vcenter02": {}},
+        raising=False,
+    )
+    monkeypatch.setenv("VLB_VCENTER_CALL_TIMEOUT_SEC", "45")
+    monkeypatch.setenv("VLB_VCENTER_CALL_TIMEOUT_SEARCH_SEC", "10")
+
+    assert VCenterDeadline.get_timeout_sec("vcenter01", VCenterDeadline.OPERATION_EVENTS) == 120
+    assert VCenterDeadline.get_timeout_sec("vcenter01", VCenterDeadline.OPERATION_RETRIEVE) == 30
+    assert VCenterDeadline.get_timeout_sec("vcenter02", VCenterDeadline.OPERATION_SEARCH) == 10
+    assert VCenterDeadline.get_timeout_sec("vcenter02", VCenterDeadline.OPERATION_RETRIEVE) == 45
+    assert VCenterDeadline.get_operation("ReadNextEvents") == VCenterDeadline.OPERATION_EVENTS
+
+
+def test_hung_soap_call_is_aborted(monkeypatch):
+    """応答のないSOAPのリクエストが、制限時間の経過後に504で中断されること"""
+    monkeypatch.setattr(g, "vcenter_configurations", {"vcenter01": {"call_timeouts": {"default": 0.3}}}, raising=False)
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    server.listen()
+    accepted = []
+    threading.Thread(target=lambda: accepted.append(server.accept()), daemon=True).start()
+
+    stub = SoapStubAdapter(host="127.0.0.1", port=server.getsockname()[1], version="vim.version.version9")
+    VCenterDeadline.apply_to_stub(stub, "vcenter01")
+    assert isinstance(stub, DeadlineSoapStubAdapter)
+
+    started = time.monotonic()
+    with pytest.raises(HTTPException) as e:
+        vim.ServiceInstance("ServiceInstance", stub).CurrentTime()
+    assert e.value.status_code == 504
+    assert time.monotonic() - started < 5
+    server.close()
+
+
+def test_watchdog_forgets_fired_and_cancelled_watches():
+    """コールバックの呼び出し後・取り消し後の登録を保持し続けないこと"""
+    fired = threading.Event()
+    fired_id = DeadlineWatchdog.watch(0.01, fired.set)
+    cancelled_id = DeadlineWatchdog.watch(60, lambda: None)
+
+    assert fired.wait(timeout=5)
+    DeadlineWatchdog.cancel(cancelled_id)
+    # 呼び出し後に取り消した場合(リクエストの終了時に必ず取り消す)も、登録が残らないこと
+    DeadlineWatchdog.cancel(fired_id)
+
+    assert fired_id not in DeadlineWatchdog._entries
+    assert cancelled_id not in DeadlineWatchdog._entries
@@ -0,0 +1,29 @@
+import vcenter_lookup_bridge.vmware.instances as g
+from vcenter_lookup_bridge.vmware.vcenter_rate_limiter import VCenterRateLimiter
+
+
+def test_get_limits_prefers_vcenter_config(monkeypatch):
+    """vCenterの設定ファイルのrate_limitが、環境変数より優先されること"""
+    monkeypatch.setattr(
+        g,
+        "vcenter_configurations",
+        {"vcenter01": {"rate_limit": {"max_concurrency": 2}}},
+        raising=False,
+    )
+    monkeypatch.setenv("VLB_VCENTER_RATE_LIMIT_MAX_CONCURRENCY", "5")
+    monkeypatch.setenv("VLB_VCENTER_RATE_LIMIT_REQUESTS_PER_SEC", "3")
+
+    limits = VCenterRateLimiter.get_limits("vcenter01")
+    assert limits["max_concurrency"] == 2
+    assert limits["requests_per_sec"] == 3.0
+
+
+def test_limited_runs_without_redis(monkeypatch):
+    """Redisを利用できない場合も、制限せずに処理が実行されること"""
+    monkeypatch.setattr(VCenterRateLimiter, "_get_redis", classmethod(lambda cls: None))
+
+    @VCenterRateLimiter.limited
+    def get_objects(vcenter_name: str, cancel_token=None):
+        return [vcenter_name]
+
+    assert get_objects("vcenter01") == ["vcenter01"]
@@ -0,0 +1,121 @@
+import asyncio
+import threading
+import time
+
+import pytest
+from vcenter_lookup_bridge.utils.cancellation import CancellationToken, OperationCancelledError
+from vcenter_lookup_bridge.vmware.work_scheduler import PriorityThreadPoolExecutor, WorkScheduler
+
+
+@pytest.fixture
+def executor():
+    """テスト用のスケジューラを作成"""
+    executor = PriorityThreadPoolExecutor(max_workers=3, reserved_interactive_workers=1)
+    yield executor
+    executor.shutdown(wait=False)
+
+
+def test_submit_returns_result(executor):
+    """処理結果をFutureから取得できること"""
+    future = executor.submit(WorkScheduler.PRIORITY_BULK, lambda x: x * 2, 21)
+    assert future.result(timeout=5) == 42
+
+
+def test_submit_propagates_exception(executor):
+    """処理中の例外がFutureに設定されること"""
+
+    def raise_error():
+        raise ValueError("error")
+
+    future = executor.submit(WorkScheduler.PRIORITY_INTERACTIVE, raise_error)
+    with pytest.raises(ValueError):
+        future.result(timeout=5)
+
+
+def test_submit_unknown_priority(executor):
+    """不明な優先度クラスを指定した場合はValueErrorとなること"""
+    with pytest.raises(ValueError):
+        executor.submit("unknown", lambda: None)
+
+
+def test_bulk_does_not_use_reserved_threads(executor):
+    """bulkクラスの処理が予約スレッドを使用せず、interactiveクラスの処理が待たされないこと"""
+    release = threading.Event()
+    bulk_futures = [executor.submit(WorkScheduler.PRIORITY_BULK, release.wait, 5) for _ in range(5)]
+    time.sleep(0.1)
+
+    stats = executor.get_stats()
+    assert stats["running"][WorkScheduler.PRIORITY_BULK] == 2
+    assert stats["queued"][WorkScheduler.PRIORITY_BULK] == 3
+
+    interactive_future = executor.submit(WorkScheduler.PRIORITY_INTERACTIVE, lambda: "interactive")
+    assert interactive_future.result(timeout=1) == "interactive"
+
+    release.set()
+    for future in bulk_futures:
+        assert future.result(timeout=5) is True
+
+
+class DisconnectedRequest(object):
+    """切断済みのHTTPクライアントを模したリクエスト"""
+
+    url = type("Url", (), {"path": "/vms/"})()
+
+    async def is_disconnected(self):
+        return True
+
+
+def test_run_async_cancels_on_client_disconnect():
+    """HTTPクライアントが切断された場合、処理がキャンセルされること"""
+    checked = threading.Event()
+
+    def long_running(cancel_token: CancellationToken):
+        while not cancel_token.is_cancelled():
+            time.sleep(0.05)
+        checked.set()
+        cancel_token.raise_if_cancelled()
+
+    with pytest.raises(OperationCancelledError):
+        asyncio.run(WorkScheduler.run_async(long_running, request=DisconnectedRequest()))
+    assert checked.is_set()
+
+
+def test_stream_from_vcenters_yields_in_completion_order():
+    """処理が完了したvCenterから順に結果が返され、失敗したvCenterは例外が返されること"""
+    delays = {"vcenter-slow": 0.3, "vcenter-fast": 0.0, "vcenter-error": 0.1}
+
+    def get_objects(vcenter_name: str, cancel_token: CancellationToken, suffix: str):
+        time.sleep(delays[vcenter_name])
+        if vcenter_name == "vcenter-error":
+            raise RuntimeError("error")
+        return [f"{vcenter_name}-{suffix}"]
+
+    async def collect():
+        return [
+            batch
+            async for batch in WorkScheduler.stream_from_vcenters(
+                WorkScheduler.PRIORITY_BULK,
+                get_objects,
+                delays.keys(),
+                cancel_token=CancellationToken(),
+                suffix="vm",
+            )
+        ]
+
+    batches = asyncio.run(collect())
+    assert [vcenter_name for vcenter_name, _, _ in batches] == ["vcenter-fast", "vcenter-error", "vcenter-slow"]
+    assert batches[0][1] == ["vcenter-fast-vm"]
+    assert batches[1][1] is None and isinstance(batches[1][2], RuntimeError)
+
+
+def test_map_nested_does_not_deadlock(executor, monkeypatch):
+    """スレッドが全て使用中でも、実行中の処理の中から並行して実行した処理の結果を、要素の順で返すこと"""
+    monkeypatch.setattr(WorkScheduler, "_executor", executor)
+
+    def outer(_):
+        return WorkScheduler.map_nested(WorkScheduler.PRIORITY_BULK, lambda x: x * 2, [1, 2, 3])
+
+    # bulkクラスが利用できるスレッドを全て使用した状態で、各処理の中から並行して実行する
+    futures = [executor.submit(WorkScheduler.PRIORITY_BULK, outer, i) for i in range(2)]
+    for future in futures:
+        assert future.result(timeout=5) == [2, 4, 6]
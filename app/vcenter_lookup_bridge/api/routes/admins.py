@@ -1,9 +1,14 @@
-from fastapi import APIRouter
+from typing import Annotated
+
+from fastapi import APIRouter, Query
 from fastapi_cache import FastAPICache
+from vcenter_lookup_bridge.cache.response_cache import ResponseCache
 from vcenter_lookup_bridge.schemas.common import ApiResponse
 from vcenter_lookup_bridge.utils.logging import Logging
 from vcenter_lookup_bridge.utils.request_util import RequestUtil
-from vcenter_lookup_bridge.schemas.admin_parameter import AdminResponseSchema
+from vcenter_lookup_bridge.schemas.admin_parameter import AdminResponseSchema, CacheFlushSchema
+from vcenter_lookup_bridge.vmware.fragment_cache import FragmentCache
+from vcenter_lookup_bridge.vmware.vcenter_circuit_breaker import VCenterCircuitBreaker
 from vcenter_lookup_bridge.vmware.vcenter_ws_session_managr import VCenterWSSessionManager
 import vcenter_lookup_bridge.vmware.instances as g
 
@@ -13,21 +18,32 @@ router = APIRouter(prefix="/admins", tags=["admins"])
 @router.post(
     "/cache/flush",
     response_model=AdminResponseSchema,
-    description="キャッシュ済みの全てのレスポンスをクリアします。",
+    description="キャッシュ済みのレスポンスをクリアします。リソースの種別・vCenterを指定した場合は、該当するレスポンスのみクリアします。",
     responses={
         500: {
             "description": "キャッシュのクリア処理中にエラーが発生した場合に返されます。",
         },
     },
 )
-async def flush_caches():
+async def flush_caches(search_params: Annotated[CacheFlushSchema, Query()]):
     request_id = RequestUtil.get_request_id()
     try:
-        Logging.info(f"{request_id} キャッシュをクリアします。")
+        target = f"(リソース: {search_params.resource or '全て'}, vCenter: {search_params.vcenter or '全て'})"
+        Logging.info(f"{request_id} キャッシュ{target}をクリアします。")
         vcenter_ws_sessions = VCenterWSSessionManager.get_all_vcenter_ws_session_informations(
             configs=g.vcenter_configurations,
         )
-        await FastAPICache.clear(key="*")
+        count = await ResponseCache.invalidate(resource=search_params.resource, vcenter_name=search_params.vcenter)
+        # レスポンスの作成に利用する、vCenterごとの断片のキャッシュもクリア
+        # (断片はレスポンスと同じRedisに保存しているため、リクエストごとに接続を作成せずにキャッシュの接続を利用する)
+        redis = getattr(FastAPICache.get_backend(), "redis", None)
+        if redis is not None:
+            await FragmentCache.clear_async(
+                redis=redis,
+                resource=search_params.resource,
+                vcenter_name=search_params.vcenter,
+            )
+        Logging.info(f"{request_id} キャッシュ{target}を{count}件クリアしました。")
 
         return ApiResponse.create(
             results=[],
@@ -41,6 +57,33 @@ async def flush_caches():
         raise e
 
 
+@router.get(
+    "/cache/stats",
+    response_model=AdminResponseSchema,
+    description="ワーカープロセス内のキャッシュの件数・ヒット率と、Redisに保存したレスポンスの圧縮率を返します。(値はリクエストを処理したワーカープロセスのものです。)",
+    responses={
+        500: {
+            "description": "キャッシュの統計情報の取得中にエラーが発生した場合に返されます。",
+        },
+    },
+)
+async def get_cache_stats():
+    request_id = RequestUtil.get_request_id()
+    try:
+        backend = FastAPICache.get_backend()
+        stats = backend.get_stats() if hasattr(backend, "get_stats") else {}
+
+        return ApiResponse.create(
+            results=[stats],
+            success=True,
+            message="キャッシュの統計情報を取得しました。",
+            requestId=request_id,
+        )
+    except Exception as e:
+        Logging.error(f"{request_id} キャッシュの統計情報の取得中にエラーが発生しました: {e}")
+        raise e
+
+
 @router.post(
     "/ws_session/reset",
     response_model=AdminResponseSchema,
@@ -61,6 +104,8 @@ async def reset_ws_session():
         vcenter_ws_sessions = await VCenterWSSessionManager.remove_all_vcenter_ws_sessions_async(
             redis=redis, configs=g.vcenter_configurations
         )
+        # 遮断中のサーキットブレーカーも解除し、次のリクエストで再接続を試みる
+        await VCenterCircuitBreaker.reset_all_async(redis=redis, configs=g.vcenter_configurations)
 
         return ApiResponse.create(
             results=[],
@@ -1,8 +1,8 @@
 import os
 
 from typing import Annotated
-from fastapi import APIRouter, Depends, Query, HTTPException
-from fastapi_cache.decorator import cache
+from fastapi import APIRouter, Depends, Query, HTTPException, Request
+from vcenter_lookup_bridge.cache.response_cache import ResponseCache
 import vcenter_lookup_bridge.vmware.instances as g
 from vcenter_lookup_bridge.schemas.common import ApiResponse
 from vcenter_lookup_bridge.schemas.cluster_parameter import (
@@ -14,6 +14,8 @@ from vcenter_lookup_bridge.utils.request_util import RequestUtil
 from vcenter_lookup_bridge.vmware.connector import Connector
 from vcenter_lookup_bridge.vmware.vcenter_ws_session_managr import VCenterWSSessionManager
 from vcenter_lookup_bridge.vmware.cluster import Cluster
+from vcenter_lookup_bridge.vmware.last_known_good import LastKnownGood
+from vcenter_lookup_bridge.vmware.work_scheduler import WorkScheduler
 
 # const
 CACHE_EXPIRE_SECS_DEFAULT = 60
@@ -35,10 +37,11 @@ cache_expire_secs = int(os.getenv("VLB_CACHE_EXPIRE_SECS", CACHE_EXPIRE_SECS_DEF
         },
     },
 )
-@cache(expire=cache_expire_secs)
+@ResponseCache.cached(resource="clusters", expire=cache_expire_secs, stale_expire=0)
 async def list_clusters(
+    request: Request,
     search_params: Annotated[ClusterListSearchSchema, Query()],
-    service_instances: object = Depends(Connector.get_service_instances),
+    service_instances: object = Depends(Connector.get_lazy_service_instances),
 ):
     request_id = RequestUtil.get_request_id()
     try:
@@ -46,7 +49,8 @@ async def list_clusters(
         vcenter_ws_sessions = VCenterWSSessionManager.get_all_vcenter_ws_session_informations(
             configs=g.vcenter_configurations,
         )
-        clusters, total_cluster_count = Cluster.get_clusters_from_all_vcenters(
+        clusters, total_cluster_count = await WorkScheduler.run_async(
+            Cluster.get_clusters_from_all_vcenters,
             service_instances=service_instances,
             configs=g.vcenter_configurations,
             cluster_names=search_params.clusters,
@@ -54,6 +58,8 @@ async def list_clusters(
             offset=search_params.offset,
             max_results=search_params.max_results,
             request_id=request_id,
+            priority=WorkScheduler.PRIORITY_BULK,
+            request=request,
         )
 
         if clusters:
@@ -63,6 +69,7 @@ async def list_clusters(
                 message=f"{len(clusters)}件のクラスタを取得しました。",
                 vcenterWsSessions=vcenter_ws_sessions,
                 requestId=request_id,
+                staleVcenters=LastKnownGood.get_stale_vcenters(request_id),
             )
         else:
             # クラスタが見つからない場合は404エラーを返す
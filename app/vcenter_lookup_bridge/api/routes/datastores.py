@@ -2,8 +2,8 @@ import os
 import vcenter_lookup_bridge.vmware.instances as g
 
 from typing import Annotated
-from fastapi import APIRouter, Depends, Query, HTTPException
-from fastapi_cache.decorator import cache
+from fastapi import APIRouter, Depends, Query, HTTPException, Request
+from vcenter_lookup_bridge.cache.response_cache import ResponseCache
 from vcenter_lookup_bridge.schemas.datastore_parameter import DatastoreListResponseSchema, DatastoreSearchSchema
 from vcenter_lookup_bridge.utils.logging import Logging
 from vcenter_lookup_bridge.utils.request_util import RequestUtil
@@ -11,6 +11,8 @@ from vcenter_lookup_bridge.vmware.connector import Connector
 from vcenter_lookup_bridge.vmware.datastore import Datastore
 from vcenter_lookup_bridge.vmware.vcenter_ws_session_managr import VCenterWSSessionManager
 from vcenter_lookup_bridge.schemas.common import ApiResponse, PaginationInfo
+from vcenter_lookup_bridge.vmware.last_known_good import LastKnownGood
+from vcenter_lookup_bridge.vmware.work_scheduler import WorkScheduler
 
 # const
 CACHE_EXPIRE_SECS_DEFAULT = 60
@@ -32,10 +34,11 @@ cache_expire_secs = int(os.getenv("VLB_CACHE_EXPIRE_SECS", CACHE_EXPIRE_SECS_DEF
         },
     },
 )
-@cache(expire=cache_expire_secs)
+@ResponseCache.cached(resource="datastores", expire=cache_expire_secs)
 async def list_datastores(
+    request: Request,
     search_params: Annotated[DatastoreSearchSchema, Query()],
-    service_instances: object = Depends(Connector.get_service_instances),
+    service_instances: object = Depends(Connector.get_lazy_service_instances),
 ):
     request_id = RequestUtil.get_request_id()
     try:
@@ -45,13 +48,16 @@ async def list_datastores(
         vcenter_ws_sessions = VCenterWSSessionManager.get_all_vcenter_ws_session_informations(
             configs=g.vcenter_configurations,
         )
-        datastores, total_datastore_count = Datastore.get_datastores_by_tags_from_all_vcenters(
+        datastores, total_datastore_count = await WorkScheduler.run_async(
+            Datastore.get_datastores_by_tags_from_all_vcenters,
             service_instances=service_instances,
             configs=g.vcenter_configurations,
             tag_category=search_params.tag_category,
             tags=search_params.tags,
             vcenter_name=search_params.vcenter,
             request_id=request_id,
+            priority=WorkScheduler.PRIORITY_BULK,
+            request=request,
         )
         if datastores:
             pagination = PaginationInfo(
@@ -69,6 +75,7 @@ async def list_datastores(
                 pagination=pagination,
                 vcenterWsSessions=vcenter_ws_sessions,
                 requestId=request_id,
+                staleVcenters=LastKnownGood.get_stale_vcenters(request_id),
             )
         else:
             # データストアが見つからない場合は404エラーを返す
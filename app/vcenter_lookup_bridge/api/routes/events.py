@@ -1,19 +1,24 @@
 import os
 
 from typing import Annotated
-from fastapi import APIRouter, Depends, Query, HTTPException
-from fastapi_cache.decorator import cache
+from fastapi import APIRouter, Depends, Query, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from vcenter_lookup_bridge.cache.response_cache import ResponseCache
 import vcenter_lookup_bridge.vmware.instances as g
 from vcenter_lookup_bridge.schemas.common import ApiResponse, PaginationInfo
 from vcenter_lookup_bridge.schemas.event_parameter import (
     EventListSearchSchema,
     EventListResponseSchema,
 )
+from vcenter_lookup_bridge.utils.cancellation import CancellationToken
 from vcenter_lookup_bridge.utils.logging import Logging
 from vcenter_lookup_bridge.utils.request_util import RequestUtil
+from vcenter_lookup_bridge.utils.stream_util import StreamUtil
 from vcenter_lookup_bridge.vmware.connector import Connector
 from vcenter_lookup_bridge.vmware.vcenter_ws_session_managr import VCenterWSSessionManager
 from vcenter_lookup_bridge.vmware.event import Event
+from vcenter_lookup_bridge.vmware.last_known_good import LastKnownGood
+from vcenter_lookup_bridge.vmware.work_scheduler import WorkScheduler
 
 # const
 CACHE_EXPIRE_SECS_DEFAULT = 60
@@ -35,10 +40,11 @@ cache_expire_secs = int(os.getenv("VLB_CACHE_EXPIRE_SECS", CACHE_EXPIRE_SECS_DEF
         },
     },
 )
-@cache(expire=cache_expire_secs)
+@ResponseCache.cached(resource="events", expire=cache_expire_secs, stale_expire=0)
 async def list_events(
+    request: Request,
     search_params: Annotated[EventListSearchSchema, Query()],
-    service_instances: object = Depends(Connector.get_service_instances),
+    service_instances: object = Depends(Connector.get_lazy_service_instances),
 ):
     request_id = RequestUtil.get_request_id()
     try:
@@ -46,7 +52,8 @@ async def list_events(
         vcenter_ws_sessions = VCenterWSSessionManager.get_all_vcenter_ws_session_informations(
             configs=g.vcenter_configurations,
         )
-        events, total_event_count = Event.get_events_from_all_vcenters(
+        events, total_event_count = await WorkScheduler.run_async(
+            Event.get_events_from_all_vcenters,
             service_instances=service_instances,
             configs=g.vcenter_configurations,
             vcenter_name=search_params.vcenter,
@@ -63,6 +70,8 @@ async def list_events(
             offset=search_params.offset,
             max_results=search_params.max_results,
             request_id=request_id,
+            priority=WorkScheduler.PRIORITY_BULK,
+            request=request,
         )
 
         if events:
@@ -80,6 +89,7 @@ async def list_events(
                 pagination=pagination,
                 vcenterWsSessions=vcenter_ws_sessions,
                 requestId=request_id,
+                staleVcenters=LastKnownGood.get_stale_vcenters(request_id),
             )
         else:
             # イベントが見つからない場合は404エラーを返す
@@ -95,3 +105,49 @@ async def list_events(
         else:
             Logging.error(f"{request_id} イベント情報の一覧を取得中にエラーが発生しました: {e}")
         raise e
+
+
+@router.get(
+    "/stream",
+    description="イベント一覧をNDJSON形式でストリーミング取得します。取得が完了したvCenterから順に1行ずつ返し、最終行に集計結果を返します。offset/max_resultsは無視されます。",
+    response_class=StreamingResponse,
+    responses={
+        200: {
+            "content": {StreamUtil.MEDIA_TYPE_NDJSON: {}},
+            "description": "vCenterごとの取得結果(StreamBatchResponse)と、集計結果(StreamSummaryResponse)を返します。",
+        },
+    },
+)
+async def stream_events(
+    request: Request,
+    search_params: Annotated[EventListSearchSchema, Query()],
+    service_instances: object = Depends(Connector.get_lazy_service_instances),
+):
+    request_id = RequestUtil.get_request_id()
+    Logging.info(f"{request_id} イベント一覧をストリーミング取得します。")
+    cancel_token = CancellationToken()
+    batches = Event.stream_events_from_all_vcenters(
+        service_instances=service_instances,
+        configs=g.vcenter_configurations,
+        vcenter_name=search_params.vcenter,
+        begin_time=search_params.begin_time,
+        end_time=search_params.end_time,
+        days_ago_begin=search_params.days_ago_begin,
+        days_ago_end=search_params.days_ago_end,
+        hours_ago_begin=search_params.hours_ago_begin,
+        hours_ago_end=search_params.hours_ago_end,
+        event_types=search_params.event_types,
+        event_sources=search_params.event_sources,
+        user_names=search_params.user_names,
+        ip_addresses=search_params.ip_addresses,
+        request_id=request_id,
+        priority=WorkScheduler.PRIORITY_BULK,
+        cancel_token=cancel_token,
+    )
+    return StreamUtil.create_ndjson_response(
+        request=request,
+        batches=batches,
+        object_name="イベント",
+        cancel_token=cancel_token,
+        request_id=request_id,
+    )
@@ -1,5 +1,10 @@
-from fastapi import APIRouter, Depends
-from vcenter_lookup_bridge.schemas.healthcheck_parameter import HealthcheckResponseSchema
+from fastapi import APIRouter, Depends, Response
+from vcenter_lookup_bridge.broker.client import BrokerClient
+from vcenter_lookup_bridge.schemas.healthcheck_parameter import (
+    HealthcheckResponseSchema,
+    LivenessResponseSchema,
+    ReadinessResponseSchema,
+)
 from vcenter_lookup_bridge.schemas.common import ApiResponse
 import vcenter_lookup_bridge.vmware.instances as g
 from vcenter_lookup_bridge.utils.logging import Logging
@@ -25,7 +30,8 @@ async def get_service_status(
 ):
     request_id = RequestUtil.get_request_id()
     Logging.info(f"{request_id} サービスのステータスを取得します。")
-    service_instance_status = "ok" if service_instances else "ng"
+    # ブローカーを利用する場合、vCenterへの接続はブローカーが保持する
+    service_instance_status = "ok" if service_instances or BrokerClient.is_enabled() else "ng"
     vcenter_ws_sessions = VCenterWSSessionManager.get_all_vcenter_ws_session_informations(
         configs=g.vcenter_configurations,
     )
@@ -37,3 +43,42 @@ async def get_service_status(
         vcenterWsSessions=vcenter_ws_sessions,
         requestId=request_id,
     )
+
+
+@router.get(
+    "/live",
+    response_model=LivenessResponseSchema,
+    description="ワーカープロセスが応答できるかどうかを返却します。vCenter・Redisへのリクエストは行いません。",
+)
+async def get_liveness():
+    # 定期的に実行されるため、ログは出力しない
+    return ApiResponse.create(
+        results={"status": "ok"},
+        success=True,
+        message="ワーカープロセスは応答可能です",
+        requestId=RequestUtil.get_request_id(),
+    )
+
+
+@router.get(
+    "/ready",
+    response_model=ReadinessResponseSchema,
+    description="リクエストを受け付けられるかどうかと、バックグラウンドの確認で記録したvCenterごとの接続状態を返却します。"
+    "vCenter・Redisへのリクエストは行いません。vCenterの障害は、サービス自体の再起動では解消しないため、ステータスには影響しません。",
+    responses={
+        503: {
+            "description": "起動処理が完了していない場合に返されます。",
+        },
+    },
+)
+async def get_readiness(response: Response):
+    # 定期的に実行されるため、ログは出力しない
+    ready = getattr(g, "startup_completed", False)
+    if not ready:
+        response.status_code = 503
+    return ApiResponse.create(
+        results={"status": "ok" if ready else "ng", "vcenters": Connector.get_health_snapshot()},
+        success=ready,
+        message="リクエストを受け付け可能です" if ready else "起動処理が完了していません",
+        requestId=RequestUtil.get_request_id(),
+    )
@@ -1,8 +1,9 @@
 import os
 
 from typing import Annotated
-from fastapi import APIRouter, Depends, Path, Query, HTTPException
-from fastapi_cache.decorator import cache
+from fastapi import APIRouter, Depends, Path, Query, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from vcenter_lookup_bridge.cache.response_cache import ResponseCache
 import vcenter_lookup_bridge.vmware.instances as g
 from vcenter_lookup_bridge.schemas.common import ApiResponse, PaginationInfo
 from vcenter_lookup_bridge.schemas.host_parameter import (
@@ -12,11 +13,15 @@ from vcenter_lookup_bridge.schemas.host_parameter import (
     HostDetailResponseSchema,
     HostSearchSchema,
 )
+from vcenter_lookup_bridge.utils.cancellation import CancellationToken
 from vcenter_lookup_bridge.utils.logging import Logging
 from vcenter_lookup_bridge.utils.request_util import RequestUtil
+from vcenter_lookup_bridge.utils.stream_util import StreamUtil
 from vcenter_lookup_bridge.vmware.connector import Connector
 from vcenter_lookup_bridge.vmware.vcenter_ws_session_managr import VCenterWSSessionManager
 from vcenter_lookup_bridge.vmware.host import Host
+from vcenter_lookup_bridge.vmware.last_known_good import LastKnownGood
+from vcenter_lookup_bridge.vmware.work_scheduler import WorkScheduler
 
 # const
 CACHE_EXPIRE_SECS_DEFAULT = 60
@@ -38,10 +43,11 @@ cache_expire_secs = int(os.getenv("VLB_CACHE_EXPIRE_SECS", CACHE_EXPIRE_SECS_DEF
         },
     },
 )
-@cache(expire=cache_expire_secs)
+@ResponseCache.cached(resource="hosts", expire=cache_expire_secs)
 async def list_hosts(
+    request: Request,
     search_params: Annotated[HostListSearchSchema, Query()],
-    service_instances: object = Depends(Connector.get_service_instances),
+    service_instances: object = Depends(Connector.get_lazy_service_instances),
 ):
     request_id = RequestUtil.get_request_id()
     try:
@@ -49,13 +55,16 @@ async def list_hosts(
         vcenter_ws_sessions = VCenterWSSessionManager.get_all_vcenter_ws_session_informations(
             configs=g.vcenter_configurations,
         )
-        hosts, total_host_count = Host.get_hosts_from_all_vcenters(
+        hosts, total_host_count = await WorkScheduler.run_async(
+            Host.get_hosts_from_all_vcenters,
             service_instances=service_instances,
             configs=g.vcenter_configurations,
             vcenter_name=search_params.vcenter,
             offset=search_params.offset,
             max_results=search_params.max_results,
             request_id=request_id,
+            priority=WorkScheduler.PRIORITY_BULK,
+            request=request,
         )
 
         if hosts:
@@ -74,6 +83,7 @@ async def list_hosts(
                 pagination=pagination,
                 vcenterWsSessions=vcenter_ws_sessions,
                 requestId=request_id,
+                staleVcenters=LastKnownGood.get_stale_vcenters(request_id),
             )
         else:
             # 仮想マシンが見つからない場合は404エラーを返す
@@ -86,6 +96,48 @@ async def list_hosts(
         raise e
 
 
+@router.get(
+    "/stream",
+    description=(
+        "ESXiホスト一覧をNDJSON形式でストリーミング取得します。"
+        "取得が完了したvCenterから順に1行ずつ返し、最終行に集計結果を返します。"
+        "offset/max_resultsはvCenterごとに適用されます。"
+    ),
+    response_class=StreamingResponse,
+    responses={
+        200: {
+            "content": {StreamUtil.MEDIA_TYPE_NDJSON: {}},
+            "description": "vCenterごとの取得結果(StreamBatchResponse)と、集計結果(StreamSummaryResponse)を返します。",
+        },
+    },
+)
+async def stream_hosts(
+    request: Request,
+    search_params: Annotated[HostListSearchSchema, Query()],
+    service_instances: object = Depends(Connector.get_lazy_service_instances),
+):
+    request_id = RequestUtil.get_request_id()
+    Logging.info(f"{request_id} ESXiホスト一覧をストリーミング取得します。")
+    cancel_token = CancellationToken()
+    batches = Host.stream_hosts_from_all_vcenters(
+        service_instances=service_instances,
+        configs=g.vcenter_configurations,
+        vcenter_name=search_params.vcenter,
+        offset=search_params.offset,
+        max_results=search_params.max_results,
+        request_id=request_id,
+        priority=WorkScheduler.PRIORITY_BULK,
+        cancel_token=cancel_token,
+    )
+    return StreamUtil.create_ndjson_response(
+        request=request,
+        batches=batches,
+        object_name="ESXiホスト",
+        cancel_token=cancel_token,
+        request_id=request_id,
+    )
+
+
 @router.get(
     "/{host_uuid}",
     response_model=HostGetResponseSchema,
@@ -99,8 +151,9 @@ async def list_hosts(
         },
     },
 )
-@cache(expire=cache_expire_secs)
+@ResponseCache.cached(resource="hosts", expire=cache_expire_secs, stale_expire=0)
 async def get_host(
+    request: Request,
     host_uuid: Annotated[
         str,
         Path(
@@ -109,7 +162,7 @@ async def get_host(
         ),
     ],
     search_params: Annotated[HostSearchSchema, Query()],
-    service_instances: object = Depends(Connector.get_service_instances),
+    service_instances: object = Depends(Connector.get_lazy_service_instances),
 ):
     request_id = RequestUtil.get_request_id()
     try:
@@ -117,11 +170,15 @@ async def get_host(
         vcenter_ws_sessions = VCenterWSSessionManager.get_all_vcenter_ws_session_informations(
             configs=g.vcenter_configurations,
         )
-        host = Host.get_host_by_uuid_from_all_vcenters(
+        host = await WorkScheduler.run_async(
+            Host.get_host_by_uuid_from_all_vcenters,
             vcenter_name=search_params.vcenter,
             service_instances=service_instances,
+            configs=g.vcenter_configurations,
             host_uuid=host_uuid,
             request_id=request_id,
+            priority=WorkScheduler.PRIORITY_INTERACTIVE,
+            request=request,
         )
         if isinstance(host, HostDetailResponseSchema):
             return ApiResponse.create(
@@ -1,8 +1,8 @@
 import os
 
 from typing import Annotated
-from fastapi import APIRouter, Depends, Query, HTTPException
-from fastapi_cache.decorator import cache
+from fastapi import APIRouter, Depends, Query, HTTPException, Request
+from vcenter_lookup_bridge.cache.response_cache import ResponseCache
 import vcenter_lookup_bridge.vmware.instances as g
 from vcenter_lookup_bridge.schemas.common import ApiResponse, PaginationInfo
 from vcenter_lookup_bridge.schemas.vm_folder_parameter import (
@@ -14,6 +14,8 @@ from vcenter_lookup_bridge.utils.request_util import RequestUtil
 from vcenter_lookup_bridge.vmware.connector import Connector
 from vcenter_lookup_bridge.vmware.vcenter_ws_session_managr import VCenterWSSessionManager
 from vcenter_lookup_bridge.vmware.vm_folder import VmFolder
+from vcenter_lookup_bridge.vmware.last_known_good import LastKnownGood
+from vcenter_lookup_bridge.vmware.work_scheduler import WorkScheduler
 
 # const
 CACHE_EXPIRE_SECS_DEFAULT = 60
@@ -35,10 +37,11 @@ cache_expire_secs = int(os.getenv("VLB_CACHE_EXPIRE_SECS", CACHE_EXPIRE_SECS_DEF
         },
     },
 )
-@cache(expire=cache_expire_secs)
+@ResponseCache.cached(resource="vm_folders", expire=cache_expire_secs, stale_expire=0)
 async def list_vm_folders(
+    request: Request,
     search_params: Annotated[VmFolderListSearchSchema, Query()],
-    service_instances: object = Depends(Connector.get_service_instances),
+    service_instances: object = Depends(Connector.get_lazy_service_instances),
 ):
     request_id = RequestUtil.get_request_id()
     try:
@@ -46,7 +49,8 @@ async def list_vm_folders(
         vcenter_ws_sessions = VCenterWSSessionManager.get_all_vcenter_ws_session_informations(
             configs=g.vcenter_configurations,
         )
-        vm_folders, total_vm_folder_count = VmFolder.get_vm_folders_from_all_vcenters(
+        vm_folders, total_vm_folder_count = await WorkScheduler.run_async(
+            VmFolder.get_vm_folders_from_all_vcenters,
             service_instances=service_instances,
             configs=g.vcenter_configurations,
             vm_folders=search_params.vm_folders,
@@ -54,6 +58,8 @@ async def list_vm_folders(
             offset=search_params.offset,
             max_results=search_params.max_results,
             request_id=request_id,
+            priority=WorkScheduler.PRIORITY_BULK,
+            request=request,
         )
 
         if vm_folders:
@@ -72,6 +78,7 @@ async def list_vm_folders(
                 pagination=pagination,
                 vcenterWsSessions=vcenter_ws_sessions,
                 requestId=request_id,
+                staleVcenters=LastKnownGood.get_stale_vcenters(request_id),
             )
         else:
             # 仮想マシンフォルダが見つからない場合は404エラーを返す
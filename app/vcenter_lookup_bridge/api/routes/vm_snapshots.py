@@ -1,7 +1,7 @@
 import os
 from typing import Annotated
-from fastapi import APIRouter, Depends, Path, Query, HTTPException
-from fastapi_cache.decorator import cache
+from fastapi import APIRouter, Depends, Path, Query, HTTPException, Request
+from vcenter_lookup_bridge.cache.response_cache import ResponseCache
 import vcenter_lookup_bridge.vmware.instances as g
 from vcenter_lookup_bridge.schemas.common import ApiResponse, PaginationInfo
 from vcenter_lookup_bridge.schemas.vm_snapshot_parameter import (
@@ -14,6 +14,8 @@ from vcenter_lookup_bridge.utils.request_util import RequestUtil
 from vcenter_lookup_bridge.vmware.connector import Connector
 from vcenter_lookup_bridge.vmware.vcenter_ws_session_managr import VCenterWSSessionManager
 from vcenter_lookup_bridge.vmware.vm_snapshot import VmSnapshot
+from vcenter_lookup_bridge.vmware.last_known_good import LastKnownGood
+from vcenter_lookup_bridge.vmware.work_scheduler import WorkScheduler
 
 # const
 CACHE_EXPIRE_SECS_DEFAULT = 60
@@ -35,10 +37,11 @@ cache_expire_secs = int(os.getenv("VLB_CACHE_EXPIRE_SECS", CACHE_EXPIRE_SECS_DEF
         },
     },
 )
-@cache(expire=cache_expire_secs)
+@ResponseCache.cached(resource="vm_snapshots", expire=cache_expire_secs, stale_expire=0)
 async def list_vm_snapshots(
+    request: Request,
     search_params: Annotated[VmSnapshotListSearchSchema, Query()],
-    service_instances: object = Depends(Connector.get_service_instances),
+    service_instances: object = Depends(Connector.get_lazy_service_instances),
 ):
     request_id = RequestUtil.get_request_id()
     try:
@@ -48,7 +51,8 @@ async def list_vm_snapshots(
         vcenter_ws_sessions = VCenterWSSessionManager.get_all_vcenter_ws_session_informations(
             configs=g.vcenter_configurations,
         )
-        snapshots, total_snapshot_count = VmSnapshot.get_vm_snapshots_from_all_vcenters(
+        snapshots, total_snapshot_count = await WorkScheduler.run_async(
+            VmSnapshot.get_vm_snapshots_from_all_vcenters,
             service_instances=service_instances,
             configs=g.vcenter_configurations,
             vm_folders=search_params.vm_folders,
@@ -56,6 +60,8 @@ async def list_vm_snapshots(
             offset=search_params.offset,
             max_results=search_params.max_results,
             request_id=request_id,
+            priority=WorkScheduler.PRIORITY_BULK,
+            request=request,
         )
 
         if snapshots:
@@ -74,6 +80,7 @@ async def list_vm_snapshots(
                 pagination=pagination,
                 vcenterWsSessions=vcenter_ws_sessions,
                 requestId=request_id,
+                staleVcenters=LastKnownGood.get_stale_vcenters(request_id),
             )
         else:
             # スナップショットが見つからない場合は404エラーを返す
@@ -99,8 +106,9 @@ async def list_vm_snapshots(
         },
     },
 )
-@cache(expire=cache_expire_secs)
+@ResponseCache.cached(resource="vm_snapshots", expire=cache_expire_secs, stale_expire=0)
 async def get_vm_snapshots(
+    request: Request,
     vm_instance_uuid: Annotated[
         str,
         Path(
@@ -109,7 +117,7 @@ async def get_vm_snapshots(
         ),
     ],
     search_params: Annotated[VmSnapshotSearchSchema, Query()],
-    service_instances: object = Depends(Connector.get_service_instances),
+    service_instances: object = Depends(Connector.get_lazy_service_instances),
 ):
     request_id = RequestUtil.get_request_id()
     try:
@@ -119,11 +127,15 @@ async def get_vm_snapshots(
         vcenter_ws_sessions = VCenterWSSessionManager.get_all_vcenter_ws_session_informations(
             configs=g.vcenter_configurations,
         )
-        snapshots = VmSnapshot.get_vm_snapshot_by_instance_uuid_from_all_vcenters(
+        snapshots = await WorkScheduler.run_async(
+            VmSnapshot.get_vm_snapshot_by_instance_uuid_from_all_vcenters,
             vcenter_name=search_params.vcenter,
             service_instances=service_instances,
+            configs=g.vcenter_configurations,
             instance_uuid=vm_instance_uuid,
             request_id=request_id,
+            priority=WorkScheduler.PRIORITY_INTERACTIVE,
+            request=request,
         )
         if isinstance(snapshots, list) and len(snapshots) > 0:
             return ApiResponse.create(
@@ -1,8 +1,9 @@
 import os
 
 from typing import Annotated
-from fastapi import APIRouter, Depends, Path, Query, HTTPException
-from fastapi_cache.decorator import cache
+from fastapi import APIRouter, Depends, Path, Query, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from vcenter_lookup_bridge.cache.response_cache import ResponseCache
 import vcenter_lookup_bridge.vmware.instances as g
 from vcenter_lookup_bridge.schemas.common import ApiResponse, PaginationInfo
 from vcenter_lookup_bridge.schemas.vm_parameter import (
@@ -12,11 +13,15 @@ from vcenter_lookup_bridge.schemas.vm_parameter import (
     VmDetailResponseSchema,
     VmSearchSchema,
 )
+from vcenter_lookup_bridge.utils.cancellation import CancellationToken
 from vcenter_lookup_bridge.utils.logging import Logging
 from vcenter_lookup_bridge.utils.request_util import RequestUtil
+from vcenter_lookup_bridge.utils.stream_util import StreamUtil
 from vcenter_lookup_bridge.vmware.connector import Connector
 from vcenter_lookup_bridge.vmware.vcenter_ws_session_managr import VCenterWSSessionManager
 from vcenter_lookup_bridge.vmware.vm import Vm
+from vcenter_lookup_bridge.vmware.last_known_good import LastKnownGood
+from vcenter_lookup_bridge.vmware.work_scheduler import WorkScheduler
 
 # const
 CACHE_EXPIRE_SECS_DEFAULT = 60
@@ -38,10 +43,11 @@ cache_expire_secs = int(os.getenv("VLB_CACHE_EXPIRE_SECS", CACHE_EXPIRE_SECS_DEF
         },
     },
 )
-@cache(expire=cache_expire_secs)
+@ResponseCache.cached(resource="vms", expire=cache_expire_secs)
 async def list_vms(
+    request: Request,
     search_params: Annotated[VmListSearchSchema, Query()],
-    service_instances: object = Depends(Connector.get_service_instances),
+    service_instances: object = Depends(Connector.get_lazy_service_instances),
 ):
     request_id = RequestUtil.get_request_id()
     try:
@@ -49,7 +55,8 @@ async def list_vms(
         vcenter_ws_sessions = VCenterWSSessionManager.get_all_vcenter_ws_session_informations(
             configs=g.vcenter_configurations,
         )
-        vms, total_vm_count = Vm.get_vms_from_all_vcenters(
+        vms, total_vm_count = await WorkScheduler.run_async(
+            Vm.get_vms_from_all_vcenters,
             service_instances=service_instances,
             configs=g.vcenter_configurations,
             vm_folders=search_params.vm_folders,
@@ -57,6 +64,8 @@ async def list_vms(
             offset=search_params.offset,
             max_results=search_params.max_results,
             request_id=request_id,
+            priority=WorkScheduler.PRIORITY_BULK,
+            request=request,
         )
 
         if vms:
@@ -75,6 +84,7 @@ async def list_vms(
                 pagination=pagination,
                 vcenterWsSessions=vcenter_ws_sessions,
                 requestId=request_id,
+                staleVcenters=LastKnownGood.get_stale_vcenters(request_id),
             )
         else:
             # 仮想マシンが見つからない場合は404エラーを返す
@@ -87,6 +97,49 @@ async def list_vms(
         raise e
 
 
+@router.get(
+    "/stream",
+    description=(
+        "仮想マシンフォルダを指定して、同フォルダ中の仮想マシン一覧をNDJSON形式でストリーミング取得します。"
+        "取得が完了したvCenterから順に1行ずつ返し、最終行に集計結果を返します。"
+        "offset/max_resultsはvCenterごとに適用されます。"
+    ),
+    response_class=StreamingResponse,
+    responses={
+        200: {
+            "content": {StreamUtil.MEDIA_TYPE_NDJSON: {}},
+            "description": "vCenterごとの取得結果(StreamBatchResponse)と、集計結果(StreamSummaryResponse)を返します。",
+        },
+    },
+)
+async def stream_vms(
+    request: Request,
+    search_params: Annotated[VmListSearchSchema, Query()],
+    service_instances: object = Depends(Connector.get_lazy_service_instances),
+):
+    request_id = RequestUtil.get_request_id()
+    Logging.info(f"{request_id} 仮想マシンフォルダ({search_params.vm_folders})の仮想マシンをストリーミング取得します。")
+    cancel_token = CancellationToken()
+    batches = Vm.stream_vms_from_all_vcenters(
+        service_instances=service_instances,
+        configs=g.vcenter_configurations,
+        vm_folders=search_params.vm_folders,
+        vcenter_name=search_params.vcenter,
+        offset=search_params.offset,
+        max_results=search_params.max_results,
+        request_id=request_id,
+        priority=WorkScheduler.PRIORITY_BULK,
+        cancel_token=cancel_token,
+    )
+    return StreamUtil.create_ndjson_response(
+        request=request,
+        batches=batches,
+        object_name="仮想マシン",
+        cancel_token=cancel_token,
+        request_id=request_id,
+    )
+
+
 @router.get(
     "/{vm_instance_uuid}",
     response_model=VmGetResponseSchema,
@@ -100,8 +153,9 @@ async def list_vms(
         },
     },
 )
-@cache(expire=cache_expire_secs)
+@ResponseCache.cached(resource="vms", expire=cache_expire_secs, stale_expire=0)
 async def get_vm(
+    request: Request,
     vm_instance_uuid: Annotated[
         str,
         Path(
@@ -110,7 +164,7 @@ async def get_vm(
         ),
     ],
     search_params: Annotated[VmSearchSchema, Query()],
-    service_instances: object = Depends(Connector.get_service_instances),
+    service_instances: object = Depends(Connector.get_lazy_service_instances),
 ):
     request_id = RequestUtil.get_request_id()
     try:
@@ -118,11 +172,15 @@ async def get_vm(
         vcenter_ws_sessions = VCenterWSSessionManager.get_all_vcenter_ws_session_informations(
             configs=g.vcenter_configurations,
         )
-        vm = Vm.get_vm_by_instance_uuid_from_all_vcenters(
+        vm = await WorkScheduler.run_async(
+            Vm.get_vm_by_instance_uuid_from_all_vcenters,
             vcenter_name=search_params.vcenter,
             service_instances=service_instances,
+            configs=g.vcenter_configurations,
             instance_uuid=vm_instance_uuid,
             request_id=request_id,
+            priority=WorkScheduler.PRIORITY_INTERACTIVE,
+            request=request,
         )
         if isinstance(vm, VmDetailResponseSchema):
             return ApiResponse.create(
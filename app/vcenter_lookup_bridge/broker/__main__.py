@@ -0,0 +1,4 @@
+from vcenter_lookup_bridge.broker.server import BrokerServer
+
+if __name__ == "__main__":
+    BrokerServer.main()
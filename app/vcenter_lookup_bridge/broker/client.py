@@ -0,0 +1,167 @@
+import asyncio
+import os
+from typing import Callable, Optional
+
+from fastapi import HTTPException
+from vcenter_lookup_bridge.broker.protocol import BrokerProtocol
+from vcenter_lookup_bridge.utils.cancellation import CancellationToken, OperationCancelledError
+from vcenter_lookup_bridge.utils.logging import Logging
+
+
+class BrokerClient(object):
+    """ブローカーにvCenterへのリクエスト処理を依頼するクラス
+
+    環境変数VLB_BROKER_SOCKETを指定した場合、ワーカープロセスはvCenterに接続せず、
+    vCenterのセッションを保持するブローカー(python -m vcenter_lookup_bridge.broker)に処理を依頼します。
+    1つの処理ごとに接続し、キャンセル時は接続を切断することで、ブローカー側の処理も中断されます。
+    vCenterへのリクエストはブローカーのスケジューラで処理されるため、ブローカーの負荷情報と接続状態を定期的に取得し、
+    リクエストの受け付け可否の判断とレディネスの確認に利用します。
+    """
+
+    # Const
+    VLB_BROKER_REQUEST_TIMEOUT_SEC_DEFAULT = 300
+    VLB_BROKER_STATS_INTERVAL_SEC_DEFAULT = 1
+    CANCEL_POLL_INTERVAL_SEC = 0.5
+    STATS_TIMEOUT_SEC = 3
+    # ブローカー側のものを利用するため、送信しない引数
+    LOCAL_ONLY_ARGS = ("service_instances", "configs")
+
+    _is_broker_process = False
+    _stats: Optional[dict] = None
+    _stats_monitor: Optional[asyncio.Task] = None
+
+    @classmethod
+    def is_enabled(cls) -> bool:
+        return bool(cls.get_socket_path()) and not cls._is_broker_process
+
+    @classmethod
+    def mark_as_broker_process(cls) -> None:
+        """ブローカー自身が、処理を自分に依頼しないようにします"""
+
+        cls._is_broker_process = True
+
+    @classmethod
+    def get_socket_path(cls) -> Optional[str]:
+        return os.getenv("VLB_BROKER_SOCKET")
+
+    @classmethod
+    def get_method_name(cls, func: Callable) -> str:
+        return func.__qualname__
+
+    @classmethod
+    async def call(
+        cls, func: Callable, cancel_token: Optional[CancellationToken] = None, priority: Optional[str] = None, **kwargs
+    ):
+        """
+        ブローカーに処理を依頼し、結果を返します
+
+        Raises:
+            HTTPException: ブローカーで処理に失敗した場合、またはブローカーに接続できない場合
+            OperationCancelledError: 処理の完了前に、キャンセルが要求された場合
+        """
+        cancel_token = cancel_token or CancellationToken()
+        method = cls.get_method_name(func)
+        request = {
+            "method": method,
+            "priority": priority,
+            "kwargs": {k: v for k, v in kwargs.items() if k not in cls.LOCAL_ONLY_ARGS},
+        }
+        timeout = int(os.getenv("VLB_BROKER_REQUEST_TIMEOUT_SEC", cls.VLB_BROKER_REQUEST_TIMEOUT_SEC_DEFAULT))
+
+        try:
+            reader, writer = await asyncio.open_unix_connection(cls.get_socket_path())
+        except OSError as e:
+            Logging.error(f"ブローカー({cls.get_socket_path()})に接続できませんでした: {e}")
+            raise HTTPException(
+                status_code=503, detail="vCenterへのリクエストを処理するブローカーに接続できませんでした。"
+            )
+
+        try:
+            writer.write(BrokerProtocol.encode_frame(BrokerProtocol.FRAME_REQUEST, request))
+            await writer.drain()
+            frame_type, payload = await cls._wait_for_response(reader, method, cancel_token, timeout)
+        finally:
+            # 切断により、キャンセル時はブローカー側の処理も中断される
+            writer.close()
+
+        if frame_type == BrokerProtocol.FRAME_RESULT:
+            return payload
+        if payload.get("cancelled"):
+            raise OperationCancelledError(payload.get("detail"))
+        raise HTTPException(status_code=payload.get("status_code", 500), detail=payload.get("detail"))
+
+    @classmethod
+    def get_stats(cls) -> Optional[dict]:
+        """
+        定期的に取得した、ブローカーのスケジューラの負荷とvCenterの接続状態を返します
+
+        Returns:
+            Optional[dict]: scheduler(WorkScheduler.get_stats()の値)とvcenters(vCenterごとの接続状態)。
+                ブローカーから取得できていない場合はNone
+        """
+        return cls._stats
+
+    @classmethod
+    def start_stats_monitor(cls) -> None:
+        """ブローカーの負荷情報と接続状態を定期的に取得するタスクを開始します"""
+
+        if cls.is_enabled() and cls._stats_monitor is None:
+            cls._stats_monitor = asyncio.create_task(cls._monitor_stats())
+
+    @classmethod
+    def stop_stats_monitor(cls) -> None:
+        if cls._stats_monitor is not None:
+            cls._stats_monitor.cancel()
+            cls._stats_monitor = None
+        cls._stats = None
+
+    @classmethod
+    async def fetch_stats(cls) -> dict:
+        """ブローカーから、スケジューラの負荷とvCenterの接続状態を取得します"""
+
+        reader, writer = await asyncio.open_unix_connection(cls.get_socket_path())
+        try:
+            request = {"method": BrokerProtocol.METHOD_STATS, "priority": None, "kwargs": {}}
+            writer.write(BrokerProtocol.encode_frame(BrokerProtocol.FRAME_REQUEST, request))
+            await writer.drain()
+            frame_type, payload = await asyncio.wait_for(BrokerProtocol.read_frame(reader), cls.STATS_TIMEOUT_SEC)
+        finally:
+            writer.close()
+        if frame_type != BrokerProtocol.FRAME_RESULT:
+            raise HTTPException(status_code=payload.get("status_code", 500), detail=payload.get("detail"))
+        return payload
+
+    @classmethod
+    async def _monitor_stats(cls) -> None:
+        interval = float(os.getenv("VLB_BROKER_STATS_INTERVAL_SEC", cls.VLB_BROKER_STATS_INTERVAL_SEC_DEFAULT))
+        while True:
+            try:
+                cls._stats = await cls.fetch_stats()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # 取得できない間は、ブローカーの負荷を考慮せずに判断する(ブローカーへの依頼時に503を返す)
+                if cls._stats is not None:
+                    Logging.warning(f"ブローカーの負荷情報を取得できませんでした: {e}")
+                cls._stats = None
+            await asyncio.sleep(interval)
+
+    @classmethod
+    async def _wait_for_response(
+        cls, reader: asyncio.StreamReader, method: str, cancel_token: CancellationToken, timeout: int
+    ) -> tuple[int, dict]:
+        read_task = asyncio.create_task(BrokerProtocol.read_frame(reader))
+        deadline = asyncio.get_running_loop().time() + timeout
+        try:
+            while not read_task.done():
+                await asyncio.wait({read_task}, timeout=cls.CANCEL_POLL_INTERVAL_SEC)
+                cancel_token.raise_if_cancelled()
+                if asyncio.get_running_loop().time() > deadline:
+                    Logging.error(f"ブローカーでの処理({method})が{timeout}秒以内に完了しませんでした。")
+                    raise HTTPException(status_code=504, detail="vCenterへのリクエスト処理がタイムアウトしました。")
+            return read_task.result()
+        except (asyncio.IncompleteReadError, ConnectionError) as e:
+            Logging.error(f"ブローカーでの処理({method})中に接続が切断されました: {e}")
+            raise HTTPException(status_code=503, detail="vCenterへのリクエストを処理するブローカーから切断されました。")
+        finally:
+            read_task.cancel()
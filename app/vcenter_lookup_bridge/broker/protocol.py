@@ -0,0 +1,61 @@
+import asyncio
+import struct
+from typing import Any
+
+from vcenter_lookup_bridge.utils.serialize_util import SerializeUtil
+
+
+class BrokerProtocolError(Exception):
+    """ブローカーとの通信で、不正なフレームを受信したことを示す例外"""
+
+    pass
+
+
+class BrokerProtocol(object):
+    """ワーカープロセスとブローカー間の、Unixソケット上のフレーム形式を定義するクラス
+
+    1つのフレームは、固定長のヘッダ(マジック、バージョン、種別、ペイロード長)と、
+    JSONでシリアライズしたペイロードで構成されます。
+    ペイロードに含まれるレスポンスのスキーマは、SerializeUtilによりクラスごと復元します。
+    """
+
+    # Const
+    MAGIC = b"VLBB"
+    VERSION = 2
+    HEADER = struct.Struct("!4sBBI")
+    MAX_PAYLOAD_BYTES = 64 * 1024 * 1024
+    FRAME_REQUEST = 1
+    FRAME_RESULT = 2
+    FRAME_ERROR = 3
+    # ブローカーの負荷情報と接続状態を取得するための、予約済みの処理名
+    METHOD_STATS = "__stats__"
+
+    @classmethod
+    def encode_frame(cls, frame_type: int, payload: Any) -> bytes:
+        body = SerializeUtil.dumps(payload)
+        if len(body) > cls.MAX_PAYLOAD_BYTES:
+            raise BrokerProtocolError(
+                f"ペイロードが上限({cls.MAX_PAYLOAD_BYTES}バイト)を超えています: {len(body)}バイト"
+            )
+        return cls.HEADER.pack(cls.MAGIC, cls.VERSION, frame_type, len(body)) + body
+
+    @classmethod
+    async def read_frame(cls, reader: asyncio.StreamReader) -> tuple[int, Any]:
+        """
+        フレームを1つ読み込みます
+
+        Raises:
+            asyncio.IncompleteReadError: フレームの途中で接続が切断された場合
+            BrokerProtocolError: ヘッダまたはペイロードが不正な場合
+        """
+        header = await reader.readexactly(cls.HEADER.size)
+        magic, version, frame_type, length = cls.HEADER.unpack(header)
+        if magic != cls.MAGIC or version != cls.VERSION:
+            raise BrokerProtocolError(f"不正なフレームを受信しました(magic={magic!r}, version={version})")
+        if length > cls.MAX_PAYLOAD_BYTES:
+            raise BrokerProtocolError(f"ペイロードが上限({cls.MAX_PAYLOAD_BYTES}バイト)を超えています: {length}バイト")
+        body = await reader.readexactly(length)
+        try:
+            return frame_type, SerializeUtil.loads(body)
+        except ValueError as e:
+            raise BrokerProtocolError(f"不正なペイロードを受信しました: {e}")
@@ -0,0 +1,205 @@
+import asyncio
+import inspect
+import os
+import signal
+
+import vcenter_lookup_bridge.vmware.instances as g
+from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+from vcenter_lookup_bridge.broker.client import BrokerClient
+from vcenter_lookup_bridge.broker.protocol import BrokerProtocol, BrokerProtocolError
+from vcenter_lookup_bridge.utils.cancellation import CancellationToken, OperationCancelledError
+from vcenter_lookup_bridge.utils.logging import Logging
+from vcenter_lookup_bridge.vmware.alarm import Alarm
+from vcenter_lookup_bridge.vmware.cluster import Cluster
+from vcenter_lookup_bridge.vmware.connector import Connector
+from vcenter_lookup_bridge.vmware.datastore import Datastore
+from vcenter_lookup_bridge.vmware.event import Event
+from vcenter_lookup_bridge.vmware.host import Host
+from vcenter_lookup_bridge.vmware.portgroup import Portgroup
+from vcenter_lookup_bridge.vmware.vcenter_config_manager import VCenterConfigManager
+from vcenter_lookup_bridge.vmware.vm import Vm
+from vcenter_lookup_bridge.vmware.vm_folder import VmFolder
+from vcenter_lookup_bridge.vmware.vm_snapshot import VmSnapshot
+from vcenter_lookup_bridge.vmware.work_scheduler import WorkScheduler
+
+
+class BrokerServer(object):
+    """全ワーカープロセスに代わって、vCenterのセッションを保持してリクエストを処理するプロセス(ブローカー)
+
+    ワーカープロセスからUnixソケット経由で依頼された処理を実行し、結果を返します。
+    実行できる処理は、METHODSに登録したものに限定します。
+    """
+
+    # Const
+    LOG_DIR_DEFAULT = "./log"
+    LOG_FILE_DEFAULT = "vcenter_lookup_bridge_broker.log"
+    CONFIG_VCENTER_DIR_DEFAULT = "./config/vcenters"
+    SOCKET_MODE = 0o600
+    SOCKET_UMASK = 0o177
+
+    # 全vCenterの処理を取りまとめる処理(スレッドで実行)
+    METHODS = {
+        method.__qualname__: method
+        for method in (
+            Alarm.get_alarms_from_all_vcenters,
+            Cluster.get_clusters_from_all_vcenters,
+            Datastore.get_datastores_by_tags_from_all_vcenters,
+            Event.get_events_from_all_vcenters,
+            Host.get_hosts_from_all_vcenters,
+            Host.get_host_by_uuid_from_all_vcenters,
+            Portgroup.get_portgroups_by_tags_from_all_vcenters,
+            Vm.get_vms_from_all_vcenters,
+            Vm.get_vm_by_instance_uuid_from_all_vcenters,
+            VmFolder.get_vm_folders_from_all_vcenters,
+            VmSnapshot.get_vm_snapshots_from_all_vcenters,
+            VmSnapshot.get_vm_snapshot_by_instance_uuid_from_all_vcenters,
+        )
+    }
+    # ストリーミングで利用する、vCenterごとの処理(スケジューラに優先度クラスを指定して登録)
+    PER_VCENTER_METHODS = {
+        method.__qualname__: method
+        for method in (
+            Event._get_events_from_vcenter,
+            Host._get_hosts_from_vcenter,
+            Vm._get_vms_by_vm_folders_from_vcenter,
+        )
+    }
+
+    @classmethod
+    def main(cls) -> None:
+        Logging.init(
+            os.getenv("VLB_LOG_DIR", cls.LOG_DIR_DEFAULT),
+            os.getenv("VLB_BROKER_LOG_FILE", cls.LOG_FILE_DEFAULT),
+        )
+        BrokerClient.mark_as_broker_process()
+        VCenterConfigManager.load_vcenter_configurations(cls.CONFIG_VCENTER_DIR_DEFAULT)
+        asyncio.run(cls.serve(BrokerClient.get_socket_path()))
+
+    @classmethod
+    async def serve(cls, socket_path: str) -> None:
+        if not socket_path:
+            raise RuntimeError(
+                "環境変数VLB_BROKER_SOCKETに、ブローカーが待ち受けるUnixソケットのパスを指定してください。"
+            )
+
+        Connector.connect_on_startup()
+        Connector.start_connection_monitor()
+        VCenterConfigManager.start_watcher()
+
+        server = await cls.start_server(socket_path)
+        Logging.info(f"ブローカーを開始しました({socket_path})")
+
+        stop = asyncio.Event()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            asyncio.get_running_loop().add_signal_handler(sig, stop.set)
+        try:
+            async with server:
+                await stop.wait()
+        finally:
+            VCenterConfigManager.stop_watcher()
+            Connector.stop_connection_monitor()
+            WorkScheduler.shutdown()
+            if os.path.exists(socket_path):
+                os.unlink(socket_path)
+            Logging.info("ブローカーを停止しました。")
+
+    @classmethod
+    async def start_server(cls, socket_path: str) -> asyncio.AbstractServer:
+        """
+        Unixソケットで待ち受けを開始します
+
+        ソケットは所有者のみが読み書きできる権限で作成し、待ち受けの開始から権限を変更するまでの間も、
+        他のユーザが接続できないようにします。
+        """
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        previous_umask = os.umask(cls.SOCKET_UMASK)
+        try:
+            server = await asyncio.start_unix_server(cls.handle_connection, path=socket_path)
+        finally:
+            os.umask(previous_umask)
+        os.chmod(socket_path, cls.SOCKET_MODE)
+        return server
+
+    @classmethod
+    def get_stats(cls) -> dict:
+        """ワーカープロセスの受け付け可否の判断・レディネスの確認に利用する、スケジューラの負荷とvCenterの接続状態を返します"""
+
+        return {"scheduler": WorkScheduler.get_stats(), "vcenters": Connector.get_health_snapshot()}
+
+    @classmethod
+    async def handle_connection(cls, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """1つの接続で1つの処理を受け付け、結果を返します。処理中に切断された場合は処理をキャンセルします"""
+
+        cancel_token = CancellationToken()
+        try:
+            frame_type, request = await BrokerProtocol.read_frame(reader)
+            if frame_type != BrokerProtocol.FRAME_REQUEST:
+                raise BrokerProtocolError(f"不正なフレームの種別です: {frame_type}")
+
+            watcher = asyncio.create_task(cls._watch_disconnect(reader, cancel_token))
+            try:
+                result = await cls.dispatch(request, cancel_token)
+                response = BrokerProtocol.encode_frame(BrokerProtocol.FRAME_RESULT, result)
+            except OperationCancelledError as e:
+                response = BrokerProtocol.encode_frame(
+                    BrokerProtocol.FRAME_ERROR, {"cancelled": True, "detail": str(e)}
+                )
+            except HTTPException as e:
+                response = BrokerProtocol.encode_frame(
+                    BrokerProtocol.FRAME_ERROR, {"status_code": e.status_code, "detail": e.detail}
+                )
+            except Exception as e:
+                Logging.error(f"ブローカーでの処理({request.get('method')})中にエラーが発生しました: {e}")
+                response = BrokerProtocol.encode_frame(
+                    BrokerProtocol.FRAME_ERROR, {"status_code": 500, "detail": str(e)}
+                )
+            finally:
+                watcher.cancel()
+
+            if not cancel_token.is_cancelled():
+                writer.write(response)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except BrokerProtocolError as e:
+            Logging.warning(f"ブローカーへの不正なリクエストを破棄しました: {e}")
+        finally:
+            cancel_token.cancel("ワーカープロセスとの接続が切断されました。")
+            writer.close()
+
+    @classmethod
+    async def dispatch(cls, request: dict, cancel_token: CancellationToken):
+        """
+        登録済みの処理を実行します
+
+        service_instancesとconfigsは、ブローカーが保持するものを渡します。
+        """
+        method = request.get("method")
+        if method == BrokerProtocol.METHOD_STATS:
+            return cls.get_stats()
+        kwargs = dict(request.get("kwargs") or {})
+        func = cls.METHODS.get(method) or cls.PER_VCENTER_METHODS.get(method)
+        if func is None:
+            raise HTTPException(status_code=400, detail=f"ブローカーに登録されていない処理です: {method}")
+
+        parameters = inspect.signature(func).parameters
+        if "service_instances" in parameters:
+            kwargs["service_instances"] = await run_in_threadpool(Connector.get_service_instances)
+        if "configs" in parameters:
+            kwargs["configs"] = g.vcenter_configurations
+
+        if method in cls.PER_VCENTER_METHODS:
+            priority = request.get("priority") or WorkScheduler.PRIORITY_BULK
+            future = WorkScheduler.submit(priority, func, cancel_token=cancel_token, **kwargs)
+            return await asyncio.wrap_future(future)
+        if request.get("priority") is not None:
+            kwargs["priority"] = request["priority"]
+        return await run_in_threadpool(func, cancel_token=cancel_token, **kwargs)
+
+    @classmethod
+    async def _watch_disconnect(cls, reader: asyncio.StreamReader, cancel_token: CancellationToken) -> None:
+        # リクエストの送信後にワーカープロセスが切断した(EOFを受信した)場合、処理をキャンセルする
+        await reader.read()
+        cancel_token.cancel("ワーカープロセスとの接続が切断されました。")
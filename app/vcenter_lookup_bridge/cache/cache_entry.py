@@ -0,0 +1,112 @@
+import json
+import math
+import random
+import struct
+import time
+from typing import Optional
+
+
+class CacheEntry(object):
+    """キャッシュに保存するレスポンスと、鮮度の情報をまとめたエントリ
+
+    バイト列の先頭にヘッダ(識別子・作成時刻・鮮度の期限・作成に要した時間・レスポンスヘッダの長さ)を付与し、
+    レスポンスヘッダ(JSON)、エンコード済みのレスポンスボディの順に続けて保存します。
+    識別子・バージョンが一致しない値(形式の異なる古いエントリなど)は、キャッシュに存在しないものとして扱います。
+    """
+
+    # Const
+    MAGIC = b"VLBC"
+    VERSION = 3
+    HEADER_FORMAT = "!4sBdddH"
+    HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+    def __init__(
+        self,
+        body: bytes,
+        created_at: float,
+        fresh_until: float,
+        headers: Optional[dict] = None,
+        compute_sec: float = 0.0,
+    ):
+        self.body = body
+        self.created_at = created_at
+        self.fresh_until = fresh_until
+        self.headers = headers or {}
+        self.compute_sec = compute_sec
+
+    @classmethod
+    def create(
+        cls, body: bytes, fresh_sec: int, headers: Optional[dict] = None, compute_sec: float = 0.0
+    ) -> "CacheEntry":
+        now = time.time()
+        return cls(body=body, created_at=now, fresh_until=now + fresh_sec, headers=headers, compute_sec=compute_sec)
+
+    def is_fresh(self, now: Optional[float] = None) -> bool:
+        now = now if now is not None else time.time()
+        return now < self.fresh_until
+
+    def get_fresh_ttl(self, now: Optional[float] = None) -> int:
+        """鮮度の期限までの残り時間(秒)を返します"""
+
+        now = now if now is not None else time.time()
+        return max(0, int(self.fresh_until - now))
+
+    def get_expire_sec(self) -> int:
+        """作成時刻から鮮度の期限までの時間(秒)を返します"""
+
+        return math.ceil(self.fresh_until - self.created_at)
+
+    def should_recompute_early(self, beta: float, now: Optional[float] = None, rand: Optional[float] = None) -> bool:
+        """
+        鮮度の期限前に、確率的に作成し直すべきかを返します(XFetch)
+
+        期限が近いほど、また作成に時間を要したエントリほど高い確率でTrueを返し、
+        複数のワーカープロセスで同時に期限切れとなって一斉に作成し直すことを防ぎます。
+
+        Args:
+            beta (float): 早期に作成し直す度合い(1.0が標準。0以下の場合は常にFalse)
+        """
+        if beta <= 0 or self.compute_sec <= 0:
+            return False
+        now = now if now is not None else time.time()
+        rand = rand if rand is not None else random.random()
+        # log(rand)は負の値のため、作成に要した時間に比例して、期限を早めた時刻と比較する
+        return now - self.compute_sec * beta * math.log(max(rand, 1e-12)) >= self.fresh_until
+
+    def encode(self) -> bytes:
+        headers = json.dumps(self.headers, separators=(",", ":")).encode("utf-8")
+        return (
+            struct.pack(
+                self.HEADER_FORMAT,
+                self.MAGIC,
+                self.VERSION,
+                self.created_at,
+                self.fresh_until,
+                self.compute_sec,
+                len(headers),
+            )
+            + headers
+            + self.body
+        )
+
+    @classmethod
+    def decode(cls, value: Optional[bytes]) -> Optional["CacheEntry"]:
+        if value is None or len(value) < cls.HEADER_SIZE:
+            return None
+        magic, version, created_at, fresh_until, compute_sec, headers_size = struct.unpack(
+            cls.HEADER_FORMAT, value[: cls.HEADER_SIZE]
+        )
+        if magic != cls.MAGIC or version != cls.VERSION:
+            return None
+        body_offset = cls.HEADER_SIZE + headers_size
+        try:
+            headers = json.loads(value[cls.HEADER_SIZE : body_offset])
+        except ValueError:
+            return None
+        return cls(
+            body=value[body_offset:],
+            created_at=created_at,
+            fresh_until=fresh_until,
+            headers=headers,
+            compute_sec=compute_sec,
+        )
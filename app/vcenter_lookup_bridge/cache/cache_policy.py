@@ -0,0 +1,109 @@
+import pathlib
+from typing import Optional
+
+import setuptools
+import vcenter_lookup_bridge.vmware.instances as g
+from vcenter_lookup_bridge.utils.config_util import ConfigUtil
+from vcenter_lookup_bridge.utils.logging import Logging
+
+
+class CachePolicy(object):
+    """エンドポイントのレスポンスのキャッシュ方法(ポリシー)を、リソースの種別・vCenterごとに決定するクラス
+
+    ポリシーは、以下の順に上書きして決定します。
+        1. エンドポイントのデコレータ(ResponseCache.cached)の引数
+        2. 設定ファイル(config/cache_policy.yml)のdefault
+        3. 設定ファイル(config/cache_policy.yml)のresourcesの、リソースの種別ごとの設定
+        4. vCenterの設定ファイルのcache_policy
+        5. vCenterの設定ファイルのcache_policy.resourcesの、リソースの種別ごとの設定
+    vCenterを指定しないリクエストには、4・5は適用しません。
+    vCenterの設定ファイルの変更は、vCenterの設定ファイルの再読み込みにより、再起動せずに反映されます。
+
+    Attributes:
+        POLICY_KEYS (dict): ポリシーの項目と、値の変換方法
+    """
+
+    # Const
+    CONFIG_FILE_DEFAULT = "./config/cache_policy.yml"
+    POLICY_KEYS = {
+        # レスポンスをそのまま返す期間(秒)。0以下の場合はキャッシュしない
+        "expire_secs": int,
+        # 鮮度の期限を過ぎたレスポンスを返しつつ、再作成する期間(秒)
+        "stale_secs": int,
+        # キャッシュするレスポンスの最大サイズ(バイト)。0の場合は制限しない
+        "max_bytes": int,
+        # Redisに保存する際に圧縮するかどうか。指定しない場合は環境変数(VLB_CACHE_COMPRESSION_ENABLED)に従う
+        "compression": lambda value: bool(setuptools.distutils.util.strtobool(str(value))),
+        # キャッシュを利用せずに、常にvCenterから取得するかどうか
+        "bypass": lambda value: bool(setuptools.distutils.util.strtobool(str(value))),
+    }
+
+    _default_policy: dict = {}
+    _resource_policies: dict[str, dict] = {}
+
+    @classmethod
+    @Logging.func_logger
+    def load(cls, config_file: str = CONFIG_FILE_DEFAULT) -> None:
+        """設定ファイルから、既定のポリシーと、リソースの種別ごとのポリシーを読み込みます(設定ファイルがない場合はクリア)"""
+
+        cls._default_policy = {}
+        cls._resource_policies = {}
+        if not pathlib.Path(config_file).is_file():
+            return
+        config = ConfigUtil.parse_config(config_file) or {}
+        cls._default_policy = cls.normalize(config.get("default"), source=f"{config_file}(default)")
+        cls._resource_policies = {
+            resource: cls.normalize(policy, source=f"{config_file}(resources.{resource})")
+            for resource, policy in (config.get("resources") or {}).items()
+        }
+        Logging.info(f"キャッシュのポリシーを読み込みました(リソース: {list(cls._resource_policies.keys())})")
+
+    @classmethod
+    def normalize(cls, policy: Optional[dict], source: str) -> dict:
+        """ポリシーの項目を検証・変換し、不正な項目は除外します"""
+
+        normalized = {}
+        for key, value in (policy or {}).items():
+            if key == "resources":
+                continue
+            if key not in cls.POLICY_KEYS:
+                Logging.warning(f"キャッシュのポリシーの不明な項目({key})を無視します: {source}")
+                continue
+            try:
+                normalized[key] = cls.POLICY_KEYS[key](value)
+            except (TypeError, ValueError):
+                Logging.warning(f"キャッシュのポリシーの項目({key})の値({value})が不正なため無視します: {source}")
+        return normalized
+
+    @classmethod
+    def get_policy(cls, resource: str, vcenter_name: Optional[str], expire_secs: int, stale_secs: int) -> dict:
+        """
+        リソースの種別・vCenterに適用するポリシーを返します
+
+        Args:
+            resource (str): リソースの種別(vms, hostsなど)
+            vcenter_name (Optional[str]): vCenter名(vCenterを指定しないリクエストの場合はNone)
+            expire_secs (int): デコレータの引数で指定された、レスポンスをそのまま返す期間(秒)
+            stale_secs (int): デコレータの引数で指定された、鮮度の期限を過ぎたレスポンスを返す期間(秒)
+
+        Returns:
+            dict: POLICY_KEYSの全項目を含むポリシー(compressionは、指定がない場合はNone)
+        """
+        policy = {
+            "expire_secs": expire_secs,
+            "stale_secs": stale_secs,
+            "max_bytes": 0,
+            "compression": None,
+            "bypass": False,
+        }
+        policy.update(cls._default_policy)
+        policy.update(cls._resource_policies.get(resource, {}))
+        if vcenter_name is not None:
+            config = getattr(g, "vcenter_configurations", {}).get(vcenter_name) or {}
+            vcenter_policy = config.get("cache_policy") or {}
+            source = f"vCenter({vcenter_name})のcache_policy"
+            policy.update(cls.normalize(vcenter_policy, source=source))
+            policy.update(
+                cls.normalize((vcenter_policy.get("resources") or {}).get(resource), source=f"{source}.{resource}")
+            )
+        return policy
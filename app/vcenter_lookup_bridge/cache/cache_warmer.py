@@ -0,0 +1,188 @@
+import asyncio
+import os
+import pathlib
+import uuid
+from typing import Optional
+from urllib.parse import urlencode
+
+import setuptools
+from redis import asyncio as aioredis
+from vcenter_lookup_bridge.utils.config_util import ConfigUtil
+from vcenter_lookup_bridge.utils.logging import Logging
+
+
+class CacheWarmer(object):
+    """設定ファイル(config/cache_warmup.yml)に記載したリクエストのレスポンスを、事前にキャッシュするクラス
+
+    起動時と、以降は一定間隔(キャッシュの有効期限より短い間隔)で、記載したリクエストをアプリケーション内で実行し、
+    キャッシュを作成し直します。リクエストはCache-Control: no-cacheを付与して実行するため、キャッシュの有無に関わらず
+    vCenterから取得し直します。
+    全ワーカープロセスのうち、Redisのロックを取得したリーダーのみが実行し、同時に実行するリクエスト数は制限します。
+
+    Attributes:
+        LEADER_LOCK_KEY (str): リーダーのワーカープロセスを決定するロックのキー
+    """
+
+    # Const
+    CONFIG_FILE_DEFAULT = "./config/cache_warmup.yml"
+    VLB_CACHE_WARMUP_ENABLED_DEFAULT = "True"
+    VLB_CACHE_WARMUP_INTERVAL_SEC_DEFAULT = 45
+    VLB_CACHE_WARMUP_CONCURRENCY_DEFAULT = 2
+    LEADER_LOCK_KEY = "vlb_cache_warmup_leader"
+
+    _task: Optional[asyncio.Task] = None
+    # ロックを取得したワーカープロセスを区別するための識別子
+    _origin = uuid.uuid4().hex
+
+    @classmethod
+    def is_enabled(cls) -> bool:
+        return bool(
+            setuptools.distutils.util.strtobool(
+                os.getenv("VLB_CACHE_WARMUP_ENABLED", cls.VLB_CACHE_WARMUP_ENABLED_DEFAULT)
+            )
+        )
+
+    @classmethod
+    def get_interval_sec(cls) -> int:
+        return max(1, int(os.getenv("VLB_CACHE_WARMUP_INTERVAL_SEC", cls.VLB_CACHE_WARMUP_INTERVAL_SEC_DEFAULT)))
+
+    @classmethod
+    def get_concurrency(cls) -> int:
+        return max(1, int(os.getenv("VLB_CACHE_WARMUP_CONCURRENCY", cls.VLB_CACHE_WARMUP_CONCURRENCY_DEFAULT)))
+
+    @classmethod
+    @Logging.func_logger
+    def load_queries(cls, config_file: str = CONFIG_FILE_DEFAULT) -> list[dict]:
+        """
+        設定ファイルから、事前にキャッシュするリクエストを読み込みます
+
+        Returns:
+            list[dict]: path(APIのパス)とparams(クエリパラメータ)の辞書のリスト。設定ファイルがない場合は空のリスト
+        """
+        if not pathlib.Path(config_file).is_file():
+            return []
+        config = ConfigUtil.parse_config(config_file) or {}
+        queries = []
+        for query in config.get("queries") or []:
+            if not query.get("path"):
+                Logging.warning(f"pathが指定されていないため、キャッシュのウォームアップの対象から除外します: {query}")
+                continue
+            queries.append({"path": query["path"], "params": query.get("params") or {}})
+        return queries
+
+    @classmethod
+    def start(cls, app, redis: aioredis.Redis, config_file: str = CONFIG_FILE_DEFAULT) -> None:
+        """キャッシュのウォームアップを、バックグラウンドのタスクで開始します"""
+
+        if os.getenv("TESTING") == "1" or not cls.is_enabled() or cls._task is not None:
+            return
+        try:
+            queries = cls.load_queries(config_file)
+        except Exception as e:
+            Logging.error(f"キャッシュのウォームアップの設定ファイルを読み込めませんでした: {e}")
+            return
+        if not queries:
+            return
+        Logging.info(f"キャッシュのウォームアップを開始します({len(queries)}件)")
+        cls._task = asyncio.get_running_loop().create_task(cls._run(app, redis, queries))
+
+    @classmethod
+    async def stop(cls, redis: Optional[aioredis.Redis] = None) -> None:
+        if cls._task is None:
+            return
+        cls._task.cancel()
+        try:
+            await cls._task
+        except asyncio.CancelledError:
+            pass
+        cls._task = None
+        if redis is not None:
+            await cls.release_leadership(redis)
+
+    @classmethod
+    async def acquire_leadership(cls, redis: aioredis.Redis, expire: int) -> bool:
+        """リーダーのロックを取得(取得済みの場合は延長)し、リーダーであればTrueを返します"""
+
+        try:
+            if await redis.set(cls.LEADER_LOCK_KEY, cls._origin, nx=True, ex=expire):
+                return True
+            leader = await redis.get(cls.LEADER_LOCK_KEY)
+            if leader is not None and (leader.decode("utf-8") if isinstance(leader, bytes) else leader) == cls._origin:
+                await redis.expire(cls.LEADER_LOCK_KEY, expire)
+                return True
+        except Exception as e:
+            Logging.warning(f"キャッシュのウォームアップのロックを取得できませんでした: {e}")
+        return False
+
+    @classmethod
+    async def release_leadership(cls, redis: aioredis.Redis) -> None:
+        try:
+            leader = await redis.get(cls.LEADER_LOCK_KEY)
+            if leader is not None and (leader.decode("utf-8") if isinstance(leader, bytes) else leader) == cls._origin:
+                await redis.delete(cls.LEADER_LOCK_KEY)
+        except Exception as e:
+            Logging.warning(f"キャッシュのウォームアップのロックを解放できませんでした: {e}")
+
+    @classmethod
+    async def warm_up(cls, app, queries: list[dict]) -> int:
+        """
+        リクエストを同時実行数を制限して実行し、レスポンスをキャッシュします
+
+        Returns:
+            int: 成功したリクエストの件数
+        """
+        semaphore = asyncio.Semaphore(cls.get_concurrency())
+
+        async def warm_up_query(query: dict) -> bool:
+            async with semaphore:
+                try:
+                    status = await cls._request(app, query["path"], query["params"])
+                except Exception as e:
+                    Logging.warning(f"キャッシュのウォームアップ({query['path']})に失敗しました: {e}")
+                    return False
+                if status != 200:
+                    Logging.warning(f"キャッシュのウォームアップ({query['path']})に失敗しました(STATUS/{status})")
+                return status == 200
+
+        results = await asyncio.gather(*[warm_up_query(query) for query in queries])
+        return sum(1 for result in results if result)
+
+    @classmethod
+    async def _run(cls, app, redis: aioredis.Redis, queries: list[dict]) -> None:
+        interval = cls.get_interval_sec()
+        while True:
+            # リーダーが停止した場合は、ロックの期限切れ後に他のワーカープロセスが引き継ぐ
+            if await cls.acquire_leadership(redis, expire=interval * 2):
+                succeeded = await cls.warm_up(app, queries)
+                Logging.info(f"キャッシュのウォームアップが完了しました(成功: {succeeded}件, 全体: {len(queries)}件)")
+            await asyncio.sleep(interval)
+
+    @classmethod
+    async def _request(cls, app, path: str, params: dict) -> int:
+        """アプリケーションにGETリクエストを送信し、ステータスコードを返します"""
+
+        status = 0
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": "GET",
+            "scheme": "http",
+            "path": path,
+            "raw_path": path.encode("utf-8"),
+            "query_string": urlencode(params, doseq=True).encode("utf-8"),
+            "headers": [(b"host", b"localhost"), (b"cache-control", b"no-cache")],
+            "client": ("127.0.0.1", 0),
+            "server": ("localhost", 80),
+        }
+
+        async def receive():
+            return {"type": "http.request", "body": b"", "more_body": False}
+
+        async def send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+
+        await app(scope, receive, send)
+        return status
@@ -0,0 +1,67 @@
+import gzip
+import os
+from typing import Optional
+
+import setuptools
+
+
+class CompressingCodec(object):
+    """Redisに保存するレスポンスを、gzipで圧縮・展開するクラス
+
+    閾値以上の大きさのレスポンスのみ圧縮し、圧縮しても小さくならない場合はそのまま保存します。
+    gzip形式の識別子(先頭2バイト)で圧縮の有無を判別するため、圧縮前に保存されたレスポンスもそのまま読み込めます。
+    圧縮の件数・圧縮前後のバイト数を記録し、圧縮率を参照できるようにします。
+    """
+
+    # Const
+    VLB_CACHE_COMPRESSION_ENABLED_DEFAULT = "True"
+    VLB_CACHE_COMPRESSION_MIN_BYTES_DEFAULT = 1024
+    VLB_CACHE_COMPRESSION_LEVEL_DEFAULT = 6
+    GZIP_MAGIC = b"\x1f\x8b"
+
+    def __init__(self):
+        self.enabled = bool(
+            setuptools.distutils.util.strtobool(
+                os.getenv("VLB_CACHE_COMPRESSION_ENABLED", CompressingCodec.VLB_CACHE_COMPRESSION_ENABLED_DEFAULT)
+            )
+        )
+        self.min_bytes = int(
+            os.getenv("VLB_CACHE_COMPRESSION_MIN_BYTES", CompressingCodec.VLB_CACHE_COMPRESSION_MIN_BYTES_DEFAULT)
+        )
+        self.level = int(os.getenv("VLB_CACHE_COMPRESSION_LEVEL", CompressingCodec.VLB_CACHE_COMPRESSION_LEVEL_DEFAULT))
+        self._compressed = 0
+        self._uncompressed = 0
+        self._raw_bytes = 0
+        self._stored_bytes = 0
+
+    def encode(self, value: bytes, enabled: Optional[bool] = None) -> bytes:
+        stored = value
+        enabled = self.enabled if enabled is None else enabled
+        if enabled and len(value) >= self.min_bytes:
+            compressed = gzip.compress(value, compresslevel=self.level, mtime=0)
+            if len(compressed) < len(value):
+                stored = compressed
+        if stored is value:
+            self._uncompressed += 1
+        else:
+            self._compressed += 1
+        self._raw_bytes += len(value)
+        self._stored_bytes += len(stored)
+        return stored
+
+    def decode(self, value: bytes) -> bytes:
+        if value[:2] == CompressingCodec.GZIP_MAGIC:
+            return gzip.decompress(value)
+        return value
+
+    def get_stats(self) -> dict:
+        """圧縮した件数・圧縮前後の合計バイト数・圧縮率(保存したバイト数/圧縮前のバイト数)を返します"""
+
+        return {
+            "enabled": self.enabled,
+            "compressed": self._compressed,
+            "uncompressed": self._uncompressed,
+            "rawBytes": self._raw_bytes,
+            "storedBytes": self._stored_bytes,
+            "ratio": round(self._stored_bytes / self._raw_bytes, 4) if self._raw_bytes else None,
+        }
@@ -0,0 +1,90 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+
+class LruCache(object):
+    """件数とバイト数の上限を持つ、ワーカープロセス内のLRUキャッシュ
+
+    値はbytesで保持し、上限を超えた場合は最も長く参照されていないエントリから破棄します。
+    エントリごとに有効期限を持ち、期限切れのエントリは参照時に破棄します。
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int):
+        self._max_entries = max(1, max_entries)
+        self._max_bytes = max(1, max_bytes)
+        self._entries: OrderedDict[str, tuple[bytes, float]] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def get_with_ttl(self, key: str) -> tuple[int, Optional[bytes]]:
+        """値と残りの有効期間(秒)を返します。存在しない場合は(0, None)を返します"""
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._misses += 1
+                return 0, None
+            value, expires_at = entry
+            remaining = expires_at - time.monotonic()
+            if remaining <= 0:
+                self._remove(key)
+                self._misses += 1
+                return 0, None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return math.ceil(remaining), value
+
+    def set(self, key: str, value: bytes, expire: int) -> None:
+        size = self._get_size(key, value)
+        with self._lock:
+            self._remove(key)
+            # 上限を超える大きさの値は保持しない
+            if expire <= 0 or size > self._max_bytes:
+                return
+            self._entries[key] = (value, time.monotonic() + expire)
+            self._bytes += size
+            while len(self._entries) > self._max_entries or self._bytes > self._max_bytes:
+                self._remove(next(iter(self._entries)))
+                self._evictions += 1
+
+    def delete(self, key: str) -> int:
+        with self._lock:
+            return 1 if self._remove(key) else 0
+
+    def clear(self, prefix: Optional[str] = None) -> int:
+        """prefixを指定した場合は、キーがprefixで始まるエントリのみ破棄します"""
+
+        with self._lock:
+            keys = [key for key in self._entries.keys() if prefix is None or key.startswith(prefix)]
+            for key in keys:
+                self._remove(key)
+            return len(keys)
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "maxEntries": self._max_entries,
+                "maxBytes": self._max_bytes,
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+            }
+
+    def _remove(self, key: str) -> bool:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return False
+        self._bytes -= self._get_size(key, entry[0])
+        return True
+
+    @staticmethod
+    def _get_size(key: str, value: bytes) -> int:
+        return len(key) + len(value)
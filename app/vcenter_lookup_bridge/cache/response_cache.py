@@ -0,0 +1,429 @@
+import asyncio
+import hashlib
+import json
+import os
+import random
+import time
+import uuid
+from functools import wraps
+from typing import Callable, Optional
+
+from fastapi.dependencies.utils import get_typed_signature
+from fastapi.encoders import jsonable_encoder
+from fastapi_cache import FastAPICache
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+from vcenter_lookup_bridge.cache.cache_entry import CacheEntry
+from vcenter_lookup_bridge.cache.cache_policy import CachePolicy
+from vcenter_lookup_bridge.utils.logging import Logging
+
+
+class ResponseCache(object):
+    """エンドポイントのレスポンスを、stale-while-revalidate方式でキャッシュするクラス
+
+    鮮度の期限(expire)を過ぎたレスポンスも、stale_expireの間はキャッシュに保持し、
+    その間のリクエストにはキャッシュしたレスポンスを即座に返した上で、バックグラウンドでレスポンスを作成し直します。
+    作成し直す処理は、Redisのロックにより全ワーカープロセスで1件のみ実行します。
+    キャッシュの格納先は、fastapi-cacheの設定(FastAPICache.init)に従います。
+    レスポンスは、エンコード済みのボディとレスポンスヘッダを保存し、キャッシュから返す際はデコードやresponse_modelによる
+    検証を行わずに、そのままResponseとして返します。作成時のレスポンスも、保存したものと同じバイト列で返します。
+    レスポンスにはETag(内容のハッシュ値)を付与し、If-None-Matchが一致するリクエストには304 Not Modifiedを返します。
+    キャッシュ済みのレスポンスがあれば、vCenterへの問い合わせやレスポンスの作成を行わずに判定します。
+
+    多数のレスポンスが同時に期限切れとなり、vCenterへの問い合わせが集中することを防ぐため、
+    鮮度の期限はVLB_CACHE_TTL_JITTER_RATIOの割合の範囲でランダムに短縮し、
+    期限前のレスポンスも、期限が近いほど高い確率でバックグラウンドで作成し直します(XFetch)。
+    最後に取得に成功した結果を含むレスポンス(staleVcentersあり)は、vCenterの復旧後に古い結果を返し続けないよう、
+    鮮度の期限をVLB_CACHE_DEGRADED_EXPIRE_SECSまでに短縮します。
+
+    有効期限などのキャッシュ方法は、リソースの種別・vCenterごとのポリシー(CachePolicy)で、デコレータの引数から上書きできます。
+
+    キャッシュのキーは「プレフィックス:リソース:vCenter名:パラメータのハッシュ値」の形式とし、
+    リソース・vCenter名ごとのタグ(キーの集合)に登録することで、キー空間全体を走査せずに、
+    特定のリソースやvCenterのキャッシュのみを破棄できるようにします。
+    vCenterを指定しないリクエストのキャッシュは、vCenter名をALL_VCENTERSとして登録し、いずれのvCenterの破棄でも破棄します。
+
+    Attributes:
+        CACHE_STATUS_HEADER (str): キャッシュの利用状況(HIT/STALE/MISS)を返すヘッダ
+        REFRESH_LOCK_PREFIX (str): バックグラウンドでの再作成の重複を防ぐロックのキーの接頭辞
+        ALL_VCENTERS (str): vCenterを指定しないリクエストのキャッシュに用いるvCenter名
+    """
+
+    # Const
+    VLB_CACHE_STALE_SECS_DEFAULT = 300
+    VLB_CACHE_TTL_JITTER_RATIO_DEFAULT = 0.1
+    VLB_CACHE_XFETCH_BETA_DEFAULT = 1.0
+    VLB_CACHE_DEGRADED_EXPIRE_SECS_DEFAULT = 5
+    CACHE_STATUS_HEADER = "X-FastAPI-Cache"
+    REFRESH_LOCK_PREFIX = "vlb_cache_refresh:"
+    REFRESH_LOCK_EXPIRE_SEC = 300
+    ALL_VCENTERS = "_all"
+    # キーの値が指定した値と一致する場合のみ削除する(他のワーカープロセスが取得し直したロックを消さないため)
+    COMPARE_AND_DELETE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+    # キーのハッシュ値に含めない引数
+    IGNORED_ARGS = ("service_instances",)
+    # ETagのハッシュ値に含めない、リクエストごとに変わるレスポンスの項目
+    ETAG_IGNORED_FIELDS = ("timestamp", "requestId")
+
+    # 実行中のバックグラウンドの再作成(タスクの参照の保持と、ワーカープロセス内での重複の防止に利用)
+    _refresh_tasks: dict[str, asyncio.Task] = {}
+
+    @classmethod
+    def get_stale_secs(cls) -> int:
+        return int(os.getenv("VLB_CACHE_STALE_SECS", cls.VLB_CACHE_STALE_SECS_DEFAULT))
+
+    @classmethod
+    def get_ttl_jitter_ratio(cls) -> float:
+        ratio = float(os.getenv("VLB_CACHE_TTL_JITTER_RATIO", cls.VLB_CACHE_TTL_JITTER_RATIO_DEFAULT))
+        return min(max(ratio, 0.0), 1.0)
+
+    @classmethod
+    def get_xfetch_beta(cls) -> float:
+        return float(os.getenv("VLB_CACHE_XFETCH_BETA", cls.VLB_CACHE_XFETCH_BETA_DEFAULT))
+
+    @classmethod
+    def get_degraded_expire_secs(cls) -> int:
+        return int(os.getenv("VLB_CACHE_DEGRADED_EXPIRE_SECS", cls.VLB_CACHE_DEGRADED_EXPIRE_SECS_DEFAULT))
+
+    @classmethod
+    def cached(cls, resource: str, expire: int, stale_expire: Optional[int] = None) -> Callable:
+        """
+        エンドポイントのレスポンスをキャッシュするデコレータを返します
+
+        エンドポイントは、引数にrequest(Request型)を持つ必要があります。
+        引数search_paramsがvcenter属性を持つ場合、その値をキャッシュのキーのvCenter名とします。
+        バックグラウンドでの再作成時は、HTTPクライアントの切断を監視しないよう、requestにNoneを指定して呼び出します。
+        エンドポイントがResponseを返した場合は、キャッシュせずにそのまま返します。
+
+        Args:
+            resource (str): キャッシュのキーに含めるリソースの種別(vms, hostsなど)
+            expire (int): レスポンスをそのまま返す期間(秒)。ポリシーのexpire_secsが優先
+            stale_expire (Optional[int]): 鮮度の期限を過ぎたレスポンスを返しつつ、再作成する期間(秒)。省略時はVLB_CACHE_STALE_SECS。ポリシーのstale_secsが優先
+        """
+
+        def wrapper(func: Callable) -> Callable:
+            signature = get_typed_signature(func)
+            request_param = next(
+                (p.name for p in signature.parameters.values() if p.annotation is Request),
+                None,
+            )
+            if request_param is None:
+                raise TypeError(f"{func.__name__}は、引数にRequest型のパラメータを持つ必要があります")
+
+            @wraps(func)
+            async def inner(*args, **kwargs):
+                request: Optional[Request] = kwargs.get(request_param)
+                if cls._is_uncacheable(request):
+                    return await func(*args, **kwargs)
+
+                vcenter_name = cls._get_vcenter_name(kwargs)
+                policy = CachePolicy.get_policy(
+                    resource,
+                    vcenter_name if vcenter_name != cls.ALL_VCENTERS else None,
+                    expire_secs=expire,
+                    stale_secs=stale_expire if stale_expire is not None else cls.get_stale_secs(),
+                )
+                if policy["bypass"] or policy["expire_secs"] <= 0:
+                    return await func(*args, **kwargs)
+
+                key_kwargs = {k: v for k, v in kwargs.items() if k != request_param}
+                cache_key = cls._build_key(resource, vcenter_name, func, args, key_kwargs)
+                entry = await cls._get_entry(cache_key)
+
+                if entry is None or request.headers.get("Cache-Control") == "no-cache":
+                    result, entry = await cls._compute(func, args, kwargs, policy["expire_secs"])
+                    if entry is None:
+                        return result
+                    await cls._set_entry(cache_key, entry, policy, resource, vcenter_name)
+                    status, max_age = "MISS", entry.get_fresh_ttl()
+                else:
+                    if entry.is_fresh():
+                        status, max_age = "HIT", entry.get_fresh_ttl()
+                        refresh = entry.should_recompute_early(cls.get_xfetch_beta())
+                    else:
+                        status, max_age = "STALE", 0
+                        refresh = True
+                    if refresh:
+                        # キャッシュしたレスポンスを返し、バックグラウンドで作成し直す
+                        refresh_kwargs = {**kwargs, request_param: None}
+                        await cls._start_refresh(cache_key, func, args, refresh_kwargs, policy, resource, vcenter_name)
+                return cls._create_response(
+                    entry, status=status, max_age=max_age, not_modified=cls._is_not_modified(request, entry)
+                )
+
+            return inner
+
+        return wrapper
+
+    @classmethod
+    def _is_uncacheable(cls, request: Optional[Request]) -> bool:
+        if not FastAPICache.get_enable() or request is None:
+            return True
+        if not cls._is_initialized():
+            return True
+        if request.method != "GET":
+            return True
+        return request.headers.get("Cache-Control") == "no-store"
+
+    @classmethod
+    def _is_initialized(cls) -> bool:
+        """キャッシュのバックエンドが初期化済みかを返します(Redisの初期化に失敗した場合はFalse)"""
+
+        try:
+            return FastAPICache.get_backend() is not None
+        except AssertionError:
+            return False
+
+    @classmethod
+    async def invalidate(cls, resource: Optional[str] = None, vcenter_name: Optional[str] = None) -> int:
+        """
+        リソース・vCenter名を指定して、キャッシュしたレスポンスを破棄します
+
+        いずれも指定しない場合は、全てのレスポンスを破棄します。
+        vCenter名を指定した場合、vCenterを指定しないリクエストのレスポンスも、同vCenterの情報を含むため破棄します。
+
+        Returns:
+            int: 破棄したレスポンスの件数
+        """
+        backend = FastAPICache.get_backend()
+        if resource is None and vcenter_name is None:
+            return await backend.clear(namespace=FastAPICache.get_prefix())
+
+        redis = getattr(backend, "redis", None)
+        if redis is None:
+            return 0
+        vcenter_names = [vcenter_name, cls.ALL_VCENTERS] if vcenter_name is not None else [None]
+        tag_keys = [cls._get_tag_key(resource, name) for name in vcenter_names]
+        keys = [key.decode("utf-8") if isinstance(key, bytes) else key for key in await redis.sunion(tag_keys)]
+        if keys:
+            await cls._delete_keys(backend, keys)
+        await redis.delete(*tag_keys)
+        return len(keys)
+
+    @classmethod
+    def _get_vcenter_name(cls, kwargs: dict) -> str:
+        return getattr(kwargs.get("search_params"), "vcenter", None) or cls.ALL_VCENTERS
+
+    @classmethod
+    def _build_key(cls, resource: str, vcenter_name: str, func: Callable, args, kwargs) -> str:
+        params = repr((args, sorted((k, v) for k, v in kwargs.items() if k not in cls.IGNORED_ARGS)))
+        digest = hashlib.md5(f"{func.__module__}:{func.__name__}:{params}".encode("utf-8")).hexdigest()
+        return f"{FastAPICache.get_prefix()}:{resource}:{vcenter_name}:{digest}"
+
+    @classmethod
+    def _get_tag_key(cls, resource: Optional[str], vcenter_name: Optional[str]) -> str:
+        """キャッシュのキーを登録するタグのキーを返します(リソース・vCenter名のいずれかはNoneを指定可能)"""
+
+        return f"{FastAPICache.get_prefix()}:tag:{resource or ''}:{vcenter_name or ''}"
+
+    @classmethod
+    async def _add_tags(cls, cache_key: str, resource: str, vcenter_name: str, expire: int) -> None:
+        redis = getattr(FastAPICache.get_backend(), "redis", None)
+        if redis is None:
+            return
+        async with redis.pipeline(transaction=False) as pipe:
+            for tag_key in (
+                cls._get_tag_key(resource, None),
+                cls._get_tag_key(None, vcenter_name),
+                cls._get_tag_key(resource, vcenter_name),
+            ):
+                pipe.sadd(tag_key, cache_key)
+                # タグは、登録したキャッシュのうち最も遅く期限切れとなるものまで保持
+                pipe.expire(tag_key, expire, gt=True)
+                pipe.expire(tag_key, expire, nx=True)
+            await pipe.execute()
+
+    @classmethod
+    async def _delete_keys(cls, backend, keys: list[str]) -> None:
+        if hasattr(backend, "delete_keys"):
+            await backend.delete_keys(keys)
+            return
+        for key in keys:
+            await backend.clear(key=key)
+
+    @classmethod
+    async def _get_entry(cls, cache_key: str) -> Optional[CacheEntry]:
+        try:
+            _, cached = await FastAPICache.get_backend().get_with_ttl(cache_key)
+        except Exception as e:
+            Logging.warning(f"キャッシュを取得できませんでした({cache_key}): {e}")
+            return None
+        return CacheEntry.decode(cached)
+
+    @classmethod
+    async def _compute(cls, func: Callable, args, kwargs, expire: int) -> tuple[object, Optional[CacheEntry]]:
+        """
+        エンドポイントを呼び出し、戻り値と、戻り値から作成したエントリを返します
+
+        鮮度の期限はランダムに短縮し、作成に要した時間はエントリに記録します(XFetchの判定に利用)。
+        エンドポイントがResponseを返した場合、エントリはNoneを返します。
+        """
+        started = time.monotonic()
+        result = await func(*args, **kwargs)
+        if isinstance(result, Response):
+            return result, None
+        return result, cls._create_entry(result, cls._get_jittered_expire(expire), time.monotonic() - started)
+
+    @classmethod
+    def _get_jittered_expire(cls, expire: int) -> int:
+        if expire <= 0:
+            return expire
+        return max(1, round(expire * (1 - random.uniform(0, cls.get_ttl_jitter_ratio()))))
+
+    @classmethod
+    def _create_entry(cls, result, expire: int, compute_sec: float = 0.0) -> CacheEntry:
+        """
+        エンドポイントの戻り値を、FastAPIと同じ形式のJSONにエンコードしたエントリを作成します
+
+        最後に取得に成功した結果を含む場合(staleVcentersあり)は、鮮度の期限をVLB_CACHE_DEGRADED_EXPIRE_SECSまでに短縮します。
+        """
+        content = jsonable_encoder(result)
+        if isinstance(content, dict) and content.get("staleVcenters"):
+            expire = min(expire, cls.get_degraded_expire_secs())
+        rendered = JSONResponse(content=content)
+        return CacheEntry.create(
+            body=rendered.body,
+            fresh_sec=expire,
+            headers={"content-type": rendered.headers["content-type"], "etag": cls._compute_etag(content)},
+            compute_sec=compute_sec,
+        )
+
+    @classmethod
+    def _compute_etag(cls, content) -> str:
+        """
+        レスポンスの内容のハッシュ値から、ETagを作成します
+
+        作成時刻などリクエストごとに変わる項目は除外し、vCenterから取得した内容が同じであれば、
+        作成し直したレスポンスも同じETagとなるようにします。
+        """
+        if isinstance(content, dict):
+            content = {k: v for k, v in content.items() if k not in cls.ETAG_IGNORED_FIELDS}
+        digest = hashlib.md5(json.dumps(content, sort_keys=True, separators=(",", ":")).encode("utf-8")).hexdigest()
+        return f'"{digest}"'
+
+    @classmethod
+    def _is_not_modified(cls, request: Request, entry: CacheEntry) -> bool:
+        """If-None-Matchのいずれかが、レスポンスのETagと一致する(弱い比較)かを返します"""
+
+        if_none_match = request.headers.get("If-None-Match")
+        etag = entry.headers.get("etag")
+        if not if_none_match or not etag:
+            return False
+        if if_none_match.strip() == "*":
+            return True
+        return etag in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+
+    @classmethod
+    async def _set_entry(
+        cls, cache_key: str, entry: CacheEntry, policy: dict, resource: str, vcenter_name: str
+    ) -> None:
+        if policy["max_bytes"] > 0 and len(entry.body) > policy["max_bytes"]:
+            Logging.info(
+                f"レスポンスのサイズ({len(entry.body)}バイト)が上限({policy['max_bytes']}バイト)を超えるため、キャッシュしません({cache_key})"
+            )
+            return
+        # 鮮度の期限を過ぎた後も、stale_secsの間はキャッシュに保持する
+        expire = entry.get_expire_sec() + policy["stale_secs"]
+        backend = FastAPICache.get_backend()
+        try:
+            if policy["compression"] is not None and hasattr(backend, "codec"):
+                await backend.set(cache_key, entry.encode(), expire, compress=policy["compression"])
+            else:
+                await backend.set(cache_key, entry.encode(), expire)
+            await cls._add_tags(cache_key, resource, vcenter_name, expire)
+        except Exception as e:
+            Logging.warning(f"キャッシュを登録できませんでした({cache_key}): {e}")
+
+    @classmethod
+    def _create_response(cls, entry: CacheEntry, status: str, max_age: int, not_modified: bool = False) -> Response:
+        headers = {"Cache-Control": f"max-age={max_age}", cls.CACHE_STATUS_HEADER: status}
+        if not_modified:
+            # 304のレスポンスには、ボディとContent-Typeを含めない
+            return Response(status_code=304, headers={"etag": entry.headers.get("etag", ""), **headers})
+        return Response(content=entry.body, headers={**entry.headers, **headers})
+
+    @classmethod
+    async def _start_refresh(
+        cls,
+        cache_key: str,
+        func: Callable,
+        args,
+        kwargs,
+        policy: dict,
+        resource: str,
+        vcenter_name: str,
+    ) -> None:
+        if cache_key in cls._refresh_tasks:
+            return
+        lock_token = await cls._acquire_refresh_lock(cache_key)
+        if lock_token is None:
+            return
+        task = asyncio.get_running_loop().create_task(
+            cls._refresh(cache_key, func, args, kwargs, policy, resource, vcenter_name, lock_token)
+        )
+        cls._refresh_tasks[cache_key] = task
+
+    @classmethod
+    async def _refresh(
+        cls,
+        cache_key: str,
+        func: Callable,
+        args,
+        kwargs,
+        policy: dict,
+        resource: str,
+        vcenter_name: str,
+        lock_token: str,
+    ) -> None:
+        try:
+            _, entry = await cls._compute(func, args, kwargs, policy["expire_secs"])
+            if entry is not None:
+                await cls._set_entry(cache_key, entry, policy, resource, vcenter_name)
+        except Exception as e:
+            # 作成し直せない場合は、stale_secsの期間が終わるまで古いレスポンスを返し続ける
+            Logging.warning(f"キャッシュをバックグラウンドで作成し直せませんでした({cache_key}): {e}")
+        finally:
+            cls._refresh_tasks.pop(cache_key, None)
+            await cls._release_refresh_lock(cache_key, lock_token)
+
+    @classmethod
+    async def _acquire_refresh_lock(cls, cache_key: str) -> Optional[str]:
+        """
+        他のワーカープロセスが作成し直している最中でなければ、ロックを取得します
+
+        Returns:
+            Optional[str]: ロックを取得した場合はロックの解放に利用するトークン、取得できなかった場合はNone
+        """
+        token = str(uuid.uuid4())
+        redis = getattr(FastAPICache.get_backend(), "redis", None)
+        if redis is None:
+            return token
+        try:
+            if await redis.set(f"{cls.REFRESH_LOCK_PREFIX}{cache_key}", token, nx=True, ex=cls.REFRESH_LOCK_EXPIRE_SEC):
+                return token
+            return None
+        except Exception as e:
+            Logging.warning(f"キャッシュを作成し直すためのロックを取得できませんでした({cache_key}): {e}")
+            return None
+
+    @classmethod
+    async def _release_refresh_lock(cls, cache_key: str, token: str) -> None:
+        """
+        取得したロックを解放します
+
+        作成し直す処理がロックの有効期限を過ぎた場合、他のワーカープロセスが取得し直したロックは解放しません。
+        """
+        redis = getattr(FastAPICache.get_backend(), "redis", None)
+        if redis is None:
+            return
+        try:
+            await redis.register_script(cls.COMPARE_AND_DELETE_SCRIPT)(
+                keys=[f"{cls.REFRESH_LOCK_PREFIX}{cache_key}"], args=[token]
+            )
+        except Exception as e:
+            Logging.warning(f"キャッシュを作成し直すためのロックを解放できませんでした({cache_key}): {e}")
@@ -0,0 +1,193 @@
+import asyncio
+import json
+import os
+import uuid
+from typing import Optional
+
+import setuptools
+from fastapi_cache.backends.redis import RedisBackend
+from fastapi_cache.types import Backend
+from redis import asyncio as aioredis
+from redis.exceptions import RedisError
+from vcenter_lookup_bridge.cache.compressing_codec import CompressingCodec
+from vcenter_lookup_bridge.cache.lru_cache import LruCache
+from vcenter_lookup_bridge.utils.logging import Logging
+
+
+class TieredBackend(Backend):
+    """ワーカープロセス内のLRUキャッシュ(1次)とRedis(2次)の2層で、レスポンスをキャッシュするバックエンド
+
+    1次キャッシュにあるレスポンスは、Redisに問い合わせずに返します。
+    キャッシュの登録・クリア時は、Redisのpub/subで他のワーカープロセスに通知し、1次キャッシュの該当エントリを破棄させます。
+    通知を受け取れない間に古いレスポンスを返し続けないよう、1次キャッシュの有効期間は短く制限し、
+    通知の購読が切れた場合は1次キャッシュを全て破棄します。
+    Redisには、一定以上の大きさのレスポンスを圧縮して保存し、1次キャッシュには展開したレスポンスを保持します。
+
+    Attributes:
+        INVALIDATION_CHANNEL (str): 1次キャッシュの破棄を通知するチャンネル
+    """
+
+    # Const
+    VLB_CACHE_LOCAL_ENABLED_DEFAULT = "True"
+    VLB_CACHE_LOCAL_MAX_ENTRIES_DEFAULT = 1000
+    VLB_CACHE_LOCAL_MAX_BYTES_DEFAULT = 64 * 1024 * 1024
+    VLB_CACHE_LOCAL_TTL_SEC_DEFAULT = 30
+    INVALIDATION_CHANNEL = "vlb_cache_invalidation"
+    LISTENER_RETRY_INTERVAL_SEC = 5
+
+    def __init__(self, redis: aioredis.Redis):
+        self.redis = redis
+        self.redis_backend = RedisBackend(redis)
+        self.local: Optional[LruCache] = None
+        if self.is_local_enabled():
+            self.local = LruCache(
+                max_entries=int(
+                    os.getenv("VLB_CACHE_LOCAL_MAX_ENTRIES", TieredBackend.VLB_CACHE_LOCAL_MAX_ENTRIES_DEFAULT)
+                ),
+                max_bytes=int(os.getenv("VLB_CACHE_LOCAL_MAX_BYTES", TieredBackend.VLB_CACHE_LOCAL_MAX_BYTES_DEFAULT)),
+            )
+        self.codec = CompressingCodec()
+        self.local_ttl = int(os.getenv("VLB_CACHE_LOCAL_TTL_SEC", TieredBackend.VLB_CACHE_LOCAL_TTL_SEC_DEFAULT))
+        # 自身が送信した通知を区別するための識別子
+        self.origin = uuid.uuid4().hex
+        self._listener_task: Optional[asyncio.Task] = None
+
+    @classmethod
+    def is_local_enabled(cls) -> bool:
+        return bool(
+            setuptools.distutils.util.strtobool(
+                os.getenv("VLB_CACHE_LOCAL_ENABLED", cls.VLB_CACHE_LOCAL_ENABLED_DEFAULT)
+            )
+        )
+
+    async def get_with_ttl(self, key: str) -> tuple[int, Optional[bytes]]:
+        if self.local is not None:
+            ttl, value = self.local.get_with_ttl(key)
+            if value is not None:
+                return ttl, value
+
+        ttl, value = await self.redis_backend.get_with_ttl(key)
+        if value is not None:
+            value = self.codec.decode(value)
+            self._set_local(key, value, ttl)
+        return ttl, value
+
+    async def get(self, key: str) -> Optional[bytes]:
+        _, value = await self.get_with_ttl(key)
+        return value
+
+    async def set(self, key: str, value: bytes, expire: Optional[int] = None, compress: Optional[bool] = None) -> None:
+        """
+        レスポンスをRedisと1次キャッシュに登録します
+
+        Args:
+            compress (Optional[bool]): Redisに保存する際に圧縮するかどうか。省略時はVLB_CACHE_COMPRESSION_ENABLEDに従う
+        """
+        await self.redis_backend.set(key, self.codec.encode(value, enabled=compress), expire)
+        self._set_local(key, value, expire)
+        # 他のワーカープロセスが保持している、更新前のレスポンスを破棄させる
+        await self.publish_invalidation(keys=[key])
+
+    async def clear(self, namespace: Optional[str] = None, key: Optional[str] = None) -> int:
+        count = await self.redis_backend.clear(namespace, key)
+        if namespace:
+            self._clear_local(prefix=namespace)
+            await self.publish_invalidation(prefix=namespace)
+        elif key:
+            self._clear_local(keys=[key])
+            await self.publish_invalidation(keys=[key])
+        return count
+
+    async def delete_keys(self, keys: list[str]) -> int:
+        """複数のキーのレスポンスを破棄し、他のワーカープロセスにはまとめて通知します"""
+
+        count = await self.redis.delete(*keys) if keys else 0
+        self._clear_local(keys=keys)
+        await self.publish_invalidation(keys=keys)
+        return count
+
+    def get_stats(self) -> dict:
+        """1次キャッシュの件数・サイズ・ヒット率などと、Redisに保存したレスポンスの圧縮率などを返します"""
+
+        return {
+            "local": self.local.get_stats() if self.local is not None else {},
+            "compression": self.codec.get_stats(),
+        }
+
+    async def publish_invalidation(self, keys: Optional[list[str]] = None, prefix: Optional[str] = None) -> None:
+        if self.local is None:
+            return
+        message = json.dumps({"origin": self.origin, "keys": keys or [], "prefix": prefix})
+        try:
+            await self.redis.publish(TieredBackend.INVALIDATION_CHANNEL, message)
+        except RedisError as e:
+            Logging.warning(f"キャッシュの破棄を他のワーカープロセスに通知できませんでした: {e}")
+
+    def start_invalidation_listener(self) -> None:
+        """他のワーカープロセスからの、1次キャッシュの破棄の通知の購読を開始します"""
+
+        if self.local is None or self._listener_task is not None:
+            return
+        self._listener_task = asyncio.get_running_loop().create_task(self._listen_invalidation())
+
+    async def stop_invalidation_listener(self) -> None:
+        if self._listener_task is None:
+            return
+        self._listener_task.cancel()
+        try:
+            await self._listener_task
+        except asyncio.CancelledError:
+            pass
+        self._listener_task = None
+
+    async def _listen_invalidation(self) -> None:
+        while True:
+            pubsub = self.redis.pubsub()
+            try:
+                await pubsub.subscribe(TieredBackend.INVALIDATION_CHANNEL)
+                async for message in pubsub.listen():
+                    if message["type"] == "message":
+                        self.apply_invalidation(message["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                Logging.warning(f"キャッシュの破棄の通知を購読できないため、1次キャッシュを破棄して再接続します: {e}")
+                # 購読できない間の通知を取りこぼしているため、保持しているレスポンスを全て破棄
+                self._clear_local()
+                await asyncio.sleep(TieredBackend.LISTENER_RETRY_INTERVAL_SEC)
+            finally:
+                try:
+                    await pubsub.reset()
+                except Exception:
+                    pass
+
+    def apply_invalidation(self, data: bytes | str) -> None:
+        """他のワーカープロセスからの通知に従って、1次キャッシュのエントリを破棄します"""
+
+        try:
+            message = json.loads(data)
+        except ValueError:
+            Logging.warning(f"不正なキャッシュの破棄の通知を無視しました: {data}")
+            return
+        if message.get("origin") == self.origin:
+            return
+        if message.get("prefix"):
+            self._clear_local(prefix=message["prefix"])
+        if message.get("keys"):
+            self._clear_local(keys=message["keys"])
+
+    def _set_local(self, key: str, value: bytes, expire: Optional[int]) -> None:
+        if self.local is None:
+            return
+        # 有効期限のないエントリ(ttl: -1)も、1次キャッシュでは短い有効期間で保持する
+        ttl = self.local_ttl if expire is None or expire < 0 else min(expire, self.local_ttl)
+        self.local.set(key, value, ttl)
+
+    def _clear_local(self, keys: Optional[list[str]] = None, prefix: Optional[str] = None) -> None:
+        if self.local is None:
+            return
+        if keys is not None:
+            for key in keys:
+                self.local.delete(key)
+        else:
+            self.local.clear(prefix=prefix)
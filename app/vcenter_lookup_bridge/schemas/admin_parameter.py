@@ -1,6 +1,33 @@
+from typing import Literal
+
+from pydantic import BaseModel, Field
 from vcenter_lookup_bridge.schemas.common import ApiResponse
 
 
+class CacheFlushSchema(BaseModel):
+    """キャッシュのクリアのクエリパラメータのスキーマ"""
+
+    resource: (
+        Literal[
+            "vms", "vm_snapshots", "vm_folders", "hosts", "clusters", "datastores", "portgroups", "events", "alarms"
+        ]
+        | None
+    ) = Field(
+        description="クリアするリソースの種別を指定します。(指定しない場合は全てのリソースをクリアします。)",
+        example="vms",
+        default=None,
+    )
+    vcenter: str | None = Field(
+        description=(
+            "クリアするvCenterの名前を指定します。(指定しない場合は全てのvCenterをクリアします。) "
+            "vCenterを指定しないリクエストのキャッシュは、いずれのvCenterを指定した場合もクリアします。"
+        ),
+        example="vcenter01",
+        default=None,
+    )
+    model_config = {"extra": "forbid"}
+
+
 class AdminResponseSchema(ApiResponse):
     """ポートグループ一覧のレスポンススキーマ"""
 
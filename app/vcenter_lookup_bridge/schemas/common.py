@@ -44,6 +44,11 @@ class ApiResponse(BaseModel, Generic[T]):
         default=None,
         example={"vcenter01": "alive", "vcenter02": "dead"},
     )
+    staleVcenters: Optional[dict] = Field(
+        description="vCenterに接続できないため、最後に取得に成功した結果を返したvCenterと、その結果の取得時刻",
+        default=None,
+        example={"vcenter02": "2025-07-24T09:55:00.000000+00:00"},
+    )
     timestamp: str = Field(
         description="レスポンス生成時刻",
         example="2025-07-24T10:00:00.000000+09:00",
@@ -63,6 +68,7 @@ class ApiResponse(BaseModel, Generic[T]):
         pagination: Optional[PaginationInfo] = None,
         vcenterWsSessions: Optional[dict] = None,
         requestId: Optional[str] = None,
+        staleVcenters: Optional[dict] = None,
     ):
         return cls(
             results=results,
@@ -70,6 +76,119 @@ class ApiResponse(BaseModel, Generic[T]):
             message=message,
             pagination=pagination,
             vcenterWsSessions=vcenterWsSessions,
+            staleVcenters=staleVcenters,
+            timestamp=datetime.now(UTC).isoformat(),
+            requestId=requestId,
+        )
+
+
+class StreamBatchResponse(BaseModel, Generic[T]):
+    """ストリーミングレスポンスで返す、vCenterごとの取得結果"""
+
+    type: str = Field(
+        description="行の種別 (batch|summary)",
+        default="batch",
+        example="batch",
+    )
+    vcenter: str = Field(
+        description="取得元のvCenter名",
+        example="vcenter01",
+    )
+    results: Optional[T] = Field(
+        description="実際のデータ",
+        default=None,
+    )
+    success: bool = Field(
+        description="処理成功フラグ (true|false)",
+        example=True,
+    )
+    message: Optional[str] = Field(
+        description="メッセージ",
+        default=None,
+        example="vCenter(vcenter01)から10件の仮想マシンを取得しました。",
+    )
+    retrievedAt: Optional[str] = Field(
+        description="vCenterに接続できないため、最後に取得に成功した結果を返した場合の、その結果の取得時刻",
+        default=None,
+        example="2025-07-24T09:55:00.000000+00:00",
+    )
+    timestamp: str = Field(
+        description="レスポンス生成時刻",
+        example="2025-07-24T10:00:00.000000+09:00",
+    )
+    requestId: Optional[str] = Field(
+        description="リクエストID",
+        default=None,
+        example="9dc4cec3-5fae-4402-a47f-04499cfefad0",
+    )
+
+    @classmethod
+    def create(
+        cls,
+        vcenter: str,
+        results: Optional[T] = None,
+        success: bool = True,
+        message: Optional[str] = None,
+        requestId: Optional[str] = None,
+        retrievedAt: Optional[str] = None,
+    ):
+        return cls(
+            vcenter=vcenter,
+            results=results,
+            success=success,
+            message=message,
+            retrievedAt=retrievedAt,
+            timestamp=datetime.now(UTC).isoformat(),
+            requestId=requestId,
+        )
+
+
+class StreamSummaryResponse(BaseModel):
+    """ストリーミングレスポンスの最終行で返す、取得結果の集計"""
+
+    type: str = Field(
+        description="行の種別 (batch|summary)",
+        default="summary",
+        example="summary",
+    )
+    totalCount: int = Field(description="全vCenterから取得した総件数")
+    failedVcenters: list[str] = Field(
+        description="取得に失敗したvCenter名の一覧",
+        default=[],
+        example=["vcenter02"],
+    )
+    success: bool = Field(
+        description="全vCenterからの取得に成功したかどうか (true|false)",
+        example=True,
+    )
+    message: Optional[str] = Field(
+        description="メッセージ",
+        default=None,
+        example="2件のvCenterから100件の仮想マシンを取得しました。",
+    )
+    timestamp: str = Field(
+        description="レスポンス生成時刻",
+        example="2025-07-24T10:00:00.000000+09:00",
+    )
+    requestId: Optional[str] = Field(
+        description="リクエストID",
+        default=None,
+        example="9dc4cec3-5fae-4402-a47f-04499cfefad0",
+    )
+
+    @classmethod
+    def create(
+        cls,
+        totalCount: int,
+        failedVcenters: list[str],
+        message: Optional[str] = None,
+        requestId: Optional[str] = None,
+    ):
+        return cls(
+            totalCount=totalCount,
+            failedVcenters=failedVcenters,
+            success=len(failedVcenters) == 0,
+            message=message,
             timestamp=datetime.now(UTC).isoformat(),
             requestId=requestId,
         )
@@ -19,3 +19,41 @@ class HealthcheckResponseSchema(ApiResponse[HealthcheckSchema]):
     """ヘルスチェックのレスポンススキーマ"""
 
     pass
+
+
+class LivenessSchema(BaseModel):
+    """ライブネスチェックのスキーマ"""
+
+    status: str = Field(
+        description="ワーカープロセスが応答できる状態であることを示します。(ok)",
+        example="ok",
+    )
+    model_config = {"extra": "forbid"}
+
+
+class LivenessResponseSchema(ApiResponse[LivenessSchema]):
+    """ライブネスチェックのレスポンススキーマ"""
+
+    pass
+
+
+class ReadinessSchema(BaseModel):
+    """レディネスチェックのスキーマ"""
+
+    status: str = Field(
+        description="リクエストを受け付けられる状態かどうかを示します。(ok|ng)",
+        example="ok",
+    )
+    vcenters: dict = Field(
+        description="バックグラウンドの確認で記録した、vCenterごとの接続状態(alive|dead|not_connected)と応答時間(ミリ秒)",
+        example={
+            "vcenter01": {"status": "alive", "latencyMs": 12.3, "checkedAt": "2025-07-24T10:00:00.000000+00:00"},
+        },
+    )
+    model_config = {"extra": "forbid"}
+
+
+class ReadinessResponseSchema(ApiResponse[ReadinessSchema]):
+    """レディネスチェックのレスポンススキーマ"""
+
+    pass
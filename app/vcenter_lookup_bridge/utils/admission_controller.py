@@ -0,0 +1,182 @@
+import asyncio
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import Optional
+
+import setuptools
+from fastapi.responses import JSONResponse
+from starlette.requests import Request
+from vcenter_lookup_bridge.broker.client import BrokerClient
+from vcenter_lookup_bridge.utils.logging import Logging
+from vcenter_lookup_bridge.vmware.work_scheduler import WorkScheduler
+
+
+class AdmissionController(object):
+    """ワーカープロセスの負荷に応じて、リクエストの受け付け可否を判断するクラス
+
+    以下のいずれかが閾値を超えた場合、gunicornのタイムアウトまで待たせずに、早期にリクエストを拒否します。
+      - ワーカープロセス内で処理中のリクエスト数(429)
+      - スケジューラに登録されたvCenterへのリクエスト処理の件数(503)
+        ブローカーを利用する場合は、ブローカーから定期的に取得したスケジューラの件数で判断します
+      - イベントループの遅延(503)
+    直近でキャッシュに格納されたURLへのリクエストは、vCenterへのリクエストを伴わないため、緩和した閾値で判断します。
+    """
+
+    # Const
+    VLB_ADMISSION_CONTROL_ENABLED_DEFAULT = "True"
+    VLB_ADMISSION_MAX_INFLIGHT_REQUESTS_DEFAULT = 100
+    VLB_ADMISSION_MAX_OUTSTANDING_WORK_DEFAULT = 200
+    VLB_ADMISSION_MAX_EVENT_LOOP_LAG_MS_DEFAULT = 500
+    VLB_ADMISSION_CACHED_THRESHOLD_FACTOR_DEFAULT = 2
+    VLB_ADMISSION_RETRY_AFTER_SECS_DEFAULT = 5
+    EVENT_LOOP_MONITOR_INTERVAL_SEC = 0.5
+    CACHED_URLS_MAX_SIZE = 10000
+    CACHE_STATUS_HEADER = "X-FastAPI-Cache"
+    CACHE_CONTROL_MAX_AGE_PATTERN = re.compile(r"max-age=(\d+)")
+    # 負荷に関わらず受け付けるパス(ヘルスチェック、管理用API、APIドキュメント)
+    EXEMPT_PATH_SEGMENTS = {"healthcheck", "admins", "docs", "redoc", "openapi.json"}
+
+    _inflight_requests = 0
+    _event_loop_lag_ms = 0.0
+    _event_loop_monitor: Optional[asyncio.Task] = None
+    _cached_urls: OrderedDict[str, float] = OrderedDict()
+
+    @classmethod
+    def is_enabled(cls) -> bool:
+        return bool(
+            setuptools.distutils.util.strtobool(
+                os.getenv("VLB_ADMISSION_CONTROL_ENABLED", cls.VLB_ADMISSION_CONTROL_ENABLED_DEFAULT)
+            )
+        )
+
+    @classmethod
+    async def dispatch(cls, request: Request, call_next):
+        """HTTPミドルウェアから呼び出し、閾値を超えている場合はリクエストを拒否します"""
+
+        if not cls.is_enabled() or cls._is_exempt(request):
+            return await call_next(request)
+
+        rejection = cls._check_admission(request)
+        if rejection is not None:
+            status_code, reason = rejection
+            Logging.warning(f"負荷が高いため、リクエストを拒否しました({request.url.path}): {reason}")
+            return JSONResponse(
+                status_code=status_code,
+                content={"detail": f"サーバの負荷が高いため、リクエストを受け付けられませんでした。{reason}"},
+                headers={"Retry-After": str(cls._get_retry_after_secs())},
+            )
+
+        cls._inflight_requests += 1
+        try:
+            response = await call_next(request)
+        finally:
+            cls._inflight_requests -= 1
+        cls._remember_cached_url(request, response)
+        return response
+
+    @classmethod
+    def get_stats(cls) -> dict:
+        """受け付け可否の判断に利用する、ワーカープロセスの負荷情報を返します"""
+
+        return {
+            "inflightRequests": cls._inflight_requests,
+            "outstandingWork": cls._get_outstanding_work(),
+            "eventLoopLagMs": round(cls._event_loop_lag_ms, 1),
+        }
+
+    @classmethod
+    def start_event_loop_monitor(cls) -> None:
+        """イベントループの遅延を計測するタスクを開始します"""
+
+        if cls._event_loop_monitor is None:
+            cls._event_loop_monitor = asyncio.create_task(cls._monitor_event_loop_lag())
+
+    @classmethod
+    def stop_event_loop_monitor(cls) -> None:
+        if cls._event_loop_monitor is not None:
+            cls._event_loop_monitor.cancel()
+            cls._event_loop_monitor = None
+
+    @classmethod
+    async def _monitor_event_loop_lag(cls) -> None:
+        # sleepから復帰するまでの超過時間を、イベントループの遅延とみなす
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(cls.EVENT_LOOP_MONITOR_INTERVAL_SEC)
+            lag_ms = max(0.0, (time.monotonic() - started - cls.EVENT_LOOP_MONITOR_INTERVAL_SEC) * 1000)
+            # 一時的な遅延で過剰に拒否しないよう、平滑化した値を利用
+            cls._event_loop_lag_ms = cls._event_loop_lag_ms * 0.5 + lag_ms * 0.5
+
+    @classmethod
+    def _check_admission(cls, request: Request) -> Optional[tuple[int, str]]:
+        factor = 1
+        if cls._is_cached_url(request):
+            factor = int(
+                os.getenv(
+                    "VLB_ADMISSION_CACHED_THRESHOLD_FACTOR",
+                    cls.VLB_ADMISSION_CACHED_THRESHOLD_FACTOR_DEFAULT,
+                )
+            )
+
+        max_event_loop_lag_ms = int(
+            os.getenv("VLB_ADMISSION_MAX_EVENT_LOOP_LAG_MS", cls.VLB_ADMISSION_MAX_EVENT_LOOP_LAG_MS_DEFAULT)
+        )
+        if cls._event_loop_lag_ms > max_event_loop_lag_ms * factor:
+            return 503, f"(イベントループの遅延: {int(cls._event_loop_lag_ms)}ms)"
+
+        max_outstanding_work = int(
+            os.getenv("VLB_ADMISSION_MAX_OUTSTANDING_WORK", cls.VLB_ADMISSION_MAX_OUTSTANDING_WORK_DEFAULT)
+        )
+        outstanding_work = cls._get_outstanding_work()
+        # キャッシュから応答できるリクエストは、vCenterへのリクエスト処理の滞留に影響されない
+        if factor == 1 and outstanding_work > max_outstanding_work:
+            return 503, f"(vCenterへのリクエスト処理の滞留: {outstanding_work}件)"
+
+        max_inflight_requests = int(
+            os.getenv("VLB_ADMISSION_MAX_INFLIGHT_REQUESTS", cls.VLB_ADMISSION_MAX_INFLIGHT_REQUESTS_DEFAULT)
+        )
+        if cls._inflight_requests >= max_inflight_requests * factor:
+            return 429, f"(処理中のリクエスト: {cls._inflight_requests}件)"
+        return None
+
+    @classmethod
+    def _get_outstanding_work(cls) -> int:
+        broker_stats = BrokerClient.get_stats() if BrokerClient.is_enabled() else None
+        stats = broker_stats["scheduler"] if broker_stats is not None else WorkScheduler.get_stats()
+        return sum(stats["queued"].values()) + sum(stats["running"].values())
+
+    @classmethod
+    def _get_retry_after_secs(cls) -> int:
+        return int(os.getenv("VLB_ADMISSION_RETRY_AFTER_SECS", cls.VLB_ADMISSION_RETRY_AFTER_SECS_DEFAULT))
+
+    @classmethod
+    def _is_exempt(cls, request: Request) -> bool:
+        return any(segment in cls.EXEMPT_PATH_SEGMENTS for segment in request.url.path.split("/"))
+
+    @classmethod
+    def _get_cache_lookup_key(cls, request: Request) -> str:
+        return f"{request.url.path}?{request.url.query}"
+
+    @classmethod
+    def _is_cached_url(cls, request: Request) -> bool:
+        if request.method != "GET" or request.headers.get("Cache-Control") in ("no-cache", "no-store"):
+            return False
+        expires_at = cls._cached_urls.get(cls._get_cache_lookup_key(request))
+        return expires_at is not None and expires_at > time.monotonic()
+
+    @classmethod
+    def _remember_cached_url(cls, request: Request, response) -> None:
+        # fastapi-cacheが応答したURLを、Cache-Controlのmax-ageが切れるまで記録
+        if request.method != "GET" or cls.CACHE_STATUS_HEADER not in response.headers:
+            return
+        match = cls.CACHE_CONTROL_MAX_AGE_PATTERN.search(response.headers.get("Cache-Control", ""))
+        if match is None:
+            return
+
+        key = cls._get_cache_lookup_key(request)
+        cls._cached_urls[key] = time.monotonic() + int(match.group(1))
+        cls._cached_urls.move_to_end(key)
+        while len(cls._cached_urls) > cls.CACHED_URLS_MAX_SIZE:
+            cls._cached_urls.popitem(last=False)
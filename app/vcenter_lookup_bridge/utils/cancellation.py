@@ -0,0 +1,59 @@
+import asyncio
+import threading
+from typing import Optional
+
+from starlette.requests import Request
+from vcenter_lookup_bridge.utils.logging import Logging
+
+
+class OperationCancelledError(Exception):
+    """クライアントの切断などにより、vCenterへのリクエスト処理がキャンセルされたことを示す例外"""
+
+    pass
+
+
+class CancellationToken(object):
+    """vCenterへのリクエスト処理を協調的にキャンセルするためのトークン
+
+    イベントループ側でcancel()を呼び出し、スレッド側の処理はフォルダやページの区切りなど、
+    安全に中断できる箇所でraise_if_cancelled()を呼び出して処理を中断します。
+    """
+
+    # Const
+    CLIENT_DISCONNECT_POLL_INTERVAL_SEC = 0.5
+
+    def __init__(self):
+        self._event = threading.Event()
+        self.reason: Optional[str] = None
+
+    def cancel(self, reason: Optional[str] = None) -> None:
+        """処理のキャンセルを要求します"""
+
+        self.reason = reason
+        self._event.set()
+
+    def is_cancelled(self) -> bool:
+        """キャンセルが要求されているかどうかを返します"""
+
+        return self._event.is_set()
+
+    def raise_if_cancelled(self) -> None:
+        """
+        キャンセルが要求されている場合、例外を送出します
+
+        Raises:
+            OperationCancelledError: キャンセルが要求されている場合
+        """
+        if self._event.is_set():
+            raise OperationCancelledError(self.reason or "処理がキャンセルされました。")
+
+    @classmethod
+    async def watch_client_disconnect(cls, request: Request, cancel_token: "CancellationToken") -> None:
+        """HTTPクライアントの切断を監視し、切断を検知した場合はトークンをキャンセルします"""
+
+        while not cancel_token.is_cancelled():
+            if await request.is_disconnected():
+                Logging.info(f"HTTPクライアントの切断を検知したため、処理をキャンセルします({request.url.path})")
+                cancel_token.cancel("HTTPクライアントが切断されました。")
+                return
+            await asyncio.sleep(cls.CLIENT_DISCONNECT_POLL_INTERVAL_SEC)
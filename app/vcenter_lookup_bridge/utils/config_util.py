@@ -1,4 +1,7 @@
+import pathlib
+
 import yaml
+from vcenter_lookup_bridge.utils.logging import Logging
 
 __version__ = "1.0"
 
@@ -9,3 +12,15 @@ class ConfigUtil(object):
     @classmethod
     def parse_config(cls, config_file):
         return yaml.safe_load(open(config_file, "r"))
+
+    @classmethod
+    def load_vcenter_configurations(cls, config_dir) -> dict:
+        """ディレクトリ配下のvCenterの設定ファイル(*.yml)を読み込み、設定の識別子をキーとした辞書を返します"""
+
+        configurations = {}
+        for vcenter_config in pathlib.Path(f"{config_dir}").iterdir():
+            if vcenter_config.suffix == ".yml":
+                config = cls.parse_config(f"{vcenter_config}")
+                Logging.info(f'vCenter Configuration Loaded: {config["name"]}')
+                configurations[config["name"]] = config
+        return configurations
@@ -0,0 +1,54 @@
+import importlib
+import json
+from typing import Any
+
+from pydantic import BaseModel
+
+
+class SerializeUtil(object):
+    """Redisやブローカーとの間で交換する取得結果を、JSONでシリアライズするヘルパークラス
+
+    取得結果に含まれるレスポンスのスキーマ(pydanticのモデル)は、クラス名とともに保存し、読み込み時に復元します。
+    復元するクラスはvcenter_lookup_bridge.schemas配下のモデルに限定し、任意のオブジェクトは復元しません。
+    タプルはリストとして復元します。
+    """
+
+    # Const
+    MODEL_KEY = "__vlb_model__"
+    MODEL_DATA_KEY = "data"
+    ALLOWED_MODEL_MODULE_PREFIX = "vcenter_lookup_bridge.schemas."
+
+    @classmethod
+    def dumps(cls, value: Any) -> bytes:
+        return json.dumps(value, default=cls._encode_model, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    @classmethod
+    def loads(cls, data: bytes) -> Any:
+        """
+        シリアライズした値を復元します
+
+        Raises:
+            ValueError: JSONとして不正な場合、または復元できないモデルが含まれる場合
+        """
+        return json.loads(data, object_hook=cls._decode_model)
+
+    @classmethod
+    def _encode_model(cls, value: Any) -> dict:
+        if not isinstance(value, BaseModel):
+            raise TypeError(f"JSONにシリアライズできない値です: {type(value).__name__}")
+        return {
+            cls.MODEL_KEY: f"{type(value).__module__}:{type(value).__qualname__}",
+            cls.MODEL_DATA_KEY: value.model_dump(mode="json"),
+        }
+
+    @classmethod
+    def _decode_model(cls, value: dict) -> Any:
+        if cls.MODEL_KEY not in value:
+            return value
+        module_name, _, class_name = value[cls.MODEL_KEY].partition(":")
+        if not module_name.startswith(cls.ALLOWED_MODEL_MODULE_PREFIX):
+            raise ValueError(f"復元できないモデルです: {value[cls.MODEL_KEY]}")
+        model = getattr(importlib.import_module(module_name), class_name, None)
+        if not isinstance(model, type) or not issubclass(model, BaseModel):
+            raise ValueError(f"復元できないモデルです: {value[cls.MODEL_KEY]}")
+        return model.model_validate(value[cls.MODEL_DATA_KEY])
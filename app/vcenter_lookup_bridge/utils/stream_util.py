@@ -0,0 +1,95 @@
+import asyncio
+from typing import AsyncIterator, Optional
+
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+from vcenter_lookup_bridge.schemas.common import StreamBatchResponse, StreamSummaryResponse
+from vcenter_lookup_bridge.utils.cancellation import CancellationToken
+from vcenter_lookup_bridge.utils.logging import Logging
+from vcenter_lookup_bridge.vmware.last_known_good import LastKnownGood
+
+
+class StreamUtil(object):
+    """vCenterごとの取得結果を、NDJSON形式でストリーミングするヘルパークラス"""
+
+    # Const
+    MEDIA_TYPE_NDJSON = "application/x-ndjson"
+
+    @classmethod
+    def create_ndjson_response(
+        cls,
+        request: Request,
+        batches: AsyncIterator[tuple[str, Optional[list], Optional[Exception]]],
+        object_name: str,
+        cancel_token: CancellationToken,
+        request_id: str = None,
+    ) -> StreamingResponse:
+        """
+        取得が完了したvCenterから順に1行ずつ結果を返す、ストリーミングレスポンスを作成します
+
+        各行はStreamBatchResponse、最終行はStreamSummaryResponseのJSONです。
+        """
+        return StreamingResponse(
+            cls._generate_ndjson_lines(
+                request=request,
+                batches=batches,
+                object_name=object_name,
+                cancel_token=cancel_token,
+                request_id=request_id,
+            ),
+            media_type=cls.MEDIA_TYPE_NDJSON,
+        )
+
+    @classmethod
+    async def _generate_ndjson_lines(
+        cls,
+        request: Request,
+        batches: AsyncIterator[tuple[str, Optional[list], Optional[Exception]]],
+        object_name: str,
+        cancel_token: CancellationToken,
+        request_id: str = None,
+    ) -> AsyncIterator[str]:
+        total_count = 0
+        succeeded_vcenters = []
+        failed_vcenters = []
+        watcher = asyncio.create_task(CancellationToken.watch_client_disconnect(request, cancel_token))
+        try:
+            async for vcenter_name, results, error in batches:
+                if error is None:
+                    Logging.info(f"{request_id} vCenter({vcenter_name})からの{object_name}情報取得に成功")
+                    total_count += len(results)
+                    succeeded_vcenters.append(vcenter_name)
+                    # Redisへの問い合わせでイベントループを停止させないよう、スレッドで実行
+                    stale_vcenters = await run_in_threadpool(LastKnownGood.get_stale_vcenters, request_id) or {}
+                    line = StreamBatchResponse.create(
+                        vcenter=vcenter_name,
+                        results=results,
+                        success=True,
+                        message=f"vCenter({vcenter_name})から{len(results)}件の{object_name}を取得しました。",
+                        requestId=request_id,
+                        retrievedAt=stale_vcenters.get(vcenter_name),
+                    )
+                else:
+                    Logging.error(f"{request_id} vCenter({vcenter_name})からの{object_name}情報取得に失敗: {error}")
+                    failed_vcenters.append(vcenter_name)
+                    line = StreamBatchResponse.create(
+                        vcenter=vcenter_name,
+                        success=False,
+                        message=f"vCenter({vcenter_name})からの{object_name}情報取得に失敗しました。",
+                        requestId=request_id,
+                    )
+                yield line.model_dump_json() + "\n"
+
+            summary = StreamSummaryResponse.create(
+                totalCount=total_count,
+                failedVcenters=failed_vcenters,
+                message=f"{len(succeeded_vcenters)}件のvCenterから{total_count}件の{object_name}を取得しました。",
+                requestId=request_id,
+            )
+            yield summary.model_dump_json() + "\n"
+        finally:
+            # クライアントの切断などでストリームが中断された場合も、実行中・待機中の処理を中断
+            watcher.cancel()
+            cancel_token.cancel("ストリーミングレスポンスが終了しました。")
+            await batches.aclose()
@@ -1,12 +1,16 @@
 import datetime
 import os
 from typing import List, Optional
-from concurrent.futures import ThreadPoolExecutor
 from fastapi import HTTPException
 from pyVmomi import vim
 from vcenter_lookup_bridge.schemas.alarm_parameter import AlarmResponseSchema
+from vcenter_lookup_bridge.utils.cancellation import CancellationToken
 from vcenter_lookup_bridge.utils.logging import Logging
 from vcenter_lookup_bridge.vmware.helper import Helper
+from vcenter_lookup_bridge.vmware.last_known_good import LastKnownGood
+from vcenter_lookup_bridge.vmware.service_instance_pool import ServiceInstancePool
+from vcenter_lookup_bridge.vmware.vcenter_rate_limiter import VCenterRateLimiter
+from vcenter_lookup_bridge.vmware.work_scheduler import WorkScheduler
 
 
 class Alarm(object):
@@ -14,7 +18,6 @@ class Alarm(object):
 
     # Const
     VLB_MAX_RETRIEVE_VCENTER_OBJECTS_DEFAULT = 1000
-    VLB_MAX_VCENTER_WEB_SERVICE_WORKER_THREADS_DEFAULT = 10
     VLB_MAX_RETRIEVE_ALARMS_PER_VCENTER_DEFAULT = 2000
 
     @classmethod
@@ -36,22 +39,20 @@ class Alarm(object):
         offset=0,
         max_results=100,
         request_id: str = None,
+        priority: WorkScheduler.Priority = WorkScheduler.PRIORITY_BULK,
+        cancel_token: CancellationToken = None,
     ) -> tuple[list[AlarmResponseSchema], int]:
         """全vCenterからトリガー済みのアラーム一覧を取得"""
 
         all_alarms = []
         total_alarm_count = 0
-        max_vcenter_web_service_worker_threads = int(
-            os.getenv(
-                "VLB_MAX_VCENTER_WEB_SERVICE_WORKER_THREADS",
-                cls.VLB_MAX_VCENTER_WEB_SERVICE_WORKER_THREADS_DEFAULT,
-            )
-        )
 
         if vcenter_name:
             # vCenterを指定した場合、指定したvCenterからトリガー済みのアラーム一覧を取得
             try:
-                alarms = cls._get_alarms_from_vcenter(
+                alarms = WorkScheduler.submit(
+                    priority,
+                    cls._get_alarms_from_vcenter,
                     vcenter_name=vcenter_name,
                     service_instances=service_instances,
                     begin_time=begin_time,
@@ -64,7 +65,8 @@ class Alarm(object):
                     alarm_sources=alarm_sources,
                     acknowledged=acknowledged,
                     request_id=request_id,
-                )
+                    cancel_token=cancel_token,
+                ).result()
                 Logging.info(f"{request_id} vCenter({vcenter_name})からのトリガー済みアラーム情報取得に成功")
                 all_alarms.extend(alarms)
                 total_alarm_count = len(all_alarms)
@@ -75,49 +77,53 @@ class Alarm(object):
         else:
             # vCenterを指定しない場合、すべてのvCenterからトリガー済みのアラーム一覧を取得
             futures = {}
-            with ThreadPoolExecutor(max_workers=max_vcenter_web_service_worker_threads) as executor:
-                try:
-                    # 各vCenterからトリガー済みのアラーム一覧を取得するスレッドを作成
-                    for vcenter_name in configs.keys():
-                        futures[vcenter_name] = executor.submit(
-                            cls._get_alarms_from_vcenter,
-                            vcenter_name,
-                            service_instances,
-                            begin_time,
-                            end_time,
-                            days_ago_begin,
-                            days_ago_end,
-                            hours_ago_begin,
-                            hours_ago_end,
-                            statuses,
-                            alarm_sources,
-                            acknowledged,
-                            request_id,
-                        )
-
-                    # 各スレッドの実行結果を回収
-                    for vcenter_name in configs.keys():
-                        alarms = futures[vcenter_name].result()
-                        Logging.info(f"{request_id} vCenter({vcenter_name})からのトリガー済みアラーム情報取得に成功")
-                        all_alarms.extend(alarms)
-
-                    # 全アラーム数を取得
-                    total_alarm_count = len(all_alarms)
-
-                    # オフセットと最大件数の調整
-                    all_alarms = all_alarms[offset:]
-                    if len(all_alarms) > max_results:
-                        all_alarms = all_alarms[:max_results]
-
-                except ValueError as e:
-                    raise HTTPException(status_code=422, detail=str(e))
-                except Exception as e:
-                    Logging.error(f"{request_id} vCenter({vcenter_name})からのトリガー済みアラーム情報取得に失敗: {e}")
+            try:
+                # 各vCenterからトリガー済みのアラーム一覧を取得する処理をスケジューラに登録
+                for vcenter_name in configs.keys():
+                    futures[vcenter_name] = WorkScheduler.submit(
+                        priority,
+                        cls._get_alarms_from_vcenter,
+                        vcenter_name,
+                        service_instances,
+                        begin_time,
+                        end_time,
+                        days_ago_begin,
+                        days_ago_end,
+                        hours_ago_begin,
+                        hours_ago_end,
+                        statuses,
+                        alarm_sources,
+                        acknowledged,
+                        request_id,
+                        cancel_token=cancel_token,
+                    )
+
+                # 各処理の実行結果を回収
+                for vcenter_name in configs.keys():
+                    alarms = futures[vcenter_name].result()
+                    Logging.info(f"{request_id} vCenter({vcenter_name})からのトリガー済みアラーム情報取得に成功")
+                    all_alarms.extend(alarms)
+
+                # 全アラーム数を取得
+                total_alarm_count = len(all_alarms)
+
+                # オフセットと最大件数の調整
+                all_alarms = all_alarms[offset:]
+                if len(all_alarms) > max_results:
+                    all_alarms = all_alarms[:max_results]
+
+            except ValueError as e:
+                raise HTTPException(status_code=422, detail=str(e))
+            except Exception as e:
+                Logging.error(f"{request_id} vCenter({vcenter_name})からのトリガー済みアラーム情報取得に失敗: {e}")
 
         return all_alarms, total_alarm_count
 
     @classmethod
     @Logging.func_logger
+    @LastKnownGood.fallback
+    @VCenterRateLimiter.limited
+    @ServiceInstancePool.pooled
     def _get_alarms_from_vcenter(
         cls,
         vcenter_name: str,
@@ -132,9 +138,13 @@ class Alarm(object):
         alarm_sources: List[str] = None,
         acknowledged: bool = None,
         request_id: str = None,
+        cancel_token: CancellationToken = None,
     ) -> list[AlarmResponseSchema]:
         """特定のvCenterからトリガー済みのアラーム一覧を取得"""
 
+        cancel_token = cancel_token or CancellationToken()
+        cancel_token.raise_if_cancelled()
+
         results = []
         max_retrieve_alarms = int(
             os.getenv(
@@ -148,7 +158,8 @@ class Alarm(object):
             raise HTTPException(status_code=404, detail=f"vCenter({vcenter_name}) not found")
 
         content = service_instances[vcenter_name].RetrieveContent()
-        datacenter = content.rootFolder.childEntity[0]
+        # アラームの発生元ごとに、所属するデータセンターを記録(同じ発生元の親フォルダを繰り返し参照しないため)
+        datacenter_names = {}
 
         # 全トリガー済みアラームをリストで取得
         root_folder = content.rootFolder
@@ -197,6 +208,7 @@ class Alarm(object):
                 end_time_obj = datetime.datetime.now().astimezone(datetime.timezone.utc)
 
         for alarm_state in triggered_alarms:
+            cancel_token.raise_if_cancelled()
             if isinstance(alarm_state, vim.AlarmState):
                 # ステータスの条件を指定した場合、マッチしないアラームをスキップ
                 if statuses:
@@ -213,14 +225,33 @@ class Alarm(object):
                             continue
                 alarm_time = alarm_state.time.astimezone(datetime.timezone.utc)
                 if alarm_time >= begin_time_obj and alarm_time < end_time_obj:
-                    alarm_info = cls._generate_alarm_info(datacenter, alarm_state, vcenter_name)
+                    alarm_info = cls._generate_alarm_info(
+                        cls._get_datacenter_name(alarm_state, datacenter_names), alarm_state, vcenter_name
+                    )
                     results.append(alarm_info)
 
         return results
 
     @classmethod
     @Logging.func_logger
-    def _generate_alarm_info(cls, datacenter, alarm_state: vim.AlarmState, vcenter_name: str) -> AlarmResponseSchema:
+    def _get_datacenter_name(cls, alarm_state: vim.AlarmState, datacenter_names: dict) -> Optional[str]:
+        """アラームの発生元が所属するデータセンター名を取得(データセンターに属さない場合はNone)"""
+
+        entity = getattr(alarm_state, "entity", None)
+        if entity is None:
+            return None
+        if isinstance(entity, vim.Datacenter):
+            return entity.name
+        if entity._moId not in datacenter_names:
+            datacenter = Helper.get_datacenter_of(entity)
+            datacenter_names[entity._moId] = datacenter.name if datacenter is not None else None
+        return datacenter_names[entity._moId]
+
+    @classmethod
+    @Logging.func_logger
+    def _generate_alarm_info(
+        cls, datacenter_name: Optional[str], alarm_state: vim.AlarmState, vcenter_name: str
+    ) -> AlarmResponseSchema:
         """アラーム情報を生成"""
 
         if hasattr(alarm_state, "entity") and alarm_state.entity:
@@ -230,7 +261,7 @@ class Alarm(object):
 
         ararm_info = {
             "vcenter": vcenter_name,
-            "datacenter": datacenter.name,
+            "datacenter": datacenter_name,
             "name": alarm_state.alarm.info.name,
             "description": alarm_state.alarm.info.description,
             "status": alarm_state.overallStatus,
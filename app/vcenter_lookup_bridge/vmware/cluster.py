@@ -1,11 +1,15 @@
-import os
 from typing import List, Optional
-from concurrent.futures import ThreadPoolExecutor
 from fastapi import HTTPException
 from pyVmomi import vim
 from vcenter_lookup_bridge.schemas.cluster_parameter import ClusterResponseSchema
+from vcenter_lookup_bridge.utils.cancellation import CancellationToken
 from vcenter_lookup_bridge.utils.logging import Logging
+from vcenter_lookup_bridge.vmware.fragment_cache import FragmentCache
 from vcenter_lookup_bridge.vmware.helper import Helper
+from vcenter_lookup_bridge.vmware.last_known_good import LastKnownGood
+from vcenter_lookup_bridge.vmware.service_instance_pool import ServiceInstancePool
+from vcenter_lookup_bridge.vmware.vcenter_rate_limiter import VCenterRateLimiter
+from vcenter_lookup_bridge.vmware.work_scheduler import WorkScheduler
 
 
 class Cluster(object):
@@ -13,7 +17,7 @@ class Cluster(object):
 
     # Const
     VLB_MAX_RETRIEVE_VCENTER_OBJECTS_DEFAULT = 1000
-    VLB_MAX_VCENTER_WEB_SERVICE_WORKER_THREADS_DEFAULT = 10
+    FRAGMENT_ALL = "all"
 
     @classmethod
     @Logging.func_logger
@@ -26,27 +30,26 @@ class Cluster(object):
         offset=0,
         max_results=100,
         request_id: str = None,
+        priority: WorkScheduler.Priority = WorkScheduler.PRIORITY_BULK,
+        cancel_token: CancellationToken = None,
     ) -> tuple[list[ClusterResponseSchema], int]:
         """全vCenterからクラスタ一覧を取得"""
 
         all_clusters = []
         total_cluster_count = 0
-        max_vcenter_web_service_worker_threads = int(
-            os.getenv(
-                "VLB_MAX_VCENTER_WEB_SERVICE_WORKER_THREADS",
-                cls.VLB_MAX_VCENTER_WEB_SERVICE_WORKER_THREADS_DEFAULT,
-            )
-        )
 
         if vcenter_name:
             # vCenterを指定した場合、指定したvCenterからクラスタ一覧を取得
             try:
-                clusters = cls._get_clusters_from_vcenter(
+                clusters = WorkScheduler.submit(
+                    priority,
+                    cls._get_clusters_from_vcenter,
                     vcenter_name=vcenter_name,
                     service_instances=service_instances,
                     cluster_names=cluster_names,
                     request_id=request_id,
-                )
+                    cancel_token=cancel_token,
+                ).result()
                 Logging.info(f"{request_id} vCenter({vcenter_name})からのクラスタ情報取得に成功")
                 all_clusters.extend(clusters)
                 total_cluster_count = len(all_clusters)
@@ -55,34 +58,35 @@ class Cluster(object):
         else:
             # vCenterを指定しない場合、すべてのvCenterからクラスタ一覧を取得
             futures = {}
-            with ThreadPoolExecutor(max_workers=max_vcenter_web_service_worker_threads) as executor:
-                try:
-                    # 各vCenterからクラスタ一覧を取得するスレッドを作成
-                    for vcenter_name in configs.keys():
-                        futures[vcenter_name] = executor.submit(
-                            cls._get_clusters_from_vcenter,
-                            vcenter_name,
-                            service_instances,
-                            cluster_names,
-                            request_id,
-                        )
-
-                    # 各スレッドの実行結果を回収
-                    for vcenter_name in configs.keys():
-                        clusters = futures[vcenter_name].result()
-                        Logging.info(f"{request_id} vCenter({vcenter_name})からのクラスタ情報取得に成功")
-                        all_clusters.extend(clusters)
-
-                    # 全クラスタ数を取得
-                    total_cluster_count = len(all_clusters)
-
-                    # オフセットと最大件数の調整
-                    all_clusters = all_clusters[offset:]
-                    if len(all_clusters) > max_results:
-                        all_clusters = all_clusters[:max_results]
-
-                except Exception as e:
-                    Logging.error(f"{request_id} vCenter({vcenter_name})からのクラスタ取得に失敗: {e}")
+            try:
+                # 各vCenterからクラスタ一覧を取得する処理をスケジューラに登録
+                for vcenter_name in configs.keys():
+                    futures[vcenter_name] = WorkScheduler.submit(
+                        priority,
+                        cls._get_clusters_from_vcenter,
+                        vcenter_name,
+                        service_instances,
+                        cluster_names,
+                        request_id,
+                        cancel_token=cancel_token,
+                    )
+
+                # 各処理の実行結果を回収
+                for vcenter_name in configs.keys():
+                    clusters = futures[vcenter_name].result()
+                    Logging.info(f"{request_id} vCenter({vcenter_name})からのクラスタ情報取得に成功")
+                    all_clusters.extend(clusters)
+
+                # 全クラスタ数を取得
+                total_cluster_count = len(all_clusters)
+
+                # オフセットと最大件数の調整
+                all_clusters = all_clusters[offset:]
+                if len(all_clusters) > max_results:
+                    all_clusters = all_clusters[:max_results]
+
+            except Exception as e:
+                Logging.error(f"{request_id} vCenter({vcenter_name})からのクラスタ取得に失敗: {e}")
 
         return all_clusters, total_cluster_count
 
@@ -94,8 +98,46 @@ class Cluster(object):
         service_instances: dict,
         cluster_names: List[str] = None,
         request_id: str = None,
+        cancel_token: CancellationToken = None,
     ) -> list[ClusterResponseSchema]:
-        """特定のvCenterからクラスタ一覧を取得"""
+        """特定のvCenterからクラスタ一覧を取得(vCenter単位でキャッシュした結果をクラスタ名で絞り込み)"""
+
+        clusters_by_fragment = FragmentCache.get_fragments(
+            resource="clusters",
+            vcenter_name=vcenter_name,
+            fragments=[cls.FRAGMENT_ALL],
+            compute=lambda fragments: {
+                cls.FRAGMENT_ALL: cls._get_all_clusters_from_vcenter(
+                    vcenter_name=vcenter_name,
+                    service_instances=service_instances,
+                    request_id=request_id,
+                    cancel_token=cancel_token,
+                )
+            },
+            request_id=request_id,
+        )
+        clusters = FragmentCache.assemble(clusters_by_fragment)
+        # クラスタ名が指定されている場合、指定されたクラスタ名のみ取得
+        if cluster_names is not None:
+            clusters = [cluster for cluster in clusters if cluster.name in cluster_names]
+        return clusters
+
+    @classmethod
+    @Logging.func_logger
+    @LastKnownGood.fallback
+    @VCenterRateLimiter.limited
+    @ServiceInstancePool.pooled
+    def _get_all_clusters_from_vcenter(
+        cls,
+        vcenter_name: str,
+        service_instances: dict,
+        request_id: str = None,
+        cancel_token: CancellationToken = None,
+    ) -> list[ClusterResponseSchema]:
+        """特定のvCenterから全てのクラスタを取得"""
+
+        cancel_token = cancel_token or CancellationToken()
+        cancel_token.raise_if_cancelled()
 
         results = []
 
@@ -104,16 +146,32 @@ class Cluster(object):
             raise HTTPException(status_code=404, detail=f"vCenter({vcenter_name}) not found")
 
         content = service_instances[vcenter_name].RetrieveContent()
-        datacenter = content.rootFolder.childEntity[0]
-        clusters = datacenter.hostFolder.childEntity
-        for cluster in clusters:
-            if isinstance(cluster, vim.ClusterComputeResource):
-                # クラスタ名が指定されている場合、指定されたクラスタ名のみ取得
-                if cluster_names is not None and cluster.name not in cluster_names:
-                    continue
-
-                cluster_info = cls._generate_cluster_info(cluster, vcenter_name)
-                results.append(cluster_info)
+
+        def get_clusters_from_datacenter(datacenter) -> list[ClusterResponseSchema]:
+            # ホストフォルダ配下のサブフォルダに配置されたクラスタも含めて取得
+            container = content.viewManager.CreateContainerView(
+                datacenter.hostFolder, [vim.ClusterComputeResource], True
+            )
+            try:
+                clusters = list(container.view)
+            finally:
+                container.Destroy()
+
+            cluster_infos = []
+            for cluster in clusters:
+                cancel_token.raise_if_cancelled()
+                if isinstance(cluster, vim.ClusterComputeResource):
+                    cluster_infos.append(cls._generate_cluster_info(cluster, vcenter_name))
+            return cluster_infos
+
+        # データセンターごとに並行して走査し、結果を結合
+        for cluster_infos in WorkScheduler.map_nested(
+            WorkScheduler.PRIORITY_BULK,
+            get_clusters_from_datacenter,
+            Helper.get_datacenters(content),
+            cancel_token=cancel_token,
+        ):
+            results.extend(cluster_infos)
         return results
 
     @classmethod
@@ -2,35 +2,142 @@ import atexit
 import os
 import socket
 import sys
+import threading
 import time
+from collections.abc import Mapping
+from datetime import UTC, datetime
+from typing import Optional
 import pyVmomi
 import setuptools
 import vcenter_lookup_bridge.vmware.instances as g
 from pyVim.connect import Disconnect, SmartConnect
+from redis.exceptions import RedisError
+from vcenter_lookup_bridge.broker.client import BrokerClient
 from vcenter_lookup_bridge.utils.constants import Constants as cs
 from vcenter_lookup_bridge.utils.logging import Logging
+from vcenter_lookup_bridge.vmware.vcenter_circuit_breaker import VCenterCircuitBreaker
+from vcenter_lookup_bridge.vmware.vcenter_deadline import VCenterDeadline
+from vcenter_lookup_bridge.vmware.vcenter_shared_session import VCenterSharedSessionManager
 from vcenter_lookup_bridge.vmware.vcenter_ws_session_managr import VCenterWSSessionManager
 
 
+class VCenterLoginError(Exception):
+    """認証情報の誤りなどにより、vCenterへのログインに失敗したことを示す例外"""
+
+    pass
+
+
 class Connector(object):
     """vCenter接続(Web Service API)を管理するクラス"""
 
     # Const
     VLB_VCENTER_CONNECT_TIMEOUT_SEC_DEFAULT = 20
-    VLB_VCENTER_CONNECT_RETRY_INTERVAL_SEC_DEFAULT = 20
-    VLB_VCENTER_CONNECT_RETRY_MAX_COUNT_DEFAULT = 2
     VLB_VCENTER_CONNECTION_POOL_TIMEOUT_SEC_DEFAULT = 3600
     VLB_VCENTER_HTTP_PROXY_HOST_DEFAULT = "proxy.example.com"
     VLB_VCENTER_HTTP_PROXY_PORT_DEFAULT = 8080
+    VLB_VCENTER_CIRCUIT_MONITOR_INTERVAL_SEC_DEFAULT = 5
+    VLB_VCENTER_CONNECT_MODE_DEFAULT = "eager"
+    VLB_VCENTER_IDLE_TIMEOUT_SEC_DEFAULT = 1800
+    # eager: 起動時に接続し、リクエストのたびに接続を確認
+    # lazy: 初回の利用時に接続
+    # idle_timeout: 初回の利用時に接続し、一定時間利用されない場合は切断
+    CONNECT_MODE_EAGER = "eager"
+    CONNECT_MODE_LAZY = "lazy"
+    CONNECT_MODE_IDLE_TIMEOUT = "idle_timeout"
+    CONNECT_MODES = (CONNECT_MODE_EAGER, CONNECT_MODE_LAZY, CONNECT_MODE_IDLE_TIMEOUT)
+
+    VLB_VCENTER_HEALTH_CHECK_INTERVAL_SEC_DEFAULT = 30
+    HEALTH_STATUS_ALIVE = "alive"
+    HEALTH_STATUS_DEAD = "dead"
+    HEALTH_STATUS_NOT_CONNECTED = "not_connected"
+
+    _connection_monitor: Optional[threading.Thread] = None
+    _connection_monitor_stop = threading.Event()
+    _owned_sessions: set = set()
+    _last_used: dict = {}
+    _on_demand_locks: dict = {}
+    _on_demand_locks_lock = threading.Lock()
+    _vcenter_health: dict = {}
+    _login_failures: set = set()
 
     @classmethod
     @Logging.func_logger
     def _connect_vcenter(cls, config, vcenter_name):
+        if VCenterSharedSessionManager.is_enabled():
+            try:
+                return cls._connect_vcenter_with_shared_session(config=config, vcenter_name=vcenter_name)
+            except RedisError as e:
+                Logging.warning(f"vCenter({vcenter_name})のセッションを共有できないため、単独でログインします: {e}")
+
+        si = cls._smart_connect(config=config, vcenter_name=vcenter_name)
+        cls._register_owned_session(vcenter_name, si)
+        return si
+
+    @classmethod
+    @Logging.func_logger
+    def _connect_vcenter_with_shared_session(cls, config, vcenter_name):
+        """
+        Redisで共有されているセッションに接続し、共有されていない場合はログインしてセッションを共有します
+
+        ログインは全ワーカープロセスで1つに直列化し、他のワーカープロセスはジッタを加えた間隔で共有を待ちます。
+        共有したセッションは他のワーカープロセスも利用するため、終了時にログアウトしません。
+        """
+        redis = VCenterWSSessionManager.initialize()
+        deadline = time.monotonic() + VCenterSharedSessionManager.get_login_lock_wait_sec()
+        while True:
+            session_id = VCenterSharedSessionManager.get_session_id(redis=redis, vcenter_name=vcenter_name)
+            if session_id:
+                si = cls._smart_connect(config=config, vcenter_name=vcenter_name, session_id=session_id)
+                if si.content.sessionManager.currentSession is not None:
+                    Logging.info(f"vCenter({vcenter_name})の共有セッションに接続しました。")
+                    cls._owned_sessions.discard(vcenter_name)
+                    return si
+                Logging.info(f"vCenter({vcenter_name})の共有セッションが無効になっているため、再ログインします。")
+                VCenterSharedSessionManager.invalidate_session_id(
+                    redis=redis, vcenter_name=vcenter_name, session_id=session_id
+                )
+
+            lock_token = VCenterSharedSessionManager.acquire_login_lock(redis=redis, vcenter_name=vcenter_name)
+            if lock_token:
+                try:
+                    si = cls._smart_connect(config=config, vcenter_name=vcenter_name)
+                    try:
+                        VCenterSharedSessionManager.publish_session_id(
+                            redis=redis, vcenter_name=vcenter_name, session_id=si._stub.GetSessionId()
+                        )
+                        cls._owned_sessions.discard(vcenter_name)
+                    except RedisError as e:
+                        # 共有できなかったセッションは、このワーカープロセスの終了時にログアウトする
+                        Logging.warning(f"vCenter({vcenter_name})のセッションを共有できませんでした: {e}")
+                        cls._register_owned_session(vcenter_name, si)
+                    return si
+                finally:
+                    VCenterSharedSessionManager.release_login_lock(
+                        redis=redis, vcenter_name=vcenter_name, token=lock_token
+                    )
+
+            if time.monotonic() >= deadline:
+                Logging.warning(f"vCenter({vcenter_name})のセッションの共有を待てないため、単独でログインします。")
+                si = cls._smart_connect(config=config, vcenter_name=vcenter_name)
+                cls._register_owned_session(vcenter_name, si)
+                return si
+
+            # 他のワーカープロセスがログインしているため、ジッタを加えた間隔で共有を待つ
+            time.sleep(VCenterSharedSessionManager.get_wait_jitter_sec())
+
+    @classmethod
+    @Logging.func_logger
+    def _smart_connect(cls, config, vcenter_name, session_id=None):
+        """vCenterにログインしてService Instanceを作成します。session_idを指定した場合は、既存のセッションに接続します"""
+
         try:
             vcenter_connect_timeout = int(
-                os.getenv(
-                    "VLB_VCENTER_CONNECT_TIMEOUT_SEC",
-                    cls.VLB_VCENTER_CONNECT_TIMEOUT_SEC_DEFAULT,
+                (config.get("call_timeouts") or {}).get(
+                    "connect",
+                    os.getenv(
+                        "VLB_VCENTER_CONNECT_TIMEOUT_SEC",
+                        cls.VLB_VCENTER_CONNECT_TIMEOUT_SEC_DEFAULT,
+                    ),
                 )
             )
             vcenter_connection_pool_timeout = int(
@@ -62,6 +169,7 @@ class Connector(object):
                     disableSslCertValidation=config["ignore_ssl_cert_verify"],
                     httpConnectionTimeout=vcenter_connect_timeout,
                     connectionPoolTimeout=vcenter_connection_pool_timeout,
+                    sessionId=session_id,
                 )
             else:
                 si = SmartConnect(
@@ -72,6 +180,7 @@ class Connector(object):
                     disableSslCertValidation=config["ignore_ssl_cert_verify"],
                     httpConnectionTimeout=vcenter_connect_timeout,
                     connectionPoolTimeout=vcenter_connection_pool_timeout,
+                    sessionId=session_id,
                 )
         except TimeoutError as e:
             Logging.error(
@@ -93,44 +202,88 @@ class Connector(object):
                 f"vCenter({vcenter_name} - {config['hostname']}:{config['port']})に接続時にログインに失敗しました(STATUS/{cs.EXIT_ERR_VCENTER_CONNECT_LOGIN_FAIL})"
             )
             Logging.error(e)
-            # 認証情報が間違っている場合は、永続的なエラーとして異常終了する
-            sys.exit(cs.EXIT_ERR_VCENTER_CONNECT_LOGIN_FAIL)
+            # バックグラウンドのスレッドからも呼び出されるため、異常終了するかどうかは呼び出し元で判断する
+            raise VCenterLoginError(e)
         except Exception as e:
             Logging.error(
                 f"vCenter({vcenter_name} - {config['hostname']}:{config['port']})に接続時に不明なエラーが発生しました(STATUS/{cs.EXIT_ERR_VCENTER_CONNECT_UNKNOWN_FAIL})"
             )
             raise e
 
-        atexit.register(cls._disconnect_vcenter, si)
+        # 接続後のリクエストにも、処理の種類に応じた制限時間を設定する
+        VCenterDeadline.apply_to_stub(si._stub, vcenter_name)
         return si
 
     @classmethod
     @Logging.func_logger
     def _disconnect_vcenter(cls, si):
-        Disconnect(si)
+        try:
+            Disconnect(si)
+        except Exception as e:
+            # アイドル時に切断済みのセッションなど、既にログアウトしている場合は無視する
+            Logging.warning(f"vCenterからのログアウトに失敗しました: {e}")
 
     @classmethod
-    @Logging.func_logger
-    def get_service_instances(cls):
-        configs = g.vcenter_configurations
-        vcenter_connect_retry_interval = int(
-            os.getenv(
-                "VLB_VCENTER_CONNECT_RETRY_INTERVAL_SEC",
-                cls.VLB_VCENTER_CONNECT_RETRY_INTERVAL_SEC_DEFAULT,
-            )
+    def _register_owned_session(cls, vcenter_name, si):
+        """このワーカープロセスのみが利用するセッションとして登録し、終了時にログアウトします"""
+
+        cls._owned_sessions.add(vcenter_name)
+        atexit.register(cls._disconnect_vcenter, si)
+
+    @classmethod
+    def get_connect_mode(cls, vcenter_name) -> str:
+        """vCenterの設定ファイルのconnect_modeを取得します。指定がない場合は環境変数の値を利用します"""
+
+        config = getattr(g, "vcenter_configurations", {}).get(vcenter_name) or {}
+        connect_mode = config.get("connect_mode") or os.getenv(
+            "VLB_VCENTER_CONNECT_MODE", cls.VLB_VCENTER_CONNECT_MODE_DEFAULT
         )
-        vcenter_connect_retry_max_count = int(
-            os.getenv(
-                "VLB_VCENTER_CONNECT_RETRY_MAX_COUNT",
-                cls.VLB_VCENTER_CONNECT_RETRY_MAX_COUNT_DEFAULT,
+        if connect_mode not in cls.CONNECT_MODES:
+            Logging.warning(
+                f"vCenter({vcenter_name})のconnect_mode({connect_mode})が不正なため、{cls.CONNECT_MODE_EAGER}として扱います。"
+            )
+            return cls.CONNECT_MODE_EAGER
+        return connect_mode
+
+    @classmethod
+    def get_idle_timeout_sec(cls, vcenter_name) -> int:
+        config = getattr(g, "vcenter_configurations", {}).get(vcenter_name) or {}
+        return int(
+            config.get(
+                "idle_timeout_sec",
+                os.getenv("VLB_VCENTER_IDLE_TIMEOUT_SEC", cls.VLB_VCENTER_IDLE_TIMEOUT_SEC_DEFAULT),
             )
         )
 
+    @classmethod
+    def is_on_demand(cls, vcenter_name) -> bool:
+        """初回の利用時に接続するvCenter(lazy/idle_timeout)かどうかを返します"""
+
+        return cls.get_connect_mode(vcenter_name) != cls.CONNECT_MODE_EAGER
+
+    @classmethod
+    def get_lazy_service_instances(cls) -> "LazyServiceInstances":
+        """
+        エンドポイントの依存関係として利用する、初回の参照時に接続を確認するService Instanceの辞書を返します
+
+        キャッシュから応答するリクエスト(304を含む)では参照されないため、vCenterへのリクエストを行いません。
+        """
+        return LazyServiceInstances()
+
+    @classmethod
+    @Logging.func_logger
+    def get_service_instances(cls):
+        configs = g.vcenter_configurations
+
         # VMware WS APIのService Instanceのリストが作成されていない場合、インスタンスを保持するリストを初期化する
         if not hasattr(g, "service_instances"):
             Logging.warning(f"vCenter Web Service APIのService Instanceを保持するリストを初期化します。")
             g.service_instances = {}
 
+        # ブローカーを利用する場合、vCenterへの接続はブローカーが保持する
+        if BrokerClient.is_enabled():
+            return g.service_instances
+
         # テスト環境の場合はモックを返す
         if os.getenv("TESTING") == "1":
             from unittest.mock import Mock
@@ -144,9 +297,13 @@ class Connector(object):
 
         redis = VCenterWSSessionManager.initialize()
         for vcenter_name in configs.keys():
-            connection_retry_count = 0
-            # ダウン状態のvCenterについては、接続を試みない
-            if VCenterWSSessionManager.is_dead_vcenter_ws_session(redis=redis, vcenter_name=vcenter_name):
+            # 初回の利用時に接続するvCenterは、利用する処理の中で接続を確認する
+            if cls.is_on_demand(vcenter_name):
+                continue
+
+            # 遮断中のvCenterについては、接続を試みない(復旧はバックグラウンドの検査で確認する)
+            circuit = VCenterCircuitBreaker.get_state(redis=redis, vcenter_name=vcenter_name)
+            if not VCenterCircuitBreaker.allows_request(circuit):
                 continue
 
             try:
@@ -154,51 +311,328 @@ class Connector(object):
                 if vcenter_name not in g.service_instances:
                     raise Exception(f"vCenter({vcenter_name}) のService Instanceが未作成です。")
 
-                current_time = g.service_instances[vcenter_name].CurrentTime()
-                VCenterWSSessionManager.set_vcenter_ws_session(
-                    redis=redis,
-                    vcenter_name=vcenter_name,
-                    status=VCenterWSSessionManager.VCENTER_STATUS_ALIVE,
-                )
+                cls._check_current_time(vcenter_name, g.service_instances[vcenter_name])
+                if circuit["failures"] > 0:
+                    VCenterCircuitBreaker.record_success(redis=redis, vcenter_name=vcenter_name)
+                else:
+                    VCenterWSSessionManager.set_vcenter_ws_session(
+                        redis=redis,
+                        vcenter_name=vcenter_name,
+                        status=VCenterWSSessionManager.VCENTER_STATUS_ALIVE,
+                    )
             except Exception as e:
-                # 一部のvCenterに接続できない場合、かつリトライ上限を超過した際は接続を諦めた上で、
-                # ダウン状態としてマークし、時間をおいて再接続を試みる
+                # 再接続は1回のみ試行し、失敗が続いた場合はサーキットブレーカーにより遮断する
                 Logging.warning(
                     f"vCenter({vcenter_name} - {configs[vcenter_name]['hostname']}:{configs[vcenter_name]['port']})は未接続です。再接続を試行します。"
                 )
-                while True:
-                    try:
-                        si = cls._connect_vcenter(config=configs[vcenter_name], vcenter_name=vcenter_name)
-                        current_time = si.CurrentTime()
-                        g.service_instances[vcenter_name] = si
-                        VCenterWSSessionManager.set_vcenter_ws_session(
-                            redis=redis,
-                            vcenter_name=vcenter_name,
-                            status=VCenterWSSessionManager.VCENTER_STATUS_ALIVE,
-                        )
-                        Logging.info(
-                            f"vCenter({vcenter_name} - {configs[vcenter_name]['hostname']}:{configs[vcenter_name]['port']})への（再）接続に成功しました。"
-                        )
-                        break
-                    except Exception as e:
-                        connection_retry_count += 1
-                        Logging.error(
-                            f"vCenter({vcenter_name} - {configs[vcenter_name]['hostname']}:{configs[vcenter_name]['port']})への（再）接続に失敗しました"
-                        )
-                        Logging.error(
-                            f"vCenter({vcenter_name} - {configs[vcenter_name]['hostname']}:{configs[vcenter_name]['port']})接続エラー: {e}"
-                        )
-
-                        if connection_retry_count >= vcenter_connect_retry_max_count:
-                            # 最大リトライ回数に達した場合、ダウン状態としてマーク
-                            VCenterWSSessionManager.set_vcenter_ws_session(
-                                redis=redis,
-                                vcenter_name=vcenter_name,
-                                status=VCenterWSSessionManager.VCENTER_STATUS_DEAD,
-                            )
-                            Logging.error(
-                                f"vCenter({vcenter_name} - {configs[vcenter_name]['hostname']}:{configs[vcenter_name]['port']})への（再）接続に失敗しました。最大リトライ回数に達したため、ダウンした接続としてマークしました"
-                            )
-                            break
-                        time.sleep(vcenter_connect_retry_interval)
+                cls._reconnect_vcenter(redis=redis, config=configs[vcenter_name], vcenter_name=vcenter_name)
         return g.service_instances
+
+    @classmethod
+    @Logging.func_logger
+    def connect_on_startup(cls) -> dict:
+        """
+        起動時に、起動時に接続するvCenter(connect_mode: eager)に接続します
+
+        認証情報が間違っているvCenterがある場合は、永続的なエラーとして異常終了します。
+        起動後の再接続(設定の再読み込み・復旧の検査・初回の利用時の接続)では、vCenterごとの接続エラーとして扱います。
+        """
+        service_instances = cls.get_service_instances()
+        if cls._login_failures:
+            Logging.error(
+                f"vCenter({', '.join(sorted(cls._login_failures))})にログインできないため、"
+                f"終了します(STATUS/{cs.EXIT_ERR_VCENTER_CONNECT_LOGIN_FAIL})"
+            )
+            sys.exit(cs.EXIT_ERR_VCENTER_CONNECT_LOGIN_FAIL)
+        return service_instances
+
+    @classmethod
+    @Logging.func_logger
+    def _reconnect_vcenter(cls, redis, config, vcenter_name) -> bool:
+        """vCenterに再接続し、結果をサーキットブレーカーに記録します"""
+
+        try:
+            si = cls._connect_vcenter(config=config, vcenter_name=vcenter_name)
+            cls._check_current_time(vcenter_name, si)
+            g.service_instances[vcenter_name] = si
+            cls._login_failures.discard(vcenter_name)
+            VCenterCircuitBreaker.record_success(redis=redis, vcenter_name=vcenter_name)
+            Logging.info(
+                f"vCenter({vcenter_name} - {config['hostname']}:{config['port']})への（再）接続に成功しました。"
+            )
+            return True
+        except Exception as e:
+            Logging.error(
+                f"vCenter({vcenter_name} - {config['hostname']}:{config['port']})への（再）接続に失敗しました"
+            )
+            Logging.error(f"vCenter({vcenter_name} - {config['hostname']}:{config['port']})接続エラー: {e}")
+            if isinstance(e, VCenterLoginError):
+                cls._login_failures.add(vcenter_name)
+            cls._record_health(vcenter_name, cls.HEALTH_STATUS_DEAD)
+            VCenterCircuitBreaker.record_failure(redis=redis, vcenter_name=vcenter_name)
+            return False
+
+    @classmethod
+    def start_connection_monitor(cls) -> None:
+        """遮断中のvCenterの復旧の検査と、アイドル状態の接続の切断を行う、バックグラウンドのスレッドを開始します"""
+
+        if os.getenv("TESTING") == "1" or BrokerClient.is_enabled() or cls._connection_monitor is not None:
+            return
+        cls._connection_monitor_stop.clear()
+        cls._connection_monitor = threading.Thread(
+            target=cls._run_connection_monitor, name="vlb-vcenter-connection-monitor", daemon=True
+        )
+        cls._connection_monitor.start()
+
+    @classmethod
+    def stop_connection_monitor(cls) -> None:
+        if cls._connection_monitor is not None:
+            cls._connection_monitor_stop.set()
+            cls._connection_monitor.join(timeout=1)
+            cls._connection_monitor = None
+
+    @classmethod
+    def _run_connection_monitor(cls) -> None:
+        interval = int(
+            os.getenv(
+                "VLB_VCENTER_CIRCUIT_MONITOR_INTERVAL_SEC",
+                cls.VLB_VCENTER_CIRCUIT_MONITOR_INTERVAL_SEC_DEFAULT,
+            )
+        )
+        health_check_interval = int(
+            os.getenv(
+                "VLB_VCENTER_HEALTH_CHECK_INTERVAL_SEC",
+                cls.VLB_VCENTER_HEALTH_CHECK_INTERVAL_SEC_DEFAULT,
+            )
+        )
+        next_health_check = 0.0
+        while not cls._connection_monitor_stop.wait(interval):
+            if time.monotonic() >= next_health_check:
+                next_health_check = time.monotonic() + health_check_interval
+                try:
+                    cls.check_connection_health()
+                except Exception as e:
+                    Logging.error(f"vCenterの接続状態の確認中にエラーが発生しました: {e}")
+            try:
+                cls.probe_open_circuits()
+            except Exception as e:
+                Logging.error(f"vCenterの復旧の検査中にエラーが発生しました: {e}")
+            try:
+                cls.close_idle_connections()
+            except Exception as e:
+                Logging.error(f"アイドル状態のvCenterの接続の切断中にエラーが発生しました: {e}")
+
+    @classmethod
+    @Logging.func_logger
+    def probe_open_circuits(cls) -> None:
+        """
+        遮断の待機時間が経過したvCenterに再接続し、復旧したかどうかを検査します
+
+        検査は全ワーカープロセスで1つのみ実行され、他のワーカープロセスはRedisで共有された結果を利用します。
+        """
+        configs = g.vcenter_configurations
+        if not hasattr(g, "service_instances"):
+            g.service_instances = {}
+
+        redis = VCenterWSSessionManager.initialize()
+        for vcenter_name in list(configs.keys()):
+            circuit = VCenterCircuitBreaker.get_state(redis=redis, vcenter_name=vcenter_name)
+            if not VCenterCircuitBreaker.is_probe_due(circuit):
+                continue
+            if not VCenterCircuitBreaker.try_start_probe(redis=redis, vcenter_name=vcenter_name):
+                continue
+
+            Logging.info(f"vCenter({vcenter_name})が復旧したかどうかを検査します。")
+            try:
+                cls._reconnect_vcenter(redis=redis, config=configs[vcenter_name], vcenter_name=vcenter_name)
+            except BaseException:
+                # 検査が中断された場合も、half_openのまま残さないよう失敗として記録する
+                VCenterCircuitBreaker.record_failure(redis=redis, vcenter_name=vcenter_name)
+                raise
+            finally:
+                VCenterCircuitBreaker.finish_probe(redis=redis, vcenter_name=vcenter_name)
+
+    @classmethod
+    @Logging.func_logger
+    def get_on_demand_service_instance(cls, vcenter_name):
+        """
+        初回の利用時に接続するvCenterについて、接続を確認したService Instanceを返します
+
+        未接続の場合や接続が切れている場合は接続し、遮断中の場合や接続・ログインに失敗した場合はNoneを返します。
+        リクエストの処理中に呼び出されるため、ログインの失敗も異常終了せずにvCenterごとの接続エラーとして扱います。
+        同じvCenterへの接続は、スレッド間で1つに直列化します。
+        """
+        configs = g.vcenter_configurations
+        if vcenter_name not in configs or not cls.is_on_demand(vcenter_name):
+            return g.service_instances.get(vcenter_name) if hasattr(g, "service_instances") else None
+        if not hasattr(g, "service_instances"):
+            g.service_instances = {}
+
+        with cls._get_on_demand_lock(vcenter_name):
+            cls._last_used[vcenter_name] = time.monotonic()
+            si = g.service_instances.get(vcenter_name)
+            if si is not None:
+                try:
+                    si.CurrentTime()
+                    return si
+                except Exception as e:
+                    Logging.warning(f"vCenter({vcenter_name})の接続が切れているため、再接続します: {e}")
+
+            redis = VCenterWSSessionManager.initialize()
+            circuit = VCenterCircuitBreaker.get_state(redis=redis, vcenter_name=vcenter_name)
+            if not VCenterCircuitBreaker.allows_request(circuit):
+                return None
+            Logging.info(f"vCenter({vcenter_name})は初回の利用時に接続する設定のため、接続します。")
+            cls._reconnect_vcenter(redis=redis, config=configs[vcenter_name], vcenter_name=vcenter_name)
+            return g.service_instances.get(vcenter_name)
+
+    @classmethod
+    @Logging.func_logger
+    def close_idle_connections(cls) -> None:
+        """connect_modeがidle_timeoutのvCenterについて、一定時間利用されていない接続を切断します"""
+
+        if not hasattr(g, "service_instances"):
+            return
+        now = time.monotonic()
+        for vcenter_name in list(g.vcenter_configurations.keys()):
+            if cls.get_connect_mode(vcenter_name) != cls.CONNECT_MODE_IDLE_TIMEOUT:
+                continue
+            with cls._get_on_demand_lock(vcenter_name):
+                if vcenter_name not in g.service_instances:
+                    continue
+                # 復旧の検査などで利用前に接続した場合は、最初に確認した時点からアイドル時間を計測する
+                if now - cls._last_used.setdefault(vcenter_name, now) < cls.get_idle_timeout_sec(vcenter_name):
+                    continue
+
+                cls._drop_service_instance(vcenter_name)
+                Logging.info(f"vCenter({vcenter_name})は一定時間利用されていないため、接続を切断しました。")
+
+    @classmethod
+    @Logging.func_logger
+    def apply_configuration_changes(cls, added: list, removed: list, changed: list) -> None:
+        """
+        vCenterの設定の変更を、このプロセスの接続に反映します
+
+        削除されたvCenterは切断し、設定が変更されたvCenterは切断して再接続します。
+        追加・変更されたvCenterのうち、起動時に接続するvCenter(connect_mode: eager)のみ接続し、
+        変更のないvCenterの接続には影響を与えません。
+        """
+        if BrokerClient.is_enabled():
+            return
+        if not hasattr(g, "service_instances"):
+            g.service_instances = {}
+
+        for vcenter_name in [*removed, *changed]:
+            with cls._get_on_demand_lock(vcenter_name):
+                cls._drop_service_instance(vcenter_name)
+                cls._last_used.pop(vcenter_name, None)
+            Logging.info(f"vCenter({vcenter_name})の設定が変更・削除されたため、接続を切断しました。")
+
+        configs = g.vcenter_configurations
+        redis = VCenterWSSessionManager.initialize()
+        for vcenter_name in [*added, *changed]:
+            if vcenter_name not in configs or cls.is_on_demand(vcenter_name):
+                continue
+            cls._reconnect_vcenter(redis=redis, config=configs[vcenter_name], vcenter_name=vcenter_name)
+
+    @classmethod
+    def _drop_service_instance(cls, vcenter_name) -> None:
+        """vCenterのService Instanceを破棄します。このプロセスのみが利用するセッションはログアウトします"""
+
+        # ServiceInstancePoolはConnectorを参照するため、循環参照を避けてここでimportする
+        from vcenter_lookup_bridge.vmware.service_instance_pool import ServiceInstancePool
+
+        si = g.service_instances.pop(vcenter_name, None)
+        cls._vcenter_health.pop(vcenter_name, None)
+        cls._login_failures.discard(vcenter_name)
+        ServiceInstancePool.invalidate(vcenter_name)
+        # 他のワーカープロセスと共有しているセッションはログアウトせず、参照のみを破棄する
+        if si is not None and vcenter_name in cls._owned_sessions:
+            cls._owned_sessions.discard(vcenter_name)
+            cls._disconnect_vcenter(si)
+
+    @classmethod
+    def _get_on_demand_lock(cls, vcenter_name) -> threading.Lock:
+        with cls._on_demand_locks_lock:
+            if vcenter_name not in cls._on_demand_locks:
+                cls._on_demand_locks[vcenter_name] = threading.Lock()
+            return cls._on_demand_locks[vcenter_name]
+
+    @classmethod
+    def get_health_snapshot(cls) -> dict:
+        """
+        バックグラウンドの確認とリクエスト時の確認で記録した、vCenterごとの接続状態と応答時間を返します
+
+        vCenterへのリクエストは行わず、記録済みの値のみを返します。
+        ブローカーを利用する場合は、ブローカーから定期的に取得した値を返します。
+        """
+        if BrokerClient.is_enabled() and BrokerClient.get_stats() is not None:
+            return BrokerClient.get_stats()["vcenters"]
+        snapshot = {}
+        for vcenter_name in getattr(g, "vcenter_configurations", {}).keys():
+            health = cls._vcenter_health.get(vcenter_name)
+            snapshot[vcenter_name] = (
+                dict(health)
+                if health is not None
+                else {"status": cls.HEALTH_STATUS_NOT_CONNECTED, "latencyMs": None, "checkedAt": None}
+            )
+        return snapshot
+
+    @classmethod
+    @Logging.func_logger
+    def check_connection_health(cls) -> None:
+        """接続済みのvCenterの応答時間を計測し、接続状態として記録します"""
+
+        if not hasattr(g, "service_instances"):
+            return
+        for vcenter_name in list(g.vcenter_configurations.keys()):
+            si = g.service_instances.get(vcenter_name)
+            if si is None:
+                continue
+            try:
+                cls._check_current_time(vcenter_name, si)
+            except Exception as e:
+                Logging.warning(f"vCenter({vcenter_name})の接続状態の確認に失敗しました: {e}")
+                cls._record_health(vcenter_name, cls.HEALTH_STATUS_DEAD)
+
+    @classmethod
+    def _check_current_time(cls, vcenter_name, si) -> None:
+        """CurrentTimeで接続を確認し、応答時間を記録します"""
+
+        started = time.monotonic()
+        si.CurrentTime()
+        cls._record_health(vcenter_name, cls.HEALTH_STATUS_ALIVE, latency_ms=(time.monotonic() - started) * 1000)
+
+    @classmethod
+    def _record_health(cls, vcenter_name, status: str, latency_ms: Optional[float] = None) -> None:
+        cls._vcenter_health[vcenter_name] = {
+            "status": status,
+            "latencyMs": round(latency_ms, 1) if latency_ms is not None else None,
+            "checkedAt": datetime.now(UTC).isoformat(),
+        }
+
+
+class LazyServiceInstances(Mapping):
+    """初回の参照時に、Connector.get_service_instances()で接続を確認したService Instanceを取得する辞書
+
+    vCenterごとの処理を並行して実行するスレッドから参照されるため、接続の確認は1回のみ行います。
+    """
+
+    def __init__(self):
+        self._service_instances: Optional[dict] = None
+        self._lock = threading.Lock()
+
+    def _resolve(self) -> dict:
+        with self._lock:
+            if self._service_instances is None:
+                self._service_instances = Connector.get_service_instances()
+            return self._service_instances
+
+    def __getitem__(self, vcenter_name):
+        return self._resolve()[vcenter_name]
+
+    def __iter__(self):
+        return iter(self._resolve())
+
+    def __len__(self) -> int:
+        return len(self._resolve())
@@ -1,13 +1,18 @@
 import os
 
 from typing import Optional
-from concurrent.futures import ThreadPoolExecutor
 from fastapi import HTTPException
 from pyVmomi import vim
 from vcenter_lookup_bridge.schemas.datastore_parameter import DatastoreResponseSchema
+from vcenter_lookup_bridge.utils.cancellation import CancellationToken
 from vcenter_lookup_bridge.utils.logging import Logging
+from vcenter_lookup_bridge.vmware.fragment_cache import FragmentCache
 from vcenter_lookup_bridge.vmware.host_helper import HostHelper
 from vcenter_lookup_bridge.vmware.tag import Tag
+from vcenter_lookup_bridge.vmware.last_known_good import LastKnownGood
+from vcenter_lookup_bridge.vmware.service_instance_pool import ServiceInstancePool
+from vcenter_lookup_bridge.vmware.vcenter_rate_limiter import VCenterRateLimiter
+from vcenter_lookup_bridge.vmware.work_scheduler import WorkScheduler
 
 
 class Datastore(object):
@@ -15,7 +20,6 @@ class Datastore(object):
 
     # Const
     VLB_MAX_RETRIEVE_VCENTER_OBJECTS_DEFAULT = 1000
-    VLB_MAX_VCENTER_WEB_SERVICE_WORKER_THREADS_DEFAULT = 10
 
     @classmethod
     @Logging.func_logger
@@ -29,6 +33,8 @@ class Datastore(object):
         offset=0,
         max_results=100,
         request_id: str = None,
+        priority: WorkScheduler.Priority = WorkScheduler.PRIORITY_BULK,
+        cancel_token: CancellationToken = None,
     ) -> tuple[list[DatastoreResponseSchema], int]:
         """全vCenterからデータストア一覧を取得"""
 
@@ -41,17 +47,13 @@ class Datastore(object):
                 cls.VLB_MAX_RETRIEVE_VCENTER_OBJECTS_DEFAULT,
             )
         )
-        max_vcenter_web_service_worker_threads = int(
-            os.getenv(
-                "VLB_MAX_VCENTER_WEB_SERVICE_WORKER_THREADS",
-                cls.VLB_MAX_VCENTER_WEB_SERVICE_WORKER_THREADS_DEFAULT,
-            )
-        )
 
         if vcenter_name:
             # vCenterを指定した場合、指定したvCenterからポートグループ一覧を取得
             try:
-                datastores = cls._get_datastores_by_tags(
+                datastores = WorkScheduler.submit(
+                    priority,
+                    cls._get_datastores_by_tags,
                     vcenter_name=vcenter_name,
                     service_instances=service_instances,
                     configs=configs,
@@ -60,7 +62,8 @@ class Datastore(object):
                     offset=offset,
                     max_results=max_results,
                     request_id=request_id,
-                )
+                    cancel_token=cancel_token,
+                ).result()
                 all_datastores.extend(datastores)
                 total_datastore_count = len(all_datastores)
             except Exception as e:
@@ -69,38 +72,39 @@ class Datastore(object):
         else:
             # vCenterを指定しない場合、すべてのvCenterからデータストア一覧を取得
             futures = {}
-            with ThreadPoolExecutor(max_workers=max_vcenter_web_service_worker_threads) as executor:
-                try:
-                    # 各vCenterからデータストア一覧を取得するスレッドを作成
-                    for vcenter_name in configs.keys():
-                        futures[vcenter_name] = executor.submit(
-                            cls._get_datastores_by_tags,
-                            vcenter_name,
-                            service_instances,
-                            configs,
-                            tag_category,
-                            tags,
-                            offset_vcenter,
-                            max_retrieve_vcenter_objects,
-                            request_id,
-                        )
-
-                    # 各スレッドの実行結果を回収
-                    for vcenter_name in configs.keys():
-                        datastores = futures[vcenter_name].result()
-                        Logging.info(f"{request_id} vCenter({vcenter_name})からのデータストア情報取得に成功")
-                        all_datastores.extend(datastores)
-
-                    # 全データストア数を取得
-                    total_datastore_count = len(all_datastores)
-
-                    # オフセットと最大件数の調整
-                    all_datastores = all_datastores[offset:]
-                    if len(all_datastores) > max_results:
-                        all_datastores = all_datastores[:max_results]
-
-                except Exception as e:
-                    Logging.error(f"{request_id} vCenter({vcenter_name})からのデータストア情報取得に失敗: {e}")
+            try:
+                # 各vCenterからデータストア一覧を取得する処理をスケジューラに登録
+                for vcenter_name in configs.keys():
+                    futures[vcenter_name] = WorkScheduler.submit(
+                        priority,
+                        cls._get_datastores_by_tags,
+                        vcenter_name,
+                        service_instances,
+                        configs,
+                        tag_category,
+                        tags,
+                        offset_vcenter,
+                        max_retrieve_vcenter_objects,
+                        request_id,
+                        cancel_token=cancel_token,
+                    )
+
+                # 各処理の実行結果を回収
+                for vcenter_name in configs.keys():
+                    datastores = futures[vcenter_name].result()
+                    Logging.info(f"{request_id} vCenter({vcenter_name})からのデータストア情報取得に成功")
+                    all_datastores.extend(datastores)
+
+                # 全データストア数を取得
+                total_datastore_count = len(all_datastores)
+
+                # オフセットと最大件数の調整
+                all_datastores = all_datastores[offset:]
+                if len(all_datastores) > max_results:
+                    all_datastores = all_datastores[:max_results]
+
+            except Exception as e:
+                Logging.error(f"{request_id} vCenter({vcenter_name})からのデータストア情報取得に失敗: {e}")
 
         return all_datastores, total_datastore_count
 
@@ -116,11 +120,54 @@ class Datastore(object):
         offset: int = 0,
         max_results: int = 100,
         request_id: str = None,
-    ) -> list[DatastoreResponseSchema]:
-        """指定したvCenterからデータストア一覧を取得"""
+        cancel_token: CancellationToken = None,
+    ) -> list:
+        """指定したvCenterからデータストア一覧を取得(タグ単位でキャッシュした結果を結合)"""
+
+        datastores_by_fragment = FragmentCache.get_fragments(
+            resource="datastores",
+            vcenter_name=vcenter_name,
+            fragments=[f"{tag_category}/{tag}" for tag in tags],
+            compute=lambda fragments: {
+                f"{tag_category}/{tag}": datastores
+                for tag, datastores in cls._get_datastores_by_tag_fragments_from_vcenter(
+                    vcenter_name=vcenter_name,
+                    service_instances=service_instances,
+                    configs=configs,
+                    tag_category=tag_category,
+                    tags=[fragment[len(tag_category) + 1 :] for fragment in fragments],
+                    request_id=request_id,
+                    cancel_token=cancel_token,
+                ).items()
+            },
+            request_id=request_id,
+        )
+        # 複数のタグが付与されたデータストアは、1件のみ返す
+        return FragmentCache.assemble(
+            datastores_by_fragment, offset=offset, max_results=max_results, unique_key=lambda result: result["name"]
+        )
+
+    @classmethod
+    @Logging.func_logger
+    @LastKnownGood.fallback(fragments_arg="tags")
+    @VCenterRateLimiter.limited
+    @ServiceInstancePool.pooled
+    def _get_datastores_by_tag_fragments_from_vcenter(
+        cls,
+        vcenter_name: str,
+        service_instances: dict,
+        configs,
+        tag_category: str,
+        tags: list[str],
+        request_id: str = None,
+        cancel_token: CancellationToken = None,
+    ) -> dict[str, list]:
+        """指定したvCenterから、タグごとのデータストア一覧を取得"""
 
-        results = []
-        datastore_count = 0
+        cancel_token = cancel_token or CancellationToken()
+        cancel_token.raise_if_cancelled()
+
+        results = {tag: [] for tag in tags}
 
         # 指定されたvCenterのService Instanceを取得
         if vcenter_name not in service_instances:
@@ -132,39 +179,32 @@ class Datastore(object):
         config = configs[vcenter_name]
 
         cv = content.viewManager.CreateContainerView(container=content.rootFolder, type=[vim.Datastore], recursive=True)
-        datastores = cv.view
+        try:
+            datastores = cv.view
+        finally:
+            # 一覧の取得後は不要なため、vCenter上のビューを破棄
+            cv.Destroy()
         datastore_tags = Tag.get_all_datastore_tags(config=config)
         if datastore_tags is None:
             raise HTTPException(status_code=500, detail="データストアのタグを取得中にエラーが発生しました。")
 
+        if datastores is None:
+            return results
         for datastore in datastores:
-            # offsetまでスキップ
-            if datastore_count < offset:
-                datastore_count += 1
+            cancel_token.raise_if_cancelled()
+            if not isinstance(datastore, vim.Datastore) or tag_category not in datastore_tags.get(datastore.name, {}):
+                continue
+            attached_tags = datastore_tags[datastore.name][tag_category]
+            matched_tags = [tag for tag in tags if tag in [str(attached_tag) for attached_tag in attached_tags]]
+            if not matched_tags:
                 continue
-            # max_resultsまで取得
-            if datastore_count >= offset + max_results:
-                break
-
-            if isinstance(datastore, vim.Datastore):
-                for datastore_name in datastore_tags.keys():
-                    if datastore.name == datastore_name:
-                        if tag_category in datastore_tags[datastore_name]:
-                            datastore_config = cls._generate_datastore_info(
-                                datastore=datastore, content=content, vcenter_name=vcenter_name
-                            )
-                            datastore_config["tag_category"] = tag_category
-                            datastore_config["tags"] = datastore_tags[datastore_name][tag_category]
-
-                            for attached_tag in datastore_tags[datastore_name][tag_category]:
-                                # すでに結果に追加済みのデータストアであれば、スキップ
-                                if datastore_name in [result["name"] for result in results]:
-                                    continue
-
-                                # タグが一致していれば、結果に追加
-                                if str(attached_tag) in tags:
-                                    results.append(datastore_config)
-                                    datastore_count += 1
+            datastore_config = cls._generate_datastore_info(
+                datastore=datastore, content=content, vcenter_name=vcenter_name
+            )
+            datastore_config["tag_category"] = tag_category
+            datastore_config["tags"] = attached_tags
+            for tag in matched_tags:
+                results[tag].append(datastore_config)
         return results
 
     @classmethod
@@ -1,12 +1,16 @@
 import datetime
 import os
-from typing import List, Optional
-from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, List, Optional
 from fastapi import HTTPException
 from pyVmomi import vim
 from vcenter_lookup_bridge.schemas.event_parameter import EventResponseSchema
+from vcenter_lookup_bridge.utils.cancellation import CancellationToken
 from vcenter_lookup_bridge.utils.logging import Logging
 from vcenter_lookup_bridge.vmware.helper import Helper
+from vcenter_lookup_bridge.vmware.last_known_good import LastKnownGood
+from vcenter_lookup_bridge.vmware.service_instance_pool import ServiceInstancePool
+from vcenter_lookup_bridge.vmware.vcenter_rate_limiter import VCenterRateLimiter
+from vcenter_lookup_bridge.vmware.work_scheduler import WorkScheduler
 
 
 class Event(object):
@@ -14,8 +18,8 @@ class Event(object):
 
     # Const
     VLB_MAX_RETRIEVE_VCENTER_OBJECTS_DEFAULT = 1000
-    VLB_MAX_VCENTER_WEB_SERVICE_WORKER_THREADS_DEFAULT = 10
     VLB_MAX_RETRIEVE_EVENTS_PER_VCENTER_DEFAULT = 1000
+    EVENT_COLLECTOR_PAGE_SIZE = 100
 
     @classmethod
     @Logging.func_logger
@@ -37,22 +41,20 @@ class Event(object):
         offset=0,
         max_results=100,
         request_id: str = None,
+        priority: WorkScheduler.Priority = WorkScheduler.PRIORITY_BULK,
+        cancel_token: CancellationToken = None,
     ) -> tuple[list[EventResponseSchema], int]:
         """全vCenterからイベント一覧を取得"""
 
         all_events = []
         total_event_count = 0
-        max_vcenter_web_service_worker_threads = int(
-            os.getenv(
-                "VLB_MAX_VCENTER_WEB_SERVICE_WORKER_THREADS",
-                cls.VLB_MAX_VCENTER_WEB_SERVICE_WORKER_THREADS_DEFAULT,
-            )
-        )
 
         if vcenter_name:
             # vCenterを指定した場合、指定したvCenterからイベント一覧を取得
             try:
-                events = cls._get_events_from_vcenter(
+                events = WorkScheduler.submit(
+                    priority,
+                    cls._get_events_from_vcenter,
                     vcenter_name=vcenter_name,
                     service_instances=service_instances,
                     begin_time=begin_time,
@@ -66,7 +68,8 @@ class Event(object):
                     user_names=user_names,
                     ip_addresses=ip_addresses,
                     request_id=request_id,
-                )
+                    cancel_token=cancel_token,
+                ).result()
                 Logging.info(f"{request_id} vCenter({vcenter_name})からのイベント情報取得に成功")
                 all_events.extend(events)
                 total_event_count = len(all_events)
@@ -77,50 +80,97 @@ class Event(object):
         else:
             # vCenterを指定しない場合、すべてのvCenterからイベント一覧を取得
             futures = {}
-            with ThreadPoolExecutor(max_workers=max_vcenter_web_service_worker_threads) as executor:
-                try:
-                    # 各vCenterからイベント一覧を取得するスレッドを作成
-                    for vcenter_name in configs.keys():
-                        futures[vcenter_name] = executor.submit(
-                            cls._get_events_from_vcenter,
-                            vcenter_name,
-                            service_instances,
-                            begin_time,
-                            end_time,
-                            days_ago_begin,
-                            days_ago_end,
-                            hours_ago_begin,
-                            hours_ago_end,
-                            event_types,
-                            event_sources,
-                            user_names,
-                            ip_addresses,
-                            request_id,
-                        )
-
-                    # 各スレッドの実行結果を回収
-                    for vcenter_name in configs.keys():
-                        events = futures[vcenter_name].result()
-                        Logging.info(f"{request_id} vCenter({vcenter_name})からのイベント情報取得に成功")
-                        all_events.extend(events)
-
-                    # 全イベント数を取得
-                    total_event_count = len(all_events)
-
-                    # オフセットと最大件数の調整
-                    all_events = all_events[offset:]
-                    if len(all_events) > max_results:
-                        all_events = all_events[:max_results]
-
-                except ValueError as e:
-                    raise HTTPException(status_code=422, detail=f"日付/時刻パラメータの書式が不正です。")
-                except Exception as e:
-                    Logging.error(f"{request_id} vCenter({vcenter_name})からのイベント情報取得に失敗: {e}")
+            try:
+                # 各vCenterからイベント一覧を取得する処理をスケジューラに登録
+                for vcenter_name in configs.keys():
+                    futures[vcenter_name] = WorkScheduler.submit(
+                        priority,
+                        cls._get_events_from_vcenter,
+                        vcenter_name,
+                        service_instances,
+                        begin_time,
+                        end_time,
+                        days_ago_begin,
+                        days_ago_end,
+                        hours_ago_begin,
+                        hours_ago_end,
+                        event_types,
+                        event_sources,
+                        user_names,
+                        ip_addresses,
+                        request_id,
+                        cancel_token=cancel_token,
+                    )
+
+                # 各処理の実行結果を回収
+                for vcenter_name in configs.keys():
+                    events = futures[vcenter_name].result()
+                    Logging.info(f"{request_id} vCenter({vcenter_name})からのイベント情報取得に成功")
+                    all_events.extend(events)
+
+                # 全イベント数を取得
+                total_event_count = len(all_events)
+
+                # オフセットと最大件数の調整
+                all_events = all_events[offset:]
+                if len(all_events) > max_results:
+                    all_events = all_events[:max_results]
+
+            except ValueError as e:
+                raise HTTPException(status_code=422, detail=f"日付/時刻パラメータの書式が不正です。")
+            except Exception as e:
+                Logging.error(f"{request_id} vCenter({vcenter_name})からのイベント情報取得に失敗: {e}")
 
         return all_events, total_event_count
 
     @classmethod
     @Logging.func_logger
+    def stream_events_from_all_vcenters(
+        cls,
+        service_instances: dict,
+        configs,
+        vcenter_name: Optional[str] = None,
+        begin_time: str = None,
+        end_time: str = None,
+        days_ago_begin: int = None,
+        days_ago_end: int = None,
+        hours_ago_begin: int = None,
+        hours_ago_end: int = None,
+        event_types: List[str] = None,
+        event_sources: List[str] = None,
+        user_names: List[str] = None,
+        ip_addresses: List[str] = None,
+        request_id: str = None,
+        priority: WorkScheduler.Priority = WorkScheduler.PRIORITY_BULK,
+        cancel_token: CancellationToken = None,
+    ) -> AsyncIterator[tuple[str, Optional[list[EventResponseSchema]], Optional[Exception]]]:
+        """全vCenterからイベント一覧を取得し、取得が完了したvCenterから順に返す"""
+
+        vcenter_names = [vcenter_name] if vcenter_name else list(configs.keys())
+        return WorkScheduler.stream_from_vcenters(
+            priority,
+            cls._get_events_from_vcenter,
+            vcenter_names,
+            cancel_token=cancel_token,
+            service_instances=service_instances,
+            begin_time=begin_time,
+            end_time=end_time,
+            days_ago_begin=days_ago_begin,
+            days_ago_end=days_ago_end,
+            hours_ago_begin=hours_ago_begin,
+            hours_ago_end=hours_ago_end,
+            event_types=event_types,
+            event_sources=event_sources,
+            user_names=user_names,
+            ip_addresses=ip_addresses,
+            request_id=request_id,
+        )
+
+    @classmethod
+    @Logging.func_logger
+    @LastKnownGood.fallback
+    @VCenterRateLimiter.limited
+    @ServiceInstancePool.pooled
     def _get_events_from_vcenter(
         cls,
         vcenter_name: str,
@@ -136,9 +186,13 @@ class Event(object):
         user_names: List[str] = None,
         ip_addresses: List[str] = None,
         request_id: str = None,
+        cancel_token: CancellationToken = None,
     ) -> list[EventResponseSchema]:
         """特定のvCenterからイベント一覧を取得"""
 
+        cancel_token = cancel_token or CancellationToken()
+        cancel_token.raise_if_cancelled()
+
         results = []
         max_retrieve_events = int(
             os.getenv(
@@ -152,7 +206,6 @@ class Event(object):
             raise HTTPException(status_code=404, detail=f"vCenter({vcenter_name}) not found")
 
         content = service_instances[vcenter_name].RetrieveContent()
-        datacenter = content.rootFolder.childEntity[0]
 
         event_mgr = content.eventManager
         filter_spec = vim.event.EventFilterSpec()
@@ -200,11 +253,22 @@ class Event(object):
             user_filter.userList = user_names
             filter_spec.userName = user_filter
         collector = event_mgr.CreateCollectorForEvents(filter=filter_spec)
-        events = collector.ReadNextEvents(max_retrieve_events)
+        try:
+            # ページ単位でイベントを読み込み、ページの区切りでキャンセル要求を確認
+            events = []
+            while len(events) < max_retrieve_events:
+                cancel_token.raise_if_cancelled()
+                page = collector.ReadNextEvents(min(cls.EVENT_COLLECTOR_PAGE_SIZE, max_retrieve_events - len(events)))
+                if not page:
+                    break
+                events.extend(page)
+        finally:
+            # キャンセル時も含め、vCenter上のコレクタを破棄
+            collector.DestroyCollector()
 
         for event in events:
             if isinstance(event, vim.Event):
-                event_info = cls._generate_event_info(datacenter, event, vcenter_name)
+                event_info = cls._generate_event_info(event, vcenter_name)
                 # IPアドレスの条件を指定した場合、マッチしないイベントをスキップ
                 if ip_addresses:
                     if event_info.ipAddress not in ip_addresses:
@@ -218,7 +282,7 @@ class Event(object):
 
     @classmethod
     @Logging.func_logger
-    def _generate_event_info(cls, datacenter, event: vim.Event, vcenter_name: str) -> EventResponseSchema:
+    def _generate_event_info(cls, event: vim.Event, vcenter_name: str) -> EventResponseSchema:
         """イベント情報を生成"""
 
         if hasattr(event, "entity") and event.entity is not None:
@@ -237,7 +301,8 @@ class Event(object):
 
         event_info = {
             "vcenter": vcenter_name,
-            "datacenter": datacenter.name,
+            # イベントの発生元のデータセンター(データセンターに属さないイベントの場合はNone)
+            "datacenter": event.datacenter.name if getattr(event, "datacenter", None) else None,
             "eventType": type(event).__name__.replace("vim.event.", ""),
             "message": event.fullFormattedMessage,
             "createdTime": event.createdTime.isoformat(),
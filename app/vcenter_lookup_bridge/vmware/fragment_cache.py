@@ -0,0 +1,207 @@
+import os
+import threading
+import time
+from typing import Callable, Optional
+
+import setuptools
+from redis import Redis
+from redis.exceptions import RedisError
+from vcenter_lookup_bridge.utils.logging import Logging
+from vcenter_lookup_bridge.utils.serialize_util import SerializeUtil
+from vcenter_lookup_bridge.vmware.last_known_good import LastKnownGood
+from vcenter_lookup_bridge.vmware.vcenter_ws_session_managr import VCenterWSSessionManager
+
+
+class FragmentCache(object):
+    """vCenterごとの一覧の取得結果を、断片(仮想マシンフォルダ・タグ・リソース種別)の単位でキャッシュするクラス
+
+    リクエスト全体ではなく断片の単位でキャッシュするため、指定するフォルダやタグの組み合わせ、offset/max_resultsが
+    異なるリクエストでも、キャッシュ済みの断片はvCenterに問い合わせずに再利用し、レスポンスは断片を結合して作成します。
+    キャッシュにない断片のみ、まとめてvCenterから取得します。
+
+    断片のキーは、リソース・vCenter名ごとのタグ(キーの集合)に登録し、キー空間全体を走査せずに破棄できるようにします。
+
+    Attributes:
+        FRAGMENT_PREFIX (str): 断片のキーのプレフィックス
+        TAG_PREFIX (str): 断片のキーを登録するタグのキーのプレフィックス
+    """
+
+    # Const
+    VLB_FRAGMENT_CACHE_ENABLED_DEFAULT = "True"
+    VLB_FRAGMENT_CACHE_EXPIRE_SECS_DEFAULT = 60
+    FRAGMENT_PREFIX = "vlb_fragment:"
+    TAG_PREFIX = "vlb_fragment_tag:"
+    REDIS_RETRY_INTERVAL_SEC = 30
+
+    _redis: Optional[Redis] = None
+    _redis_unavailable_until = 0.0
+    _lock = threading.Lock()
+
+    @classmethod
+    def is_enabled(cls) -> bool:
+        return bool(
+            setuptools.distutils.util.strtobool(
+                os.getenv("VLB_FRAGMENT_CACHE_ENABLED", cls.VLB_FRAGMENT_CACHE_ENABLED_DEFAULT)
+            )
+        )
+
+    @classmethod
+    def get_expire_secs(cls) -> int:
+        return int(os.getenv("VLB_FRAGMENT_CACHE_EXPIRE_SECS", cls.VLB_FRAGMENT_CACHE_EXPIRE_SECS_DEFAULT))
+
+    @classmethod
+    def get_fragments(
+        cls,
+        resource: str,
+        vcenter_name: str,
+        fragments: list[str],
+        compute: Callable[[list[str]], dict],
+        request_id: str = None,
+    ) -> dict:
+        """
+        断片ごとの取得結果を返します
+
+        キャッシュにない断片のみcompute(断片のリスト)で取得し、キャッシュに登録します。
+        computeが最後に取得に成功した結果(LastKnownGood)を返した場合は、キャッシュに登録しません。
+
+        Args:
+            resource (str): リソースの種別(vms, hostsなど)
+            vcenter_name (str): vCenter名
+            fragments (list[str]): 取得する断片の名前(重複は除外)
+            compute (Callable[[list[str]], dict]): 断片の名前のリストを受け取り、断片の名前と取得結果の辞書を返す関数
+        Returns:
+            dict: 断片の名前と取得結果の辞書(指定した断片の順)
+        """
+        fragments = list(dict.fromkeys(fragments))
+        redis = cls._get_redis() if cls.is_enabled() else None
+        if redis is None:
+            return cls._order(fragments, compute(fragments))
+
+        keys = [cls._get_key(resource, vcenter_name, fragment) for fragment in fragments]
+        results = {}
+        try:
+            for fragment, value in zip(fragments, redis.mget(keys)):
+                if value is None:
+                    continue
+                try:
+                    results[fragment] = SerializeUtil.loads(value)
+                except ValueError as e:
+                    # 形式の異なる(旧形式で保存した)断片は、キャッシュにないものとして取得し直す
+                    Logging.warning(f"{request_id} 断片のキャッシュを読み込めないため、破棄します: {e}")
+        except RedisError as e:
+            cls._mark_redis_unavailable()
+            Logging.warning(f"{request_id} 断片のキャッシュの読み込みに失敗しました: {e}")
+
+        missing = [fragment for fragment in fragments if fragment not in results]
+        Logging.info(
+            f"{request_id} vCenter({vcenter_name})の{resource}の断片のキャッシュ: ヒット{len(results)}件, ミス{len(missing)}件"
+        )
+        if missing:
+            with LastKnownGood.detect_stale() as detection:
+                computed = compute(missing)
+            # vCenterから取得できずに保存した結果を返した場合は、新たに取得した断片としてキャッシュしない
+            if not detection["stale"]:
+                cls._save(redis, resource, vcenter_name, {fragment: computed.get(fragment, []) for fragment in missing})
+            results.update(computed)
+        return cls._order(fragments, results)
+
+    @classmethod
+    def assemble(
+        cls,
+        results_by_fragment: dict,
+        offset: int = 0,
+        max_results: Optional[int] = None,
+        unique_key: Optional[Callable] = None,
+    ) -> list:
+        """
+        断片ごとの取得結果を結合し、offset/max_resultsを適用します
+
+        unique_keyを指定した場合、複数の断片に含まれる結果は、最初の断片のもののみ残します。
+        """
+        results = []
+        seen = set()
+        for fragment_results in results_by_fragment.values():
+            for result in fragment_results:
+                if unique_key is not None:
+                    key = unique_key(result)
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                results.append(result)
+        return results[offset:] if max_results is None else results[offset : offset + max_results]
+
+    @classmethod
+    async def clear_async(cls, redis, resource: Optional[str] = None, vcenter_name: Optional[str] = None) -> int:
+        """
+        リソース・vCenter名を指定して、キャッシュした断片を破棄し、破棄した件数を返します
+
+        いずれも指定しない場合は、全ての断片を破棄します。
+        """
+        if resource is None and vcenter_name is None:
+            keys = [key async for key in redis.scan_iter(match=f"{cls.FRAGMENT_PREFIX}*", count=1000)]
+            keys += [key async for key in redis.scan_iter(match=f"{cls.TAG_PREFIX}*", count=1000)]
+            if keys:
+                await redis.delete(*keys)
+            return len(keys)
+
+        tag_key = cls._get_tag_key(resource, vcenter_name)
+        keys = list(await redis.smembers(tag_key))
+        if keys:
+            await redis.delete(*keys)
+        await redis.delete(tag_key)
+        return len(keys)
+
+    @classmethod
+    def _order(cls, fragments: list[str], results: dict) -> dict:
+        return {fragment: results.get(fragment, []) for fragment in fragments}
+
+    @classmethod
+    def _save(cls, redis: Redis, resource: str, vcenter_name: str, results: dict) -> None:
+        try:
+            with redis.pipeline(transaction=False) as pipe:
+                keys = []
+                for fragment, fragment_results in results.items():
+                    key = cls._get_key(resource, vcenter_name, fragment)
+                    pipe.set(key, SerializeUtil.dumps(fragment_results), ex=cls.get_expire_secs())
+                    keys.append(key)
+                for tag_key in (
+                    cls._get_tag_key(resource, None),
+                    cls._get_tag_key(None, vcenter_name),
+                    cls._get_tag_key(resource, vcenter_name),
+                ):
+                    pipe.sadd(tag_key, *keys)
+                    pipe.expire(tag_key, cls.get_expire_secs())
+                pipe.execute()
+        except RedisError as e:
+            cls._mark_redis_unavailable()
+            Logging.warning(f"vCenter({vcenter_name})の{resource}の断片のキャッシュの保存に失敗しました: {e}")
+
+    @classmethod
+    def _get_key(cls, resource: str, vcenter_name: str, fragment: str) -> str:
+        return f"{cls.FRAGMENT_PREFIX}{resource}:{vcenter_name}:{fragment}"
+
+    @classmethod
+    def _get_tag_key(cls, resource: Optional[str], vcenter_name: Optional[str]) -> str:
+        """断片のキーを登録するタグのキーを返します(リソース・vCenter名のいずれかはNoneを指定可能)"""
+
+        return f"{cls.TAG_PREFIX}{resource or ''}:{vcenter_name or ''}"
+
+    @classmethod
+    def _get_redis(cls) -> Optional[Redis]:
+        if time.monotonic() < cls._redis_unavailable_until:
+            return None
+        if cls._redis is None:
+            with cls._lock:
+                if cls._redis is None:
+                    try:
+                        cls._redis = VCenterWSSessionManager.initialize()
+                    except Exception as e:
+                        cls._mark_redis_unavailable()
+                        Logging.warning(f"断片のキャッシュ用のRedis接続を初期化できませんでした: {e}")
+                        return None
+        return cls._redis
+
+    @classmethod
+    def _mark_redis_unavailable(cls) -> None:
+        # Redisの障害時に毎回タイムアウトを待たないよう、一定時間はキャッシュを利用しない
+        cls._redis_unavailable_until = time.monotonic() + cls.REDIS_RETRY_INTERVAL_SEC
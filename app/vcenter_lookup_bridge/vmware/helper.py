@@ -1,10 +1,17 @@
+from typing import Callable, Optional
+
 from pyVmomi import vim
+from vcenter_lookup_bridge.utils.cancellation import CancellationToken
 from vcenter_lookup_bridge.utils.logging import Logging
+from vcenter_lookup_bridge.vmware.work_scheduler import WorkScheduler
 
 
 class Helper(object):
     """vCenterオブジェクト取得用のヘルパークラス"""
 
+    # Const
+    MAX_INVENTORY_DEPTH = 64
+
     @classmethod
     @Logging.func_logger
     def get_object_by_name(cls, content, vimtype, name):
@@ -55,6 +62,130 @@ class Helper(object):
         cv.Destroy()
         return obj
 
+    @classmethod
+    @Logging.func_logger
+    def get_datacenters(cls, content) -> list:
+        """フォルダの配下も含め、vCenterの全てのデータセンターを取得"""
+
+        datacenters = []
+        folders = [content.rootFolder]
+        while folders:
+            for child_entity in folders.pop(0).childEntity:
+                # ルートフォルダ配下には、フォルダとデータセンターのみが配置される
+                if isinstance(child_entity, vim.Folder):
+                    folders.append(child_entity)
+                else:
+                    datacenters.append(child_entity)
+        return datacenters
+
+    @classmethod
+    @Logging.func_logger
+    def get_datacenter_of(cls, entity, content=None):
+        """
+        オブジェクトが所属するデータセンターを取得
+
+        見つからない場合は、contentを指定していれば最初に見つかったデータセンターを返します。
+        """
+        parent = getattr(entity, "parent", None)
+        for _ in range(cls.MAX_INVENTORY_DEPTH):
+            if parent is None:
+                break
+            if isinstance(parent, vim.Datacenter):
+                return parent
+            parent = getattr(parent, "parent", None)
+        if content is None:
+            return None
+        datacenters = cls.get_datacenters(content)
+        return datacenters[0] if datacenters else None
+
+    @classmethod
+    @Logging.func_logger
+    def find_vm_folder(cls, search_index, datacenter, *folder_paths: str):
+        """
+        データセンターの仮想マシンフォルダ(vmFolder)を起点に、指定したパスのフォルダを取得
+
+        インベントリパスはデータセンターの親フォルダに依存するため、vmFolderから1階層ずつたどります。
+        見つからない場合はNoneを返します。
+        """
+        folder = datacenter.vmFolder
+        for name in "/".join(folder_paths).split("/"):
+            if not name:
+                continue
+            folder = search_index.FindChild(folder, name)
+            if folder is None:
+                return None
+        return folder
+
+    @classmethod
+    @Logging.func_logger
+    def get_vms_in_vm_folders(
+        cls,
+        search_index,
+        datacenter,
+        base_vm_folder: str,
+        vm_folders: list[str],
+        limit: Optional[int] = None,
+        cancel_token: Optional[CancellationToken] = None,
+        log_prefix: str = "",
+    ) -> list[tuple[str, vim.VirtualMachine]]:
+        """データセンターの仮想マシンフォルダ直下の仮想マシンを、(フォルダ名, 仮想マシン)のリストで取得"""
+
+        vms = []
+        for vm_folder in vm_folders:
+            # フォルダ単位でキャンセル要求を確認
+            if cancel_token is not None:
+                cancel_token.raise_if_cancelled()
+            if limit is not None and len(vms) >= limit:
+                break
+            folder = cls.find_vm_folder(search_index, datacenter, base_vm_folder, vm_folder)
+            if folder is None:
+                Logging.info(
+                    f"{log_prefix}のデータセンター({datacenter.name})に仮想マシンフォルダ({vm_folder})は見つかりませんでした。"
+                )
+                continue
+            vms.extend((vm_folder, vm) for vm in folder.childEntity if isinstance(vm, vim.VirtualMachine))
+        return vms if limit is None else vms[:limit]
+
+    @classmethod
+    @Logging.func_logger
+    def scan_datacenters(
+        cls,
+        datacenters: list,
+        collect: Callable,
+        generate: Callable,
+        offset: int = 0,
+        max_results: Optional[int] = None,
+        cancel_token: Optional[CancellationToken] = None,
+    ) -> list:
+        """
+        データセンターごとに並行してオブジェクトを走査し、データセンターの順に結合した結果を返します
+
+        collect(datacenter, limit)で走査したオブジェクトを結合してoffset/max_resultsを適用し、
+        残ったオブジェクトのみ、generate(datacenter, obj)で応答を生成します(生成もデータセンターごとに並行して実行)。
+        """
+        limit = None if max_results is None else offset + max_results
+        collected = WorkScheduler.map_nested(
+            WorkScheduler.PRIORITY_BULK,
+            lambda datacenter: collect(datacenter, limit),
+            datacenters,
+            cancel_token=cancel_token,
+        )
+
+        # 全データセンターの結果に対してoffset/max_resultsを適用
+        entries = [(index, obj) for index, objs in enumerate(collected) for obj in objs]
+        entries = entries[offset:limit]
+        objs_by_datacenter = {}
+        for index, obj in entries:
+            objs_by_datacenter.setdefault(index, []).append(obj)
+
+        generated = WorkScheduler.map_nested(
+            WorkScheduler.PRIORITY_BULK,
+            lambda index: [generate(datacenters[index], obj) for obj in objs_by_datacenter[index]],
+            objs_by_datacenter.keys(),
+            cancel_token=cancel_token,
+        )
+        return [result for results in generated for result in results]
+
     @classmethod
     @Logging.func_logger
     def _create_container_view(cls, content, vimtypes):
@@ -1,10 +1,16 @@
 import os
-from typing import List, Optional
-from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, List, Optional
 from fastapi import HTTPException
 from pyVmomi import vim
 from vcenter_lookup_bridge.schemas.host_parameter import HostResponseSchema, HostDetailResponseSchema
+from vcenter_lookup_bridge.utils.cancellation import CancellationToken
 from vcenter_lookup_bridge.utils.logging import Logging
+from vcenter_lookup_bridge.vmware.fragment_cache import FragmentCache
+from vcenter_lookup_bridge.vmware.helper import Helper
+from vcenter_lookup_bridge.vmware.last_known_good import LastKnownGood
+from vcenter_lookup_bridge.vmware.service_instance_pool import ServiceInstancePool
+from vcenter_lookup_bridge.vmware.vcenter_rate_limiter import VCenterRateLimiter
+from vcenter_lookup_bridge.vmware.work_scheduler import WorkScheduler
 
 
 class Host(object):
@@ -12,7 +18,7 @@ class Host(object):
 
     # Const
     VLB_MAX_RETRIEVE_VCENTER_OBJECTS_DEFAULT = 1000
-    VLB_MAX_VCENTER_WEB_SERVICE_WORKER_THREADS_DEFAULT = 10
+    FRAGMENT_ALL = "all"
 
     @classmethod
     @Logging.func_logger
@@ -24,6 +30,8 @@ class Host(object):
         offset=0,
         max_results=100,
         request_id: str = None,
+        priority: WorkScheduler.Priority = WorkScheduler.PRIORITY_BULK,
+        cancel_token: CancellationToken = None,
     ) -> tuple[list[HostResponseSchema], int]:
         """全vCenterからESXiホスト一覧を取得"""
 
@@ -36,24 +44,21 @@ class Host(object):
                 cls.VLB_MAX_RETRIEVE_VCENTER_OBJECTS_DEFAULT,
             )
         )
-        max_vcenter_web_service_worker_threads = int(
-            os.getenv(
-                "VLB_MAX_VCENTER_WEB_SERVICE_WORKER_THREADS",
-                cls.VLB_MAX_VCENTER_WEB_SERVICE_WORKER_THREADS_DEFAULT,
-            )
-        )
 
         if vcenter_name:
             # vCenterを指定した場合、指定したvCenterからESXiホスト一覧を取得
             try:
-                hosts = cls._get_hosts_from_vcenter(
+                hosts = WorkScheduler.submit(
+                    priority,
+                    cls._get_hosts_from_vcenter,
                     vcenter_name=vcenter_name,
                     service_instances=service_instances,
                     configs=configs,
                     offset=offset,
                     max_results=max_results,
                     request_id=request_id,
-                )
+                    cancel_token=cancel_token,
+                ).result()
                 all_hosts.extend(hosts)
                 total_host_count = len(all_hosts)
             except Exception as e:
@@ -62,39 +67,68 @@ class Host(object):
         else:
             # vCenterを指定しない場合、すべてのvCenterからESXiホスト一覧を取得
             futures = {}
-            with ThreadPoolExecutor(max_workers=max_vcenter_web_service_worker_threads) as executor:
-                try:
-                    # 各vCenterからESXiホスト一覧を取得するスレッドを作成
-                    for vcenter_name in configs.keys():
-                        futures[vcenter_name] = executor.submit(
-                            cls._get_hosts_from_vcenter,
-                            vcenter_name,
-                            service_instances,
-                            configs,
-                            offset_vcenter,
-                            max_retrieve_vcenter_objects,
-                            request_id,
-                        )
+            try:
+                # 各vCenterからESXiホスト一覧を取得する処理をスケジューラに登録
+                for vcenter_name in configs.keys():
+                    futures[vcenter_name] = WorkScheduler.submit(
+                        priority,
+                        cls._get_hosts_from_vcenter,
+                        vcenter_name,
+                        service_instances,
+                        configs,
+                        offset_vcenter,
+                        max_retrieve_vcenter_objects,
+                        request_id,
+                        cancel_token=cancel_token,
+                    )
 
-                    # 各スレッドの実行結果を回収
-                    for vcenter_name in configs.keys():
-                        hosts = futures[vcenter_name].result()
-                        Logging.info(f"{request_id} vCenter({vcenter_name})からのESXiホスト情報取得に成功")
-                        all_hosts.extend(hosts)
+                # 各処理の実行結果を回収
+                for vcenter_name in configs.keys():
+                    hosts = futures[vcenter_name].result()
+                    Logging.info(f"{request_id} vCenter({vcenter_name})からのESXiホスト情報取得に成功")
+                    all_hosts.extend(hosts)
 
-                    # 全ESXiホスト数を取得
-                    total_host_count = len(all_hosts)
+                # 全ESXiホスト数を取得
+                total_host_count = len(all_hosts)
 
-                    # オフセットと最大件数の調整
-                    all_hosts = all_hosts[offset:]
-                    if len(all_hosts) > max_results:
-                        all_hosts = all_hosts[:max_results]
+                # オフセットと最大件数の調整
+                all_hosts = all_hosts[offset:]
+                if len(all_hosts) > max_results:
+                    all_hosts = all_hosts[:max_results]
 
-                except Exception as e:
-                    Logging.error(f"{request_id} vCenter({vcenter_name})からのESXiホスト情報取得に失敗: {e}")
+            except Exception as e:
+                Logging.error(f"{request_id} vCenter({vcenter_name})からのESXiホスト情報取得に失敗: {e}")
 
         return all_hosts, total_host_count
 
+    @classmethod
+    @Logging.func_logger
+    def stream_hosts_from_all_vcenters(
+        cls,
+        service_instances: dict,
+        configs,
+        vcenter_name: Optional[str] = None,
+        offset=0,
+        max_results=100,
+        request_id: str = None,
+        priority: WorkScheduler.Priority = WorkScheduler.PRIORITY_BULK,
+        cancel_token: CancellationToken = None,
+    ) -> AsyncIterator[tuple[str, Optional[list[HostResponseSchema]], Optional[Exception]]]:
+        """全vCenterからESXiホスト一覧を取得し、取得が完了したvCenterから順に返す（offset/max_resultsはvCenterごとに適用）"""
+
+        vcenter_names = [vcenter_name] if vcenter_name else list(configs.keys())
+        return WorkScheduler.stream_from_vcenters(
+            priority,
+            cls._get_hosts_from_vcenter,
+            vcenter_names,
+            cancel_token=cancel_token,
+            service_instances=service_instances,
+            configs=configs,
+            offset=offset,
+            max_results=max_results,
+            request_id=request_id,
+        )
+
     @classmethod
     @Logging.func_logger
     def _get_hosts_from_vcenter(
@@ -105,10 +139,42 @@ class Host(object):
         offset=0,
         max_results=100,
         request_id: str = None,
+        cancel_token: CancellationToken = None,
     ) -> list[HostResponseSchema]:
-        """特定のvCenterからESXiホスト一覧を取得"""
+        """特定のvCenterからESXiホスト一覧を取得(vCenter単位でキャッシュした結果にoffset/max_resultsを適用)"""
+
+        hosts_by_fragment = FragmentCache.get_fragments(
+            resource="hosts",
+            vcenter_name=vcenter_name,
+            fragments=[cls.FRAGMENT_ALL],
+            compute=lambda fragments: {
+                cls.FRAGMENT_ALL: cls._get_all_hosts_from_vcenter(
+                    vcenter_name=vcenter_name,
+                    service_instances=service_instances,
+                    request_id=request_id,
+                    cancel_token=cancel_token,
+                )
+            },
+            request_id=request_id,
+        )
+        return FragmentCache.assemble(hosts_by_fragment, offset=offset, max_results=max_results)
 
-        results = []
+    @classmethod
+    @Logging.func_logger
+    @LastKnownGood.fallback
+    @VCenterRateLimiter.limited
+    @ServiceInstancePool.pooled
+    def _get_all_hosts_from_vcenter(
+        cls,
+        vcenter_name: str,
+        service_instances: dict,
+        request_id: str = None,
+        cancel_token: CancellationToken = None,
+    ) -> list[HostResponseSchema]:
+        """特定のvCenterから全てのESXiホストを取得"""
+
+        cancel_token = cancel_token or CancellationToken()
+        cancel_token.raise_if_cancelled()
 
         # 指定されたvCenterのService Instanceを取得
         if vcenter_name not in service_instances:
@@ -117,31 +183,35 @@ class Host(object):
             )
 
         content = service_instances[vcenter_name].RetrieveContent()
-        config = configs[vcenter_name]
-
-        datacenter = content.rootFolder.childEntity[0]
-        container = content.viewManager.CreateContainerView(content.rootFolder, [vim.HostSystem], True)
-        hosts = container.view
-        host_count = 0
-
-        for host in hosts:
-            if host_count < offset:
-                host_count += 1
-                continue
-            if host_count >= offset + max_results:
-                break
-
-            if isinstance(host, vim.HostSystem):
-                host_info = cls._generate_host_info(
-                    content=content,
-                    datacenter=datacenter,
-                    host=host,
-                    vcenter_name=vcenter_name,
-                    is_detail=False,
-                )
-                results.append(host_info)
-                host_count += 1
-        return results
+
+        def collect_hosts(datacenter, limit: Optional[int]) -> list[vim.HostSystem]:
+            cancel_token.raise_if_cancelled()
+            container = content.viewManager.CreateContainerView(datacenter.hostFolder, [vim.HostSystem], True)
+            try:
+                hosts = [host for host in container.view if isinstance(host, vim.HostSystem)]
+            finally:
+                # キャンセル時も含め、vCenter上のビューを破棄
+                container.Destroy()
+            return hosts if limit is None else hosts[:limit]
+
+        def generate_host_info(datacenter, host: vim.HostSystem) -> HostResponseSchema:
+            # ESXiホスト単位でキャンセル要求を確認
+            cancel_token.raise_if_cancelled()
+            return cls._generate_host_info(
+                content=content,
+                datacenter=datacenter,
+                host=host,
+                vcenter_name=vcenter_name,
+                is_detail=False,
+            )
+
+        # データセンターごとに並行して走査し、結果を結合
+        return Helper.scan_datacenters(
+            datacenters=Helper.get_datacenters(content),
+            collect=collect_hosts,
+            generate=generate_host_info,
+            cancel_token=cancel_token,
+        )
 
     @classmethod
     @Logging.func_logger
@@ -149,28 +219,28 @@ class Host(object):
         cls,
         vcenter_name: str,
         service_instances: dict,
+        configs,
         host_uuid: str,
         request_id: str = None,
+        priority: WorkScheduler.Priority = WorkScheduler.PRIORITY_INTERACTIVE,
+        cancel_token: CancellationToken = None,
     ) -> HostResponseSchema:
         """指定したUUIDのESXiホストを取得"""
 
         result = None
-        max_vcenter_web_service_worker_threads = int(
-            os.getenv(
-                "VLB_MAX_VCENTER_WEB_SERVICE_WORKER_THREADS",
-                cls.VLB_MAX_VCENTER_WEB_SERVICE_WORKER_THREADS_DEFAULT,
-            )
-        )
 
         if vcenter_name:
             # vCenterを指定した場合、指定したvCenterからESXiホストを取得
             try:
-                host = cls._get_host_by_uuid(
+                host = WorkScheduler.submit(
+                    priority,
+                    cls._get_host_by_uuid,
                     vcenter_name=vcenter_name,
                     service_instances=service_instances,
                     host_uuid=host_uuid,
                     request_id=request_id,
-                )
+                    cancel_token=cancel_token,
+                ).result()
                 if host is not None:
                     Logging.info(f"{request_id} vCenter({vcenter_name})からのESXiホスト情報取得に成功")
                     result = host
@@ -182,46 +252,53 @@ class Host(object):
         else:
             # vCenterを指定しない場合、すべてのvCenterからESXiホストを取得
             futures = {}
-            with ThreadPoolExecutor(max_workers=max_vcenter_web_service_worker_threads) as executor:
-                try:
-                    # 各vCenterからESXiホストを取得するスレッドを作成
-                    for vcenter_name in service_instances.keys():
-                        futures[vcenter_name] = executor.submit(
-                            cls._get_host_by_uuid,
-                            vcenter_name,
-                            service_instances,
-                            host_uuid,
-                            request_id,
-                        )
+            try:
+                # 各vCenterからESXiホストを取得する処理をスケジューラに登録
+                for vcenter_name in configs.keys():
+                    futures[vcenter_name] = WorkScheduler.submit(
+                        priority,
+                        cls._get_host_by_uuid,
+                        vcenter_name,
+                        service_instances,
+                        host_uuid,
+                        request_id,
+                        cancel_token=cancel_token,
+                    )
 
-                    # 各スレッドの実行結果を回収
-                    for vcenter_name in service_instances.keys():
-                        host = futures[vcenter_name].result()
-                        if host is not None:
-                            Logging.info(f"{request_id} vCenter({vcenter_name})からのESXiホスト情報取得に成功")
-                            result = host
-                        else:
-                            Logging.info(
-                                f"{request_id} vCenter({vcenter_name})にUUID({host_uuid})を持つESXiホストは見つかりませんでした。"
-                            )
-                except HTTPException as e:
-                    Logging.info(f"{request_id} vCenter({vcenter_name})からのESXiホスト情報取得に失敗: {e}")
-                    pass
-                except Exception as e:
-                    raise e
+                # 各処理の実行結果を回収
+                for vcenter_name in configs.keys():
+                    host = futures[vcenter_name].result()
+                    if host is not None:
+                        Logging.info(f"{request_id} vCenter({vcenter_name})からのESXiホスト情報取得に成功")
+                        result = host
+                    else:
+                        Logging.info(
+                            f"{request_id} vCenter({vcenter_name})にUUID({host_uuid})を持つESXiホストは見つかりませんでした。"
+                        )
+            except HTTPException as e:
+                Logging.info(f"{request_id} vCenter({vcenter_name})からのESXiホスト情報取得に失敗: {e}")
+                pass
+            except Exception as e:
+                raise e
         return result
 
     @classmethod
     @Logging.func_logger
+    @VCenterRateLimiter.limited
+    @ServiceInstancePool.pooled
     def _get_host_by_uuid(
         cls,
         vcenter_name: str,
         service_instances: dict,
         host_uuid: str,
         request_id: str = None,
+        cancel_token: CancellationToken = None,
     ) -> HostResponseSchema:
         """UUIDとvCenterを指定して、ESXiホスト情報を取得"""
 
+        cancel_token = cancel_token or CancellationToken()
+        cancel_token.raise_if_cancelled()
+
         # 指定されたvCenterのService Instanceを取得
         if vcenter_name not in service_instances:
             raise HTTPException(
@@ -229,10 +306,9 @@ class Host(object):
             )
 
         content = service_instances[vcenter_name].RetrieveContent()
-        datacenter = content.rootFolder.childEntity[0]
         search_index = content.searchIndex
 
-        # ESXiホストをUUIDを指定して検索
+        # ESXiホストをUUIDを指定して検索(全データセンターが検索対象)
         host = search_index.FindByUuid(
             uuid=host_uuid,
             vmSearch=False,
@@ -242,7 +318,7 @@ class Host(object):
         if isinstance(host, vim.HostSystem):
             return cls._generate_host_info(
                 content=content,
-                datacenter=datacenter,
+                datacenter=Helper.get_datacenter_of(host, content),
                 host=host,
                 vcenter_name=vcenter_name,
                 is_detail=True,
@@ -342,8 +418,11 @@ class Host(object):
                     dvs_view = content.viewManager.CreateContainerView(
                         content.rootFolder, [vim.DistributedVirtualSwitch], True
                     )
-                    for dvs in dvs_view.view:
-                        vswitches.append({"name": dvs.name})
+                    try:
+                        for dvs in dvs_view.view:
+                            vswitches.append({"name": dvs.name})
+                    finally:
+                        dvs_view.Destroy()
 
         if is_detail:
             host_info = {
@@ -0,0 +1,245 @@
+import functools
+import hashlib
+import inspect
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import UTC, datetime
+from typing import Callable, Optional
+
+import setuptools
+from redis import Redis
+from redis.exceptions import RedisError
+from vcenter_lookup_bridge.utils.cancellation import OperationCancelledError
+from vcenter_lookup_bridge.utils.logging import Logging
+from vcenter_lookup_bridge.utils.serialize_util import SerializeUtil
+from vcenter_lookup_bridge.vmware.vcenter_circuit_breaker import VCenterCircuitBreaker
+from vcenter_lookup_bridge.vmware.vcenter_ws_session_managr import VCenterWSSessionManager
+
+
+class LastKnownGood(object):
+    """vCenterごとの一覧の取得結果のうち、最後に取得に成功したものを保持するクラス
+
+    取得に成功した結果をRedisに保存し、vCenterへの接続が遮断されている場合や、取得に失敗した場合
+    (制限時間の超過を含む)は、猶予期間内であれば保存した結果を返します。
+    保存した結果を返したvCenterと取得時刻は、リクエストIDごとに記録し、レスポンスのstaleVcentersで返します。
+    断片(仮想マシンフォルダ・タグなど)ごとの取得結果を返す処理は、断片ごとに保存し、取得する断片の組み合わせが
+    異なるリクエストでも、保存した結果を利用できるようにします。
+
+    Attributes:
+        RESULT_PREFIX (str): 取得結果のキーのプレフィックス
+        STALE_PREFIX (str): 保存した結果を返したvCenterを記録するキーのプレフィックス
+    """
+
+    # Const
+    VLB_LAST_KNOWN_GOOD_ENABLED_DEFAULT = "True"
+    VLB_LAST_KNOWN_GOOD_GRACE_SEC_DEFAULT = 86400
+    RESULT_PREFIX = "vlb_last_known_good:"
+    STALE_PREFIX = "vlb_last_known_good_stale:"
+    STALE_EXPIRE_SEC = 600
+    REDIS_RETRY_INTERVAL_SEC = 30
+    # 取得結果を区別するキーに含めない引数
+    IGNORED_ARGS = ("cls", "service_instances", "configs", "request_id", "cancel_token")
+
+    _redis: Optional[Redis] = None
+    _redis_unavailable_until = 0.0
+    _lock = threading.Lock()
+    _local = threading.local()
+
+    @classmethod
+    def is_enabled(cls) -> bool:
+        return bool(
+            setuptools.distutils.util.strtobool(
+                os.getenv("VLB_LAST_KNOWN_GOOD_ENABLED", cls.VLB_LAST_KNOWN_GOOD_ENABLED_DEFAULT)
+            )
+        )
+
+    @classmethod
+    def get_grace_sec(cls) -> int:
+        return int(os.getenv("VLB_LAST_KNOWN_GOOD_GRACE_SEC", cls.VLB_LAST_KNOWN_GOOD_GRACE_SEC_DEFAULT))
+
+    @classmethod
+    def fallback(cls, func: Optional[Callable] = None, fragments_arg: Optional[str] = None) -> Callable:
+        """
+        vCenterごとの一覧の取得処理に、最後に取得に成功した結果へのフォールバックを適用するデコレータ
+
+        デコレート対象の関数は、引数にvcenter_nameとrequest_idを持つ必要があります。
+        fragments_argを指定した場合、デコレート対象の関数は、その引数で指定された断片の名前と取得結果の辞書を
+        返す必要があり、取得結果を断片ごとに保存します。
+
+        Args:
+            func (Optional[Callable]): デコレート対象の関数(fragments_argを指定する場合は省略)
+            fragments_arg (Optional[str]): 断片の名前のリストを受け取る引数の名前
+        """
+        if func is None:
+            return functools.partial(cls.fallback, fragments_arg=fragments_arg)
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not cls.is_enabled():
+                return func(*args, **kwargs)
+            redis = cls._get_redis()
+            if redis is None:
+                return func(*args, **kwargs)
+
+            bound = signature.bind(*args, **kwargs)
+            vcenter_name = bound.arguments.get("vcenter_name")
+            request_id = bound.arguments.get("request_id")
+            if fragments_arg is None:
+                keys = {None: cls._get_result_key(func, vcenter_name, bound.arguments)}
+            else:
+                keys = {
+                    fragment: cls._get_result_key(func, vcenter_name, {**bound.arguments, fragments_arg: fragment})
+                    for fragment in bound.arguments.get(fragments_arg) or []
+                }
+
+            # 遮断中のvCenterには接続を試みず、保存した結果を返す
+            circuit = VCenterCircuitBreaker.get_state(redis=redis, vcenter_name=vcenter_name)
+            if not VCenterCircuitBreaker.allows_request(circuit):
+                records = cls._load_all(redis, keys)
+                if records is not None:
+                    return cls._serve(redis, records, vcenter_name, request_id, reason="接続が遮断されている")
+
+            try:
+                results = func(*args, **kwargs)
+            except OperationCancelledError:
+                raise
+            except Exception as e:
+                records = cls._load_all(redis, keys)
+                if records is None:
+                    raise
+                return cls._serve(redis, records, vcenter_name, request_id, reason=f"取得に失敗した({e})")
+
+            if fragments_arg is None:
+                cls._save(redis, keys[None], vcenter_name, results)
+            else:
+                for fragment, key in keys.items():
+                    cls._save(redis, key, vcenter_name, results.get(fragment, []))
+            return results
+
+        return wrapper
+
+    @classmethod
+    @contextmanager
+    def detect_stale(cls):
+        """
+        ブロック内の取得処理が、保存した結果を返したかどうかを検出します
+
+        返した辞書のstaleは、保存した結果を返した場合にTrueになります。
+        保存した結果を、新たに取得した結果として別のキャッシュに登録しないために利用します。
+        """
+        detection = {"stale": False}
+        detections = cls._local.__dict__.setdefault("detections", [])
+        detections.append(detection)
+        try:
+            yield detection
+        finally:
+            detections.remove(detection)
+
+    @classmethod
+    def get_stale_vcenters(cls, request_id: str) -> Optional[dict]:
+        """リクエストで保存した結果を返したvCenterと、その結果の取得時刻(ISO 8601)を返します"""
+
+        redis = cls._get_redis()
+        if redis is None or request_id is None:
+            return None
+        try:
+            stale_vcenters = redis.hgetall(f"{cls.STALE_PREFIX}{request_id}")
+        except RedisError as e:
+            Logging.warning(f"{request_id} 保存した結果を返したvCenterの取得に失敗しました: {e}")
+            return None
+        if not stale_vcenters:
+            return None
+        return {k.decode("utf-8"): v.decode("utf-8") for k, v in stale_vcenters.items()}
+
+    @classmethod
+    def _serve(cls, redis: Redis, records: dict, vcenter_name: str, request_id: str, reason: str):
+        """保存した結果を返します(断片ごとに保存した場合は、最も古い取得時刻を記録します)"""
+
+        retrieved_at = datetime.fromtimestamp(
+            min(record["retrievedAt"] for record in records.values()), UTC
+        ).isoformat()
+        Logging.warning(
+            f"{request_id} vCenter({vcenter_name})への{reason}ため、{retrieved_at}に取得した結果を返します。"
+        )
+        for detection in getattr(cls._local, "detections", []):
+            detection["stale"] = True
+        if request_id is not None:
+            try:
+                stale_key = f"{cls.STALE_PREFIX}{request_id}"
+                redis.hset(stale_key, vcenter_name, retrieved_at)
+                redis.expire(stale_key, cls.STALE_EXPIRE_SEC)
+            except RedisError as e:
+                Logging.warning(f"{request_id} 保存した結果を返したvCenterの記録に失敗しました: {e}")
+        if list(records.keys()) == [None]:
+            return records[None]["results"]
+        return {fragment: record["results"] for fragment, record in records.items()}
+
+    @classmethod
+    def _save(cls, redis: Redis, key: str, vcenter_name: str, results) -> None:
+        try:
+            redis.set(
+                key,
+                SerializeUtil.dumps({"retrievedAt": time.time(), "results": results}),
+                ex=cls.get_grace_sec(),
+            )
+        except RedisError as e:
+            cls._mark_redis_unavailable()
+            Logging.warning(f"vCenter({vcenter_name})の取得結果の保存に失敗しました: {e}")
+
+    @classmethod
+    def _load(cls, redis: Redis, key: str) -> Optional[dict]:
+        try:
+            record = redis.get(key)
+        except RedisError as e:
+            cls._mark_redis_unavailable()
+            Logging.warning(f"保存した取得結果の読み込みに失敗しました: {e}")
+            return None
+        if not record:
+            return None
+        try:
+            return SerializeUtil.loads(record)
+        except ValueError as e:
+            # 形式の異なる(旧形式で保存した)結果は、保存していないものとして扱う
+            Logging.warning(f"保存した取得結果を読み込めないため、破棄します: {e}")
+            return None
+
+    @classmethod
+    def _load_all(cls, redis: Redis, keys: dict) -> Optional[dict]:
+        """断片ごとの保存した結果を返します。保存した結果がない断片がある場合はNoneを返します"""
+
+        records = {}
+        for fragment, key in keys.items():
+            record = cls._load(redis, key)
+            if record is None:
+                return None
+            records[fragment] = record
+        return records or None
+
+    @classmethod
+    def _get_result_key(cls, func: Callable, vcenter_name: str, arguments: dict) -> str:
+        params = repr(sorted((k, v) for k, v in arguments.items() if k not in cls.IGNORED_ARGS))
+        digest = hashlib.sha1(params.encode("utf-8")).hexdigest()
+        return f"{cls.RESULT_PREFIX}{func.__qualname__}:{vcenter_name}:{digest}"
+
+    @classmethod
+    def _get_redis(cls) -> Optional[Redis]:
+        if time.monotonic() < cls._redis_unavailable_until:
+            return None
+        if cls._redis is None:
+            with cls._lock:
+                if cls._redis is None:
+                    try:
+                        cls._redis = VCenterWSSessionManager.initialize()
+                    except Exception as e:
+                        cls._mark_redis_unavailable()
+                        Logging.warning(f"取得結果の保存用のRedis接続を初期化できませんでした: {e}")
+                        return None
+        return cls._redis
+
+    @classmethod
+    def _mark_redis_unavailable(cls) -> None:
+        # Redisの障害時に毎回タイムアウトを待たないよう、一定時間は結果の保存・読み込みを行わない
+        cls._redis_unavailable_until = time.monotonic() + cls.REDIS_RETRY_INTERVAL_SEC
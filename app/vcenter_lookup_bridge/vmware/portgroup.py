@@ -1,12 +1,17 @@
 import os
 
 from typing import Optional
-from concurrent.futures import ThreadPoolExecutor
 from fastapi import HTTPException
 from pyVmomi import vim
+from vcenter_lookup_bridge.utils.cancellation import CancellationToken
 from vcenter_lookup_bridge.utils.logging import Logging
+from vcenter_lookup_bridge.vmware.fragment_cache import FragmentCache
 from vcenter_lookup_bridge.vmware.tag import Tag
 from vcenter_lookup_bridge.schemas.portgroup_parameter import PortgroupResponseSchema
+from vcenter_lookup_bridge.vmware.last_known_good import LastKnownGood
+from vcenter_lookup_bridge.vmware.service_instance_pool import ServiceInstancePool
+from vcenter_lookup_bridge.vmware.vcenter_rate_limiter import VCenterRateLimiter
+from vcenter_lookup_bridge.vmware.work_scheduler import WorkScheduler
 
 
 class Portgroup(object):
@@ -14,7 +19,6 @@ class Portgroup(object):
 
     # Const
     VLB_MAX_RETRIEVE_VCENTER_OBJECTS_DEFAULT = 1000
-    VLB_MAX_VCENTER_WEB_SERVICE_WORKER_THREADS_DEFAULT = 10
 
     @classmethod
     @Logging.func_logger
@@ -28,6 +32,8 @@ class Portgroup(object):
         offset=0,
         max_results=100,
         request_id: str = None,
+        priority: WorkScheduler.Priority = WorkScheduler.PRIORITY_BULK,
+        cancel_token: CancellationToken = None,
     ) -> tuple[list[PortgroupResponseSchema], int]:
         """全vCenterからポートグループ一覧を取得"""
 
@@ -40,17 +46,13 @@ class Portgroup(object):
                 cls.VLB_MAX_RETRIEVE_VCENTER_OBJECTS_DEFAULT,
             )
         )
-        max_vcenter_web_service_worker_threads = int(
-            os.getenv(
-                "VLB_MAX_VCENTER_WEB_SERVICE_WORKER_THREADS",
-                cls.VLB_MAX_VCENTER_WEB_SERVICE_WORKER_THREADS_DEFAULT,
-            )
-        )
 
         if vcenter_name:
             # vCenterを指定した場合、指定したvCenterからポートグループ一覧を取得
             try:
-                portgroups = cls._get_portgroups_by_tags_from_vcenter(
+                portgroups = WorkScheduler.submit(
+                    priority,
+                    cls._get_portgroups_by_tags_from_vcenter,
                     vcenter_name=vcenter_name,
                     service_instances=service_instances,
                     configs=configs,
@@ -59,7 +61,8 @@ class Portgroup(object):
                     offset=offset,
                     max_results=max_results,
                     request_id=request_id,
-                )
+                    cancel_token=cancel_token,
+                ).result()
                 all_portgroups.extend(portgroups)
                 total_portgroup_count = len(all_portgroups)
             except Exception as e:
@@ -68,38 +71,39 @@ class Portgroup(object):
         else:
             # vCenterを指定しない場合、すべてのvCenterからポートグループ一覧を取得
             futures = {}
-            with ThreadPoolExecutor(max_workers=max_vcenter_web_service_worker_threads) as executor:
-                try:
-                    # 各vCenterからポートグループ一覧を取得するスレッドを作成
-                    for vcenter_name in configs.keys():
-                        futures[vcenter_name] = executor.submit(
-                            cls._get_portgroups_by_tags_from_vcenter,
-                            vcenter_name,
-                            service_instances,
-                            configs,
-                            tag_category,
-                            tags,
-                            offset_vcenter,
-                            max_retrieve_vcenter_objects,
-                            request_id,
-                        )
-
-                    # 各スレッドの実行結果を回収
-                    for vcenter_name in configs.keys():
-                        portgroups = futures[vcenter_name].result()
-                        Logging.info(f"{request_id} vCenter({vcenter_name})からのポートグループ情報取得に成功")
-                        all_portgroups.extend(portgroups)
-
-                    # 全ポートグループ数を取得
-                    total_portgroup_count = len(all_portgroups)
-
-                    # オフセットと最大件数の調整
-                    all_portgroups = all_portgroups[offset:]
-                    if len(all_portgroups) > max_results:
-                        all_portgroups = all_portgroups[:max_results]
-
-                except Exception as e:
-                    Logging.error(f"{request_id} vCenter({vcenter_name})からのポートグループ情報取得に失敗: {e}")
+            try:
+                # 各vCenterからポートグループ一覧を取得する処理をスケジューラに登録
+                for vcenter_name in configs.keys():
+                    futures[vcenter_name] = WorkScheduler.submit(
+                        priority,
+                        cls._get_portgroups_by_tags_from_vcenter,
+                        vcenter_name,
+                        service_instances,
+                        configs,
+                        tag_category,
+                        tags,
+                        offset_vcenter,
+                        max_retrieve_vcenter_objects,
+                        request_id,
+                        cancel_token=cancel_token,
+                    )
+
+                # 各処理の実行結果を回収
+                for vcenter_name in configs.keys():
+                    portgroups = futures[vcenter_name].result()
+                    Logging.info(f"{request_id} vCenter({vcenter_name})からのポートグループ情報取得に成功")
+                    all_portgroups.extend(portgroups)
+
+                # 全ポートグループ数を取得
+                total_portgroup_count = len(all_portgroups)
+
+                # オフセットと最大件数の調整
+                all_portgroups = all_portgroups[offset:]
+                if len(all_portgroups) > max_results:
+                    all_portgroups = all_portgroups[:max_results]
+
+            except Exception as e:
+                Logging.error(f"{request_id} vCenter({vcenter_name})からのポートグループ情報取得に失敗: {e}")
 
         return all_portgroups, total_portgroup_count
 
@@ -115,11 +119,54 @@ class Portgroup(object):
         offset: int = 0,
         max_results: int = 100,
         request_id: str = None,
+        cancel_token: CancellationToken = None,
     ) -> list:
-        """指定したvCenterからポートグループ一覧を取得"""
+        """指定したvCenterからポートグループ一覧を取得(タグ単位でキャッシュした結果を結合)"""
+
+        portgroups_by_fragment = FragmentCache.get_fragments(
+            resource="portgroups",
+            vcenter_name=vcenter_name,
+            fragments=[f"{tag_category}/{tag}" for tag in tags],
+            compute=lambda fragments: {
+                f"{tag_category}/{tag}": portgroups
+                for tag, portgroups in cls._get_portgroups_by_tag_fragments_from_vcenter(
+                    vcenter_name=vcenter_name,
+                    service_instances=service_instances,
+                    configs=configs,
+                    tag_category=tag_category,
+                    tags=[fragment[len(tag_category) + 1 :] for fragment in fragments],
+                    request_id=request_id,
+                    cancel_token=cancel_token,
+                ).items()
+            },
+            request_id=request_id,
+        )
+        # 複数のタグが付与されたポートグループは、1件のみ返す
+        return FragmentCache.assemble(
+            portgroups_by_fragment, offset=offset, max_results=max_results, unique_key=lambda result: result["name"]
+        )
+
+    @classmethod
+    @Logging.func_logger
+    @LastKnownGood.fallback(fragments_arg="tags")
+    @VCenterRateLimiter.limited
+    @ServiceInstancePool.pooled
+    def _get_portgroups_by_tag_fragments_from_vcenter(
+        cls,
+        vcenter_name: str,
+        service_instances: dict,
+        configs,
+        tag_category: str,
+        tags: list[str],
+        request_id: str = None,
+        cancel_token: CancellationToken = None,
+    ) -> dict[str, list]:
+        """指定したvCenterから、タグごとのポートグループ一覧を取得"""
+
+        cancel_token = cancel_token or CancellationToken()
+        cancel_token.raise_if_cancelled()
 
-        results = []
-        portgroup_count = 0
+        results = {tag: [] for tag in tags}
 
         # 指定されたvCenterのService Instanceを取得
         if vcenter_name not in service_instances:
@@ -131,7 +178,11 @@ class Portgroup(object):
         config = configs[vcenter_name]
 
         cv = content.viewManager.CreateContainerView(container=content.rootFolder, type=[vim.Network], recursive=True)
-        portgroups = cv.view
+        try:
+            portgroups = cv.view
+        finally:
+            # 一覧の取得後は不要なため、vCenter上のビューを破棄
+            cv.Destroy()
         portgroup_tags = Tag.get_all_portgroup_tags(config=config)
         if portgroup_tags is None:
             raise HTTPException(status_code=500, detail="ポートグループのタグを取得中にエラーが発生しました。")
@@ -139,33 +190,18 @@ class Portgroup(object):
         if portgroups is None:
             return results
         for portgroup in portgroups:
-            # offsetまでスキップ
-            if portgroup_count < offset:
-                portgroup_count += 1
+            cancel_token.raise_if_cancelled()
+            if not isinstance(portgroup, vim.Network) or tag_category not in portgroup_tags.get(portgroup.name, {}):
+                continue
+            attached_tags = portgroup_tags[portgroup.name][tag_category]
+            matched_tags = [tag for tag in tags if tag in [str(attached_tag) for attached_tag in attached_tags]]
+            if not matched_tags:
                 continue
-            # max_resultsまで取得
-            if portgroup_count >= offset + max_results:
-                break
-
-            if isinstance(portgroup, vim.Network):
-                for portgroup_name in portgroup_tags.keys():
-                    if portgroup.name == portgroup_name:
-                        if tag_category in portgroup_tags[portgroup_name]:
-                            portgroup_config = cls._generate_portgroup_info(
-                                portgroup=portgroup, vcenter_name=vcenter_name
-                            )
-                            portgroup_config["tag_category"] = tag_category
-                            portgroup_config["tags"] = portgroup_tags[portgroup_name][tag_category]
-
-                            for attached_tag in portgroup_tags[portgroup_name][tag_category]:
-                                # すでに結果に追加済みのデータストアであれば、スキップ
-                                if portgroup_name in [result["name"] for result in results]:
-                                    continue
-
-                                # タグが一致していれば、結果に追加
-                                if str(attached_tag) in tags:
-                                    results.append(portgroup_config)
-                                    portgroup_count += 1
+            portgroup_config = cls._generate_portgroup_info(portgroup=portgroup, vcenter_name=vcenter_name)
+            portgroup_config["tag_category"] = tag_category
+            portgroup_config["tags"] = attached_tags
+            for tag in matched_tags:
+                results[tag].append(portgroup_config)
         return results
 
     @classmethod
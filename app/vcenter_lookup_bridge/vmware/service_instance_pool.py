@@ -0,0 +1,200 @@
+import functools
+import inspect
+import os
+import queue
+import threading
+from contextlib import contextmanager
+from typing import Callable
+
+from pyVmomi import vim
+from pyVmomi.SoapAdapter import SoapStubAdapter
+from vcenter_lookup_bridge.utils.logging import Logging
+from vcenter_lookup_bridge.vmware.connector import Connector
+from vcenter_lookup_bridge.vmware.vcenter_deadline import VCenterDeadline
+
+
+class ServiceInstancePool(object):
+    """vCenterごとに、同じセッションを共有するService Instanceのプールを管理するクラス
+
+    Connectorが作成したService Instanceを元に、SOAPスタブ(SoapStubAdapter)を複製して
+    セッションCookieを共有するService Instanceを作成し、貸し出し/返却の形で利用します。
+    これにより、同じvCenterへの複数スレッドからのリクエストが、1つのスタブのコネクションを取り合わずに並行して実行されます。
+    """
+
+    # Const
+    VLB_VCENTER_SOAP_STUB_POOL_SIZE_DEFAULT = 4
+    VLB_VCENTER_SOAP_STUB_CHECKOUT_TIMEOUT_SEC_DEFAULT = 30
+    # 複製元のSOAPスタブから引き継ぐ、接続先・TLS・プロキシなどの設定
+    STUB_SETTING_ATTRIBUTES = (
+        "host",
+        "path",
+        "scheme",
+        "is_tunnel",
+        "thumbprint",
+        "poolSize",
+        "connectionPoolTimeout",
+        "certFile",
+        "certKeyFile",
+        "samlToken",
+        "requestContext",
+        "_customHeaders",
+        "_acceptCompressedResponses",
+    )
+
+    _pools: dict = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def pooled(cls, func: Callable) -> Callable:
+        """
+        vCenterごとの処理に、プールから貸し出したService Instanceを渡すデコレータ
+
+        デコレート対象の関数は、引数にvcenter_nameとservice_instancesを持つ必要があります。
+        初回の利用時に接続するvCenter(connect_mode: lazy/idle_timeout)の場合は、ここで接続します。
+        """
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            vcenter_name = bound.arguments.get("vcenter_name")
+            service_instances = bound.arguments.get("service_instances")
+            if vcenter_name is not None and service_instances is not None and Connector.is_on_demand(vcenter_name):
+                si = Connector.get_on_demand_service_instance(vcenter_name)
+                service_instances = {k: v for k, v in service_instances.items() if k != vcenter_name}
+                if si is not None:
+                    service_instances[vcenter_name] = si
+                bound.arguments["service_instances"] = service_instances
+
+            if not service_instances or vcenter_name not in service_instances:
+                return func(*bound.args, **bound.kwargs)
+
+            with cls.checkout(vcenter_name, service_instances[vcenter_name]) as si:
+                bound.arguments["service_instances"] = {**service_instances, vcenter_name: si}
+                return func(*bound.args, **bound.kwargs)
+
+        return wrapper
+
+    @classmethod
+    @contextmanager
+    def checkout(cls, vcenter_name: str, base_si):
+        """
+        プールからService Instanceを貸し出し、処理の終了後に返却します
+
+        プールの上限まで貸し出し中で、一定時間内に返却されない場合は、元のService Instanceを共有して利用します。
+        """
+        if not cls._is_poolable(base_si):
+            # テスト用のモックなど、SOAPスタブを複製できない場合はそのまま利用
+            yield base_si
+            return
+
+        pool = cls._get_pool(vcenter_name, base_si)
+        si = cls._take(vcenter_name, pool, base_si)
+        if si is None:
+            yield base_si
+            return
+
+        try:
+            # 元のService Instanceが再ログインした場合に備え、セッションCookieを同期
+            si._stub.cookie = base_si._stub.cookie
+            yield si
+        finally:
+            pool["idle"].put(si)
+
+    @classmethod
+    def get_stats(cls) -> dict:
+        """vCenterごとのプールの作成数と、貸し出し可能な数を返します"""
+
+        with cls._lock:
+            return {
+                vcenter_name: {"created": pool["created"], "idle": pool["idle"].qsize()}
+                for vcenter_name, pool in cls._pools.items()
+            }
+
+    @classmethod
+    def invalidate(cls, vcenter_name: str) -> None:
+        """vCenterへの再接続時などに、vCenterのプールを破棄します"""
+
+        with cls._lock:
+            cls._pools.pop(vcenter_name, None)
+
+    @classmethod
+    def _is_poolable(cls, si) -> bool:
+        return isinstance(si, vim.ServiceInstance) and isinstance(getattr(si, "_stub", None), SoapStubAdapter)
+
+    @classmethod
+    def _get_pool(cls, vcenter_name: str, base_si) -> dict:
+        with cls._lock:
+            pool = cls._pools.get(vcenter_name)
+            # 再接続などでService Instanceが置き換えられた場合は、プールを作り直す
+            if pool is None or pool["base_si"] is not base_si:
+                pool = {
+                    "base_si": base_si,
+                    "idle": queue.LifoQueue(),
+                    "created": 0,
+                    "size": max(
+                        1,
+                        int(
+                            os.getenv(
+                                "VLB_VCENTER_SOAP_STUB_POOL_SIZE",
+                                cls.VLB_VCENTER_SOAP_STUB_POOL_SIZE_DEFAULT,
+                            )
+                        ),
+                    ),
+                }
+                cls._pools[vcenter_name] = pool
+            return pool
+
+    @classmethod
+    def _take(cls, vcenter_name: str, pool: dict, base_si):
+        try:
+            return pool["idle"].get_nowait()
+        except queue.Empty:
+            pass
+
+        with cls._lock:
+            create = pool["created"] < pool["size"]
+            if create:
+                pool["created"] += 1
+        if create:
+            try:
+                return cls._clone_service_instance(vcenter_name, base_si)
+            except Exception as e:
+                # 作成できなかった分は、プールの作成数に含めない
+                with cls._lock:
+                    pool["created"] -= 1
+                Logging.warning(
+                    f"vCenter({vcenter_name})のService Instanceを複製できないため、共有のService Instanceを利用します: {e}"
+                )
+                return None
+
+        timeout = int(
+            os.getenv(
+                "VLB_VCENTER_SOAP_STUB_CHECKOUT_TIMEOUT_SEC",
+                cls.VLB_VCENTER_SOAP_STUB_CHECKOUT_TIMEOUT_SEC_DEFAULT,
+            )
+        )
+        try:
+            return pool["idle"].get(timeout=timeout)
+        except queue.Empty:
+            Logging.warning(
+                f"vCenter({vcenter_name})のService Instanceのプールが枯渇しているため、共有のService Instanceを利用します。"
+            )
+            return None
+
+    @classmethod
+    def _clone_service_instance(cls, vcenter_name: str, base_si):
+        """接続先・TLS・プロキシなどの設定とセッションCookieを引き継いだ、独立したSOAPスタブを作成"""
+
+        base_stub = base_si._stub
+        # コネクションプール・ロック・スレッドごとの状態(制限時間など)は複製元と共有しないよう、新たに作成したスタブに設定のみを引き継ぐ
+        stub = SoapStubAdapter(version=base_stub.version)
+        for name in cls.STUB_SETTING_ATTRIBUTES:
+            if hasattr(base_stub, name):
+                setattr(stub, name, getattr(base_stub, name))
+        stub.schemeArgs = dict(base_stub.schemeArgs)
+        stub.requestModifierList = list(base_stub.requestModifierList)
+        stub.sessionId = base_stub.sessionId
+        stub.cookie = base_stub.cookie
+        VCenterDeadline.apply_to_stub(stub, vcenter_name)
+        return vim.ServiceInstance("ServiceInstance", stub)
@@ -1,6 +1,7 @@
 import requests
 import urllib3
 from vcenter_lookup_bridge.utils.logging import Logging
+from vcenter_lookup_bridge.vmware.vcenter_deadline import VCenterDeadline
 from vmware.vapi.vsphere.client import create_vsphere_client, VsphereClient
 
 # SSL関連の警告出力を抑制
@@ -51,6 +52,8 @@ class Tag(object):
         try:
             session = requests.session()
             session.verify = not config["ignore_ssl_cert_verify"]
+            # 応答のないリクエストでスレッドが占有されないよう、制限時間を設定
+            session.mount("https://", VCenterDeadline.create_rest_adapter(config["name"]))
             # vSphere REST APIの接続先のポート番号は指定することはできない。
             # HTTPS/443固定であることに留意
             client = create_vsphere_client(
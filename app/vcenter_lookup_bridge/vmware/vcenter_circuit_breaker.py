@@ -0,0 +1,195 @@
+import os
+import time
+from typing import Literal
+
+from redis import Redis
+from redis.exceptions import RedisError
+from vcenter_lookup_bridge.utils.logging import Logging
+from vcenter_lookup_bridge.vmware.vcenter_ws_session_managr import VCenterWSSessionManager
+
+
+class VCenterCircuitBreaker(object):
+    """vCenterへの接続を、vCenterごとのサーキットブレーカーで管理するクラス
+
+    状態はRedisで全ワーカープロセス・全コンテナと共有します。
+      - closed: 通常状態。リクエスト時に接続を確認し、失敗が閾値に達した場合はopenに遷移
+      - open: 遮断状態。リクエスト時には接続を試みず、待機時間の経過後にバックグラウンドの検査を1つだけ実行
+      - half_open: 検査中の状態。検査に成功した場合はclosed、失敗した場合は待機時間を倍にしてopenに遷移
+        検査したワーカープロセスが結果を記録せずに停止した場合に備え、ロックの有効期限の経過後は再び検査の対象とする
+    従来の接続状態(alive/dead)も、レスポンスへの表示のために引き続き登録します。
+
+    Attributes:
+        CIRCUIT_PREFIX (str): サーキットブレーカーの状態を保持するキーのプレフィックス
+        PROBE_LOCK_PREFIX (str): 検査を1つに限定するロックのキーのプレフィックス
+    """
+
+    # Const
+    STATE_CLOSED = "closed"
+    STATE_OPEN = "open"
+    STATE_HALF_OPEN = "half_open"
+    VLB_VCENTER_CONNECT_RETRY_MAX_COUNT_DEFAULT = 2
+    VLB_VCENTER_CONNECT_RETRY_INTERVAL_SEC_DEFAULT = 20
+    VLB_VCENTER_CIRCUIT_BACKOFF_MAX_SEC_DEFAULT = 600
+    CIRCUIT_PREFIX = "vlb_vcenter_circuit:"
+    PROBE_LOCK_PREFIX = "vlb_vcenter_circuit_probe:"
+    PROBE_LOCK_EXPIRE_SEC = 120
+
+    # 型定義
+    CircuitState = Literal["closed", "open", "half_open"]
+
+    @classmethod
+    def get_state(cls, redis: Redis, vcenter_name: str) -> dict:
+        """
+        vCenterのサーキットブレーカーの状態を取得します
+
+        Redisを利用できない場合は、リクエストを止めないようclosedとして扱います。
+        """
+        try:
+            circuit = redis.hgetall(f"{cls.CIRCUIT_PREFIX}{vcenter_name}")
+        except RedisError as e:
+            Logging.error(f"vCenter({vcenter_name})のサーキットブレーカーの状態の取得に失敗しました: {e}")
+            circuit = {}
+        return cls._decode_state(circuit)
+
+    @classmethod
+    def allows_request(cls, circuit: dict) -> bool:
+        """リクエスト時に、vCenterへの接続を試みてよいかどうかを返します"""
+
+        return circuit["state"] == cls.STATE_CLOSED
+
+    @classmethod
+    def is_probe_due(cls, circuit: dict, now: float = None) -> bool:
+        """
+        遮断状態で待機時間が経過し、復旧の検査を行うべきかどうかを返します
+
+        検査中(half_open)の場合も、検査の期限(ロックの有効期限)が経過していれば、結果が記録されなかったものとして対象とします。
+        """
+        now = now if now is not None else time.time()
+        return circuit["state"] in (cls.STATE_OPEN, cls.STATE_HALF_OPEN) and now >= circuit["open_until"]
+
+    @classmethod
+    def record_success(cls, redis: Redis, vcenter_name: str) -> None:
+        """接続に成功したことを記録し、closedに遷移します"""
+
+        try:
+            redis.delete(f"{cls.CIRCUIT_PREFIX}{vcenter_name}")
+        except RedisError as e:
+            Logging.error(f"vCenter({vcenter_name})のサーキットブレーカーの更新に失敗しました: {e}")
+        VCenterWSSessionManager.set_vcenter_ws_session(
+            redis=redis,
+            vcenter_name=vcenter_name,
+            status=VCenterWSSessionManager.VCENTER_STATUS_ALIVE,
+        )
+
+    @classmethod
+    def record_failure(cls, redis: Redis, vcenter_name: str) -> dict:
+        """
+        接続に失敗したことを記録し、必要に応じてopenに遷移します
+
+        Returns:
+            dict: 更新後の状態
+        """
+        key = f"{cls.CIRCUIT_PREFIX}{vcenter_name}"
+        try:
+            circuit = cls._decode_state(redis.hgetall(key))
+            circuit["failures"] = int(redis.hincrby(key, "failures", 1))
+            circuit = cls.next_state_on_failure(circuit, now=time.time())
+            redis.hset(
+                key,
+                mapping={
+                    "state": circuit["state"],
+                    "backoff": circuit["backoff"],
+                    "open_until": circuit["open_until"],
+                },
+            )
+        except RedisError as e:
+            Logging.error(f"vCenter({vcenter_name})のサーキットブレーカーの更新に失敗しました: {e}")
+            return cls._decode_state({})
+
+        if circuit["state"] == cls.STATE_OPEN:
+            Logging.error(
+                f"vCenter({vcenter_name})への接続を{circuit['backoff']}秒間遮断します(連続失敗回数: {circuit['failures']})"
+            )
+            VCenterWSSessionManager.set_vcenter_ws_session(
+                redis=redis,
+                vcenter_name=vcenter_name,
+                status=VCenterWSSessionManager.VCENTER_STATUS_DEAD,
+                expire_seconds=int(circuit["backoff"]) + VCenterWSSessionManager.VCENTER_WS_SESSION_EXPIRE_SEC,
+            )
+        return circuit
+
+    @classmethod
+    def next_state_on_failure(cls, circuit: dict, now: float) -> dict:
+        """接続の失敗を受けた次の状態を返します(失敗回数は加算済みであること)"""
+
+        threshold = int(
+            os.getenv("VLB_VCENTER_CONNECT_RETRY_MAX_COUNT", cls.VLB_VCENTER_CONNECT_RETRY_MAX_COUNT_DEFAULT)
+        )
+        if circuit["state"] != cls.STATE_HALF_OPEN and circuit["failures"] < threshold:
+            return circuit
+
+        # 遮断のたびに待機時間を倍にする(指数バックオフ)
+        backoff_base = int(
+            os.getenv("VLB_VCENTER_CONNECT_RETRY_INTERVAL_SEC", cls.VLB_VCENTER_CONNECT_RETRY_INTERVAL_SEC_DEFAULT)
+        )
+        backoff_max = int(
+            os.getenv("VLB_VCENTER_CIRCUIT_BACKOFF_MAX_SEC", cls.VLB_VCENTER_CIRCUIT_BACKOFF_MAX_SEC_DEFAULT)
+        )
+        backoff = backoff_base if circuit["backoff"] <= 0 else min(circuit["backoff"] * 2, backoff_max)
+        return {
+            **circuit,
+            "state": cls.STATE_OPEN,
+            "backoff": backoff,
+            "open_until": now + backoff,
+        }
+
+    @classmethod
+    def try_start_probe(cls, redis: Redis, vcenter_name: str) -> bool:
+        """
+        復旧の検査を開始します
+
+        全ワーカープロセスで1つの検査のみ実行するため、ロックを取得できた場合のみhalf_openに遷移してTrueを返します。
+        """
+        try:
+            if not redis.set(f"{cls.PROBE_LOCK_PREFIX}{vcenter_name}", 1, nx=True, ex=cls.PROBE_LOCK_EXPIRE_SEC):
+                return False
+            # 検査の期限をロックの有効期限と揃え、期限の経過後は再び検査の対象とする
+            redis.hset(
+                f"{cls.CIRCUIT_PREFIX}{vcenter_name}",
+                mapping={
+                    "state": cls.STATE_HALF_OPEN,
+                    "open_until": time.time() + cls.PROBE_LOCK_EXPIRE_SEC,
+                },
+            )
+            return True
+        except RedisError as e:
+            Logging.error(f"vCenter({vcenter_name})の復旧の検査を開始できませんでした: {e}")
+            return False
+
+    @classmethod
+    def finish_probe(cls, redis: Redis, vcenter_name: str) -> None:
+        try:
+            redis.delete(f"{cls.PROBE_LOCK_PREFIX}{vcenter_name}")
+        except RedisError as e:
+            # 解放できなかったロックは、有効期限の経過後に削除される
+            Logging.warning(f"vCenter({vcenter_name})の検査のロックの解放に失敗しました: {e}")
+
+    @classmethod
+    async def reset_all_async(cls, redis: Redis, configs: dict) -> None:
+        """全てのvCenterのサーキットブレーカーをclosedに戻します"""
+
+        for vcenter_name in configs.keys():
+            await redis.delete(f"{cls.CIRCUIT_PREFIX}{vcenter_name}", f"{cls.PROBE_LOCK_PREFIX}{vcenter_name}")
+
+    @classmethod
+    def _decode_state(cls, circuit: dict) -> dict:
+        circuit = {
+            (k.decode("utf-8") if isinstance(k, bytes) else k): (v.decode("utf-8") if isinstance(v, bytes) else v)
+            for k, v in circuit.items()
+        }
+        return {
+            "state": circuit.get("state", cls.STATE_CLOSED),
+            "failures": int(circuit.get("failures", 0)),
+            "backoff": int(float(circuit.get("backoff", 0))),
+            "open_until": float(circuit.get("open_until", 0)),
+        }
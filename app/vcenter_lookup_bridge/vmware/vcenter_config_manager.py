@@ -0,0 +1,146 @@
+import os
+import pathlib
+import threading
+from typing import Optional
+
+import setuptools
+import vcenter_lookup_bridge.vmware.instances as g
+from vcenter_lookup_bridge.utils.config_util import ConfigUtil
+from vcenter_lookup_bridge.utils.logging import Logging
+from vcenter_lookup_bridge.vmware.connector import Connector
+
+
+class VCenterConfigManager(object):
+    """vCenterの設定(config/vcenters/*.yml)を管理し、ワーカープロセスを再起動せずに変更を反映するクラス
+
+    バックグラウンドのスレッドで設定ファイルの変更を監視し、変更された場合は読み込み直した設定と比較して、
+    追加されたvCenterへの接続、削除されたvCenterの切断、設定が変更されたvCenterの再接続のみを行います。
+    設定の辞書は差し替えで更新するため、処理中のリクエストは変更前または変更後のいずれかの設定を参照します。
+    """
+
+    # Const
+    CONFIG_VCENTER_DIR_DEFAULT = "./config/vcenters"
+    VLB_VCENTER_CONFIG_RELOAD_ENABLED_DEFAULT = "True"
+    VLB_VCENTER_CONFIG_RELOAD_INTERVAL_SEC_DEFAULT = 10
+
+    _config_dir: str = CONFIG_VCENTER_DIR_DEFAULT
+    _signature: Optional[tuple] = None
+    _reload_lock = threading.Lock()
+    _watcher: Optional[threading.Thread] = None
+    _watcher_stop = threading.Event()
+
+    @classmethod
+    def is_reload_enabled(cls) -> bool:
+        return bool(
+            setuptools.distutils.util.strtobool(
+                os.getenv("VLB_VCENTER_CONFIG_RELOAD_ENABLED", cls.VLB_VCENTER_CONFIG_RELOAD_ENABLED_DEFAULT)
+            )
+        )
+
+    @classmethod
+    def get_vcenter_configurations(cls) -> dict:
+        return getattr(g, "vcenter_configurations", {})
+
+    @classmethod
+    def set_vcenter_configurations(cls, configs: dict) -> None:
+        """vCenterの設定を差し替えます"""
+
+        g.vcenter_configurations = dict(configs)
+
+    @classmethod
+    @Logging.func_logger
+    def load_vcenter_configurations(cls, config_dir: str = CONFIG_VCENTER_DIR_DEFAULT) -> dict:
+        """設定ファイルを読み込んで設定を差し替え、以降の変更の監視対象とします"""
+
+        cls._config_dir = config_dir
+        signature = cls._get_signature(config_dir)
+        configs = ConfigUtil.load_vcenter_configurations(config_dir)
+        cls.set_vcenter_configurations(configs)
+        cls._signature = signature
+        return configs
+
+    @classmethod
+    @Logging.func_logger
+    def reload(cls) -> bool:
+        """
+        設定ファイルが変更されている場合に読み込み直し、変更のあったvCenterの接続のみを更新します
+
+        Returns:
+            bool: 設定を差し替えた場合はTrue
+        """
+        with cls._reload_lock:
+            try:
+                signature = cls._get_signature(cls._config_dir)
+                if signature == cls._signature:
+                    return False
+                configs = ConfigUtil.load_vcenter_configurations(cls._config_dir)
+            except Exception as e:
+                # 編集途中のファイルなどで読み込めない場合は、現在の設定を維持し、次回の確認で再度読み込む
+                Logging.error(f"vCenterの設定ファイルを読み込めないため、現在の設定を維持します: {e}")
+                return False
+
+            cls._signature = signature
+            added, removed, changed = cls.diff_configurations(cls.get_vcenter_configurations(), configs)
+            if not (added or removed or changed):
+                return False
+
+            Logging.info(f"vCenterの設定を更新します(追加: {added}, 削除: {removed}, 変更: {changed})")
+            cls.set_vcenter_configurations(configs)
+            Connector.apply_configuration_changes(added=added, removed=removed, changed=changed)
+            return True
+
+    @classmethod
+    def diff_configurations(cls, current: dict, new: dict) -> tuple[list, list, list]:
+        """
+        設定を比較し、追加・削除・変更されたvCenterの名前を返します
+
+        Returns:
+            tuple[list, list, list]: 追加されたvCenter, 削除されたvCenter, 設定が変更されたvCenter
+        """
+        added = [vcenter_name for vcenter_name in new.keys() if vcenter_name not in current]
+        removed = [vcenter_name for vcenter_name in current.keys() if vcenter_name not in new]
+        changed = [
+            vcenter_name
+            for vcenter_name in new.keys()
+            if vcenter_name in current and current[vcenter_name] != new[vcenter_name]
+        ]
+        return added, removed, changed
+
+    @classmethod
+    def start_watcher(cls) -> None:
+        """設定ファイルの変更を監視する、バックグラウンドのスレッドを開始します"""
+
+        if os.getenv("TESTING") == "1" or not cls.is_reload_enabled() or cls._watcher is not None:
+            return
+        cls._watcher_stop.clear()
+        cls._watcher = threading.Thread(target=cls._run_watcher, name="vlb-vcenter-config-watcher", daemon=True)
+        cls._watcher.start()
+
+    @classmethod
+    def stop_watcher(cls) -> None:
+        if cls._watcher is not None:
+            cls._watcher_stop.set()
+            cls._watcher.join(timeout=1)
+            cls._watcher = None
+
+    @classmethod
+    def _run_watcher(cls) -> None:
+        interval = int(
+            os.getenv("VLB_VCENTER_CONFIG_RELOAD_INTERVAL_SEC", cls.VLB_VCENTER_CONFIG_RELOAD_INTERVAL_SEC_DEFAULT)
+        )
+        while not cls._watcher_stop.wait(interval):
+            try:
+                cls.reload()
+            except Exception as e:
+                Logging.error(f"vCenterの設定の更新中にエラーが発生しました: {e}")
+
+    @classmethod
+    def _get_signature(cls, config_dir: str) -> tuple:
+        """設定ファイルの名前・更新時刻・サイズから、変更の有無を判定するための値を作成します"""
+
+        signature = []
+        for vcenter_config in sorted(pathlib.Path(f"{config_dir}").iterdir()):
+            if vcenter_config.suffix == ".yml":
+                stat = vcenter_config.stat()
+                signature.append((vcenter_config.name, stat.st_mtime_ns, stat.st_size))
+        return tuple(signature)
@@ -0,0 +1,208 @@
+import heapq
+import itertools
+import os
+import socket
+import threading
+import time
+from typing import Callable, Optional
+
+import vcenter_lookup_bridge.vmware.instances as g
+from fastapi import HTTPException
+from pyVmomi.SoapAdapter import SoapStubAdapter
+from requests.adapters import HTTPAdapter
+from vcenter_lookup_bridge.utils.logging import Logging
+
+
+class VCenterDeadline(object):
+    """vCenterへのSOAP/RESTのリクエストに、処理の種類ごとの制限時間を設定するクラス
+
+    制限時間はvCenterの設定ファイルのcall_timeoutsで処理の種類ごとに指定し、
+    指定がない場合は環境変数(VLB_VCENTER_CALL_TIMEOUT_<種類>_SEC、VLB_VCENTER_CALL_TIMEOUT_SEC)の値を利用します。
+    制限時間を超えたリクエストはコネクションを切断して中断し、スレッドを解放します。
+    """
+
+    # Const
+    VLB_VCENTER_CALL_TIMEOUT_SEC_DEFAULT = 60
+    OPERATION_DEFAULT = "default"
+    OPERATION_RETRIEVE = "retrieve"
+    OPERATION_SEARCH = "search"
+    OPERATION_EVENTS = "events"
+    OPERATION_REST = "rest"
+    OPERATIONS = (OPERATION_DEFAULT, OPERATION_RETRIEVE, OPERATION_SEARCH, OPERATION_EVENTS, OPERATION_REST)
+    # SOAPのメソッド名と処理の種類の対応(対応がないメソッドはdefault)
+    SOAP_METHOD_OPERATIONS = {
+        "RetrieveServiceContent": OPERATION_RETRIEVE,
+        "RetrieveProperties": OPERATION_RETRIEVE,
+        "RetrievePropertiesEx": OPERATION_RETRIEVE,
+        "ContinueRetrievePropertiesEx": OPERATION_RETRIEVE,
+        "FindByInventoryPath": OPERATION_SEARCH,
+        "FindByUuid": OPERATION_SEARCH,
+        "FindByDnsName": OPERATION_SEARCH,
+        "FindByIp": OPERATION_SEARCH,
+        "FindChild": OPERATION_SEARCH,
+        "CreateCollectorForEvents": OPERATION_EVENTS,
+        "ReadNextEvents": OPERATION_EVENTS,
+        "ReadPreviousEvents": OPERATION_EVENTS,
+        "QueryEvents": OPERATION_EVENTS,
+    }
+
+    @classmethod
+    def get_operation(cls, soap_method_name: str) -> str:
+        return cls.SOAP_METHOD_OPERATIONS.get(soap_method_name, cls.OPERATION_DEFAULT)
+
+    @classmethod
+    def get_timeout_sec(cls, vcenter_name: str, operation: str) -> float:
+        """vCenterと処理の種類に応じた制限時間(秒)を返します"""
+
+        config = getattr(g, "vcenter_configurations", {}).get(vcenter_name) or {}
+        call_timeouts = config.get("call_timeouts") or {}
+        if operation in call_timeouts:
+            return float(call_timeouts[operation])
+        if call_timeouts.get(cls.OPERATION_DEFAULT) is not None:
+            default = call_timeouts[cls.OPERATION_DEFAULT]
+        else:
+            default = os.getenv("VLB_VCENTER_CALL_TIMEOUT_SEC", cls.VLB_VCENTER_CALL_TIMEOUT_SEC_DEFAULT)
+        return float(os.getenv(f"VLB_VCENTER_CALL_TIMEOUT_{operation.upper()}_SEC", default))
+
+    @classmethod
+    def apply_to_stub(cls, stub, vcenter_name: str) -> None:
+        """SOAPスタブを、リクエストごとに制限時間を設定するスタブに切り替えます"""
+
+        if isinstance(stub, SoapStubAdapter):
+            stub.__class__ = DeadlineSoapStubAdapter
+            stub.vcenter_name = vcenter_name
+
+    @classmethod
+    def create_rest_adapter(cls, vcenter_name: str) -> HTTPAdapter:
+        """vSphere REST APIのリクエストに制限時間を設定する、requestsのアダプタを作成します"""
+
+        return DeadlineHTTPAdapter(timeout=cls.get_timeout_sec(vcenter_name, cls.OPERATION_REST))
+
+
+class DeadlineHTTPAdapter(HTTPAdapter):
+    """制限時間の指定がないリクエストに、既定の制限時間を設定するrequestsのアダプタ"""
+
+    def __init__(self, timeout: float, *args, **kwargs):
+        self._timeout = timeout
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, timeout=None, **kwargs):
+        return super().send(request, timeout=timeout if timeout is not None else self._timeout, **kwargs)
+
+
+class DeadlineWatchdog(object):
+    """制限時間を超えた処理のコールバックを呼び出す、全スレッドで共有の監視スレッド
+
+    SOAPのリクエストごとにタイマースレッドを作成しないよう、1つのスレッドで期限をまとめて管理します。
+    """
+
+    _heap: list = []
+    # 取り消し可能な(コールバックを呼び出す前の)登録。取り消した登録は、ヒープ上のコールバックをNoneにして無効化する
+    _entries: dict = {}
+    _counter = itertools.count()
+    _condition = threading.Condition()
+    _thread: Optional[threading.Thread] = None
+
+    @classmethod
+    def watch(cls, timeout_sec: float, callback: Callable[[], None]) -> int:
+        """timeout_sec秒後にcallbackを呼び出すよう登録し、取り消しに利用するIDを返します"""
+
+        watch_id = next(cls._counter)
+        entry = [time.monotonic() + timeout_sec, watch_id, callback]
+        with cls._condition:
+            heapq.heappush(cls._heap, entry)
+            cls._entries[watch_id] = entry
+            if cls._thread is None:
+                cls._thread = threading.Thread(target=cls._run, name="vlb-vcenter-deadline-watchdog", daemon=True)
+                cls._thread.start()
+            cls._condition.notify()
+        return watch_id
+
+    @classmethod
+    def cancel(cls, watch_id: int) -> None:
+        """登録を取り消します。コールバックの呼び出し後に取り消した場合は何もしません"""
+
+        with cls._condition:
+            entry = cls._entries.pop(watch_id, None)
+            if entry is not None:
+                entry[2] = None
+
+    @classmethod
+    def _run(cls) -> None:
+        while True:
+            with cls._condition:
+                while not cls._heap:
+                    cls._condition.wait()
+                deadline, watch_id, callback = cls._heap[0]
+                if callback is None:
+                    heapq.heappop(cls._heap)
+                    continue
+                wait_sec = deadline - time.monotonic()
+                if wait_sec > 0:
+                    cls._condition.wait(wait_sec)
+                    continue
+                heapq.heappop(cls._heap)
+                cls._entries.pop(watch_id, None)
+            try:
+                callback()
+            except Exception as e:
+                Logging.warning(f"制限時間を超えた処理の中断に失敗しました: {e}")
+
+
+class DeadlineSoapStubAdapter(SoapStubAdapter):
+    """SOAPのリクエストごとに、処理の種類に応じた制限時間を設定するSOAPスタブ
+
+    ServiceInstancePoolが複製したスタブに適用します。制限時間を超えた場合はソケットを切断し、
+    pyVmomiがスタブのコネクションプールを破棄したうえで、504のHTTPExceptionを送出します。
+    """
+
+    vcenter_name: Optional[str] = None
+
+    def InvokeMethod(self, mo, info, args, outerStub=None):
+        operation = VCenterDeadline.get_operation(info.wsdlName)
+        timeout = VCenterDeadline.get_timeout_sec(self.vcenter_name, operation)
+        call = {"conn": None, "timeout": timeout, "expired": False}
+        self._deadline_local().call = call
+
+        def abort():
+            call["expired"] = True
+            conn = call["conn"]
+            if conn is not None and conn.sock is not None:
+                try:
+                    conn.sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+        watch_id = DeadlineWatchdog.watch(timeout, abort)
+        try:
+            return super().InvokeMethod(mo, info, args, outerStub)
+        except Exception as e:
+            if not call["expired"]:
+                raise
+            Logging.error(
+                f"vCenter({self.vcenter_name})へのリクエスト({info.wsdlName})が制限時間({timeout}秒)を超えたため中断しました: {e}"
+            )
+            raise HTTPException(
+                status_code=504,
+                detail=f"vCenter({self.vcenter_name})からの応答が制限時間内にありませんでした。",
+            )
+        finally:
+            DeadlineWatchdog.cancel(watch_id)
+            self._deadline_local().call = None
+
+    def GetConnection(self):
+        conn = super().GetConnection()
+        call = getattr(self._deadline_local(), "call", None)
+        if call is not None:
+            # 1回の送受信が制限時間を超えないよう、ソケットのタイムアウトも設定
+            conn.timeout = call["timeout"]
+            if conn.sock is not None:
+                conn.sock.settimeout(call["timeout"])
+            call["conn"] = conn
+        return conn
+
+    def _deadline_local(self) -> threading.local:
+        # 複製元のスタブと共有しないよう、スタブごとに作成
+        if "_deadline_local_storage" not in self.__dict__:
+            self.__dict__["_deadline_local_storage"] = threading.local()
+        return self.__dict__["_deadline_local_storage"]
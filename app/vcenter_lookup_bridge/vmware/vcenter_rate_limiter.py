@@ -0,0 +1,257 @@
+import functools
+import inspect
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Callable, Optional
+
+import setuptools
+import vcenter_lookup_bridge.vmware.instances as g
+from fastapi import HTTPException
+from redis import Redis
+from redis.exceptions import RedisError
+from vcenter_lookup_bridge.utils.cancellation import CancellationToken
+from vcenter_lookup_bridge.utils.logging import Logging
+from vcenter_lookup_bridge.vmware.vcenter_ws_session_managr import VCenterWSSessionManager
+
+
+class VCenterRateLimiter(object):
+    """vCenterへのリクエストの流量を、全ワーカープロセス・全コンテナで共有して制限するクラス
+
+    Redisを利用して、vCenterごとに以下の2つの制限を行います。
+      - 同時実行数の上限(リース付きのセマフォ)
+      - 1秒あたりのリクエスト数の上限(トークンバケット)
+    制限値はvCenterの設定ファイルのrate_limitで指定し、指定がない場合は環境変数の値を利用します。
+    Redisを利用できない場合は、vCenterへのリクエストを止めないよう制限せずに処理を継続します。
+
+    Attributes:
+        RATE_LIMIT_SEMAPHORE_PREFIX (str): 同時実行数を管理するキーのプレフィックス
+        RATE_LIMIT_BUCKET_PREFIX (str): トークンバケットを管理するキーのプレフィックス
+    """
+
+    # Const
+    VLB_VCENTER_RATE_LIMIT_ENABLED_DEFAULT = "True"
+    VLB_VCENTER_RATE_LIMIT_MAX_CONCURRENCY_DEFAULT = 8
+    VLB_VCENTER_RATE_LIMIT_REQUESTS_PER_SEC_DEFAULT = 0
+    VLB_VCENTER_RATE_LIMIT_BURST_DEFAULT = 10
+    VLB_VCENTER_RATE_LIMIT_WAIT_TIMEOUT_SEC_DEFAULT = 30
+    VLB_VCENTER_RATE_LIMIT_LEASE_SEC_DEFAULT = 300
+    RATE_LIMIT_SEMAPHORE_PREFIX = "vlb_vcenter_rate_limit_semaphore:"
+    RATE_LIMIT_BUCKET_PREFIX = "vlb_vcenter_rate_limit_bucket:"
+    WAIT_POLL_INTERVAL_SEC = 0.1
+    REDIS_RETRY_INTERVAL_SEC = 30
+
+    # 期限切れのリースを削除したうえで、上限未満であればリースを追加する
+    # (各ホストの時計のずれの影響を受けないよう、Redisの時刻を利用)
+    ACQUIRE_SEMAPHORE_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+if redis.call('ZCARD', KEYS[1]) < tonumber(ARGV[1]) then
+    redis.call('ZADD', KEYS[1], now + tonumber(ARGV[2]), ARGV[3])
+    redis.call('PEXPIRE', KEYS[1], ARGV[2])
+    return 1
+end
+return 0
+"""
+
+    # トークンを補充したうえで1つ消費し、トークンが不足している場合は待ち時間(ミリ秒)を返す
+    TAKE_TOKEN_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local rate = tonumber(ARGV[1]) / 1000
+local burst = tonumber(ARGV[2])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or burst
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + (now - ts) * rate)
+local wait_ms = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait_ms = math.ceil((1 - tokens) / rate)
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate) + 1000)
+return wait_ms
+"""
+
+    _redis: Optional[Redis] = None
+    _redis_unavailable_until = 0.0
+    _scripts: dict = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def is_enabled(cls) -> bool:
+        return bool(
+            setuptools.distutils.util.strtobool(
+                os.getenv("VLB_VCENTER_RATE_LIMIT_ENABLED", cls.VLB_VCENTER_RATE_LIMIT_ENABLED_DEFAULT)
+            )
+        )
+
+    @classmethod
+    def limited(cls, func: Callable) -> Callable:
+        """
+        vCenterごとの処理に流量制限を適用するデコレータ
+
+        デコレート対象の関数は、引数にvcenter_nameを持つ必要があります。
+        cancel_tokenを持つ場合、制限の解除を待つ間もキャンセル要求を確認します。
+        """
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            bound = signature.bind_partial(*args, **kwargs)
+            vcenter_name = bound.arguments.get("vcenter_name")
+            cancel_token = bound.arguments.get("cancel_token")
+            with cls.acquire(vcenter_name=vcenter_name, cancel_token=cancel_token):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    @classmethod
+    @contextmanager
+    def acquire(cls, vcenter_name: str, cancel_token: Optional[CancellationToken] = None):
+        """
+        vCenterへのリクエストの実行枠を取得し、処理の終了後に返却します
+
+        Raises:
+            HTTPException: 待ち時間の上限を超えても、実行枠を取得できなかった場合
+            OperationCancelledError: 実行枠の取得待ちの間に、キャンセルが要求された場合
+        """
+        if not cls.is_enabled() or vcenter_name is None:
+            yield
+            return
+
+        redis = cls._get_redis()
+        if redis is None:
+            yield
+            return
+
+        limits = cls.get_limits(vcenter_name)
+        lease_id = None
+        try:
+            lease_id = cls._wait_for_slot(redis, vcenter_name, limits, cancel_token)
+        except RedisError as e:
+            # Redisの障害時に毎回タイムアウトを待たないよう、一定時間は流量制限を適用しない
+            cls._redis_unavailable_until = time.monotonic() + cls.REDIS_RETRY_INTERVAL_SEC
+            Logging.warning(f"vCenter({vcenter_name})の流量制限を適用できないため、制限せずに処理します: {e}")
+
+        try:
+            yield
+        finally:
+            if lease_id is not None:
+                cls._release(redis, vcenter_name, lease_id)
+
+    @classmethod
+    def get_limits(cls, vcenter_name: str) -> dict:
+        """vCenterの設定ファイルのrate_limitと環境変数から、vCenterごとの制限値を取得します"""
+
+        config = getattr(g, "vcenter_configurations", {}).get(vcenter_name) or {}
+        rate_limit = config.get("rate_limit") or {}
+        return {
+            "max_concurrency": int(
+                rate_limit.get(
+                    "max_concurrency",
+                    os.getenv(
+                        "VLB_VCENTER_RATE_LIMIT_MAX_CONCURRENCY",
+                        cls.VLB_VCENTER_RATE_LIMIT_MAX_CONCURRENCY_DEFAULT,
+                    ),
+                )
+            ),
+            "requests_per_sec": float(
+                rate_limit.get(
+                    "requests_per_sec",
+                    os.getenv(
+                        "VLB_VCENTER_RATE_LIMIT_REQUESTS_PER_SEC",
+                        cls.VLB_VCENTER_RATE_LIMIT_REQUESTS_PER_SEC_DEFAULT,
+                    ),
+                )
+            ),
+            "burst": int(
+                rate_limit.get(
+                    "burst",
+                    os.getenv("VLB_VCENTER_RATE_LIMIT_BURST", cls.VLB_VCENTER_RATE_LIMIT_BURST_DEFAULT),
+                )
+            ),
+        }
+
+    @classmethod
+    def _wait_for_slot(
+        cls, redis: Redis, vcenter_name: str, limits: dict, cancel_token: Optional[CancellationToken]
+    ) -> Optional[str]:
+        wait_timeout = int(
+            os.getenv("VLB_VCENTER_RATE_LIMIT_WAIT_TIMEOUT_SEC", cls.VLB_VCENTER_RATE_LIMIT_WAIT_TIMEOUT_SEC_DEFAULT)
+        )
+        lease_ms = (
+            int(os.getenv("VLB_VCENTER_RATE_LIMIT_LEASE_SEC", cls.VLB_VCENTER_RATE_LIMIT_LEASE_SEC_DEFAULT)) * 1000
+        )
+        deadline = time.monotonic() + wait_timeout
+
+        # 1秒あたりのリクエスト数の制限(0以下の場合は制限しない)
+        if limits["requests_per_sec"] > 0:
+            while True:
+                wait_ms = cls._get_script(redis, "take_token", cls.TAKE_TOKEN_SCRIPT)(
+                    keys=[f"{cls.RATE_LIMIT_BUCKET_PREFIX}{vcenter_name}"],
+                    args=[limits["requests_per_sec"], max(1, limits["burst"])],
+                )
+                if int(wait_ms) == 0:
+                    break
+                cls._sleep_until_retry(vcenter_name, deadline, int(wait_ms) / 1000, cancel_token)
+
+        # 同時実行数の制限(0以下の場合は制限しない)
+        if limits["max_concurrency"] <= 0:
+            return None
+        lease_id = str(uuid.uuid4())
+        while True:
+            acquired = cls._get_script(redis, "acquire_semaphore", cls.ACQUIRE_SEMAPHORE_SCRIPT)(
+                keys=[f"{cls.RATE_LIMIT_SEMAPHORE_PREFIX}{vcenter_name}"],
+                args=[limits["max_concurrency"], lease_ms, lease_id],
+            )
+            if int(acquired) == 1:
+                return lease_id
+            cls._sleep_until_retry(vcenter_name, deadline, cls.WAIT_POLL_INTERVAL_SEC, cancel_token)
+
+    @classmethod
+    def _sleep_until_retry(
+        cls, vcenter_name: str, deadline: float, wait_sec: float, cancel_token: Optional[CancellationToken]
+    ) -> None:
+        if cancel_token is not None:
+            cancel_token.raise_if_cancelled()
+        if time.monotonic() + wait_sec > deadline:
+            Logging.warning(f"vCenter({vcenter_name})へのリクエストが流量制限の上限に達しています。")
+            raise HTTPException(
+                status_code=503,
+                detail=f"vCenter({vcenter_name})へのリクエストが混み合っているため、処理を実行できませんでした。",
+            )
+        time.sleep(wait_sec)
+
+    @classmethod
+    def _release(cls, redis: Redis, vcenter_name: str, lease_id: str) -> None:
+        try:
+            redis.zrem(f"{cls.RATE_LIMIT_SEMAPHORE_PREFIX}{vcenter_name}", lease_id)
+        except RedisError as e:
+            # 返却できなかったリースは、有効期限の経過後に削除される
+            Logging.warning(f"vCenter({vcenter_name})の実行枠の返却に失敗しました: {e}")
+
+    @classmethod
+    def _get_redis(cls) -> Optional[Redis]:
+        if time.monotonic() < cls._redis_unavailable_until:
+            return None
+        if cls._redis is None:
+            with cls._lock:
+                if cls._redis is None:
+                    try:
+                        cls._redis = VCenterWSSessionManager.initialize()
+                    except Exception as e:
+                        Logging.warning(f"流量制限用のRedis接続を初期化できませんでした: {e}")
+                        return None
+        return cls._redis
+
+    @classmethod
+    def _get_script(cls, redis: Redis, name: str, script: str):
+        if name not in cls._scripts:
+            cls._scripts[name] = redis.register_script(script)
+        return cls._scripts[name]
@@ -0,0 +1,109 @@
+import os
+import random
+import uuid
+from typing import Optional
+
+import setuptools
+from redis import Redis
+from redis.exceptions import RedisError
+from vcenter_lookup_bridge.utils.logging import Logging
+
+
+class VCenterSharedSessionManager(object):
+    """vCenterのセッションを、全ワーカープロセス・全コンテナで共有するためのクラス
+
+    ログインしたワーカープロセスがセッションIDをRedisに公開し、他のワーカープロセスはそのセッションに接続します。
+    ログインはRedisのロックで直列化し、ロックを取得できなかったワーカープロセスはジッタを加えた間隔で
+    公開されたセッションを待つことで、再起動やvCenterの瞬断時のログインの集中を防ぎます。
+
+    Attributes:
+        SHARED_SESSION_PREFIX (str): 共有するセッションIDのキーのプレフィックス
+        LOGIN_LOCK_PREFIX (str): ログインを直列化するロックのキーのプレフィックス
+    """
+
+    # Const
+    VLB_VCENTER_SHARED_SESSION_ENABLED_DEFAULT = "True"
+    VLB_VCENTER_SHARED_SESSION_TTL_SEC_DEFAULT = 1800
+    VLB_VCENTER_LOGIN_LOCK_WAIT_SEC_DEFAULT = 30
+    SHARED_SESSION_PREFIX = "vlb_vcenter_shared_session:"
+    LOGIN_LOCK_PREFIX = "vlb_vcenter_login_lock:"
+    LOGIN_LOCK_EXPIRE_SEC = 60
+    LOGIN_WAIT_JITTER_MIN_SEC = 0.5
+    LOGIN_WAIT_JITTER_MAX_SEC = 2.0
+
+    # キーの値が指定した値と一致する場合のみ削除する(他のワーカープロセスが更新した値を消さないため)
+    COMPARE_AND_DELETE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+    @classmethod
+    def is_enabled(cls) -> bool:
+        return bool(
+            setuptools.distutils.util.strtobool(
+                os.getenv("VLB_VCENTER_SHARED_SESSION_ENABLED", cls.VLB_VCENTER_SHARED_SESSION_ENABLED_DEFAULT)
+            )
+        )
+
+    @classmethod
+    def get_login_lock_wait_sec(cls) -> int:
+        return int(os.getenv("VLB_VCENTER_LOGIN_LOCK_WAIT_SEC", cls.VLB_VCENTER_LOGIN_LOCK_WAIT_SEC_DEFAULT))
+
+    @classmethod
+    def get_wait_jitter_sec(cls) -> float:
+        """公開されたセッションを待つ間隔を、ワーカープロセス間で分散させるためのジッタ付きの時間を返します"""
+
+        return random.uniform(cls.LOGIN_WAIT_JITTER_MIN_SEC, cls.LOGIN_WAIT_JITTER_MAX_SEC)
+
+    @classmethod
+    def get_session_id(cls, redis: Redis, vcenter_name: str) -> Optional[str]:
+        """公開されているセッションIDを取得します"""
+
+        result = redis.get(f"{cls.SHARED_SESSION_PREFIX}{vcenter_name}")
+        return result.decode("utf-8") if result else None
+
+    @classmethod
+    def publish_session_id(cls, redis: Redis, vcenter_name: str, session_id: str) -> None:
+        """ログインしたセッションのIDを公開します"""
+
+        if not session_id:
+            return
+        ttl = int(os.getenv("VLB_VCENTER_SHARED_SESSION_TTL_SEC", cls.VLB_VCENTER_SHARED_SESSION_TTL_SEC_DEFAULT))
+        redis.set(f"{cls.SHARED_SESSION_PREFIX}{vcenter_name}", session_id, ex=ttl)
+        Logging.info(f"vCenter({vcenter_name})のセッションを共有しました。")
+
+    @classmethod
+    def invalidate_session_id(cls, redis: Redis, vcenter_name: str, session_id: str) -> None:
+        """無効になったセッションIDの公開を取り消します"""
+
+        try:
+            redis.register_script(cls.COMPARE_AND_DELETE_SCRIPT)(
+                keys=[f"{cls.SHARED_SESSION_PREFIX}{vcenter_name}"], args=[session_id]
+            )
+        except RedisError as e:
+            Logging.warning(f"vCenter({vcenter_name})の共有セッションの取り消しに失敗しました: {e}")
+
+    @classmethod
+    def acquire_login_lock(cls, redis: Redis, vcenter_name: str) -> Optional[str]:
+        """
+        ログインのロックを取得します
+
+        Returns:
+            Optional[str]: ロックを取得した場合はロックの解放に利用するトークン、取得できなかった場合はNone
+        """
+        token = str(uuid.uuid4())
+        if redis.set(f"{cls.LOGIN_LOCK_PREFIX}{vcenter_name}", token, nx=True, ex=cls.LOGIN_LOCK_EXPIRE_SEC):
+            return token
+        return None
+
+    @classmethod
+    def release_login_lock(cls, redis: Redis, vcenter_name: str, token: str) -> None:
+        try:
+            redis.register_script(cls.COMPARE_AND_DELETE_SCRIPT)(
+                keys=[f"{cls.LOGIN_LOCK_PREFIX}{vcenter_name}"], args=[token]
+            )
+        except RedisError as e:
+            # 解放できなかったロックは、有効期限の経過後に削除される
+            Logging.warning(f"vCenter({vcenter_name})のログインのロックの解放に失敗しました: {e}")
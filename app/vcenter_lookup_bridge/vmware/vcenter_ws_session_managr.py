@@ -245,11 +245,15 @@ class VCenterWSSessionManager:
                 return VCenterWSSessionManager.generate_all_vcenter_ws_session_informations_unknown(configs)
 
         try:
-            vcenter_keys = redis.keys(f"{VCenterWSSessionManager.VCENTER_WS_SESSION_PREFIX}*")
+            # KEYSで全キーを走査せず、設定済みのvCenterのキーのみを一括で取得
+            vcenter_names = list(configs.keys())
+            if not vcenter_names:
+                return {}
+            statuses = redis.mget(
+                [f"{VCenterWSSessionManager.VCENTER_WS_SESSION_PREFIX}{vcenter_name}" for vcenter_name in vcenter_names]
+            )
             vcenter_ws_sessions = {}
-            for vcenter_key in vcenter_keys:
-                vcenter_name = vcenter_key.decode("utf-8").split(":")[1]
-                status = redis.get(vcenter_key)
+            for vcenter_name, status in zip(vcenter_names, statuses):
                 if status:
                     vcenter_ws_sessions[vcenter_name] = status.decode("utf-8")
         except Exception as e:
@@ -296,15 +300,19 @@ class VCenterWSSessionManager:
             VCenterWSSessionError: Redis操作に失敗した場合
         """
         try:
-            vcenter_keys = await redis.keys(f"{VCenterWSSessionManager.VCENTER_WS_SESSION_PREFIX}*")
+            # KEYSで全キーを走査せず、設定済みのvCenterのキーのみを一括で取得
+            vcenter_names = list(configs.keys())
+            if not vcenter_names:
+                return {}
+            statuses = await redis.mget(
+                [f"{VCenterWSSessionManager.VCENTER_WS_SESSION_PREFIX}{vcenter_name}" for vcenter_name in vcenter_names]
+            )
             vcenter_ws_sessions = {}
-            for vcenter_key in vcenter_keys:
+            for vcenter_name, status in zip(vcenter_names, statuses):
                 try:
-                    vcenter_name = vcenter_key.decode("utf-8").split(":")[1]
-                    status = await redis.get(vcenter_key)
                     if status:
                         vcenter_ws_sessions[vcenter_name] = status.decode("utf-8")
-                except (IndexError, UnicodeDecodeError):
+                except UnicodeDecodeError:
                     continue
             return vcenter_ws_sessions
         except Exception as e:
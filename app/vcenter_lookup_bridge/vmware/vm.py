@@ -1,11 +1,16 @@
 import os
-from typing import List, Optional
-from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, List, Optional
 from fastapi import HTTPException
 from pyVmomi import vim
 from vcenter_lookup_bridge.schemas.vm_parameter import VmDetailResponseSchema, VmResponseSchema
+from vcenter_lookup_bridge.utils.cancellation import CancellationToken
 from vcenter_lookup_bridge.utils.logging import Logging
+from vcenter_lookup_bridge.vmware.fragment_cache import FragmentCache
 from vcenter_lookup_bridge.vmware.helper import Helper
+from vcenter_lookup_bridge.vmware.last_known_good import LastKnownGood
+from vcenter_lookup_bridge.vmware.service_instance_pool import ServiceInstancePool
+from vcenter_lookup_bridge.vmware.vcenter_rate_limiter import VCenterRateLimiter
+from vcenter_lookup_bridge.vmware.work_scheduler import WorkScheduler
 
 
 class Vm(object):
@@ -13,7 +18,6 @@ class Vm(object):
 
     # Const
     VLB_MAX_RETRIEVE_VCENTER_OBJECTS_DEFAULT = 1000
-    VLB_MAX_VCENTER_WEB_SERVICE_WORKER_THREADS_DEFAULT = 10
 
     @classmethod
     @Logging.func_logger
@@ -26,6 +30,8 @@ class Vm(object):
         offset=0,
         max_results=100,
         request_id: str = None,
+        priority: WorkScheduler.Priority = WorkScheduler.PRIORITY_BULK,
+        cancel_token: CancellationToken = None,
     ) -> tuple[list[VmResponseSchema], int]:
         """全vCenterから仮想マシン一覧を取得"""
 
@@ -38,17 +44,13 @@ class Vm(object):
                 cls.VLB_MAX_RETRIEVE_VCENTER_OBJECTS_DEFAULT,
             )
         )
-        max_vcenter_web_service_worker_threads = int(
-            os.getenv(
-                "VLB_MAX_VCENTER_WEB_SERVICE_WORKER_THREADS",
-                cls.VLB_MAX_VCENTER_WEB_SERVICE_WORKER_THREADS_DEFAULT,
-            )
-        )
 
         if vcenter_name:
             # vCenterを指定した場合、指定したvCenterから仮想マシン一覧を取得
             try:
-                vms = cls._get_vms_by_vm_folders_from_vcenter(
+                vms = WorkScheduler.submit(
+                    priority,
+                    cls._get_vms_by_vm_folders_from_vcenter,
                     vcenter_name=vcenter_name,
                     service_instances=service_instances,
                     configs=configs,
@@ -56,7 +58,8 @@ class Vm(object):
                     offset=offset,
                     max_results=max_results,
                     request_id=request_id,
-                )
+                    cancel_token=cancel_token,
+                ).result()
                 all_vms.extend(vms)
                 total_vm_count = len(all_vms)
             except Exception as e:
@@ -65,40 +68,71 @@ class Vm(object):
         else:
             # vCenterを指定しない場合、すべてのvCenterから仮想マシン一覧を取得
             futures = {}
-            with ThreadPoolExecutor(max_workers=max_vcenter_web_service_worker_threads) as executor:
-                try:
-                    # 各vCenterから仮想マシン一覧を取得するスレッドを作成
-                    for vcenter_name in configs.keys():
-                        futures[vcenter_name] = executor.submit(
-                            cls._get_vms_by_vm_folders_from_vcenter,
-                            vcenter_name,
-                            service_instances,
-                            configs,
-                            vm_folders,
-                            offset_vcenter,
-                            max_retrieve_vcenter_objects,
-                            request_id,
-                        )
+            try:
+                # 各vCenterから仮想マシン一覧を取得する処理をスケジューラに登録
+                for vcenter_name in configs.keys():
+                    futures[vcenter_name] = WorkScheduler.submit(
+                        priority,
+                        cls._get_vms_by_vm_folders_from_vcenter,
+                        vcenter_name,
+                        service_instances,
+                        configs,
+                        vm_folders,
+                        offset_vcenter,
+                        max_retrieve_vcenter_objects,
+                        request_id,
+                        cancel_token=cancel_token,
+                    )
 
-                    # 各スレッドの実行結果を回収
-                    for vcenter_name in configs.keys():
-                        vms = futures[vcenter_name].result()
-                        Logging.info(f"{request_id} vCenter({vcenter_name})からの仮想マシン情報取得に成功")
-                        all_vms.extend(vms)
+                # 各処理の実行結果を回収
+                for vcenter_name in configs.keys():
+                    vms = futures[vcenter_name].result()
+                    Logging.info(f"{request_id} vCenter({vcenter_name})からの仮想マシン情報取得に成功")
+                    all_vms.extend(vms)
 
-                    # 全仮想マシン数を取得
-                    total_vm_count = len(all_vms)
+                # 全仮想マシン数を取得
+                total_vm_count = len(all_vms)
 
-                    # オフセットと最大件数の調整
-                    all_vms = all_vms[offset:]
-                    if len(all_vms) > max_results:
-                        all_vms = all_vms[:max_results]
+                # オフセットと最大件数の調整
+                all_vms = all_vms[offset:]
+                if len(all_vms) > max_results:
+                    all_vms = all_vms[:max_results]
 
-                except Exception as e:
-                    Logging.error(f"{request_id} vCenter({vcenter_name})からのVM取得に失敗: {e}")
+            except Exception as e:
+                Logging.error(f"{request_id} vCenter({vcenter_name})からのVM取得に失敗: {e}")
 
         return all_vms, total_vm_count
 
+    @classmethod
+    @Logging.func_logger
+    def stream_vms_from_all_vcenters(
+        cls,
+        service_instances: dict,
+        configs,
+        vm_folders: List[str],
+        vcenter_name: Optional[str] = None,
+        offset=0,
+        max_results=100,
+        request_id: str = None,
+        priority: WorkScheduler.Priority = WorkScheduler.PRIORITY_BULK,
+        cancel_token: CancellationToken = None,
+    ) -> AsyncIterator[tuple[str, Optional[list[VmResponseSchema]], Optional[Exception]]]:
+        """全vCenterから仮想マシン一覧を取得し、取得が完了したvCenterから順に返す（offset/max_resultsはvCenterごとに適用）"""
+
+        vcenter_names = [vcenter_name] if vcenter_name else list(configs.keys())
+        return WorkScheduler.stream_from_vcenters(
+            priority,
+            cls._get_vms_by_vm_folders_from_vcenter,
+            vcenter_names,
+            cancel_token=cancel_token,
+            service_instances=service_instances,
+            configs=configs,
+            vm_folders=vm_folders,
+            offset=offset,
+            max_results=max_results,
+            request_id=request_id,
+        )
+
     @classmethod
     @Logging.func_logger
     def _get_vms_by_vm_folders_from_vcenter(
@@ -110,10 +144,51 @@ class Vm(object):
         offset=0,
         max_results=100,
         request_id: str = None,
+        cancel_token: CancellationToken = None,
     ) -> list[VmResponseSchema]:
-        """特定のvCenterから仮想マシン一覧を取得"""
+        """特定のvCenterから仮想マシン一覧を取得(仮想マシンフォルダ単位でキャッシュした結果を結合)"""
+
+        if vcenter_name not in configs:
+            raise HTTPException(
+                status_code=404, detail=f"指定したvCenter({vcenter_name})が接続先に登録されていません。"
+            )
+
+        base_vm_folder = configs[vcenter_name]["base_vm_folder"]
+        vms_by_vm_folder = FragmentCache.get_fragments(
+            resource="vms",
+            vcenter_name=vcenter_name,
+            # 基準となるフォルダの設定が変更された場合に、変更前の結果を利用しないよう、断片の名前に含める
+            fragments=[f"{base_vm_folder}/{vm_folder}" for vm_folder in vm_folders],
+            compute=lambda fragments: cls._get_vms_by_fragments_from_vcenter(
+                vcenter_name=vcenter_name,
+                service_instances=service_instances,
+                configs=configs,
+                fragments=fragments,
+                request_id=request_id,
+                cancel_token=cancel_token,
+            ),
+            request_id=request_id,
+        )
+        return FragmentCache.assemble(vms_by_vm_folder, offset=offset, max_results=max_results)
+
+    @classmethod
+    @Logging.func_logger
+    @LastKnownGood.fallback(fragments_arg="fragments")
+    @VCenterRateLimiter.limited
+    @ServiceInstancePool.pooled
+    def _get_vms_by_fragments_from_vcenter(
+        cls,
+        vcenter_name: str,
+        service_instances: dict,
+        configs,
+        fragments: List[str],
+        request_id: str = None,
+        cancel_token: CancellationToken = None,
+    ) -> dict[str, list[VmResponseSchema]]:
+        """特定のvCenterから、断片(基準となるフォルダ/仮想マシンフォルダ)ごとの仮想マシン一覧を取得"""
 
-        results = []
+        cancel_token = cancel_token or CancellationToken()
+        cancel_token.raise_if_cancelled()
 
         # 指定されたvCenterのService Instanceを取得
         if vcenter_name not in service_instances:
@@ -122,43 +197,44 @@ class Vm(object):
             )
 
         content = service_instances[vcenter_name].RetrieveContent()
-        config = configs[vcenter_name]
-
-        datacenter = content.rootFolder.childEntity[0]
-        base_vm_folder = config["base_vm_folder"]
+        base_vm_folder = configs[vcenter_name]["base_vm_folder"]
+        vm_folders = [fragment[len(base_vm_folder) + 1 :] for fragment in fragments]
         search_index = content.searchIndex
-        vm_count = 0
 
-        for vm_folder in vm_folders:
-            folder = search_index.FindByInventoryPath(f"/{datacenter.name}/vm/{base_vm_folder}/{vm_folder}/")
-            if folder is None:
-                Logging.info(
-                    f"{request_id} vCenter({vcenter_name})に仮想マシンフォルダ({vm_folder})は見つかりませんでした。"
-                )
-                continue
-
-            if vm_count >= offset + max_results:
-                break
-
-            for vm in folder.childEntity:
-                if vm_count < offset:
-                    vm_count += 1
-                    continue
-                if vm_count >= offset + max_results:
-                    break
-
-                if isinstance(vm, vim.VirtualMachine):
-                    vm_info = cls._generate_vm_info(
-                        content=content,
-                        datacenter=datacenter,
-                        vm_folder=vm_folder,
-                        vm=vm,
-                        vcenter_name=vcenter_name,
-                        is_detail=False,
-                    )
-                    results.append(vm_info)
-                    vm_count += 1
-        return results
+        def collect_vms(datacenter, limit: Optional[int]) -> list[tuple[str, vim.VirtualMachine]]:
+            return Helper.get_vms_in_vm_folders(
+                search_index=search_index,
+                datacenter=datacenter,
+                base_vm_folder=base_vm_folder,
+                vm_folders=vm_folders,
+                limit=limit,
+                cancel_token=cancel_token,
+                log_prefix=f"{request_id} vCenter({vcenter_name})",
+            )
+
+        def generate_vm_info(datacenter, entry: tuple[str, vim.VirtualMachine]) -> tuple[str, VmResponseSchema]:
+            cancel_token.raise_if_cancelled()
+            vm_folder, vm = entry
+            vm_info = cls._generate_vm_info(
+                content=content,
+                datacenter=datacenter,
+                vm_folder=vm_folder,
+                vm=vm,
+                vcenter_name=vcenter_name,
+                is_detail=False,
+            )
+            return f"{base_vm_folder}/{vm_folder}", vm_info
+
+        # データセンターごとに並行して走査し、断片ごとに振り分け
+        vms_by_fragment = {fragment: [] for fragment in fragments}
+        for fragment, vm_info in Helper.scan_datacenters(
+            datacenters=Helper.get_datacenters(content),
+            collect=collect_vms,
+            generate=generate_vm_info,
+            cancel_token=cancel_token,
+        ):
+            vms_by_fragment[fragment].append(vm_info)
+        return vms_by_fragment
 
     @classmethod
     @Logging.func_logger
@@ -166,28 +242,28 @@ class Vm(object):
         cls,
         vcenter_name: str,
         service_instances: dict,
+        configs,
         instance_uuid: str,
         request_id: str = None,
+        priority: WorkScheduler.Priority = WorkScheduler.PRIORITY_INTERACTIVE,
+        cancel_token: CancellationToken = None,
     ) -> VmDetailResponseSchema:
         """指定したインスタンスUUIDの仮想マシンを取得"""
 
         result = None
-        max_vcenter_web_service_worker_threads = int(
-            os.getenv(
-                "VLB_MAX_VCENTER_WEB_SERVICE_WORKER_THREADS",
-                cls.VLB_MAX_VCENTER_WEB_SERVICE_WORKER_THREADS_DEFAULT,
-            )
-        )
 
         if vcenter_name:
             # vCenterを指定した場合、指定したvCenterから仮想マシン一覧を取得
             try:
-                vm = cls._get_vm_by_instance_uuid(
+                vm = WorkScheduler.submit(
+                    priority,
+                    cls._get_vm_by_instance_uuid,
                     vcenter_name=vcenter_name,
                     service_instances=service_instances,
                     instance_uuid=instance_uuid,
                     request_id=request_id,
-                )
+                    cancel_token=cancel_token,
+                ).result()
                 if vm is not None:
                     Logging.info(f"{request_id} vCenter({vcenter_name})からの仮想マシン情報取得に成功")
                     result = vm
@@ -199,46 +275,53 @@ class Vm(object):
         else:
             # vCenterを指定しない場合、すべてのvCenterから仮想マシン一覧を取得
             futures = {}
-            with ThreadPoolExecutor(max_workers=max_vcenter_web_service_worker_threads) as executor:
-                try:
-                    # 各vCenterから仮想マシン一覧を取得するスレッドを作成
-                    for vcenter_name in service_instances.keys():
-                        futures[vcenter_name] = executor.submit(
-                            cls._get_vm_by_instance_uuid,
-                            vcenter_name,
-                            service_instances,
-                            instance_uuid,
-                            request_id,
-                        )
+            try:
+                # 各vCenterから仮想マシン一覧を取得する処理をスケジューラに登録
+                for vcenter_name in configs.keys():
+                    futures[vcenter_name] = WorkScheduler.submit(
+                        priority,
+                        cls._get_vm_by_instance_uuid,
+                        vcenter_name,
+                        service_instances,
+                        instance_uuid,
+                        request_id,
+                        cancel_token=cancel_token,
+                    )
 
-                    # 各スレッドの実行結果を回収
-                    for vcenter_name in service_instances.keys():
-                        vm = futures[vcenter_name].result()
-                        if vm is not None:
-                            Logging.info(f"{request_id} vCenter({vcenter_name})からの仮想マシン情報取得に成功")
-                            result = vm
-                        else:
-                            Logging.info(
-                                f"{request_id} vCenter({vcenter_name})にインスタンスUUID({instance_uuid})を持つ仮想マシンは見つかりませんでした。"
-                            )
-                except HTTPException as e:
-                    Logging.info(f"{request_id} vCenter({vcenter_name})からのVM取得に失敗: {e}")
-                    pass
-                except Exception as e:
-                    raise e
+                # 各処理の実行結果を回収
+                for vcenter_name in configs.keys():
+                    vm = futures[vcenter_name].result()
+                    if vm is not None:
+                        Logging.info(f"{request_id} vCenter({vcenter_name})からの仮想マシン情報取得に成功")
+                        result = vm
+                    else:
+                        Logging.info(
+                            f"{request_id} vCenter({vcenter_name})にインスタンスUUID({instance_uuid})を持つ仮想マシンは見つかりませんでした。"
+                        )
+            except HTTPException as e:
+                Logging.info(f"{request_id} vCenter({vcenter_name})からのVM取得に失敗: {e}")
+                pass
+            except Exception as e:
+                raise e
         return result
 
     @classmethod
     @Logging.func_logger
+    @VCenterRateLimiter.limited
+    @ServiceInstancePool.pooled
     def _get_vm_by_instance_uuid(
         cls,
         vcenter_name: str,
         service_instances: dict,
         instance_uuid: str,
         request_id: str = None,
+        cancel_token: CancellationToken = None,
     ) -> VmDetailResponseSchema:
         """インスタンスUUIDとvCenterを指定して、仮想マシン情報を取得"""
 
+        cancel_token = cancel_token or CancellationToken()
+        cancel_token.raise_if_cancelled()
+
         # 指定されたvCenterのService Instanceを取得
         if vcenter_name not in service_instances:
             raise HTTPException(
@@ -246,10 +329,9 @@ class Vm(object):
             )
 
         content = service_instances[vcenter_name].RetrieveContent()
-        datacenter = content.rootFolder.childEntity[0]
         search_index = content.searchIndex
 
-        # 仮想マシンをインスタンスUUIDを指定して検索
+        # 仮想マシンをインスタンスUUIDを指定して検索(全データセンターが検索対象)
         vm = search_index.FindByUuid(
             uuid=instance_uuid,
             vmSearch=True,
@@ -259,7 +341,7 @@ class Vm(object):
         if isinstance(vm, vim.VirtualMachine):
             return cls._generate_vm_info(
                 content=content,
-                datacenter=datacenter,
+                datacenter=Helper.get_datacenter_of(vm, content),
                 vm_folder=None,
                 vm=vm,
                 vcenter_name=vcenter_name,
@@ -278,7 +360,10 @@ class Vm(object):
         view_vms = content.viewManager.CreateContainerView(
             container=root_folder, type=[vim.VirtualMachine], recursive=True
         )
-        return len(view_vms.view)
+        try:
+            return len(view_vms.view)
+        finally:
+            view_vms.Destroy()
 
     @classmethod
     @Logging.func_logger
@@ -1,11 +1,14 @@
-import os
 from typing import List, Optional
-from concurrent.futures import ThreadPoolExecutor
 from fastapi import HTTPException
 from pyVmomi import vim
 from vcenter_lookup_bridge.schemas.vm_folder_parameter import VmFolderResponseSchema
+from vcenter_lookup_bridge.utils.cancellation import CancellationToken
 from vcenter_lookup_bridge.utils.logging import Logging
 from vcenter_lookup_bridge.vmware.helper import Helper
+from vcenter_lookup_bridge.vmware.last_known_good import LastKnownGood
+from vcenter_lookup_bridge.vmware.service_instance_pool import ServiceInstancePool
+from vcenter_lookup_bridge.vmware.vcenter_rate_limiter import VCenterRateLimiter
+from vcenter_lookup_bridge.vmware.work_scheduler import WorkScheduler
 
 
 class VmFolder(object):
@@ -13,7 +16,6 @@ class VmFolder(object):
 
     # Const
     VLB_MAX_RETRIEVE_VCENTER_OBJECTS_DEFAULT = 1000
-    VLB_MAX_VCENTER_WEB_SERVICE_WORKER_THREADS_DEFAULT = 10
 
     @classmethod
     @Logging.func_logger
@@ -26,28 +28,27 @@ class VmFolder(object):
         offset=0,
         max_results=100,
         request_id: str = None,
+        priority: WorkScheduler.Priority = WorkScheduler.PRIORITY_BULK,
+        cancel_token: CancellationToken = None,
     ) -> tuple[list[VmFolderResponseSchema], int]:
         """全vCenterから仮想マシンフォルダ一覧を取得"""
 
         all_vm_folders = []
         total_vm_folder_count = 0
-        max_vcenter_web_service_worker_threads = int(
-            os.getenv(
-                "VLB_MAX_VCENTER_WEB_SERVICE_WORKER_THREADS",
-                cls.VLB_MAX_VCENTER_WEB_SERVICE_WORKER_THREADS_DEFAULT,
-            )
-        )
 
         if vcenter_name:
             # vCenterを指定した場合、指定したvCenterから仮想マシンフォルダ一覧を取得
             try:
-                folders = cls._get_vm_folders_from_vcenter(
+                folders = WorkScheduler.submit(
+                    priority,
+                    cls._get_vm_folders_from_vcenter,
                     vcenter_name=vcenter_name,
                     service_instances=service_instances,
                     configs=configs,
                     vm_folders=vm_folders,
                     request_id=request_id,
-                )
+                    cancel_token=cancel_token,
+                ).result()
                 Logging.info(f"{request_id} vCenter({vcenter_name})からの仮想マシンフォルダ情報取得に成功")
                 all_vm_folders.extend(folders)
                 total_vm_folder_count = len(all_vm_folders)
@@ -56,40 +57,44 @@ class VmFolder(object):
         else:
             # vCenterを指定しない場合、すべてのvCenterから仮想マシンフォルダ一覧を取得
             futures = {}
-            with ThreadPoolExecutor(max_workers=max_vcenter_web_service_worker_threads) as executor:
-                try:
-                    # 各vCenterから仮想マシンフォルダ一覧を取得するスレッドを作成
-                    for vcenter_name in configs.keys():
-                        futures[vcenter_name] = executor.submit(
-                            cls._get_vm_folders_from_vcenter,
-                            vcenter_name,
-                            service_instances,
-                            configs,
-                            vm_folders,
-                            request_id,
-                        )
-
-                    # 各スレッドの実行結果を回収
-                    for vcenter_name in configs.keys():
-                        folders = futures[vcenter_name].result()
-                        Logging.info(f"{request_id} vCenter({vcenter_name})からの仮想マシンフォルダ情報取得に成功")
-                        all_vm_folders.extend(folders)
-
-                    # 全仮想マシンフォルダ数を取得
-                    total_vm_folder_count = len(all_vm_folders)
-
-                    # オフセットと最大件数の調整
-                    all_vm_folders = all_vm_folders[offset:]
-                    if len(all_vm_folders) > max_results:
-                        all_vm_folders = all_vm_folders[:max_results]
-
-                except Exception as e:
-                    Logging.error(f"{request_id} vCenter({vcenter_name})からの仮想マシンフォルダ取得に失敗: {e}")
+            try:
+                # 各vCenterから仮想マシンフォルダ一覧を取得する処理をスケジューラに登録
+                for vcenter_name in configs.keys():
+                    futures[vcenter_name] = WorkScheduler.submit(
+                        priority,
+                        cls._get_vm_folders_from_vcenter,
+                        vcenter_name,
+                        service_instances,
+                        configs,
+                        vm_folders,
+                        request_id,
+                        cancel_token=cancel_token,
+                    )
+
+                # 各処理の実行結果を回収
+                for vcenter_name in configs.keys():
+                    folders = futures[vcenter_name].result()
+                    Logging.info(f"{request_id} vCenter({vcenter_name})からの仮想マシンフォルダ情報取得に成功")
+                    all_vm_folders.extend(folders)
+
+                # 全仮想マシンフォルダ数を取得
+                total_vm_folder_count = len(all_vm_folders)
+
+                # オフセットと最大件数の調整
+                all_vm_folders = all_vm_folders[offset:]
+                if len(all_vm_folders) > max_results:
+                    all_vm_folders = all_vm_folders[:max_results]
+
+            except Exception as e:
+                Logging.error(f"{request_id} vCenter({vcenter_name})からの仮想マシンフォルダ取得に失敗: {e}")
 
         return all_vm_folders, total_vm_folder_count
 
     @classmethod
     @Logging.func_logger
+    @LastKnownGood.fallback
+    @VCenterRateLimiter.limited
+    @ServiceInstancePool.pooled
     def _get_vm_folders_from_vcenter(
         cls,
         vcenter_name: str,
@@ -97,9 +102,13 @@ class VmFolder(object):
         configs,
         vm_folders: List[str] = None,
         request_id: str = None,
+        cancel_token: CancellationToken = None,
     ) -> list[VmFolderResponseSchema]:
         """特定のvCenterから仮想マシンフォルダ一覧を取得"""
 
+        cancel_token = cancel_token or CancellationToken()
+        cancel_token.raise_if_cancelled()
+
         results = []
 
         # 指定されたvCenterのService Instanceを取得
@@ -109,40 +118,58 @@ class VmFolder(object):
         content = service_instances[vcenter_name].RetrieveContent()
         config = configs[vcenter_name]
 
-        datacenter = content.rootFolder.childEntity[0]
         base_vm_folder = config["base_vm_folder"]
         search_index = content.searchIndex
 
+        def get_vm_folder_names_from_datacenter(datacenter) -> list[str]:
+            vm_folder_names = []
+            if vm_folders is not None:
+                for vm_folder in vm_folders:
+                    # フォルダ単位でキャンセル要求を確認
+                    cancel_token.raise_if_cancelled()
+                    folder = Helper.find_vm_folder(search_index, datacenter, base_vm_folder, vm_folder)
+                    if folder is not None:
+                        vm_folder_names.append(vm_folder)
+            else:
+                base_folder = Helper.find_vm_folder(search_index, datacenter, base_vm_folder)
+                if base_folder is None:
+                    Logging.info(
+                        f"{request_id} vCenter({vcenter_name})のデータセンター({datacenter.name})に"
+                        f"仮想マシンフォルダは見つかりませんでした。{base_vm_folder}フォルダにアクセスできません。"
+                    )
+                else:
+                    for child_folder in base_folder.childEntity:
+                        cancel_token.raise_if_cancelled()
+                        # base_folder直下のサブフォルダのみ取得
+                        if isinstance(child_folder, vim.Folder):
+                            vm_folder_names.append(child_folder.name)
+            return vm_folder_names
+
+        # データセンターごとに並行して走査し、複数のデータセンターに存在する同名のフォルダは1つにまとめる
+        found_vm_folders = []
+        for vm_folder_names in WorkScheduler.map_nested(
+            WorkScheduler.PRIORITY_BULK,
+            get_vm_folder_names_from_datacenter,
+            Helper.get_datacenters(content),
+            cancel_token=cancel_token,
+        ):
+            found_vm_folders.extend(name for name in vm_folder_names if name not in found_vm_folders)
+
         if vm_folders is not None:
             for vm_folder in vm_folders:
-                folder = search_index.FindByInventoryPath(f"/{datacenter.name}/vm/{base_vm_folder}/{vm_folder}/")
-                if folder is None:
+                if vm_folder not in found_vm_folders:
                     Logging.info(
                         f"{request_id} vCenter({vcenter_name})に指定した名前の仮想マシンフォルダ({vm_folder})は見つかりませんでした。"
                     )
-                    continue
+            # 指定された順序で返す
+            found_vm_folders = [vm_folder for vm_folder in vm_folders if vm_folder in found_vm_folders]
 
-                vm_folder_info = cls._generate_vm_folder_info(
-                    vm_folder=vm_folder,
-                    vcenter_name=vcenter_name,
-                )
-                results.append(vm_folder_info)
-        else:
-            base_folder = search_index.FindByInventoryPath(f"/{datacenter.name}/vm/{base_vm_folder}/")
-            if base_folder is None:
-                Logging.info(
-                    f"{request_id} vCenter({vcenter_name})に仮想マシンフォルダは見つかりませんでした。{base_vm_folder}フォルダにアクセスできません。"
-                )
-                # return None
-            else:
-                for child_folder in base_folder.childEntity:
-                    # base_folder直下のサブフォルダのみ取得
-                    if isinstance(child_folder, vim.Folder):
-                        vm_folder_info = cls._generate_vm_folder_info(
-                            vm_folder=child_folder.name,
-                            vcenter_name=vcenter_name,
-                        )
-                        results.append(vm_folder_info)
+        for vm_folder in found_vm_folders:
+            vm_folder_info = cls._generate_vm_folder_info(
+                vm_folder=vm_folder,
+                vcenter_name=vcenter_name,
+            )
+            results.append(vm_folder_info)
         return results
 
     @classmethod
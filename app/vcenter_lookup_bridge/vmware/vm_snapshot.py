@@ -1,10 +1,15 @@
 import os
 from typing import List, Optional
-from concurrent.futures import ThreadPoolExecutor
 from fastapi import HTTPException
 from pyVmomi import vim
 from vcenter_lookup_bridge.schemas.vm_snapshot_parameter import VmSnapshotResponseSchema
+from vcenter_lookup_bridge.utils.cancellation import CancellationToken
 from vcenter_lookup_bridge.utils.logging import Logging
+from vcenter_lookup_bridge.vmware.helper import Helper
+from vcenter_lookup_bridge.vmware.last_known_good import LastKnownGood
+from vcenter_lookup_bridge.vmware.service_instance_pool import ServiceInstancePool
+from vcenter_lookup_bridge.vmware.vcenter_rate_limiter import VCenterRateLimiter
+from vcenter_lookup_bridge.vmware.work_scheduler import WorkScheduler
 import urllib.parse
 
 
@@ -13,7 +18,6 @@ class VmSnapshot(object):
 
     # Const
     VLB_MAX_RETRIEVE_VCENTER_OBJECTS_DEFAULT = 1000
-    VLB_MAX_VCENTER_WEB_SERVICE_WORKER_THREADS_DEFAULT = 4
 
     @classmethod
     @Logging.func_logger
@@ -26,6 +30,8 @@ class VmSnapshot(object):
         offset=0,
         max_results=100,
         request_id: str = None,
+        priority: WorkScheduler.Priority = WorkScheduler.PRIORITY_BULK,
+        cancel_token: CancellationToken = None,
     ) -> tuple[list[VmSnapshotResponseSchema], int]:
         """全vCenterからスナップショット一覧を取得"""
 
@@ -38,24 +44,21 @@ class VmSnapshot(object):
                 cls.VLB_MAX_RETRIEVE_VCENTER_OBJECTS_DEFAULT,
             )
         )
-        max_vcenter_web_service_worker_threads = int(
-            os.getenv(
-                "VLB_MAX_VCENTER_WEB_SERVICE_WORKER_THREADS",
-                cls.VLB_MAX_VCENTER_WEB_SERVICE_WORKER_THREADS_DEFAULT,
-            )
-        )
 
         if vcenter_name:
             # vCenterを指定した場合、指定したvCenterから仮想マシン一覧を取得し、各仮想マシンの持つスナップショット情報を取得
             try:
-                snapshots = cls._get_vm_snapshots_by_vm_folders_from_vcenter(
+                snapshots = WorkScheduler.submit(
+                    priority,
+                    cls._get_vm_snapshots_by_vm_folders_from_vcenter,
                     vcenter_name=vcenter_name,
                     service_instances=service_instances,
                     configs=configs,
                     vm_folders=vm_folders,
                     offset=offset,
                     max_results=max_results,
-                )
+                    cancel_token=cancel_token,
+                ).result()
                 Logging.info(f"{request_id} vCenter({vcenter_name})からのスナップショット情報取得に成功")
                 all_snapshots.extend(snapshots)
                 total_snapshot_count = len(all_snapshots)
@@ -65,41 +68,46 @@ class VmSnapshot(object):
         else:
             # vCenterを指定しない場合、すべてのvCenterから仮想マシン一覧を取得し、各仮想マシンの持つスナップショット情報を取得
             futures = {}
-            with ThreadPoolExecutor(max_workers=max_vcenter_web_service_worker_threads) as executor:
-                try:
-                    # 各vCenterから仮想マシン一覧を取得するスレッドを作成
-                    for vcenter_name in configs.keys():
-                        futures[vcenter_name] = executor.submit(
-                            cls._get_vm_snapshots_by_vm_folders_from_vcenter,
-                            vcenter_name,
-                            service_instances,
-                            configs,
-                            vm_folders,
-                            offset_vcenter,
-                            max_retrieve_vcenter_objects,
-                        )
-
-                    # 各スレッドの実行結果を回収
-                    for vcenter_name in configs.keys():
-                        snapshots = futures[vcenter_name].result()
-                        Logging.info(f"{request_id} vCenter({vcenter_name})からのスナップショット情報取得に成功")
-                        all_snapshots.extend(snapshots)
+            try:
+                # 各vCenterから仮想マシン一覧を取得する処理をスケジューラに登録
+                for vcenter_name in configs.keys():
+                    futures[vcenter_name] = WorkScheduler.submit(
+                        priority,
+                        cls._get_vm_snapshots_by_vm_folders_from_vcenter,
+                        vcenter_name,
+                        service_instances,
+                        configs,
+                        vm_folders,
+                        offset_vcenter,
+                        max_retrieve_vcenter_objects,
+                        request_id,
+                        cancel_token=cancel_token,
+                    )
 
-                    # 全スナップショット数を取得
-                    total_snapshot_count = len(all_snapshots)
+                # 各処理の実行結果を回収
+                for vcenter_name in configs.keys():
+                    snapshots = futures[vcenter_name].result()
+                    Logging.info(f"{request_id} vCenter({vcenter_name})からのスナップショット情報取得に成功")
+                    all_snapshots.extend(snapshots)
 
-                    # オフセットと最大件数の調整
-                    all_snapshots = all_snapshots[offset:]
-                    if len(all_snapshots) > max_results:
-                        all_snapshots = all_snapshots[:max_results]
+                # 全スナップショット数を取得
+                total_snapshot_count = len(all_snapshots)
 
-                except Exception as e:
-                    Logging.warning(f"{request_id} vCenter({vcenter_name})からのVM取得に失敗: {e}")
+                # オフセットと最大件数の調整
+                all_snapshots = all_snapshots[offset:]
+                if len(all_snapshots) > max_results:
+                    all_snapshots = all_snapshots[:max_results]
+
+            except Exception as e:
+                Logging.warning(f"{request_id} vCenter({vcenter_name})からのVM取得に失敗: {e}")
 
         return all_snapshots, total_snapshot_count
 
     @classmethod
     @Logging.func_logger
+    @LastKnownGood.fallback
+    @VCenterRateLimiter.limited
+    @ServiceInstancePool.pooled
     def _get_vm_snapshots_by_vm_folders_from_vcenter(
         cls,
         vcenter_name: str,
@@ -109,10 +117,12 @@ class VmSnapshot(object):
         offset=0,
         max_results=100,
         request_id: str = None,
+        cancel_token: CancellationToken = None,
     ) -> list[VmSnapshotResponseSchema]:
         """特定のvCenterから仮想マシンフォルダを指定して、仮想マシンのスナップショット一覧を取得"""
 
-        results = []
+        cancel_token = cancel_token or CancellationToken()
+        cancel_token.raise_if_cancelled()
 
         # 指定されたvCenterのService Instanceを取得
         if vcenter_name not in service_instances:
@@ -123,39 +133,40 @@ class VmSnapshot(object):
         content = service_instances[vcenter_name].RetrieveContent()
         config = configs[vcenter_name]
 
-        datacenter = content.rootFolder.childEntity[0]
         base_vm_folder = config["base_vm_folder"]
         search_index = content.searchIndex
-        vm_count = 0
-
-        for vm_folder in vm_folders:
-            folder = search_index.FindByInventoryPath(f"/{datacenter.name}/vm/{base_vm_folder}/{vm_folder}/")
-            if folder is None:
-                Logging.info(
-                    f"{request_id} vCenter({vcenter_name})に仮想マシンフォルダ({vm_folder})は見つかりませんでした。"
-                )
-                continue
-
-            if vm_count >= offset + max_results:
-                break
-
-            for vm in folder.childEntity:
-                if vm_count < offset:
-                    vm_count += 1
-                    continue
-                if vm_count >= offset + max_results:
-                    break
-
-                if isinstance(vm, vim.VirtualMachine):
-                    snapshot_info = cls._generate_vm_snapshot_info(
-                        datacenter=datacenter,
-                        vm_folder=vm_folder,
-                        vm=vm,
-                        vcenter_name=vcenter_name,
-                    )
-                    results.extend(snapshot_info)
-                    vm_count += 1
-        return results
+
+        def collect_vms(datacenter, limit: Optional[int]) -> list[tuple[str, vim.VirtualMachine]]:
+            return Helper.get_vms_in_vm_folders(
+                search_index=search_index,
+                datacenter=datacenter,
+                base_vm_folder=base_vm_folder,
+                vm_folders=vm_folders,
+                limit=limit,
+                cancel_token=cancel_token,
+                log_prefix=f"{request_id} vCenter({vcenter_name})",
+            )
+
+        def generate_vm_snapshot_info(datacenter, entry: tuple[str, vim.VirtualMachine]) -> list:
+            cancel_token.raise_if_cancelled()
+            vm_folder, vm = entry
+            return cls._generate_vm_snapshot_info(
+                datacenter=datacenter,
+                vm_folder=vm_folder,
+                vm=vm,
+                vcenter_name=vcenter_name,
+            )
+
+        # データセンターごとに並行して走査し、結果を結合
+        snapshots_by_vm = Helper.scan_datacenters(
+            datacenters=Helper.get_datacenters(content),
+            collect=collect_vms,
+            generate=generate_vm_snapshot_info,
+            offset=offset,
+            max_results=max_results,
+            cancel_token=cancel_token,
+        )
+        return [snapshot for snapshots in snapshots_by_vm for snapshot in snapshots]
 
     @classmethod
     @Logging.func_logger
@@ -163,28 +174,28 @@ class VmSnapshot(object):
         cls,
         vcenter_name: str,
         service_instances,
+        configs,
         instance_uuid: str,
         request_id: str = None,
+        priority: WorkScheduler.Priority = WorkScheduler.PRIORITY_INTERACTIVE,
+        cancel_token: CancellationToken = None,
     ) -> list[VmSnapshotResponseSchema]:
         """全vCenterから指定したインスタンスUUIDを持つ仮想マシンのスナップショット情報を取得"""
 
         all_snapshots = []
-        max_vcenter_web_service_worker_threads = int(
-            os.getenv(
-                "VLB_MAX_VCENTER_WEB_SERVICE_WORKER_THREADS",
-                cls.VLB_MAX_VCENTER_WEB_SERVICE_WORKER_THREADS_DEFAULT,
-            )
-        )
 
         if vcenter_name:
             # vCenterを指定した場合、指定したvCenterから仮想マシン一覧を取得
             try:
-                snapshots = cls._get_vm_snapshot_by_instance_uuid(
+                snapshots = WorkScheduler.submit(
+                    priority,
+                    cls._get_vm_snapshot_by_instance_uuid,
                     vcenter_name=vcenter_name,
                     service_instances=service_instances,
                     instance_uuid=instance_uuid,
                     request_id=request_id,
-                )
+                    cancel_token=cancel_token,
+                ).result()
                 if snapshots is not None:
                     all_snapshots.extend(snapshots)
             except Exception as e:
@@ -193,38 +204,45 @@ class VmSnapshot(object):
         else:
             # vCenterを指定しない場合、すべてのvCenterから仮想マシン一覧を取得
             futures = {}
-            with ThreadPoolExecutor(max_workers=max_vcenter_web_service_worker_threads) as executor:
-                try:
-                    # 各vCenterから仮想マシン一覧を取得するスレッドを作成
-                    for vcenter_name in service_instances.keys():
-                        futures[vcenter_name] = executor.submit(
-                            cls._get_vm_snapshot_by_instance_uuid,
-                            vcenter_name,
-                            service_instances,
-                            instance_uuid,
-                            request_id,
-                        )
-
-                    # 各スレッドの実行結果を回収
-                    for vcenter_name in service_instances.keys():
-                        snapshots = futures[vcenter_name].result()
-                        if snapshots is not None:
-                            all_snapshots.extend(snapshots)
-                except Exception as e:
-                    Logging.error(f"{request_id} vCenter({vcenter_name})からのスナップショット情報取得に失敗: {e}")
+            try:
+                # 各vCenterから仮想マシン一覧を取得する処理をスケジューラに登録
+                for vcenter_name in configs.keys():
+                    futures[vcenter_name] = WorkScheduler.submit(
+                        priority,
+                        cls._get_vm_snapshot_by_instance_uuid,
+                        vcenter_name,
+                        service_instances,
+                        instance_uuid,
+                        request_id,
+                        cancel_token=cancel_token,
+                    )
+
+                # 各処理の実行結果を回収
+                for vcenter_name in configs.keys():
+                    snapshots = futures[vcenter_name].result()
+                    if snapshots is not None:
+                        all_snapshots.extend(snapshots)
+            except Exception as e:
+                Logging.error(f"{request_id} vCenter({vcenter_name})からのスナップショット情報取得に失敗: {e}")
         return all_snapshots
 
     @classmethod
     @Logging.func_logger
+    @VCenterRateLimiter.limited
+    @ServiceInstancePool.pooled
     def _get_vm_snapshot_by_instance_uuid(
         cls,
         vcenter_name: str,
         service_instances: dict,
         instance_uuid: str,
         request_id: str = None,
+        cancel_token: CancellationToken = None,
     ) -> list[VmSnapshotResponseSchema]:
         """指定したインスタンスUUIDを持つ仮想マシンのスナップショット情報を取得"""
 
+        cancel_token = cancel_token or CancellationToken()
+        cancel_token.raise_if_cancelled()
+
         # 指定されたvCenterのService Instanceを取得
         if vcenter_name not in service_instances:
             raise HTTPException(
@@ -232,10 +250,9 @@ class VmSnapshot(object):
             )
 
         content = service_instances[vcenter_name].RetrieveContent()
-        datacenter = content.rootFolder.childEntity[0]
         search_index = content.searchIndex
 
-        # 仮想マシンをインスタンスUUIDを指定して検索
+        # 仮想マシンをインスタンスUUIDを指定して検索(全データセンターが検索対象)
         vm = search_index.FindByUuid(
             uuid=instance_uuid,
             vmSearch=True,
@@ -244,7 +261,7 @@ class VmSnapshot(object):
 
         if isinstance(vm, vim.VirtualMachine):
             return cls._generate_vm_snapshot_info(
-                datacenter=datacenter,
+                datacenter=Helper.get_datacenter_of(vm, content),
                 vm_folder=None,
                 vm=vm,
                 vcenter_name=vcenter_name,
@@ -0,0 +1,317 @@
+import asyncio
+import os
+import threading
+from collections import deque
+from concurrent.futures import Future
+from typing import AsyncIterator, Callable, Iterable, Literal, Optional
+
+from fastapi.concurrency import run_in_threadpool
+from starlette.requests import Request
+from vcenter_lookup_bridge.broker.client import BrokerClient
+from vcenter_lookup_bridge.utils.cancellation import CancellationToken
+from vcenter_lookup_bridge.utils.logging import Logging
+
+
+class PriorityThreadPoolExecutor(object):
+    """優先度クラス付きのスレッドプール
+
+    interactiveクラスの処理は常にbulkクラスの処理より先に実行されます。
+    また、bulkクラスの処理が同時に利用できるスレッド数は「最大スレッド数 - 予約スレッド数」に制限され、
+    予約されたスレッドはinteractiveクラスの処理のためだけに使用されます。
+    """
+
+    def __init__(self, max_workers: int, reserved_interactive_workers: int, thread_name_prefix: str = "vlb-worker"):
+        self._max_workers = max(1, max_workers)
+        self._reserved_interactive_workers = min(max(0, reserved_interactive_workers), self._max_workers - 1)
+        self._bulk_workers_limit = self._max_workers - self._reserved_interactive_workers
+        self._thread_name_prefix = thread_name_prefix
+        self._condition = threading.Condition()
+        self._queues = {
+            WorkScheduler.PRIORITY_INTERACTIVE: deque(),
+            WorkScheduler.PRIORITY_BULK: deque(),
+        }
+        self._running = {
+            WorkScheduler.PRIORITY_INTERACTIVE: 0,
+            WorkScheduler.PRIORITY_BULK: 0,
+        }
+        self._threads = []
+        self._idle_workers = 0
+        self._shutdown = False
+
+    def submit(self, priority: str, fn: Callable, *args, **kwargs) -> Future:
+        """処理を優先度クラスのキューに追加し、Futureを返します"""
+
+        if priority not in self._queues:
+            raise ValueError(f"不明な優先度クラスが指定されました: {priority}")
+
+        future = Future()
+        with self._condition:
+            if self._shutdown:
+                raise RuntimeError("シャットダウン済みのスケジューラには処理を追加できません。")
+            self._queues[priority].append((future, fn, args, kwargs))
+            self._adjust_thread_count()
+            self._condition.notify_all()
+        return future
+
+    def get_stats(self) -> dict:
+        """優先度クラスごとの待ち件数と実行中の件数を返します"""
+
+        with self._condition:
+            return {
+                "maxWorkers": self._max_workers,
+                "reservedInteractiveWorkers": self._reserved_interactive_workers,
+                "queued": {priority: len(queue) for priority, queue in self._queues.items()},
+                "running": dict(self._running),
+            }
+
+    def shutdown(self, wait: bool = True) -> None:
+        with self._condition:
+            self._shutdown = True
+            self._condition.notify_all()
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+    def _adjust_thread_count(self) -> None:
+        # 待ち状態のスレッドが不足している場合のみ、最大スレッド数までスレッドを追加
+        if len(self._threads) >= self._max_workers:
+            return
+        queued_items = sum(len(queue) for queue in self._queues.values())
+        if self._idle_workers >= queued_items:
+            return
+        thread = threading.Thread(
+            target=self._worker,
+            name=f"{self._thread_name_prefix}-{len(self._threads)}",
+            daemon=True,
+        )
+        thread.start()
+        self._threads.append(thread)
+
+    def _next_work_item(self) -> Optional[tuple]:
+        # interactiveクラスを優先し、bulkクラスは予約スレッドを侵食しない範囲でのみ取り出す
+        interactive_queue = self._queues[WorkScheduler.PRIORITY_INTERACTIVE]
+        if interactive_queue:
+            return WorkScheduler.PRIORITY_INTERACTIVE, interactive_queue.popleft()
+
+        bulk_queue = self._queues[WorkScheduler.PRIORITY_BULK]
+        if bulk_queue and self._running[WorkScheduler.PRIORITY_BULK] < self._bulk_workers_limit:
+            return WorkScheduler.PRIORITY_BULK, bulk_queue.popleft()
+        return None
+
+    def _worker(self) -> None:
+        while True:
+            with self._condition:
+                while True:
+                    work_item = self._next_work_item()
+                    if work_item is not None:
+                        break
+                    if self._shutdown:
+                        return
+                    self._idle_workers += 1
+                    self._condition.wait()
+                    self._idle_workers -= 1
+                priority, (future, fn, args, kwargs) = work_item
+                self._running[priority] += 1
+
+            try:
+                if future.set_running_or_notify_cancel():
+                    try:
+                        result = fn(*args, **kwargs)
+                    except BaseException as e:
+                        future.set_exception(e)
+                    else:
+                        future.set_result(result)
+            finally:
+                with self._condition:
+                    self._running[priority] -= 1
+                    self._condition.notify_all()
+
+
+class WorkScheduler(object):
+    """vCenterへのリクエストを優先度クラスに基づいてスケジューリングするクラス
+
+    ワーカープロセス内の全リクエストで、1つのスレッドプールを共有します。
+    単一オブジェクトの参照（interactive）は、一覧・イベント・アラームの走査（bulk）に待たされないよう、
+    予約されたスレッドを利用できます。
+    """
+
+    # Const
+    PRIORITY_INTERACTIVE = "interactive"
+    PRIORITY_BULK = "bulk"
+    VLB_VCENTER_SCHEDULER_WORKER_THREADS_DEFAULT = 20
+    VLB_VCENTER_SCHEDULER_INTERACTIVE_RESERVED_THREADS_DEFAULT = 4
+
+    # 型定義
+    Priority = Literal["interactive", "bulk"]
+
+    _executor: Optional[PriorityThreadPoolExecutor] = None
+    _executor_lock = threading.Lock()
+
+    @classmethod
+    def get_executor(cls) -> PriorityThreadPoolExecutor:
+        """ワーカープロセスで共有するスレッドプールを取得します（未作成の場合は作成します）"""
+
+        if cls._executor is None:
+            with cls._executor_lock:
+                if cls._executor is None:
+                    max_workers = int(
+                        os.getenv(
+                            "VLB_VCENTER_SCHEDULER_WORKER_THREADS",
+                            cls.VLB_VCENTER_SCHEDULER_WORKER_THREADS_DEFAULT,
+                        )
+                    )
+                    reserved_interactive_workers = int(
+                        os.getenv(
+                            "VLB_VCENTER_SCHEDULER_INTERACTIVE_RESERVED_THREADS",
+                            cls.VLB_VCENTER_SCHEDULER_INTERACTIVE_RESERVED_THREADS_DEFAULT,
+                        )
+                    )
+                    Logging.info(
+                        f"vCenterリクエスト用のスケジューラを初期化します"
+                        f"(スレッド数: {max_workers}, interactive予約数: {reserved_interactive_workers})"
+                    )
+                    cls._executor = PriorityThreadPoolExecutor(
+                        max_workers=max_workers,
+                        reserved_interactive_workers=reserved_interactive_workers,
+                    )
+        return cls._executor
+
+    @classmethod
+    def submit(cls, priority: Priority, fn: Callable, *args, **kwargs) -> Future:
+        """指定した優先度クラスで、vCenterへのリクエスト処理を実行キューに追加します"""
+
+        return cls.get_executor().submit(priority, fn, *args, **kwargs)
+
+    @classmethod
+    def map_nested(
+        cls,
+        priority: Priority,
+        fn: Callable,
+        items: Iterable,
+        cancel_token: Optional[CancellationToken] = None,
+    ) -> list:
+        """
+        スケジューラで実行中の処理の中から、itemsの要素ごとの処理を並行して実行し、結果をitemsの順で返します
+
+        先頭の要素は呼び出し元のスレッドで処理し、実行が開始されていない処理も呼び出し元のスレッドで引き取るため、
+        スレッドが全て使用中でも、処理の完了の待ち合わせでデッドロックすることはありません。
+        """
+        items = list(items)
+        if len(items) <= 1:
+            return [fn(item) for item in items]
+
+        futures = [cls.submit(priority, fn, item) for item in items[1:]]
+        try:
+            results = [fn(items[0])]
+            for item, future in zip(items[1:], futures):
+                if cancel_token is not None:
+                    cancel_token.raise_if_cancelled()
+                results.append(fn(item) if future.cancel() else future.result())
+            return results
+        finally:
+            # 例外やキャンセルで中断した場合、実行が開始されていない処理は破棄する
+            for future in futures:
+                future.cancel()
+
+    @classmethod
+    def get_stats(cls) -> dict:
+        """スケジューラの待ち件数と実行中の件数を取得します"""
+
+        return cls.get_executor().get_stats()
+
+    @classmethod
+    async def run_async(cls, func: Callable, request: Optional[Request] = None, **kwargs):
+        """
+        複数vCenterへのリクエストを取りまとめる処理を、イベントループを塞がないようにスレッドで実行します
+
+        requestを指定した場合、HTTPクライアントの切断を監視し、切断時はcancel_token経由で処理を中断します。
+        ブローカーを利用する設定の場合は、ブローカーに処理を依頼します。
+
+        Raises:
+            OperationCancelledError: HTTPクライアントの切断により、処理がキャンセルされた場合
+        """
+        if BrokerClient.is_enabled():
+            return await cls._run_on_broker(func, request=request, **kwargs)
+        if request is None:
+            return await run_in_threadpool(func, **kwargs)
+
+        cancel_token = CancellationToken()
+        watcher = asyncio.create_task(CancellationToken.watch_client_disconnect(request, cancel_token))
+        try:
+            result = await run_in_threadpool(func, cancel_token=cancel_token, **kwargs)
+        finally:
+            watcher.cancel()
+        cancel_token.raise_if_cancelled()
+        return result
+
+    @classmethod
+    async def _run_on_broker(cls, func: Callable, request: Optional[Request] = None, **kwargs):
+        cancel_token = CancellationToken()
+        watcher = None
+        if request is not None:
+            watcher = asyncio.create_task(CancellationToken.watch_client_disconnect(request, cancel_token))
+        try:
+            return await BrokerClient.call(func, cancel_token=cancel_token, **kwargs)
+        finally:
+            if watcher is not None:
+                watcher.cancel()
+
+    @classmethod
+    async def iter_completed(cls, futures: dict[str, Future]) -> AsyncIterator[tuple[str, asyncio.Future]]:
+        """
+        vCenterごとの処理のFutureを、完了した順に返します
+
+        反復を途中で打ち切った場合、まだ実行が開始されていない処理はキャンセルされます。
+        """
+        pending = {asyncio.wrap_future(future): vcenter_name for vcenter_name, future in futures.items()}
+        try:
+            while pending:
+                done, _ = await asyncio.wait(pending.keys(), return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    yield pending.pop(future), future
+        finally:
+            for future in pending:
+                future.cancel()
+
+    @classmethod
+    async def stream_from_vcenters(
+        cls,
+        priority: Priority,
+        fn: Callable,
+        vcenter_names: Iterable[str],
+        cancel_token: Optional[CancellationToken] = None,
+        **kwargs,
+    ) -> AsyncIterator[tuple[str, Optional[list], Optional[Exception]]]:
+        """
+        vCenterごとの処理をスケジューラに登録し、処理が完了したvCenterから順に結果を返します
+
+        fnはvcenter_nameとcancel_tokenをキーワード引数で受け取る必要があります。
+        戻り値は(vCenter名, 処理結果, 例外)のタプルで、処理に失敗した場合は処理結果がNoneとなります。
+        """
+        futures = {}
+        for vcenter_name in vcenter_names:
+            if BrokerClient.is_enabled():
+                # ブローカーにvCenterごとの処理を依頼し、完了を待つタスクをFutureとして扱う
+                futures[vcenter_name] = asyncio.create_task(
+                    BrokerClient.call(
+                        fn, cancel_token=cancel_token, priority=priority, vcenter_name=vcenter_name, **kwargs
+                    )
+                )
+            else:
+                futures[vcenter_name] = cls.submit(
+                    priority, fn, vcenter_name=vcenter_name, cancel_token=cancel_token, **kwargs
+                )
+
+        async for vcenter_name, future in cls.iter_completed(futures):
+            error = future.exception()
+            if error is None:
+                yield vcenter_name, future.result(), None
+            else:
+                yield vcenter_name, None, error
+
+    @classmethod
+    def shutdown(cls, wait: bool = False) -> None:
+        with cls._executor_lock:
+            if cls._executor is not None:
+                cls._executor.shutdown(wait=wait)
+                cls._executor = None